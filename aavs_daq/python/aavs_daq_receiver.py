@@ -5,6 +5,7 @@ from time import sleep
 from persisters import *
 from interface import *
 import numpy as np
+import threading
 import logging
 
 # Custom numpy type for creating complex signed 8-bit data
@@ -19,8 +20,8 @@ def raw_data_callback(data, timestamp):
     values = buffer_from_memory(data, np.dtype('int8').itemsize * nof_values)
     values = np.frombuffer(values, np.int8)
 
-    # Persist extracted data to file
-    persisters['RAW_DATA'].write_data(data_ptr=values, timestamp=timestamp)
+    # Queue extracted data for persisting, the buffer is copied since DAQ reuses it
+    writers['RAW_DATA'].put(values, timestamp)
     logging.info("Received raw data")
 
 def channel_data_callback(data, timestamp, continuous = False):
@@ -36,12 +37,8 @@ def channel_data_callback(data, timestamp, continuous = False):
     values = buffer_from_memory(data, complex_8t.itemsize * nof_values)
     values = np.frombuffer(values, complex_8t)
 
-    # Persist extracted data to file
-    if continuous:
-       persisters['CHANNEL_DATA'].append_data(data_ptr=values, timestamp=timestamp)
-    else:
-       persisters['CHANNEL_DATA'].write_data(data_ptr=values, timestamp=timestamp)
-
+    # Queue extracted data for persisting, the buffer is copied since DAQ reuses it
+    writers['CHANNEL_DATA'].put(values, timestamp)
     logging.info("Received channel data")
 
 def channel_burst_data_callback(data, timestamp):
@@ -65,8 +62,8 @@ def beam_data_callback(data, timestamp):
 #    values_ptr = ctypes.cast(data, ctypes.POINTER(Complex_8t))
 #    values     = np.array([(values_ptr[i].x, values_ptr[i].y) for i in range(nof_values)], dtype=complex_8t)
 
-    # Persist extracted data to file
-    persisters['BEAM_DATA'].write_data(data_ptr=values, timestamp=timestamp)
+    # Queue extracted data for persisting, the buffer is copied since DAQ reuses it
+    writers['BEAM_DATA'].put(values, timestamp)
     logging.info("Received beam data")
 
 # ----------------------------------------- Script Body ------------------------------------------------
@@ -82,6 +79,30 @@ callbacks = {'RAW_DATA'     : DATACALLBACK_RAW(raw_data_callback),
 # Global HDF5 persisters handles
 persisters = { }
 
+# Writer queues between callbacks and persisters
+writers = { }
+
+def create_writer(name, persister, persist, append = False):
+    # Queue for persisting data on a dedicated thread, with the configured backpressure policy.
+    # In fast spill mode buffers are written to spill files rather than HDF5
+    spill = SpillWriter(conf.directory, name.lower(), persister, append, conf.spill_file_size * 1024 * 1024)
+    policy = {'block'       : BackpressurePolicy.Block,
+              'drop_oldest' : BackpressurePolicy.DropOldest,
+              'spill'       : BackpressurePolicy.Spill}[conf.backpressure]
+    writers[name] = PersisterQueue(spill.write if conf.fast_spill else persist, name = name,
+                                   max_depth = conf.queue_depth, policy = policy, spill = spill)
+
+def log_writer_statistics():
+    # Periodically log writer queue metrics
+    while True:
+        sleep(conf.metrics_period)
+        for name, writer in writers.iteritems():
+            stats = writer.statistics()
+            logging.info("%s writer: depth %d (max %d), written %d, dropped %d, spilled %d, errors %d, "
+                         "latency %.3fs (max %.3fs)" % (name, stats['depth'], stats['max_depth'], stats['written'],
+                                                        stats['dropped'], stats['spilled'], stats['errors'],
+                                                        stats['mean_latency'], stats['max_latency']))
+
 # Script main entry point
 if __name__ == "__main__":
 
@@ -145,6 +166,28 @@ if __name__ == "__main__":
     # Persister options
     parser.add_option("-d", "--data-directory", action="store", dest="directory",
                       default=".", help="Parent directory where data will be stored [default: current directory]")
+    parser.add_option("", "--queue_depth", action="store", dest="queue_depth",
+                      type="int", default=16, help="Maximum number of buffers queued for persisting [default: 16]")
+    parser.add_option("", "--backpressure", action="store", dest="backpressure", type="choice",
+                      choices=["block", "drop_oldest", "spill"], default="block",
+                      help="Policy when the persisting queue is full: block, drop_oldest or spill to spill files, "
+                           "spill cannot be used with --fast_spill [default: block]")
+    parser.add_option("", "--metrics_period", action="store", dest="metrics_period",
+                      type="float", default=0, help="Seconds between writer queue metrics logs, 0 to disable "
+                                                    "[default: 0]")
+    parser.add_option("-F", "--fast_spill", action="store_true", dest="fast_spill",
+                      default=False, help="Write buffers to binary spill files instead of HDF5, convert them with "
+                                          "spill_converter.py [default: False]")
+    parser.add_option("", "--spill_file_size", action="store", dest="spill_file_size",
+                      type="int", default=1024, help="Size of preallocated spill files in MB [default: 1024]")
+    parser.add_option("", "--flush_period", action="store", dest="flush_period",
+                      type="float", default=1.0, help="Seconds between file flushes in continuous mode [default: 1.0]")
+    parser.add_option("", "--max_file_size", action="store", dest="max_file_size",
+                      type="int", default=0, help="Start a new file after this many MB in continuous mode, 0 for no "
+                                                  "limit [default: 0]")
+    parser.add_option("", "--max_file_period", action="store", dest="max_file_period",
+                      type="int", default=0, help="Start a new file after this many seconds in continuous mode, 0 for "
+                                                  "no limit [default: 0]")
 
     (conf, args) = parser.parse_args(argv[1:])
 
@@ -169,6 +212,12 @@ if __name__ == "__main__":
         logging.error("Specified data directory [%s] does not exist" % conf.directory)
         exit(-1)
 
+    # In fast spill mode the writer threads already spill, and buffers spilled by the callbacks
+    # would be written ahead of older queued buffers, out of order within the spill files
+    if conf.fast_spill and conf.backpressure == "spill":
+        logging.error("Spill backpressure policy cannot be used in fast spill mode. Exiting")
+        exit(-1)
+
     # Initialise AAVS DAQ library
     initialise_library("/usr/local/lib/libaavsdaq")
 
@@ -215,6 +264,7 @@ if __name__ == "__main__":
                               n_pols     = conf.nof_polarisations,
                               n_samples  = conf.nof_raw_samples)
         persisters['RAW_DATA'] = raw_file
+        create_writer('RAW_DATA', raw_file, lambda data, timestamp: raw_file.write_data(data_ptr=data, timestamp=timestamp))
 
     # ----------------------------- Channel data consumer ----------------------------------------
     # Channel consumer can either run in continuous or burst mode, but not both
@@ -243,6 +293,8 @@ if __name__ == "__main__":
                                       n_pols     = conf.nof_polarisations,
                                       n_samples  = conf.nof_channel_samples)
             persisters['CHANNEL_DATA'] = channel_file
+            create_writer('CHANNEL_DATA', channel_file, lambda data, timestamp:
+                          channel_file.write_data(data_ptr=data, timestamp=timestamp))
 
         else:
             # Set channel data consumer callback
@@ -255,7 +307,14 @@ if __name__ == "__main__":
                                       n_antennas = conf.nof_antennas,
                                       n_pols     = conf.nof_polarisations,
                                       n_samples  = conf.nof_channel_samples)
+
+            # Keep file open across blocks
+            channel_file.start_session(flush_period    = conf.flush_period,
+                                       max_file_size   = conf.max_file_size * 1024 * 1024 or None,
+                                       max_file_period = conf.max_file_period or None)
             persisters['CHANNEL_DATA'] = channel_file
+            create_writer('CHANNEL_DATA', channel_file, lambda data, timestamp:
+                          channel_file.append_data(data_ptr=data, timestamp=timestamp), append = True)
 
     # ------------------------------- Beam data consumer -----------------------------------------
     if conf.read_beam_data:
@@ -276,6 +335,14 @@ if __name__ == "__main__":
                                n_pols    = conf.nof_polarisations,
                                n_samples = conf.nof_beam_samples)
         persisters['BEAM_DATA'] = beam_file
+        create_writer('BEAM_DATA', beam_file, lambda data, timestamp:
+                      beam_file.write_data(data_ptr=data, timestamp=timestamp))
+
+    # Log writer queue metrics
+    if conf.metrics_period > 0:
+        metrics = threading.Thread(target = log_writer_statistics)
+        metrics.daemon = True
+        metrics.start()
 
     # Wait forever
     logging.info("Ready to receive data. Enter 'quit' to quit")
@@ -283,3 +350,11 @@ if __name__ == "__main__":
     # Wait until "quit" is input
     while (raw_input("").replace(" ", "").upper() != "QUIT"):
         pass
+
+    # Persist queued buffers, then close files kept open by persister sessions
+    for name, writer in writers.iteritems():
+        writer.stop()
+        writer.spill.close()
+        logging.info("%s writer statistics: %s" % (name, str(writer.statistics())))
+    for persister in persisters.itervalues():
+        persister.stop_session()
@@ -1,3 +1,6 @@
 from beam import *
 from raw import *
 from channel import *
+from writer import *
+from spill import *
+from reader import *
@@ -119,6 +119,105 @@ class FileMonitor(Thread):
     def add_subscriber(self, subscriber):
         zope.event.subscribers.append(subscriber)
 
+class FileSession(object):
+    """ Keeps a file and its dataset handles open across appends. Datasets grow geometrically
+        rather than being resized for every block, and are trimmed to the written length when
+        the file is closed. Data is flushed when the flush period or size is exceeded, and a
+        new file is started when the maximum file size or period is reached """
+
+    def __init__(self, manager, flush_period=1.0, flush_size=64 * 1024 * 1024, max_file_size=None,
+                 max_file_period=None):
+        self.manager = manager
+        self.flush_period = flush_period
+        self.flush_size = flush_size
+        self.max_file_size = max_file_size
+        self.max_file_period = max_file_period
+
+        self.file = None
+        self.filename = None
+        self.datasets = {}
+        self.n_written = 0
+        self.file_size = 0
+        self.file_start = 0
+        self.timestamp = None
+        self.unflushed = 0
+        self.last_flush = 0
+
+        # Statistics across all files
+        self.nof_files = 0
+        self.nof_flushes = 0
+        self.nof_resizes = 0
+
+    def append(self, blocks, timestamp=None):
+        # Blocks is a list of (dataset name, data) tuples, all with the same number of samples
+        if self.file is None or self.rollover_due():
+            self.rollover(timestamp)
+
+        n_samp = blocks[0][1].shape[-1]
+        for name, data in blocks:
+            dset = self.datasets.get(name)
+            if dset is None:
+                dset = self.file[name]
+                self.datasets[name] = dset
+
+            # Double dataset capacity when full
+            if self.n_written + n_samp > dset.shape[1]:
+                dset.resize(max(2 * dset.shape[1], self.n_written + n_samp), axis=1)
+                self.nof_resizes += 1
+
+            dset[:, self.n_written:self.n_written + n_samp] = data
+            self.unflushed += data.nbytes
+            self.file_size += data.nbytes
+
+        self.n_written += n_samp
+        self.timestamp = timestamp
+
+        if self.unflushed >= self.flush_size or time.time() - self.last_flush >= self.flush_period:
+            self.flush()
+
+    def rollover_due(self):
+        if self.max_file_size is not None and self.file_size >= self.max_file_size:
+            return True
+        if self.max_file_period is not None and time.time() - self.file_start >= self.max_file_period:
+            return True
+        return False
+
+    def rollover(self, timestamp=None):
+        self.close_file()
+        self.file = self.manager.create_file(timestamp)
+        self.filename = self.file.filename
+        self.file_start = self.last_flush = time.time()
+        self.nof_files += 1
+
+    def flush(self):
+        if self.file is None:
+            return
+        self.manager.main_dset.attrs['timestamp'] = self.timestamp
+        self.manager.main_dset.attrs['n_written'] = self.n_written
+        self.file.flush()
+        self.unflushed = 0
+        self.last_flush = time.time()
+        self.nof_flushes += 1
+
+    def close_file(self):
+        if self.file is None:
+            return
+
+        # Trim datasets to the written length
+        for dset in self.datasets.values():
+            if dset.shape[1] != self.n_written:
+                dset.resize(self.n_written, axis=1)
+        self.flush()
+        self.manager.close_file(self.file)
+
+        self.file = None
+        self.datasets = {}
+        self.n_written = 0
+        self.file_size = 0
+
+    def close(self):
+        self.close_file()
+
 class AAVSFileManager(object):
     # Class constructor
     def __init__(self, root_path='', type=None, mode=FileModes.Read):
@@ -149,6 +248,9 @@ class AAVSFileManager(object):
         self.file_locks = {}
         self.add_subscriber(self.file_status_event_receiver)
 
+        # Optional session keeping files open across appends
+        self.session = None
+
     # def handle_close(self, evt):
     #     self.file_monitor.stop_file_monitor()
 
@@ -170,6 +272,7 @@ class AAVSFileManager(object):
 
     def signal_term_handler(self, signal, frame):
         print 'Exiting in ~5 seconds...'
+        self.stop_session()
         self.stop_monitoring()
         time.sleep(5)
         sys.exit(0)
@@ -202,9 +305,37 @@ class AAVSFileManager(object):
         self.n_chans = n_chans
         self.n_samples = n_samples
 
+    def get_metadata(self):
+        return {'n_antennas': self.n_antennas, 'n_pols': self.n_pols, 'n_stations': self.n_stations,
+                'n_beams': self.n_beams, 'n_tiles': self.n_tiles, 'n_chans': self.n_chans,
+                'n_samples': self.n_samples}
+
     def complex_abs(self, value):
         return math.sqrt((value[0] ** 2) + (value[1] ** 2))
 
+    def write_samples(self, dset, data, offset=0):
+        # Resize dataset to fit data along the sample axis, then write it as a single hyperslab.
+        # Files written by a session record their written length, which has to follow later appends
+        n_samp = data.shape[-1]
+        dset.resize(offset + n_samp, axis=1)
+        dset[:, offset:offset + n_samp] = data
+        if 'n_written' in self.main_dset.attrs:
+            self.main_dset.attrs['n_written'] = offset + n_samp
+
+    def start_session(self, flush_period=1.0, flush_size=64 * 1024 * 1024, max_file_size=None,
+                      max_file_period=None):
+        # Keep files open across append_data calls, instead of re-opening the file for every block.
+        # Sizes are in bytes and periods in seconds
+        self.stop_session()
+        self.session = FileSession(self, flush_period=flush_period, flush_size=flush_size,
+                                   max_file_size=max_file_size, max_file_period=max_file_period)
+        return self.session
+
+    def stop_session(self):
+        if self.session is not None:
+            self.session.close()
+            self.session = None
+
     def ingest_data(self, data_ptr=None, timestamp=0, append=False):
         if append:
             self.append_data(data_ptr=data_ptr, timestamp=timestamp)
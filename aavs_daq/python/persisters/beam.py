@@ -1,4 +1,5 @@
 from aavs_file import *
+from reader import DataReader
 from matplotlib import pyplot as plt
 import time
 import numpy
@@ -229,32 +230,22 @@ class BeamFormatFileManager(AAVSFileManager):
             print "Can't load file for data reading: ", e.message
             raise
 
+        # Selections outside the file are errors, rather than a file in construction to re-try
+        try:
+            DataReader(file).check_selection(channels=channels, polarizations=polarizations)
+        except IndexError:
+            self.close_file(file)
+            raise
+
         data_flushed = False
         while not data_flushed:
             try:
-                file_items = temp_dset.attrs.items()
-                file_groups = file.values()
-                file_groups_names = [elem.name for elem in file_groups]
-
-                for polarization_idx in xrange(0, len(polarizations)):
-                    current_polarization = polarizations[polarization_idx]
-                    polarization_name = "/"+"polarization_" + str(current_polarization)
-                    if polarization_name in file_groups_names:
-                        polarization_grp = file["polarization_" + str(current_polarization)]
-                        if polarization_grp.values()[0].name == polarization_name+"/data":
-                            dset = polarization_grp["data"]
-                            dset_rows = dset.shape[0]
-                            dset_columns = dset.shape[1]
-                            nof_items = dset[0].size
-                            if (dset_rows == temp_dset.attrs["n_chans"]) and (dset_columns >= temp_dset.attrs["n_samples"]):
-                                for channel_idx in xrange(0, len(channels)):
-                                    current_channel = channels[channel_idx]
-                                    if sample_offset+n_samples > nof_items:
-                                        output_buffer[polarization_idx,channel_idx,:] = dset[current_channel,0:nof_items]
-                                    else:
-                                        output_buffer[polarization_idx,channel_idx,:] = dset[current_channel,sample_offset:sample_offset+n_samples]
+                # Read selection with a single hyperslab per dataset, samples beyond the file are left as zeros
+                data = DataReader(file).read(channels=channels, polarizations=polarizations,
+                                             sample_offset=sample_offset, n_samples=n_samples)
+                output_buffer[:, :, :data.shape[-1]] = data
                 data_flushed = True
-            except Exception as e:
+            except IOError:
                 print "File appears to be in construction, re-trying."
                 print "Closing file..."
                 self.close_file(file)
@@ -265,6 +256,13 @@ class BeamFormatFileManager(AAVSFileManager):
         self.close_file(file)
         return output_buffer
 
+    @staticmethod
+    def deinterleave(data_ptr, n_pols, n_chans, n_samp):
+        # Buffers are ordered by polarization, sample and channel. Re-order to
+        # (polarization, channel, sample), the on-disk layout, with a single copy
+        data = data_ptr[:n_pols * n_samp * n_chans].reshape((n_pols, n_samp, n_chans))
+        return numpy.ascontiguousarray(data.transpose((0, 2, 1)))
+
     def write_data(self, timestamp=None, data_ptr=None):
         file = self.create_file(timestamp)
         file.flush()
@@ -275,18 +273,19 @@ class BeamFormatFileManager(AAVSFileManager):
         n_samp = self.main_dset.attrs['n_samples']
         n_chans = self.main_dset.attrs['n_chans']
         self.main_dset.attrs['timestamp'] = timestamp
+        data = self.deinterleave(data_ptr, n_pols, n_chans, n_samp)
         for polarization in xrange(0, n_pols):
-            polarization_grp = file["polarization_"+str(polarization)]
-            dset = polarization_grp["data"]
-            dset.resize(n_samp, axis=1) #resize for only one fit
-            for channel in xrange(0, n_chans):
-                start_idx = (polarization * n_chans * n_samp) + channel
-                end_idx = (polarization + 1) * n_chans * n_samp
-                dset[channel,:] = data_ptr[start_idx : end_idx : n_chans]
+            self.write_samples(file["polarization_"+str(polarization)]["data"], data[polarization])
         file.flush()
         self.close_file(file)
 
     def append_data(self, timestamp = None, data_ptr=None):
+        if self.session is not None:
+            data = self.deinterleave(data_ptr, self.n_pols, self.n_chans, self.n_samples)
+            self.session.append([("polarization_" + str(polarization) + "/data", data[polarization])
+                                 for polarization in xrange(0, self.n_pols)], timestamp)
+            return
+
         try:
             file = self.load_file(timestamp)
         except:
@@ -296,15 +295,10 @@ class BeamFormatFileManager(AAVSFileManager):
         n_samp = self.main_dset.attrs['n_samples']
         n_chans = self.main_dset.attrs['n_chans']
         self.main_dset.attrs['timestamp'] = timestamp
+        data = self.deinterleave(data_ptr, n_pols, n_chans, n_samp)
         for polarization in xrange(0, n_pols):
-            polarization_grp = file["polarization_"+str(polarization)]
-            dset = polarization_grp["data"]
-            ds_last_size = dset[0].size
-            dset.resize(ds_last_size+n_samp, axis=1) #resize to fit new data
-            for channel in xrange(0, n_chans):
-                start_idx = (polarization * n_chans * n_samp) + channel
-                end_idx = (polarization + 1) * n_chans * n_samp
-                dset[channel, ds_last_size:ds_last_size+n_samp] = data_ptr[start_idx : end_idx : n_chans]
+            dset = file["polarization_"+str(polarization)]["data"]
+            self.write_samples(dset, data[polarization], dset.shape[1])
         file.flush()
         self.close_file(file)
 
@@ -1,4 +1,5 @@
 from aavs_file import *
+from reader import DataReader
 from matplotlib import pyplot as plt
 from matplotlib import cm
 import time
@@ -241,33 +242,25 @@ class ChannelFormatFileManager(AAVSFileManager):
             print "Can't load file for data reading: ", e.message
             raise
 
+        # Channels missing from the file are skipped, leaving zeros, while other selections outside
+        # the file are errors, rather than a file in construction to re-try
+        present = [i for i, channel in enumerate(channels) if "channel_%d" % channel in file]
+        try:
+            DataReader(file).check_selection(antennas=antennas, polarizations=polarizations)
+        except IndexError:
+            self.close_file(file)
+            raise
+
         data_flushed = False
         while not data_flushed:
             try:
-                file_items = temp_dset.attrs.items()
-                file_groups = file.values()
-                file_groups_names = [elem.name for elem in file_groups]
-                for channel_idx in xrange(0, len(channels)):
-                    current_channel = channels[channel_idx]
-                    channel_name = "/"+"channel_" + str(current_channel)
-                    if channel_name in file_groups_names:
-                        channel_grp = file["channel_" + str(current_channel)]
-                        if channel_grp.values()[0].name == channel_name+"/data":
-                            dset = channel_grp["data"]
-                            dset_rows = dset.shape[0]
-                            dset_columns = dset.shape[1]
-                            nof_items = dset[0].size
-                            if (dset_rows == temp_dset.attrs["n_antennas"] * temp_dset.attrs["n_pols"]) and (dset_columns >= temp_dset.attrs["n_samples"]):
-                                for antenna_idx in xrange(0, len(antennas)):
-                                    current_antenna = antennas[antenna_idx]
-                                    for polarization_idx in xrange(0, len(polarizations)):
-                                        current_polarization = polarizations[polarization_idx]
-                                        if sample_offset+n_samples > nof_items:
-                                            output_buffer[channel_idx,antenna_idx,polarization_idx,:] = dset[(current_antenna*self.n_pols)+current_polarization, 0:nof_items]
-                                        else:
-                                            output_buffer[channel_idx,antenna_idx,polarization_idx,:] = dset[(current_antenna*self.n_pols)+current_polarization, sample_offset:sample_offset+n_samples]
+                # Read selection with a single hyperslab per dataset, samples beyond the file are left as zeros
+                data = DataReader(file).read(channels=[channels[i] for i in present], antennas=antennas,
+                                             polarizations=polarizations, sample_offset=sample_offset,
+                                             n_samples=n_samples)
+                output_buffer[present, :, :, :data.shape[-1]] = data
                 data_flushed = True
-            except Exception as e:
+            except IOError:
                 print "File appears to be in construction, re-trying."
                 print "Closing file..."
                 self.close_file(file)
@@ -278,6 +271,13 @@ class ChannelFormatFileManager(AAVSFileManager):
         self.close_file(file)
         return output_buffer
 
+    @staticmethod
+    def deinterleave(data_ptr, n_chans, n_antennas, n_pols, n_samp):
+        # Buffers are ordered by channel, sample, antenna and polarization. Re-order to
+        # (channel, antenna * pol, sample), the on-disk layout, with a single copy
+        data = data_ptr[:n_chans * n_samp * n_antennas * n_pols].reshape((n_chans, n_samp, n_antennas * n_pols))
+        return numpy.ascontiguousarray(data.transpose((0, 2, 1)))
+
     def write_data(self, data_ptr=None, timestamp=None):
         file = self.create_file(timestamp)
         file.flush()
@@ -288,22 +288,20 @@ class ChannelFormatFileManager(AAVSFileManager):
         n_antennas = self.main_dset.attrs['n_antennas']
         n_samp = self.main_dset.attrs['n_samples']
         n_chans = self.main_dset.attrs['n_chans']
-        collected_data = numpy.empty((n_pols*n_antennas,n_samp),dtype=self.ctype)
         self.main_dset.attrs['timestamp'] = timestamp
+        data = self.deinterleave(data_ptr, n_chans, n_antennas, n_pols, n_samp)
         for channel in xrange(0, n_chans):
-            channel_grp = file["channel_" + str(channel)]
-            dset = channel_grp["data"]
-            dset.resize(n_samp, axis=1) #resize for only one fit
-            for antenna in xrange(0, n_antennas):
-                for polarization in xrange(0, n_pols):
-                    start_idx = (channel * n_samp * n_pols * n_antennas) + (n_pols * antenna) + polarization
-                    end_idx = ((channel + 1) * n_samp * n_pols * n_antennas)
-                    collected_data[(antenna*n_pols)+polarization,:] = data_ptr[start_idx : end_idx : n_antennas * n_pols]
-            dset[:,:] = collected_data
+            self.write_samples(file["channel_" + str(channel)]["data"], data[channel])
         file.flush()
         self.close_file(file)
 
     def append_data(self, data_ptr=None, timestamp=None):
+        if self.session is not None:
+            data = self.deinterleave(data_ptr, self.n_chans, self.n_antennas, self.n_pols, self.n_samples)
+            self.session.append([("channel_" + str(channel) + "/data", data[channel])
+                                 for channel in xrange(0, self.n_chans)], timestamp)
+            return
+
         try:
             file = self.load_file(timestamp)
         except:
@@ -313,19 +311,11 @@ class ChannelFormatFileManager(AAVSFileManager):
         n_antennas = self.main_dset.attrs['n_antennas']
         n_samp = self.main_dset.attrs['n_samples']
         n_chans = self.main_dset.attrs['n_chans']
-        collected_data = numpy.empty((n_pols*n_antennas,n_samp),dtype=self.ctype)
         self.main_dset.attrs['timestamp'] = timestamp
+        data = self.deinterleave(data_ptr, n_chans, n_antennas, n_pols, n_samp)
         for channel in xrange(0, n_chans):
-            channel_grp = file["channel_" + str(channel)]
-            dset = channel_grp["data"]
-            ds_last_size = dset[0].size
-            dset.resize(ds_last_size+n_samp, axis=1) #resize to fit new data
-            for antenna in xrange(0, n_antennas):
-                for polarization in xrange(0, n_pols):
-                    start_idx = (channel * n_samp * n_pols * n_antennas) + (n_pols * antenna) + polarization
-                    end_idx = ((channel + 1) * n_samp * n_pols * n_antennas)
-                    collected_data[(antenna*n_pols)+polarization,:] = data_ptr[start_idx : end_idx : n_antennas * n_pols]
-            dset[:,ds_last_size:ds_last_size+n_samp] = collected_data
+            dset = file["channel_" + str(channel)]["data"]
+            self.write_samples(dset, data[channel], dset.shape[1])
         file.flush()
         self.close_file(file)
 
@@ -1,4 +1,5 @@
 from aavs_file import AAVSFileManager, FileModes, FileTypes
+from reader import DataReader
 from matplotlib import pyplot as plt
 import time
 import numpy
@@ -33,36 +34,22 @@ class RawFormatFileManager(AAVSFileManager):
             print "Can't load file for data reading: ", e.message
             raise
 
+        # Selections outside the file are errors, rather than a file in construction to re-try
+        try:
+            DataReader(file).check_selection(antennas=antennas, polarizations=polarizations)
+        except IndexError:
+            self.close_file(file)
+            raise
+
         data_flushed = False
         while not data_flushed:
             try:
-                file_items = temp_dset.attrs.items()
-                file_groups = file.values()
-                file_groups_names = [elem.name for elem in file_groups]
-
-                # raw_grp = file["raw_"]
-                # dset = raw_grp["data"]
-                # nof_items = dset[0].size
-
-                raw_grp_name = "/raw_"
-                if raw_grp_name in file_groups_names:
-                    raw_grp = file[raw_grp_name]
-                    if raw_grp.values()[0].name == raw_grp_name+"/data":
-                        dset = raw_grp["data"]
-                        dset_rows = dset.shape[0]
-                        dset_columns = dset.shape[1]
-                        nof_items = dset[0].size
-                        if (dset_rows == temp_dset.attrs["n_antennas"] * temp_dset.attrs["n_pols"]) and (dset_columns >= temp_dset.attrs["n_samples"]):
-                            for antenna_idx in xrange(0, len(antennas)):
-                                current_antenna = antennas[antenna_idx]
-                                for polarization_idx in xrange(0, len(polarizations)):
-                                    current_polarization = polarizations[polarization_idx]
-                                    if sample_offset+n_samples > nof_items:
-                                        output_buffer[antenna_idx,polarization_idx,:] = dset[(current_antenna*self.n_pols)+current_polarization, 0:nof_items]
-                                    else:
-                                        output_buffer[antenna_idx,polarization_idx,:] = dset[(current_antenna*self.n_pols)+current_polarization, sample_offset:sample_offset+n_samples]
-                            data_flushed = True
-            except Exception as e:
+                # Read selection with a single hyperslab per dataset, samples beyond the file are left as zeros
+                data = DataReader(file).read(antennas=antennas, polarizations=polarizations,
+                                             sample_offset=sample_offset, n_samples=n_samples)
+                output_buffer[:, :, :data.shape[-1]] = data
+                data_flushed = True
+            except IOError:
                 print "File appears to be in construction, re-trying."
                 print "Closing file..."
                 self.close_file(file)
@@ -209,6 +196,13 @@ class RawFormatFileManager(AAVSFileManager):
         plt.show()
         print "All file processed"
 
+    @staticmethod
+    def deinterleave(data_ptr, n_antennas, n_pols, n_samp):
+        # Buffers are ordered by antenna, sample and polarization. Re-order to
+        # (antenna * pol, sample), the on-disk layout, with a single copy
+        data = data_ptr[:n_antennas * n_samp * n_pols].reshape((n_antennas, n_samp, n_pols))
+        return data.transpose((0, 2, 1)).reshape((n_antennas * n_pols, n_samp))
+
     def write_data(self, data_ptr=None, timestamp=None):
         file = self.create_file(timestamp)
         file.flush()
@@ -218,20 +212,16 @@ class RawFormatFileManager(AAVSFileManager):
         n_samp = self.main_dset.attrs['n_samples']
         self.main_dset.attrs['timestamp'] = timestamp
 
-        raw_grp = file["raw_"]
-        dset = raw_grp["data"]
-        ds_last_size = dset[0].size
-        dset.resize(n_samp, axis=1) #resize for only one fit
-
-        for antenna in xrange(0, n_antennas):
-            for polarization in xrange(0, n_pols):
-                start_idx = antenna * n_samp * n_pols + polarization
-                end_idx = (antenna+1) * n_samp * n_pols
-                dset[(antenna*n_pols)+polarization,:] = data_ptr[start_idx : end_idx : n_pols]
+        self.write_samples(file["raw_"]["data"], self.deinterleave(data_ptr, n_antennas, n_pols, n_samp))
         file.flush()
         self.close_file(file)
 
     def append_data(self, data_ptr=None, timestamp=None):
+        if self.session is not None:
+            data = self.deinterleave(data_ptr, self.n_antennas, self.n_pols, self.n_samples)
+            self.session.append([("raw_/data", data)], timestamp)
+            return
+
         try:
             file = self.load_file(timestamp)
         except:
@@ -242,16 +232,8 @@ class RawFormatFileManager(AAVSFileManager):
         n_samp = self.main_dset.attrs['n_samples']
         self.main_dset.attrs['timestamp'] = timestamp
 
-        raw_grp = file["raw_"]
-        dset = raw_grp["data"]
-        ds_last_size = dset[0].size
-        dset.resize(ds_last_size+n_samp, axis=1) #resize to fit new data
-
-        for antenna in xrange(0, n_antennas):
-            for polarization in xrange(0, n_pols):
-                start_idx = antenna * n_samp * n_pols + polarization
-                end_idx = (antenna+1) * n_samp * n_pols
-                dset[(antenna*n_pols)+polarization,ds_last_size:ds_last_size+n_samp] = data_ptr[start_idx : end_idx : n_pols]
+        dset = file["raw_"]["data"]
+        self.write_samples(dset, self.deinterleave(data_ptr, n_antennas, n_pols, n_samp), dset.shape[1])
         file.flush()
         self.close_file(file)
 
@@ -0,0 +1,132 @@
+from aavs_file import FileTypes
+import numpy
+import h5py
+
+
+class DataReader(object):
+    """ Reads selections of channel, raw and beam data files without per-antenna or
+        per-polarization loops. Contiguous, unfiltered datasets are memory-mapped through
+        their file offset, such that selections are sliced lazily from the page cache,
+        while chunked datasets are read with a single hyperslab per dataset """
+
+    def __init__(self, file):
+        """ Class constructor
+        :param file: File name, or open h5py File
+        """
+        self.file = h5py.File(file, 'r') if isinstance(file, basestring) else file
+        self._owned = isinstance(file, basestring)
+
+        root = self.file["root"]
+        self.type = FileTypes(root.attrs['type'])
+        self.n_antennas = root.attrs['n_antennas']
+        self.n_pols = root.attrs['n_pols']
+        self.n_chans = root.attrs['n_chans']
+        self.n_written = root.attrs['n_written'] if 'n_written' in root.attrs else None
+        self._views = {}
+
+    def view(self, name):
+        """ Get lazily sliceable view of a dataset
+        :param name: Dataset path, such as "channel_0/data"
+        :return: Read-only numpy.memmap for contiguous uncompressed datasets, otherwise the h5py dataset
+        """
+        view = self._views.get(name)
+        if view is not None:
+            return view
+
+        view = dset = self.file[name]
+        offset = dset.id.get_offset() if dset.chunks is None and dset.compression is None else None
+        if offset is not None:
+            view = numpy.memmap(self.file.filename, dtype=dset.dtype, mode='r', offset=offset, shape=dset.shape)
+        self._views[name] = view
+        return view
+
+    @property
+    def n_samples(self):
+        """ Number of samples available in the file """
+        if self.type == FileTypes.Raw:
+            n_samples = self.view("raw_/data").shape[1]
+        elif self.type == FileTypes.Channel:
+            n_samples = self.view("channel_0/data").shape[1]
+        else:
+            n_samples = self.view("polarization_0/data").shape[1]
+        return n_samples if self.n_written is None else min(n_samples, self.n_written)
+
+    def read(self, channels=None, antennas=None, polarizations=None, sample_offset=0, n_samples=None):
+        """ Read selection. Antennas, polarizations and channels default to all, and samples to
+            all samples from sample_offset. Selections beyond the available samples are clipped
+        :return: Array shaped (channel, antenna, pol, sample) for channel data, (antenna, pol, sample)
+                 for raw data and (pol, channel, sample) for beam data
+        """
+        antennas = numpy.arange(self.n_antennas) if antennas is None else numpy.asarray(antennas, numpy.int64)
+        polarizations = numpy.arange(self.n_pols) if polarizations is None else numpy.asarray(polarizations, numpy.int64)
+        channels = numpy.arange(self.n_chans) if channels is None else numpy.asarray(channels, numpy.int64)
+        self.check_selection(channels, antennas, polarizations)
+
+        available = self.n_samples
+        start = min(sample_offset, available)
+        stop = available if n_samples is None else min(sample_offset + n_samples, available)
+
+        if self.type == FileTypes.Raw:
+            rows = (antennas[:, None] * self.n_pols + polarizations[None, :]).ravel()
+            data = self._read(["raw_/data"], rows, start, stop)
+            return data.reshape((len(antennas), len(polarizations), stop - start))
+
+        elif self.type == FileTypes.Channel:
+            rows = (antennas[:, None] * self.n_pols + polarizations[None, :]).ravel()
+            data = self._read(["channel_%d/data" % c for c in channels], rows, start, stop)
+            return data.reshape((len(channels), len(antennas), len(polarizations), stop - start))
+
+        else:
+            return self._read(["polarization_%d/data" % p for p in polarizations], channels, start, stop)
+
+    def check_selection(self, channels=None, antennas=None, polarizations=None):
+        """ Check that selected channels, antennas and polarizations are in the file
+        :raises IndexError: When a selection is out of range
+        """
+        for name, selection, n in [('Channel', channels, self.n_chans), ('Antenna', antennas, self.n_antennas),
+                                   ('Polarization', polarizations, self.n_pols)]:
+            selection = numpy.asarray([] if selection is None else selection, numpy.int64)
+            if selection.size > 0 and (selection.min() < 0 or selection.max() >= n):
+                raise IndexError("%s selection %s out of range, file has %d" % (name, str(selection.tolist()), n))
+
+    def iterate(self, window, channels=None, antennas=None, polarizations=None, sample_offset=0, n_samples=None):
+        """ Iterate over a selection in windows of a fixed number of samples, the last window may be shorter
+        :param window: Number of samples per window
+        :return: Generator of (sample offset, data) tuples, with data shaped as returned by read
+        """
+        stop = self.n_samples if n_samples is None else min(sample_offset + n_samples, self.n_samples)
+        for offset in xrange(sample_offset, stop, window):
+            yield offset, self.read(channels, antennas, polarizations, offset, min(window, stop - offset))
+
+    def close(self):
+        self._views = {}
+        if self._owned:
+            self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def _read(self, names, rows, start, stop):
+        # Read a single block of rows per dataset. Rows are selected from a hyperslab spanning the
+        # requested rows, unless they form a contiguous range which can be sliced directly
+        rows = numpy.asarray(rows, dtype=numpy.int64)
+        first, last = (rows.min(), rows.max() + 1) if rows.size > 0 else (0, 0)
+        contiguous = rows.size == last - first and (rows == numpy.arange(first, last)).all()
+
+        output = None
+        for i, name in enumerate(names):
+            view = self.view(name)
+            block = view[first:last, start:stop]
+            block = block if contiguous else block[rows - first]
+
+            # A single memory-mapped dataset is returned without copying
+            if len(names) == 1 and isinstance(view, numpy.memmap):
+                return block[None, :, :]
+
+            if output is None:
+                output = numpy.empty((len(names), rows.size, stop - start), dtype=view.dtype)
+            output[i] = block
+        return output if output is not None else numpy.empty((0, rows.size, stop - start))
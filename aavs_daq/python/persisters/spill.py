@@ -0,0 +1,161 @@
+from threading import Lock
+import ctypes.util
+import ctypes
+import logging
+import numpy
+import json
+import os
+
+# posix_fallocate reserves disk blocks for spill files up front, where available
+try:
+    _libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+    _posix_fallocate = _libc.posix_fallocate
+    _posix_fallocate.argtypes = [ctypes.c_int, ctypes.c_int64, ctypes.c_int64]
+except (OSError, AttributeError, TypeError):
+    _posix_fallocate = None
+
+
+class SpillWriter(object):
+    """ Writes buffers sequentially to preallocated binary spill files, without any formatting
+        on the write path. Buffers start at page-aligned offsets. Each spill file has a sidecar
+        index with one JSON line per buffer (timestamp, offset, shape), preceded by a header line
+        with the buffer dtype and the persister's type and metadata, such that spill files can be
+        converted to the persister's HDF5 layout offline with spill_converter.py """
+
+    def __init__(self, directory='.', name='data', persister=None, append=False, file_size=1024 * 1024 * 1024,
+                 alignment=4096):
+        """ Class constructor
+        :param directory: Directory where spill files are written
+        :param name: Stream name, used as spill file name prefix
+        :param persister: AAVSFileManager whose type and metadata are recorded for conversion
+        :param append: Buffers are appended to a single HDF5 file when converted, rather than one file each
+        :param file_size: Size in bytes to which spill files are preallocated, a new file is started when full
+        :param alignment: Buffer offset alignment in bytes
+        """
+        self.directory = directory
+        self.name = name
+        self.append = append
+        self.file_size = file_size
+        self.alignment = alignment
+        self.file_type = persister.type.name if persister is not None else None
+        self.metadata = persister.get_metadata() if persister is not None else {}
+
+        self.filename = None
+        self.nof_files = 0
+        self.nof_buffers = 0
+        self._file = None
+        self._index = None
+        self._dtype = None
+        self._offset = 0
+        self._allocated = 0
+        self._lock = Lock()
+
+    def write(self, data, timestamp):
+        """ Write buffer to the current spill file
+        :param data: numpy array
+        :param timestamp: Buffer timestamp
+        :return: Spill file name
+        """
+        data = numpy.ascontiguousarray(data)
+        with self._lock:
+            if self._file is None or data.dtype != self._dtype or self._offset + data.nbytes > self._allocated:
+                self._open(data, timestamp)
+
+            self._file.seek(self._offset)
+            self._file.write(buffer(data))
+            self._index.write(json.dumps({'timestamp': timestamp, 'offset': self._offset, 'shape': data.shape}) + '\n')
+
+            self._offset += -(-data.nbytes // self.alignment) * self.alignment
+            self.nof_buffers += 1
+            return self.filename
+
+    def close(self):
+        """ Close current spill file, trimming it to its used length """
+        with self._lock:
+            self._close()
+
+    def _close(self):
+        if self._file is None:
+            return
+        self._file.truncate(self._offset)
+        self._file.close()
+        self._index.close()
+        self._file = None
+        self._index = None
+
+    def _open(self, data, timestamp):
+        self._close()
+
+        self.filename = os.path.join(self.directory, "%s_%s.spill" % (self.name, str(timestamp)))
+        self._file = open(self.filename, 'w+b', 0)
+        self._allocated = max(self.file_size, data.nbytes)
+        if _posix_fallocate is None or _posix_fallocate(self._file.fileno(), 0, self._allocated) != 0:
+            self._file.truncate(self._allocated)
+
+        self._index = open(self.filename + '.idx', 'w', 1)
+        self._index.write(json.dumps({'name': self.name, 'type': self.file_type, 'append': self.append,
+                                      'dtype': numpy.lib.format.dtype_to_descr(data.dtype),
+                                      'metadata': self.metadata}) + '\n')
+        self._dtype = data.dtype
+        self._offset = 0
+        self.nof_files += 1
+
+
+class SpillReader(object):
+    """ Reads buffers from a spill file as memory-mapped arrays """
+
+    def __init__(self, filename):
+        """ Class constructor
+        :param filename: Spill file, its index is expected alongside it
+        """
+        self.filename = filename
+        with open(filename + '.idx') as index:
+            lines = index.readlines()
+
+        # Writes to a spill file which was not closed can end part-way through an index line
+        if len(lines) > 0 and not lines[-1].endswith('\n'):
+            logging.warning("Ignoring incomplete index line at the end of %s.idx" % filename)
+            lines = lines[:-1]
+        lines = [json.loads(line) for line in lines if line.strip() != '']
+
+        header = lines[0]
+        self.name = header['name']
+        self.file_type = header['type']
+        self.append = header['append']
+        self.metadata = header['metadata']
+        self.dtype = numpy.dtype(self._descr(header['dtype']))
+
+        # Spill files which were not closed keep their preallocated size, beyond the indexed buffers,
+        # while truncated spill files can end before the last indexed buffers
+        size = os.path.getsize(filename)
+        self.entries = [entry for entry in lines[1:]
+                        if entry['offset'] + int(numpy.prod(entry['shape'])) * self.dtype.itemsize <= size]
+        if len(self.entries) < len(lines) - 1:
+            logging.warning("Ignoring %d indexed buffers beyond the end of %s" % (len(lines) - 1 - len(self.entries),
+                                                                                  filename))
+        self._data = numpy.memmap(filename, dtype=numpy.uint8, mode='r') if size > 0 else None
+
+    def read(self, i):
+        """ Get buffer as a read-only view of the spill file
+        :param i: Buffer index
+        :return: (timestamp, numpy array) tuple
+        """
+        entry = self.entries[i]
+        count = int(numpy.prod(entry['shape']))
+        data = self._data[entry['offset']:entry['offset'] + count * self.dtype.itemsize]
+        return entry['timestamp'], data.view(self.dtype).reshape(entry['shape'])
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __iter__(self):
+        for i in xrange(len(self.entries)):
+            yield self.read(i)
+
+    @staticmethod
+    def _descr(descr):
+        # JSON turns the field tuples of structured dtypes into lists, which numpy does not accept
+        if type(descr) is not list:
+            return str(descr)
+        return [(str(field[0]), SpillReader._descr(field[1])) + ((tuple(field[2]),) if len(field) > 2 else ())
+                for field in descr]
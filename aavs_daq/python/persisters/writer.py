@@ -0,0 +1,150 @@
+from enum import Enum
+from threading import Thread, Lock
+import Queue
+import logging
+import numpy
+import time
+
+
+class BackpressurePolicy(Enum):
+    Block = 1
+    DropOldest = 2
+    Spill = 3
+
+
+class PersisterQueue(object):
+    """ Bounded queue between a DAQ consumer callback and a persister. Callbacks copy their
+        buffer into the queue and return immediately, while a dedicated writer thread calls
+        the persister, such that slow disks or file flushes do not hold up the consumer.
+        When the queue is full, the callback either waits for space, drops the oldest
+        queued buffer, or spills the buffer to a file, depending on the policy """
+
+    # Queued to stop the writer thread once preceding buffers are persisted
+    _STOP = (None, None, None)
+
+    def __init__(self, persist, name='data', max_depth=16, policy=BackpressurePolicy.Block, spill=None):
+        """ Class constructor
+        :param persist: Function called with (data, timestamp) for each buffer, on the writer thread
+        :param name: Stream name, used for logging
+        :param max_depth: Maximum number of queued buffers
+        :param policy: BackpressurePolicy applied when the queue is full
+        :param spill: SpillWriter, required by the Spill policy
+        """
+        if policy == BackpressurePolicy.Spill and spill is None:
+            raise ValueError("Spill policy requires a spill writer")
+
+        self.persist = persist
+        self.name = name
+        self.policy = policy
+        self.spill = spill
+        self._queue = Queue.Queue(maxsize=max_depth)
+        self._lock = Lock()
+
+        self.reset_statistics()
+
+        self._thread = Thread(target=self._run, name="%s_writer" % name)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def put(self, data, timestamp):
+        """ Queue a copy of a buffer for persisting. The buffer can be reused once this returns
+        :param data: numpy array, such as a view of the consumer's buffer
+        :param timestamp: Buffer timestamp
+        """
+        item = (numpy.array(data, copy=True), timestamp, time.time())
+
+        if self.policy == BackpressurePolicy.Block:
+            self._queue.put(item)
+        else:
+            try:
+                self._queue.put_nowait(item)
+            except Queue.Full:
+                if self.policy == BackpressurePolicy.DropOldest:
+                    self._drop_oldest(item)
+                else:
+                    # Spilled buffers bypass the queue, and are only counted as spilled
+                    self.spill.write(item[0], timestamp)
+                    self._count('spilled')
+                    return
+
+        with self._lock:
+            self.enqueued += 1
+            self.max_depth = max(self.max_depth, self._queue.qsize())
+
+    def stop(self, timeout=None):
+        """ Persist queued buffers and stop the writer thread
+        :param timeout: Maximum time to wait for queued buffers, in seconds
+        """
+        self._queue.put(self._STOP)
+        self._thread.join(timeout)
+
+    def statistics(self):
+        """ Queue metrics, latencies are in seconds from queueing to persisting a buffer. Buffers
+            are either enqueued or spilled, and enqueued buffers are either written, dropped,
+            failed (errors) or still queued (depth) """
+        with self._lock:
+            return {'depth': self._queue.qsize(),
+                    'max_depth': self.max_depth,
+                    'enqueued': self.enqueued,
+                    'written': self.written,
+                    'dropped': self.dropped,
+                    'spilled': self.spilled,
+                    'errors': self.errors,
+                    'mean_latency': self._total_latency / self.written if self.written > 0 else 0,
+                    'max_latency': self._max_latency,
+                    'mean_write_time': self._total_write_time / self.written if self.written > 0 else 0}
+
+    def reset_statistics(self):
+        with self._lock:
+            self.max_depth = 0
+            self.enqueued = 0
+            self.written = 0
+            self.dropped = 0
+            self.spilled = 0
+            self.errors = 0
+            self._total_latency = 0
+            self._max_latency = 0
+            self._total_write_time = 0
+
+    def _drop_oldest(self, item):
+        while True:
+            try:
+                oldest = self._queue.get_nowait()
+                if oldest is self._STOP:
+                    # Queue is being stopped, so keep the stop request and drop the new buffer instead
+                    self._queue.put(oldest)
+                    self._count('dropped')
+                    return
+                self._count('dropped')
+            except Queue.Empty:
+                pass
+            try:
+                self._queue.put_nowait(item)
+                return
+            except Queue.Full:
+                continue
+
+    def _count(self, counter):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def _run(self):
+        while True:
+            data, timestamp, queued = self._queue.get()
+            if data is None:
+                return
+
+            start = time.time()
+            try:
+                self.persist(data, timestamp)
+            except Exception as e:
+                logging.error("Failed to persist %s buffer with timestamp %s: %s" % (self.name, str(timestamp), str(e)))
+                self._count('errors')
+                continue
+
+            end = time.time()
+            with self._lock:
+                self.written += 1
+                self._total_latency += end - queued
+                self._max_latency = max(self._max_latency, end - queued)
+                self._total_write_time += end - start
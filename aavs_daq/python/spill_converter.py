@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+
+# Convert spill files written by aavs_daq_receiver.py in fast spill mode, or by its spill
+# backpressure policy, to the HDF5 layout of the corresponding persister:
+#   python spill_converter.py -d /data/hdf5 /data/spill/*.spill
+from multiprocessing import Pool
+import logging
+import glob
+import os
+
+from persisters import *
+
+# Persister for each file type recorded in spill indices
+managers = {FileTypes.Raw.name        : RawFormatFileManager,
+            FileTypes.Channel.name    : ChannelFormatFileManager,
+            FileTypes.Beamformed.name : BeamFormatFileManager}
+
+def convert(task):
+    # Convert a range of buffers from a spill file. Buffers of appended streams are all
+    # written to a single HDF5 file, otherwise each buffer gets its own file
+    filename, directory, start, stop = task
+    reader = SpillReader(filename)
+
+    manager = managers[reader.file_type](root_path = directory, mode = FileModes.Write)
+    manager.set_metadata(**reader.metadata)
+
+    if reader.append:
+        manager.start_session(flush_period = 10.0)
+        for i in xrange(start, stop):
+            timestamp, data = reader.read(i)
+            manager.append_data(data_ptr = data, timestamp = timestamp)
+        manager.stop_session()
+    else:
+        for i in xrange(start, stop):
+            timestamp, data = reader.read(i)
+            manager.write_data(data_ptr = data, timestamp = timestamp)
+
+    return filename, stop - start
+
+def create_tasks(filenames, directory, buffers_per_task):
+    # Appended streams are converted sequentially, so each of their spill files is a single task
+    tasks = []
+    for filename in filenames:
+        reader = SpillReader(filename)
+        step = len(reader) if reader.append else buffers_per_task
+        for start in xrange(0, len(reader), max(step, 1)):
+            tasks.append((filename, directory, start, min(start + step, len(reader))))
+    return tasks
+
+# Script main entry point
+if __name__ == "__main__":
+
+    # Use OptionParse to get command-line arguments
+    from optparse import OptionParser
+    from sys import argv, stdout
+
+    parser = OptionParser(usage="usage: %spill_converter [options] spill_files")
+    parser.add_option("-d", "--data-directory", action="store", dest="directory",
+                      default=".", help="Directory where HDF5 files will be stored [default: current directory]")
+    parser.add_option("-s", "--spill-directory", action="store", dest="spill_directory",
+                      default=None, help="Convert all spill files in directory [default: None]")
+    parser.add_option("-p", "--processes", action="store", dest="processes",
+                      type="int", default=4, help="Number of conversion processes [default: 4]")
+    parser.add_option("-b", "--buffers_per_task", action="store", dest="buffers_per_task",
+                      type="int", default=16, help="Buffers converted per task, for streams which are not "
+                                                   "appended [default: 16]")
+    parser.add_option("-r", "--remove", action="store_true", dest="remove",
+                      default=False, help="Remove spill files once converted [default: False]")
+
+    (conf, args) = parser.parse_args(argv[1:])
+
+    # Set logging
+    log = logging.getLogger('')
+    log.setLevel(logging.INFO)
+    format = logging.Formatter("%(asctime)s - %(levelname)s - %(message)s")
+    ch = logging.StreamHandler(stdout)
+    ch.setFormatter(format)
+    log.addHandler(ch)
+
+    filenames = list(args)
+    if conf.spill_directory is not None:
+        filenames += sorted(glob.glob(os.path.join(conf.spill_directory, "*.spill")))
+
+    if len(filenames) == 0:
+        logging.error("No spill files specified. Exiting")
+        exit(0)
+
+    if not os.path.exists(conf.directory):
+        logging.error("Specified data directory [%s] does not exist" % conf.directory)
+        exit(-1)
+
+    # Convert spill files concurrently
+    tasks = create_tasks(filenames, conf.directory, conf.buffers_per_task)
+    pool = Pool(conf.processes)
+    converted = {}
+    for filename, nof_buffers in pool.imap_unordered(convert, tasks):
+        converted[filename] = converted.get(filename, 0) + nof_buffers
+    pool.close()
+    pool.join()
+
+    for filename in filenames:
+        logging.info("Converted %d buffers from %s" % (converted.get(filename, 0), filename))
+        if conf.remove:
+            os.remove(filename)
+            os.remove(filename + '.idx')
@@ -0,0 +1,537 @@
+from threading import Event, Thread
+import tempfile
+import unittest
+import shutil
+import numpy
+import h5py
+import os
+
+from persisters import *
+
+# Complex samples of channel and beam data
+COMPLEX_8T = numpy.dtype([('real', numpy.int8), ('imag', numpy.int8)])
+
+
+class TestFileSession(unittest.TestCase):
+
+    n_antennas = 4
+    n_pols = 2
+    n_samples = 8
+
+    def setUp(self):
+        self._directory = tempfile.mkdtemp()
+        self._manager = RawFormatFileManager(root_path=self._directory, mode=FileModes.Write)
+        self._manager.set_metadata(n_antennas=self.n_antennas, n_pols=self.n_pols, n_samples=self.n_samples)
+
+    def tearDown(self):
+        self._manager.stop_session()
+        shutil.rmtree(self._directory)
+
+    def _buffer(self, i):
+        """ Raw buffer, ordered by antenna, sample and polarization """
+        return ((numpy.arange(self.n_antennas * self.n_samples * self.n_pols) + i * 7) % 127).astype(numpy.int8)
+
+    def _expected(self, blocks):
+        """ On-disk layout of consecutive buffers, (antenna * pol, sample) """
+        return numpy.concatenate([self._buffer(i).reshape((self.n_antennas, self.n_samples, self.n_pols))
+                                  .transpose((0, 2, 1)).reshape((self.n_antennas * self.n_pols, self.n_samples))
+                                  for i in blocks], axis=1)
+
+    def _read(self, timestamp):
+        with h5py.File(os.path.join(self._directory, "raw_%d.hdf5" % timestamp), 'r') as f:
+            return f["raw_/data"][:], f["root"].attrs['n_written']
+
+    def test_append_across_reopen(self):
+        """ Check that files written by a session are trimmed on close, and appended to once re-opened """
+
+        session = self._manager.start_session(flush_period=100)
+        for i in range(3):
+            self._manager.append_data(data_ptr=self._buffer(i), timestamp=1)
+        self.assertEqual(session.nof_files, 1)
+        self.assertEqual(session.nof_resizes, 3)
+        self._manager.stop_session()
+
+        data, n_written = self._read(1)
+        self.assertEqual(n_written, 3 * self.n_samples)
+        numpy.testing.assert_array_equal(data, self._expected(range(3)))
+
+        # Appending without a session re-opens the file, keeping its written length up to date
+        for i in range(3, 5):
+            self._manager.append_data(data_ptr=self._buffer(i), timestamp=1)
+
+        data, n_written = self._read(1)
+        self.assertEqual(n_written, 5 * self.n_samples)
+        numpy.testing.assert_array_equal(data, self._expected(range(5)))
+        with DataReader(os.path.join(self._directory, "raw_1.hdf5")) as reader:
+            self.assertEqual(reader.n_samples, 5 * self.n_samples)
+
+    def test_rollover(self):
+        """ Check that files are closed and a new file started once the maximum file size is reached """
+
+        block_size = self.n_antennas * self.n_pols * self.n_samples
+        session = self._manager.start_session(flush_period=100, max_file_size=2 * block_size)
+        for i in range(3):
+            self._manager.append_data(data_ptr=self._buffer(i), timestamp=10 + i)
+
+        # First file was closed on rollover, and is complete while the session continues
+        first = os.path.join(self._directory, "raw_10.hdf5")
+        self.assertNotIn(first, self._manager.file_locks)
+        self.assertEqual(session.filename, os.path.join(self._directory, "raw_12.hdf5"))
+        data, n_written = self._read(10)
+        self.assertEqual(n_written, 2 * self.n_samples)
+        numpy.testing.assert_array_equal(data, self._expected(range(2)))
+
+        for i in range(3, 5):
+            self._manager.append_data(data_ptr=self._buffer(i), timestamp=10 + i)
+        self._manager.stop_session()
+
+        self.assertEqual(session.nof_files, 3)
+        self.assertEqual(self._manager.file_locks, {})
+        for timestamp, blocks in [(10, range(2)), (12, range(2, 4)), (14, [4])]:
+            data, n_written = self._read(timestamp)
+            self.assertEqual(n_written, len(blocks) * self.n_samples)
+            numpy.testing.assert_array_equal(data, self._expected(blocks))
+
+
+class TestDeinterleave(unittest.TestCase):
+    """ Compare de-interleaving with per-element re-ordering of the buffer, as done by the
+        strided copies which it replaced. Dimensions are distinct to catch swapped axes """
+
+    n_chans = 3
+    n_antennas = 5
+    n_pols = 2
+    n_samples = 7
+
+    def _buffer(self, n, dtype=numpy.dtype(numpy.int16)):
+        """ Buffer with a distinct value per element and trailing items beyond the used length """
+        data = numpy.zeros(n + 3, dtype=dtype)
+        values = numpy.arange(n + 3) % 251
+        if dtype.names is None:
+            data[:] = values
+        else:
+            data['real'], data['imag'] = values - 125, 125 - values
+        return data
+
+    def test_channel(self):
+        n_chans, n_antennas, n_pols, n_samp = self.n_chans, self.n_antennas, self.n_pols, self.n_samples
+        for dtype in [numpy.dtype(numpy.int16), numpy.dtype([('real', numpy.int8), ('imag', numpy.int8)])]:
+            data_ptr = self._buffer(n_chans * n_samp * n_antennas * n_pols, dtype)
+            expected = numpy.zeros((n_chans, n_antennas * n_pols, n_samp), dtype=dtype)
+            for channel in xrange(n_chans):
+                for antenna in xrange(n_antennas):
+                    for polarization in xrange(n_pols):
+                        for sample in xrange(n_samp):
+                            index = ((channel * n_samp + sample) * n_antennas + antenna) * n_pols + polarization
+                            expected[channel, antenna * n_pols + polarization, sample] = data_ptr[index]
+
+            data = ChannelFormatFileManager.deinterleave(data_ptr, n_chans, n_antennas, n_pols, n_samp)
+            self.assertTrue(data.flags['C_CONTIGUOUS'])
+            numpy.testing.assert_array_equal(data, expected)
+
+    def test_raw(self):
+        n_antennas, n_pols, n_samp = self.n_antennas, self.n_pols, self.n_samples
+        data_ptr = self._buffer(n_antennas * n_samp * n_pols)
+        expected = numpy.zeros((n_antennas * n_pols, n_samp), dtype=data_ptr.dtype)
+        for antenna in xrange(n_antennas):
+            for polarization in xrange(n_pols):
+                for sample in xrange(n_samp):
+                    index = (antenna * n_samp + sample) * n_pols + polarization
+                    expected[antenna * n_pols + polarization, sample] = data_ptr[index]
+
+        numpy.testing.assert_array_equal(RawFormatFileManager.deinterleave(data_ptr, n_antennas, n_pols, n_samp),
+                                         expected)
+
+    def test_beam(self):
+        n_pols, n_chans, n_samp = self.n_pols, self.n_chans, self.n_samples
+        data_ptr = self._buffer(n_pols * n_samp * n_chans, numpy.dtype([('real', numpy.int8), ('imag', numpy.int8)]))
+        expected = numpy.zeros((n_pols, n_chans, n_samp), dtype=data_ptr.dtype)
+        for polarization in xrange(n_pols):
+            for channel in xrange(n_chans):
+                for sample in xrange(n_samp):
+                    index = (polarization * n_samp + sample) * n_chans + channel
+                    expected[polarization, channel, sample] = data_ptr[index]
+
+        data = BeamFormatFileManager.deinterleave(data_ptr, n_pols, n_chans, n_samp)
+        self.assertTrue(data.flags['C_CONTIGUOUS'])
+        numpy.testing.assert_array_equal(data, expected)
+
+
+class StubPersister(object):
+    """ Persister which records buffers, holding up the writer thread until released """
+
+    def __init__(self, fail=()):
+        self.fail = fail
+        self.persisted = []
+        self.started = Event()
+        self.released = Event()
+
+    def __call__(self, data, timestamp):
+        self.started.set()
+        self.released.wait(5)
+        if timestamp in self.fail:
+            raise IOError("Write failed")
+        self.persisted.append((timestamp, data.copy()))
+
+    @property
+    def timestamps(self):
+        return [timestamp for timestamp, _ in self.persisted]
+
+
+class TestPersisterQueue(unittest.TestCase):
+
+    def _fill(self, queue, persister, timestamps):
+        """ Queue buffers while the writer thread is held up by the first one """
+        queue.put(numpy.full(4, timestamps[0]), timestamps[0])
+        self.assertTrue(persister.started.wait(1))
+        for timestamp in timestamps[1:]:
+            queue.put(numpy.full(4, timestamp), timestamp)
+
+    def test_block(self):
+        """ Check that buffers wait for space in a full queue and are all persisted in order """
+
+        persister = StubPersister()
+        queue = PersisterQueue(persister, max_depth=2, policy=BackpressurePolicy.Block)
+        self._fill(queue, persister, [0, 1, 2])
+
+        # Buffers are copied when queued
+        buf = numpy.full(4, 3)
+        producer = Thread(target=queue.put, args=(buf, 3))
+        producer.start()
+        producer.join(0.1)
+        self.assertTrue(producer.is_alive())
+        buf[:] = -1
+
+        persister.released.set()
+        producer.join(1)
+        self.assertFalse(producer.is_alive())
+        queue.stop(1)
+
+        self.assertEqual(persister.timestamps, [0, 1, 2, 3])
+        numpy.testing.assert_array_equal(persister.persisted[3][1], numpy.full(4, 3))
+        statistics = queue.statistics()
+        self.assertEqual((statistics['enqueued'], statistics['written'], statistics['max_depth']), (4, 4, 2))
+        self.assertEqual((statistics['dropped'], statistics['spilled']), (0, 0))
+
+    def test_drop_oldest(self):
+        """ Check that the oldest queued buffers are dropped to make space for new ones """
+
+        persister = StubPersister()
+        queue = PersisterQueue(persister, max_depth=2, policy=BackpressurePolicy.DropOldest)
+        self._fill(queue, persister, range(6))
+        self.assertEqual(queue.statistics()['dropped'], 3)
+
+        persister.released.set()
+        queue.stop(1)
+
+        self.assertEqual(persister.timestamps, [0, 4, 5])
+        statistics = queue.statistics()
+        self.assertEqual((statistics['enqueued'], statistics['written'], statistics['dropped']), (6, 3, 3))
+
+    def test_stop_while_dropping(self):
+        """ Check that buffers queued after stop do not evict the stop request from a full queue """
+
+        persister = StubPersister()
+        queue = PersisterQueue(persister, max_depth=2, policy=BackpressurePolicy.DropOldest)
+        self._fill(queue, persister, [0, 1])
+        queue.stop(0.01)
+
+        # Queue holds buffer 1 and the stop request, buffer 3 would evict the stop request
+        queue.put(numpy.full(4, 2), 2)
+        queue.put(numpy.full(4, 3), 3)
+
+        persister.released.set()
+        queue._thread.join(1)
+        self.assertFalse(queue._thread.is_alive())
+
+        self.assertEqual(persister.timestamps, [0, 2])
+        statistics = queue.statistics()
+        self.assertEqual((statistics['enqueued'], statistics['written'], statistics['dropped']), (4, 2, 2))
+
+    def test_spill(self):
+        """ Check that buffers which do not fit in the queue are written to the spill file """
+
+        self.assertRaises(ValueError, PersisterQueue, StubPersister(), policy=BackpressurePolicy.Spill)
+
+        directory = tempfile.mkdtemp()
+        try:
+            spill = SpillWriter(directory=directory, name='test', file_size=1 << 16)
+            persister = StubPersister()
+            queue = PersisterQueue(persister, max_depth=2, policy=BackpressurePolicy.Spill, spill=spill)
+            self._fill(queue, persister, range(5))
+
+            persister.released.set()
+            queue.stop(1)
+            spill.close()
+
+            self.assertEqual(persister.timestamps, [0, 1, 2])
+            statistics = queue.statistics()
+            self.assertEqual((statistics['enqueued'], statistics['written'], statistics['spilled']), (3, 3, 2))
+            reader = SpillReader(spill.filename)
+            self.assertEqual([(timestamp, data.tolist()) for timestamp, data in reader], [(3, [3] * 4), (4, [4] * 4)])
+        finally:
+            shutil.rmtree(directory)
+
+    def test_stop(self):
+        """ Check that stopping drains the queued buffers, including those queued after persist errors """
+
+        persister = StubPersister(fail=(1,))
+        queue = PersisterQueue(persister, max_depth=8)
+        self._fill(queue, persister, range(5))
+
+        # Writer thread is still held up once the stop timeout expires
+        queue.stop(0.05)
+        self.assertTrue(queue._thread.is_alive())
+
+        persister.released.set()
+        queue._thread.join(1)
+        self.assertFalse(queue._thread.is_alive())
+
+        self.assertEqual(persister.timestamps, [0, 2, 3, 4])
+        statistics = queue.statistics()
+        self.assertEqual((statistics['depth'], statistics['written'], statistics['errors']), (0, 4, 1))
+        self.assertTrue(statistics['max_latency'] >= statistics['mean_latency'] > 0)
+
+
+class TestSpillConversion(unittest.TestCase):
+    """ Spill files converted to HDF5 match the files written directly by the persister """
+
+    metadata = dict(n_antennas=4, n_pols=2, n_chans=3, n_samples=8)
+
+    def setUp(self):
+        self._directory = tempfile.mkdtemp()
+        for name in ['direct', 'spill', 'converted']:
+            os.mkdir(os.path.join(self._directory, name))
+
+    def tearDown(self):
+        shutil.rmtree(self._directory)
+
+    def _manager(self, manager, name):
+        manager = manager(root_path=os.path.join(self._directory, name), mode=FileModes.Write)
+        manager.set_metadata(**self.metadata)
+        return manager
+
+    def _buffer(self, dtype, n, i):
+        """ Buffer as received from DAQ, before de-interleaving """
+        values = (numpy.arange(n) * 3 + i * 11) % 251 - 125
+        if dtype.names is None:
+            return values.astype(dtype)
+        data = numpy.zeros(n, dtype=dtype)
+        data['real'], data['imag'] = values, -values
+        return data
+
+    def _spill(self, manager, append, timestamps, dtype, n):
+        """ Write buffers through a spill writer, and directly through the persister """
+        direct = self._manager(manager, 'direct')
+        spill = SpillWriter(directory=os.path.join(self._directory, 'spill'), name='test',
+                            persister=self._manager(manager, 'spill'), append=append)
+        if append:
+            direct.start_session(flush_period=10.0)
+        for i, timestamp in enumerate(timestamps):
+            data = self._buffer(dtype, n, i)
+            spill.write(data, timestamp)
+            if append:
+                direct.append_data(data_ptr=data, timestamp=timestamp)
+            else:
+                direct.write_data(data_ptr=data, timestamp=timestamp)
+        direct.stop_session()
+        spill.close()
+        return spill.filename
+
+    def _convert(self, filename, buffers_per_task=16):
+        import spill_converter
+        tasks = spill_converter.create_tasks([filename], os.path.join(self._directory, 'converted'),
+                                             buffers_per_task)
+        return sum([spill_converter.convert(task)[1] for task in tasks])
+
+    def _assert_converted(self, nof_files):
+        """ Compare datasets and root attributes of direct and converted HDF5 files """
+        names = sorted(os.listdir(os.path.join(self._directory, 'direct')))
+        self.assertEqual(len(names), nof_files)
+        self.assertEqual(sorted(os.listdir(os.path.join(self._directory, 'converted'))), names)
+
+        for name in names:
+            datasets = []
+            for directory in ['direct', 'converted']:
+                with h5py.File(os.path.join(self._directory, directory, name), 'r') as f:
+                    items = {}
+                    f.visititems(lambda path, item: items.__setitem__(path, item[()])
+                                 if isinstance(item, h5py.Dataset) else None)
+                    datasets.append((items, dict(f["root"].attrs)))
+
+            (direct, direct_attrs), (converted, converted_attrs) = datasets
+            self.assertEqual(sorted(converted.keys()), sorted(direct.keys()))
+            for path in direct:
+                self.assertEqual((converted[path].dtype, converted[path].shape), (direct[path].dtype, direct[path].shape))
+                numpy.testing.assert_array_equal(converted[path], direct[path])
+            self.assertEqual(sorted(converted_attrs.keys()), sorted(direct_attrs.keys()))
+            for key in direct_attrs:
+                self.assertEqual(converted_attrs[key], direct_attrs[key])
+
+    def test_channel_append(self):
+        """ Check appended complex channel buffers, converted into a single file """
+
+        n = self.metadata['n_chans'] * self.metadata['n_samples'] * self.metadata['n_antennas'] * self.metadata['n_pols']
+        filename = self._spill(ChannelFormatFileManager, True, [5] * 4, COMPLEX_8T, n)
+        self.assertEqual(self._convert(filename), 4)
+        self._assert_converted(1)
+
+        with DataReader(os.path.join(self._directory, 'converted', 'channel_5.hdf5')) as reader:
+            self.assertEqual(reader.n_samples, 4 * self.metadata['n_samples'])
+
+    def test_raw_files(self):
+        """ Check raw buffers converted into one file each, over several conversion tasks """
+
+        n = self.metadata['n_antennas'] * self.metadata['n_samples'] * self.metadata['n_pols']
+        filename = self._spill(RawFormatFileManager, False, [1, 2, 3, 4, 5], numpy.dtype(numpy.int8), n)
+        self.assertEqual(self._convert(filename, buffers_per_task=2), 5)
+        self._assert_converted(5)
+
+    def test_truncated(self):
+        """ Check that buffers missing from a truncated spill file or index are not converted """
+
+        n = self.metadata['n_antennas'] * self.metadata['n_samples'] * self.metadata['n_pols']
+        self._spill(RawFormatFileManager, True, [1] * 3, numpy.dtype(numpy.int8), n)
+
+        # Append a buffer beyond the end of the truncated spill file, and an incomplete index line
+        writer = SpillWriter(directory=self._directory, name='truncated',
+                             persister=self._manager(RawFormatFileManager, 'spill'), append=True)
+        for i in range(4):
+            writer.write(self._buffer(numpy.dtype(numpy.int8), n, i), 1)
+        writer.close()
+        with open(writer.filename, 'r+b') as f:
+            f.truncate(3 * writer.alignment + n / 2)
+        with open(writer.filename + '.idx', 'a') as f:
+            f.write('{"timestamp": 1, "off')
+
+        reader = SpillReader(writer.filename)
+        self.assertEqual(len(reader), 3)
+        self.assertEqual(self._convert(writer.filename), 3)
+        self._assert_converted(1)
+
+
+class TestDataReader(unittest.TestCase):
+
+    n_antennas = 4
+    n_pols = 2
+    n_chans = 3
+    n_samples = 8
+
+    def setUp(self):
+        self._directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self._directory)
+
+    def _raw_file(self):
+        """ Write raw file, returning its manager and contents shaped (antenna, pol, sample) """
+        manager = RawFormatFileManager(root_path=self._directory, mode=FileModes.Write)
+        manager.set_metadata(n_antennas=self.n_antennas, n_pols=self.n_pols, n_samples=self.n_samples)
+        buf = (numpy.arange(self.n_antennas * self.n_samples * self.n_pols) % 127).astype(numpy.int8)
+        manager.write_data(data_ptr=buf, timestamp=1)
+        return manager, buf.reshape((self.n_antennas, self.n_samples, self.n_pols)).transpose((0, 2, 1))
+
+    def _channel_file(self):
+        """ Write channel file, returning its contents shaped (channel, antenna, pol, sample) """
+        manager = ChannelFormatFileManager(root_path=self._directory, mode=FileModes.Write)
+        manager.set_metadata(n_antennas=self.n_antennas, n_pols=self.n_pols, n_chans=self.n_chans,
+                             n_samples=self.n_samples)
+        values = numpy.arange(self.n_chans * self.n_samples * self.n_antennas * self.n_pols)
+        buf = numpy.zeros(values.size, dtype=manager.ctype)
+        buf['real'] = values % 127
+        buf['imag'] = -(values % 101)
+        manager.write_data(data_ptr=buf, timestamp=1)
+        return buf.reshape((self.n_chans, self.n_samples, self.n_antennas, self.n_pols)).transpose((0, 2, 3, 1))
+
+    def test_raw_selection(self):
+        """ Check that antenna, polarization and sample selections are read from raw files """
+
+        _, expected = self._raw_file()
+        with DataReader(os.path.join(self._directory, "raw_1.hdf5")) as reader:
+            self.assertEqual(reader.n_samples, self.n_samples)
+            numpy.testing.assert_array_equal(reader.read(), expected)
+            numpy.testing.assert_array_equal(reader.read(antennas=[3, 1], polarizations=[1], sample_offset=2,
+                                                         n_samples=4), expected[[3, 1]][:, [1], 2:6])
+            numpy.testing.assert_array_equal(reader.read(antennas=[1, 2], sample_offset=5), expected[1:3, :, 5:])
+
+            # Selections beyond the written samples are clipped
+            self.assertEqual(reader.read(sample_offset=6, n_samples=10).shape, (self.n_antennas, self.n_pols, 2))
+            self.assertEqual(reader.read(sample_offset=20).shape, (self.n_antennas, self.n_pols, 0))
+
+    def test_channel_selection(self):
+        """ Check that channel selections are read with a hyperslab per channel dataset """
+
+        expected = self._channel_file()
+        with DataReader(os.path.join(self._directory, "channel_1.hdf5")) as reader:
+            data = reader.read(channels=[2, 0], antennas=[0, 3], polarizations=[1], sample_offset=1, n_samples=5)
+            self.assertEqual(data.dtype, expected.dtype)
+            numpy.testing.assert_array_equal(data, expected[[2, 0]][:, [0, 3]][:, :, [1], 1:6])
+            numpy.testing.assert_array_equal(reader.read(), expected)
+
+    def test_read_data_selection(self):
+        """ Check that read_data leaves channels missing from the file as zeros, and raises on
+            antennas, polarizations and beam channels outside the file instead of re-trying """
+
+        expected = self._channel_file()
+        manager = ChannelFormatFileManager(root_path=self._directory, mode=FileModes.Read)
+        data = manager.read_data(timestamp=1, channels=[2, 5, 0], antennas=[1], polarizations=[0, 1], n_samples=4)
+        numpy.testing.assert_array_equal(data[[0, 2]], expected[[2, 0]][:, [1], :, :4])
+        self.assertTrue((data[1] == numpy.zeros(1, dtype=data.dtype)).all())
+        self.assertRaises(IndexError, manager.read_data, timestamp=1, channels=[0], antennas=[4], polarizations=[0],
+                          n_samples=4)
+
+        raw, _ = self._raw_file()
+        for antennas, polarizations in [([0, 4], [0]), ([0], [2]), ([-1], [0])]:
+            self.assertRaises(IndexError, raw.read_data, timestamp=1, antennas=antennas, polarizations=polarizations,
+                              n_samples=4)
+        self.assertEqual(raw.file_locks, {})
+
+        beam = BeamFormatFileManager(root_path=self._directory, mode=FileModes.Write)
+        beam.set_metadata(n_pols=self.n_pols, n_chans=self.n_chans, n_samples=self.n_samples)
+        beam.write_data(timestamp=1, data_ptr=numpy.zeros(self.n_pols * self.n_chans * self.n_samples,
+                                                          dtype=beam.ctype))
+        self.assertRaises(IndexError, beam.read_data, timestamp=1, channels=[self.n_chans], polarizations=[0],
+                          n_samples=4)
+        self.assertEqual(beam.read_data(timestamp=1, channels=[1], polarizations=[1], n_samples=4).shape, (1, 1, 4))
+
+    def test_memory_mapped(self):
+        """ Check that contiguous datasets are read through a memory map """
+
+        _, expected = self._raw_file()
+        filename = os.path.join(self._directory, "contiguous.hdf5")
+        with h5py.File(filename, 'w') as f:
+            root = f.create_group("root")
+            for name, value in [('type', FileTypes.Raw.value), ('n_antennas', self.n_antennas),
+                                ('n_pols', self.n_pols), ('n_chans', 1)]:
+                root.attrs[name] = value
+            f.create_dataset("raw_/data", data=expected.reshape((self.n_antennas * self.n_pols, self.n_samples)))
+
+        with DataReader(filename) as reader:
+            self.assertIsInstance(reader.view("raw_/data"), numpy.memmap)
+            numpy.testing.assert_array_equal(reader.read(antennas=[2, 0], polarizations=[1, 0], sample_offset=3),
+                                             expected[[2, 0]][:, [1, 0], 3:])
+
+    def test_iterate(self):
+        """ Check that windows cover the selected samples, with a shorter last window """
+
+        expected = self._channel_file()
+        with DataReader(os.path.join(self._directory, "channel_1.hdf5")) as reader:
+            windows = list(reader.iterate(3, channels=[1], antennas=[2], sample_offset=1))
+        self.assertEqual([(offset, data.shape[-1]) for offset, data in windows], [(1, 3), (4, 3), (7, 1)])
+        numpy.testing.assert_array_equal(numpy.concatenate([data for _, data in windows], axis=-1),
+                                         expected[[1]][:, [2], :, 1:])
+
+        with DataReader(os.path.join(self._directory, "channel_1.hdf5")) as reader:
+            self.assertEqual([offset for offset, _ in reader.iterate(2, sample_offset=2, n_samples=3)], [2, 4])
+
+    def test_read_data(self):
+        """ Check that read_data fills samples beyond the end of the file with zeros """
+
+        manager, expected = self._raw_file()
+        data = manager.read_data(timestamp=1, antennas=[0, 2], polarizations=[1], n_samples=12, sample_offset=4)
+        self.assertEqual(data.shape, (2, 1, 12))
+        numpy.testing.assert_array_equal(data[:, :, :4], expected[[0, 2]][:, [1], 4:])
+        self.assertFalse(data[:, :, 4:].any())
+
+
+if __name__ == "__main__":
+    unittest.main()
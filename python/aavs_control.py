@@ -394,7 +394,7 @@ class Tile(object):
 
     def program_fpgas(self, bitfile="/home/lessju/Code/TPM-Access-Layer/bitfiles/xtpm_xcku040_tpm_top_wrap_lbrc5.bit"):
         self.connect(simulation=True)
-        self.tpm.download_firmware(Device.FPGA_1, bitfile)
+        self.tpm.download_firmware([Device.FPGA_1, Device.FPGA_2], bitfile)
 
     def get_temperature(self):
         """ Get board temperature """
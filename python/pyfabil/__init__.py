@@ -3,4 +3,6 @@ __author__ = 'Alessio Magro'
 from base.definitions import *
 from boards.tpm import TPM
 from boards.roach import Roach
-from boards.uniboard import UniBoard
\ No newline at end of file
+from boards.uniboard import UniBoard
+from boards.async_board import AsyncFPGABoard, AsyncTPM, gather
+from base.statistics_monitor import StatisticsMonitor
@@ -69,6 +69,22 @@ class Permission(Enum):
     Write     = 2
     ReadWrite = 3
 
+class CachePolicy(Enum):
+    """ Read cache policy enumeration """
+    Static   = 1
+    Slow     = 2
+    Volatile = 3
+
+class OperationType(Enum):
+    """ Transaction operation type enumeration """
+    ReadRegister  = 1
+    WriteRegister = 2
+    ReadAddress   = 3
+    WriteAddress  = 4
+    ReadDevice    = 5
+    WriteDevice   = 6
+    WriteAddressMasked = 7
+
 
 # --------------- Structures --------------------------
 class Values(object):
@@ -129,6 +145,34 @@ class SPIDeviceInfoStruct(ctypes.Structure):
         ('spi_en',   ctypes.c_uint32)
     ]
 
+class OperationStruct(ctypes.Structure):
+    """ Class representing OPERATION struct """
+    _fields_ = [
+        ('type',    ctypes.c_int),
+        ('device',  ctypes.c_int),
+        ('name',    ctypes.c_char_p),
+        ('address', ctypes.c_uint32),
+        ('value',   ctypes.c_uint32),
+        ('bitmask', ctypes.c_uint32),
+        ('error',   ctypes.c_int)
+    ]
+
+# Number of bins in link latency histograms, bin i counts replies received
+# within [2^i, 2^(i+1)) microseconds
+LATENCY_HISTOGRAM_BINS = 24
+
+class LinkStatisticsStruct(ctypes.Structure):
+    """ Class representing LINK_STATISTICS struct """
+    _fields_ = [
+        ('packets_sent',      ctypes.c_uint64),
+        ('packets_received',  ctypes.c_uint64),
+        ('retries',           ctypes.c_uint64),
+        ('timeouts',          ctypes.c_uint64),
+        ('duplicates',        ctypes.c_uint64),
+        ('failures',          ctypes.c_uint64),
+        ('latency_histogram', ctypes.c_uint64 * LATENCY_HISTOGRAM_BINS)
+    ]
+
 # -------------------- Classes -------------------------
 class PluginList(list):
     def __getattr__(self, item):
@@ -1,112 +1,182 @@
 from pyfabil.base.definitions import *
+import numpy as np
+import threading
 
 # ------------- Wrap library calls ---------------------------
 
 # Global store for interface object
 library = None
+_library_lock = threading.Lock()
 
-def initialise_library(filepath = None):
+# Default number of packets kept in flight by boards, None uses library default
+default_window_size = None
+
+# Per-thread scratch buffers which values are read into when the caller does not provide one
+_buffer_pool = threading.local()
+
+def initialise_library(filepath = None, window_size = None):
     """ Wrap access library shared library functionality in ctypes
     :param filepath: Path to library path
+    :param window_size: Default number of packets kept in flight for newly connected boards
     :return: None
     """
     global library
+    global default_window_size
+
+    # Default window size can be updated on every call
+    if window_size is not None:
+        default_window_size = window_size
 
     # This only need to be done once
     if library is not None:
         return
 
-    # Load access layer shared library
-    if filepath is None:
-        _library = "libaccesslayer"
-    else:
-        _library = filepath
+    # Boards may be connected from multiple threads, make sure library is only loaded once
+    with _library_lock:
+        if library is not None:
+            return
+
+        # Load access layer shared library
+        if filepath is None:
+            _library = "libaccesslayer"
+        else:
+            _library = filepath
+
+        # Load library
+        _lib = ctypes.CDLL(_library + ".so")
+
+        # Define connect function
+        _lib.connectBoard.argtypes = [ctypes.c_uint32, ctypes.c_char_p, ctypes.c_uint16]
+        _lib.connectBoard.restype  = ctypes.c_uint32
+
+        # Define disconnect function
+        _lib.disconnectBoard.argtypes = [ctypes.c_uint32]
+        _lib.disconnectBoard.restype  = ctypes.c_int
+
+        # Define reset function
+        _lib.resetBoard.argtypes = [ctypes.c_uint32, ctypes.c_int]
+        _lib.resetBoard.restype = ctypes.c_int
+
+        # Define getFirmware function
+        _lib.getFirmware.argtypes = [ctypes.c_uint32, ctypes.c_int, ctypes.POINTER(ctypes.c_int)]
+        _lib.getFirmware.restype = ctypes.POINTER(ctypes.c_char_p)
+
+        # Define loadFirmwareBlocking function
+        _lib.loadFirmware.argtypes =  [ctypes.c_uint32, ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        _lib.loadFirmware.restype = ctypes.c_int
 
-    # Load library
-    library = ctypes.CDLL(_library + ".so")
+        # Define getRegisterList function
+        _lib.getRegisterList.argtypes = [ctypes.c_uint32, ctypes.POINTER(ctypes.c_int), ctypes.c_bool]
+        _lib.getRegisterList.restype = ctypes.POINTER(RegisterInfoStruct)
 
-    # Define connect function
-    library.connectBoard.argtypes = [ctypes.c_uint32, ctypes.c_char_p, ctypes.c_uint16]
-    library.connectBoard.restype  = ctypes.c_uint32
+        # Define readRegister function
+        _lib.readRegister.argtypes = [ctypes.c_uint32, ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        _lib.readRegister.restype = ValuesStruct
 
-    # Define disconnect function
-    library.disconnectBoard.argtypes = [ctypes.c_uint32]
-    library.disconnectBoard.restype  = ctypes.c_int
+        # Define writeRegister function
+        _lib.writeRegister.argtypes = [ctypes.c_uint32, ctypes.c_int, ctypes.c_char_p, ctypes.POINTER(ctypes.c_uint32), ctypes.c_uint32, ctypes.c_uint32]
+        _lib.writeRegister.restype = ctypes.c_int
 
-    # Define reset function
-    library.resetBoard.argtypes = [ctypes.c_uint32, ctypes.c_int]
-    library.resetBoard.restype = ctypes.c_int
+        # Define readFifoRegister function
+        _lib.readFifoRegister.argtypes = [ctypes.c_uint32, ctypes.c_int, ctypes.c_char_p]
+        _lib.readFifoRegister.restype = ValuesStruct
 
-    # Define getFirmware function
-    library.getFirmware.argtypes = [ctypes.c_uint32, ctypes.c_int, ctypes.POINTER(ctypes.c_int)]
-    library.getFirmware.restype = ctypes.POINTER(ctypes.c_char_p)
+        # Define writeFifoRegister function
+        _lib.writeFifoRegister.argtypes = [ctypes.c_uint32, ctypes.c_int, ctypes.c_char_p, ctypes.POINTER(ctypes.c_uint32), ctypes.c_uint32]
+        _lib.writeFifoRegister.restype = ctypes.c_int
 
-    # Define loadFirmwareBlocking function
-    library.loadFirmware.argtypes =  [ctypes.c_uint32, ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
-    library.loadFirmware.restype = ctypes.c_int
+        # Define readRegister function
+        _lib.readAddress.argtypes = [ctypes.c_uint32, ctypes.c_uint32, ctypes.c_uint32, ctypes.c_uint32]
+        _lib.readAddress.restype = ValuesStruct
 
-    # Define getRegisterList function
-    library.getRegisterList.argtypes = [ctypes.c_uint32, ctypes.POINTER(ctypes.c_int), ctypes.c_bool]
-    library.getRegisterList.restype = ctypes.POINTER(RegisterInfoStruct)
+        # Define writeRegister function
+        _lib.writeAddress.argtypes = [ctypes.c_uint32, ctypes.c_uint32, ctypes.c_uint32, ctypes.POINTER(ctypes.c_uint32), ctypes.c_uint32]
+        _lib.writeAddress.restype = ctypes.c_int
 
-    # Define readRegister function
-    library.readRegister.argtypes = [ctypes.c_uint32, ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
-    library.readRegister.restype = ValuesStruct
+        # Define loadSPIDevices functionn
+        _lib.loadSPIDevices.argtypes = [ctypes.c_uint32, ctypes.c_uint32, ctypes.c_char_p]
+        _lib.loadSPIDevices.restype = ctypes.c_int
 
-    # Define writeRegister function
-    library.writeRegister.argtypes = [ctypes.c_uint32, ctypes.c_int, ctypes.c_char_p, ctypes.POINTER(ctypes.c_uint32), ctypes.c_uint32, ctypes.c_uint32]
-    library.writeRegister.restype = ctypes.c_int
+        # Define getDeviceList function
+        _lib.getDeviceList.argtypes = [ctypes.c_uint32, ctypes.POINTER(ctypes.c_uint32)]
+        _lib.getDeviceList.restype = ctypes.POINTER(SPIDeviceInfoStruct)
 
-    # Define readFifoRegister function
-    library.readFifoRegister.argtypes = [ctypes.c_uint32, ctypes.c_int, ctypes.c_char_p]
-    library.readFifoRegister.restype = ValuesStruct
+        # Define readDevice function
+        _lib.readDevice.argtypes = [ctypes.c_uint32, ctypes.c_char_p, ctypes.c_uint32]
+        _lib.readDevice.restype = ValuesStruct
 
-    # Define writeFifoRegister function
-    library.writeFifoRegister.argtypes = [ctypes.c_uint32, ctypes.c_int, ctypes.c_char_p, ctypes.POINTER(ctypes.c_uint32), ctypes.c_uint32]
-    library.writeFifoRegister.restype = ctypes.c_int
+        # Define writeDevice function
+        _lib.writeDevice.argtypes = [ctypes.c_uint32, ctypes.c_char_p, ctypes.c_uint32, ctypes.c_uint32]
+        _lib.writeDevice.restype = ctypes.c_int
 
-    # Define readRegister function
-    library.readAddress.argtypes = [ctypes.c_uint32, ctypes.c_uint32, ctypes.c_uint32, ctypes.c_uint32]
-    library.readAddress.restype = ValuesStruct
+        # Define readRegisterInto function
+        _lib.readRegisterInto.argtypes = [ctypes.c_uint32, ctypes.c_int, ctypes.c_char_p, ctypes.POINTER(ctypes.c_uint32), ctypes.c_uint32, ctypes.c_uint32]
+        _lib.readRegisterInto.restype = ctypes.c_int
 
-    # Define writeRegister function
-    library.writeAddress.argtypes = [ctypes.c_uint32, ctypes.c_uint32, ctypes.c_uint32, ctypes.POINTER(ctypes.c_uint32), ctypes.c_uint32]
-    library.writeAddress.restype = ctypes.c_int
+        # Define readAddressInto function
+        _lib.readAddressInto.argtypes = [ctypes.c_uint32, ctypes.c_uint32, ctypes.c_uint32, ctypes.POINTER(ctypes.c_uint32), ctypes.c_uint32]
+        _lib.readAddressInto.restype = ctypes.c_int
 
-    # Define loadSPIDevices functionn
-    library.loadSPIDevices.argtypes = [ctypes.c_uint32, ctypes.c_uint32, ctypes.c_char_p]
-    library.loadSPIDevices.restype = ctypes.c_int
+        # Define writeStream function
+        _lib.writeStream.argtypes = [ctypes.c_uint32, ctypes.c_uint32, ctypes.c_uint32, ctypes.POINTER(ctypes.c_uint32), ctypes.c_uint32]
+        _lib.writeStream.restype = ctypes.c_int
 
-    # Define getDeviceList function
-    library.getDeviceList.argtypes = [ctypes.c_uint32, ctypes.POINTER(ctypes.c_uint32)]
-    library.getDeviceList.restype = ctypes.POINTER(SPIDeviceInfoStruct)
+        # Define executeTransaction function
+        _lib.executeTransaction.argtypes = [ctypes.c_uint32, ctypes.POINTER(OperationStruct), ctypes.c_uint32]
+        _lib.executeTransaction.restype = ctypes.c_int
 
-    # Define readDevice function
-    library.readDevice.argtypes = [ctypes.c_uint32, ctypes.c_char_p, ctypes.c_uint32]
-    library.readDevice.restype = ValuesStruct
+        # Define setWindowSize function
+        _lib.setWindowSize.argtypes = [ctypes.c_uint32, ctypes.c_uint32]
+        _lib.setWindowSize.restype = ctypes.c_int
 
-    # Define writeDevice function
-    library.writeDevice.argtypes = [ctypes.c_uint32, ctypes.c_char_p, ctypes.c_uint32, ctypes.c_uint32]
-    library.writeDevice.restype = ctypes.c_int
+        # Define setTimeoutPolicy function
+        _lib.setTimeoutPolicy.argtypes = [ctypes.c_uint32, ctypes.c_uint32, ctypes.c_uint32, ctypes.c_uint32]
+        _lib.setTimeoutPolicy.restype = ctypes.c_int
 
-    # Define getStatus function
-    library.getStatus.argtype = [ctypes.c_uint32]
-    library.getStatus.restype = Status
+        # Define getLinkStatistics function
+        _lib.getLinkStatistics.argtypes = [ctypes.c_uint32, ctypes.POINTER(LinkStatisticsStruct), ctypes.c_bool]
+        _lib.getLinkStatistics.restype = ctypes.c_int
 
-    # Define freeMemory function
-    library.freeMemory.argtypes = [ctypes.c_void_p]
+        # Define getStatus function
+        _lib.getStatus.argtype = [ctypes.c_uint32]
+        _lib.getStatus.restype = Status
+
+        # Define freeMemory function
+        _lib.freeMemory.argtypes = [ctypes.c_void_p]
+
+        # Library is only made available once all functions are defined
+        library = _lib
 
 # ------------- Function wrappers to library ---------------------------
 
-def call_connect_board(board_type, ip, port):
+def call_connect_board(board_type, ip, port, window_size = None):
     """ Call connect board
     :param board_type: Board type to connect to
     :param ip: IP address of board
     :param port: port number to connect to
+    :param window_size: Number of packets kept in flight, None uses library default
     :return: Integer ID representation of board
     """
     global library
-    return library.connectBoard(board_type, ip, port)
+    board_id = library.connectBoard(board_type, ip, port)
+
+    # Set window size for connected board
+    if window_size is None:
+        window_size = default_window_size
+    if board_id != 0 and window_size is not None:
+        if call_set_window_size(board_id, window_size) != Error.Success:
+            raise LibraryError("Could not set window size %s for board with ip %s" % (str(window_size), ip))
+
+    return board_id
+
+def call_set_window_size(board_id, window_size):
+    """ Set the number of packets kept in flight for multi-packet transfers
+    :param board_id: ID of board to configure
+    :param window_size: Maximum number of packets in flight, 1 disables pipelining
+    :return: Success or Failure
+    """
+    global library
+    return Error(library.setWindowSize(board_id, window_size))
 
 def call_disconnect_board(board_id):
     """
@@ -339,30 +409,67 @@ def call_write_fifo_register(board_id, device, register, values):
     else:
         return Error.Failure
 
-def call_read_address(board_id, device, address, n = 1):
+def call_read_address(board_id, device, address, n = 1, as_array = False, out = None):
     """ Read form address on board
     :param board_id: ID of board to operate upon
     :param device: Device on board to operate upon
     :param address: Memory address to read from
     :param n: Number of words to read
+    :param as_array: Return values as a numpy.uint32 array
+    :param out: numpy.uint32 array to write values into
     :return: Memory-mapped values
     """
-    global library
 
-    # Call function
-    values = library.readAddress(board_id, device.value, address, n)
+    # Values are read directly into the output array, or into a pooled buffer
+    if out is not None:
+        buf = check_buffer(out, n)
+    elif as_array:
+        buf = np.empty(n, dtype = np.uint32)
+    else:
+        buf = get_buffer(n)
 
-    # Check if value succeeded, othewise rerturn
-    if values.error == Error.Failure.value:
+    if call_read_address_into(board_id, device, address, buf, n) == Error.Failure:
         return Error.Failure
 
     # Read successful, wrap data and return
-    valPtr = ctypes.cast(values.values, ctypes.POINTER(ctypes.c_uint32))
+    if out is not None or as_array:
+        return buf
+    return int(buf[0]) if n == 1 else buf[:n].tolist()
 
-    if n == 1:
-        return valPtr[0]
-    else:
-        return [valPtr[i] for i in range(n)]
+
+def call_read_address_into(board_id, device, address, out, n = None):
+    """ Read from address on board into a caller-provided buffer, without allocating memory
+    :param board_id: ID of board to operate upon
+    :param device: Device on board to operate upon
+    :param address: Memory address to read from
+    :param out: Contiguous numpy.uint32 array to write values into
+    :param n: Number of words to read, defaults to size of out
+    :return: Success or Failure
+    """
+    global library
+
+    n = out.size if n is None else n
+    check_buffer(out, n)
+    return Error(library.readAddressInto(board_id, device.value, address,
+                                         out.ctypes.data_as(ctypes.POINTER(ctypes.c_uint32)), n))
+
+
+def call_read_register_into(board_id, device, register, out, n = None, offset = 0):
+    """ Read register into a caller-provided buffer, without allocating memory
+    :param board_id: ID of board to operate upon
+    :param device: Device on board to operate upon
+    :param register: Register name
+    :param out: Contiguous numpy.uint32 array to write values into
+    :param n: Number of words to read, defaults to size of out
+    :param offset: Address offset
+    :return: Success or Failure
+    """
+    global library
+
+    n = out.size if n is None else n
+    check_buffer(out, n)
+    return Error(library.readRegisterInto(board_id, device.value, register,
+                                          out.ctypes.data_as(ctypes.POINTER(ctypes.c_uint32)), n, offset))
 
 
 def call_write_address(board_id, device, address, values):
@@ -393,6 +500,25 @@ def call_write_address(board_id, device, address, values):
     else:
         return Error.Failure
 
+def call_write_stream(board_id, device, address, values):
+    """ Write values to a single address, such as a memory-mapped FIFO, one packet at a time
+    :param board_id: ID of board to operate upon
+    :param device: Device on board to operate upon
+    :param address: Memory address to write to
+    :param values: List or numpy array of values to write. Arrays of native
+                   uint32 values are passed to the library without copying
+    :return: Success or Failure
+    """
+    global library
+
+    if isinstance(values, np.ndarray):
+        values = np.ascontiguousarray(values, dtype = np.uint32)
+        ptr = values.ctypes.data_as(ctypes.POINTER(ctypes.c_uint32))
+    else:
+        ptr = (ctypes.c_uint32 * len(values)) (*values)
+
+    return Error(library.writeStream(board_id, device.value, address, ptr, len(values)))
+
 def call_read_device(board_id, device, address):
     """ Read from an SPI device
     :param board_id: ID of board to operate upon
@@ -407,13 +533,11 @@ def call_read_device(board_id, device, address):
 
     # Check if value succeeded, otherwise reture
     if values.error == Error.Failure.value:
+        free_values(values)
         return Error.Failure
 
     # Read succeeded, wrap data and return
-    valPtr = ctypes.cast(values.values, ctypes.POINTER(ctypes.c_uint32))
-
-    # Return value
-    return valPtr[0]
+    return extract_values(values, 1)
 
 def call_write_device(board_id, device, address, value):
     """
@@ -427,3 +551,132 @@ def call_write_device(board_id, device, address, value):
 
     # Call function
     return Error(library.writeDevice(board_id, device, address, value))
+
+def call_execute_transaction(board_id, operations):
+    """ Execute a batch of single-word operations in one call
+    :param board_id: ID of board to operate upon
+    :param operations: List of (OperationType, device, name, address, value[, bitmask]) tuples. Name
+                       is the register or SPI device name, and is ignored for address operations.
+                       Bitmask is only used by masked address writes, whose value is already shifted
+    :return: List of (Error, value) tuples, one per operation
+    """
+    global library
+
+    # Populate operations array
+    n = len(operations)
+    ops = (OperationStruct * n)()
+    for i, operation in enumerate(operations):
+        op_type, device, name, address, value = operation[:5]
+        ops[i].type    = op_type.value
+        ops[i].device  = device.value if device is not None else 0
+        ops[i].name    = name
+        ops[i].address = address
+        ops[i].value   = value
+        ops[i].bitmask = operation[5] if len(operation) > 5 else 0xFFFFFFFF
+
+    # Call function
+    library.executeTransaction(board_id, ops, n)
+
+    # Return per-operation results
+    return [(Error(op.error), op.value) for op in ops]
+
+def call_set_timeout_policy(board_id, timeout, max_timeout, max_retries):
+    """ Set reply timeout policy
+    :param board_id: ID of board to configure
+    :param timeout: Reply timeout in microseconds
+    :param max_timeout: Maximum reply timeout in microseconds, reached through exponential backoff
+    :param max_retries: Maximum number of times a lost request is re-sent
+    :return: Success or Failure
+    """
+    global library
+    return Error(library.setTimeoutPolicy(board_id, timeout, max_timeout, max_retries))
+
+def call_get_link_statistics(board_id, reset = False):
+    """ Get communication statistics for board
+    :param board_id: ID of board to query
+    :param reset: Clear statistics after reading them
+    :return: Dictionary of counters, or None on failure
+    """
+    global library
+
+    stats = LinkStatisticsStruct()
+    if Error(library.getLinkStatistics(board_id, ctypes.byref(stats), reset)) != Error.Success:
+        return None
+
+    return {'packets_sent'      : stats.packets_sent,
+            'packets_received'  : stats.packets_received,
+            'retries'           : stats.retries,
+            'timeouts'          : stats.timeouts,
+            'duplicates'        : stats.duplicates,
+            'failures'          : stats.failures,
+            'latency_histogram' : list(stats.latency_histogram)}
+
+# ------------- Helpers for values returned by library ---------------------------
+
+def free_values(values):
+    """ Release the memory buffer allocated by the library for a VALUES struct
+    :param values: ValuesStruct returned by library
+    """
+    global library
+
+    if values.values:
+        library.freeMemory(values.values)
+
+def check_buffer(out, n):
+    """ Check that an array can be handed to the library to write values into
+    :param out: numpy.uint32 array
+    :param n: Number of words which will be written
+    :return: The array
+    """
+    if not isinstance(out, np.ndarray) or out.dtype != np.uint32 or \
+       not out.flags['C_CONTIGUOUS'] or not out.flags['WRITEABLE'] or out.size < n:
+        raise LibraryError("Output array must be a contiguous numpy.uint32 array of at least %d items" % n)
+    return out
+
+def get_buffer(n):
+    """ Get the calling thread's scratch buffer, grown to hold at least n words. The
+        buffer is reused by subsequent calls from the same thread, so values must be
+        copied out of it before the next read
+    :param n: Number of words
+    :return: numpy.uint32 array
+    """
+    buf = getattr(_buffer_pool, 'buffer', None)
+    if buf is None or buf.size < n:
+        size = 256 if buf is None else buf.size
+        while size < n:
+            size *= 2
+        buf = _buffer_pool.buffer = np.empty(size, dtype = np.uint32)
+    return buf
+
+def extract_values(values, n, as_array = False, out = None):
+    """ Copy values returned by the library and release the library buffer. The
+        copy is performed as a single memory move, without going through
+        Python integers, when an array is requested
+    :param values: ValuesStruct returned by library
+    :param n: Number of words in values
+    :param as_array: Return values as a numpy.uint32 array
+    :param out: numpy.uint32 array to write values into
+    :return: Single value, list of values or numpy array
+    """
+
+    try:
+        # Caller supplied array, check that it can hold the values
+        if out is not None:
+            check_buffer(out, n)
+            ctypes.memmove(out.ctypes.data, values.values, n * ctypes.sizeof(ctypes.c_uint32))
+            return out
+
+        # Create new array and copy values
+        if as_array:
+            array = np.empty(n, dtype = np.uint32)
+            ctypes.memmove(array.ctypes.data, values.values, n * ctypes.sizeof(ctypes.c_uint32))
+            return array
+
+        # Otherwise return a single value or a list
+        if n == 1:
+            return values.values[0]
+        else:
+            return values.values[:n]
+    finally:
+        free_values(values)
+
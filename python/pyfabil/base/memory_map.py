@@ -0,0 +1,76 @@
+import logging
+import os
+import tempfile
+
+
+class MemoryMapCache(object):
+    """ On-disk cache of XML memory map files read from a board. Files are
+        identified by a name describing their origin (such as the firmware
+        design and version), the length of the compressed XML file stored
+        on the board and the Adler-32 checksum at the end of its zlib stream,
+        such that a cached file can be validated by reading a few words """
+
+    def __init__(self, directory = None):
+        """ Class constructor
+        :param directory: Cache directory, defaults to PYFABIL_CACHE_DIR or ~/.pyfabil/cache
+        """
+        if directory is None:
+            directory = os.environ.get('PYFABIL_CACHE_DIR',
+                                       os.path.join(os.path.expanduser('~'), '.pyfabil', 'cache'))
+        self.directory = directory
+
+        self.hits   = 0
+        self.misses = 0
+
+    def get(self, name, length, checksum):
+        """ Get path of cached XML file
+        :param name: Name identifying the XML file
+        :param length: Length of compressed XML file on board
+        :param checksum: Adler-32 checksum of XML file
+        :return: File path, or None if not cached
+        """
+        filepath = self._filepath(name, length, checksum)
+        if os.path.exists(filepath):
+            self.hits += 1
+            return filepath
+
+        self.misses += 1
+        return None
+
+    def put(self, name, length, checksum, contents):
+        """ Store XML file in cache
+        :param name: Name identifying the XML file
+        :param length: Length of compressed XML file on board
+        :param checksum: Adler-32 checksum of XML file
+        :param contents: XML file contents
+        :return: File path, or None if the file could not be stored
+        """
+        filepath = self._filepath(name, length, checksum)
+        try:
+            if not os.path.exists(self.directory):
+                os.makedirs(self.directory)
+
+            # Write to a temporary file first, such that concurrent readers never see partial files
+            fd, temp_filepath = tempfile.mkstemp(dir = self.directory, suffix = '.tmp')
+            with os.fdopen(fd, 'w') as f:
+                f.write(contents)
+            os.rename(temp_filepath, filepath)
+        except (IOError, OSError) as e:
+            logging.warning("Could not store memory map %s in cache %s: %s" % (name, self.directory, str(e)))
+            return None
+
+        return filepath
+
+    def clear(self):
+        """ Remove all cached XML files """
+        if not os.path.exists(self.directory):
+            return
+
+        for filename in os.listdir(self.directory):
+            if filename.endswith('.xml'):
+                os.remove(os.path.join(self.directory, filename))
+
+    def _filepath(self, name, length, checksum):
+        """ Generate cache file path """
+        name = ''.join([c if c.isalnum() or c in '._-' else '_' for c in name])
+        return os.path.join(self.directory, "%s_%08x_%08x.xml" % (name, length, checksum))
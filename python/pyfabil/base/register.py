@@ -0,0 +1,466 @@
+import numpy as np
+import time
+import re
+
+from pyfabil.base.definitions import *
+from pyfabil.base.interface import call_read_address, call_write_address
+from pyfabil.base.utils import synchronised
+
+
+class RegisterHandle(object):
+    """ Pre-resolved register. Device, address, bitmask, shift and size are looked up
+        once from the board's register list, such that reads and writes go straight
+        to address-level I/O without any register name processing. Handles are
+        re-resolved automatically if the board's register list is reloaded """
+
+    def __init__(self, board, name, device = None):
+        """ Class constructor
+        :param board: Board on which register resides
+        :param name: Full register name, including device prefix
+        :param device: Device can be explicitly specified
+        """
+        self._board  = board
+        self.name    = name
+        self._device = device
+        self._resolve()
+
+    def _resolve(self):
+        """ Look up register information from board register list """
+
+        # Make sure register list is populated
+        self._board._checks(None)
+        if self.name not in self._board.register_list:
+            raise LibraryError("Register %s not found" % self.name)
+
+        info = self._board.register_list[self.name]
+        self.device     = self._device if self._device is not None else info['device']
+        self.address    = info['address']
+        self.bitmask    = info['bitmask']
+        self.size       = info['size']
+        self.type       = info['type']
+        self.permission = info['permission']
+
+        # Shift is the position of the least significant bit in the bitmask
+        self.shift = 0
+        if self.bitmask != 0:
+            while not (self.bitmask >> self.shift) & 0x1:
+                self.shift += 1
+
+        # FIFO registers require FIFO opcodes, and boards which do not support address
+        # I/O, such as the ROACH, need to go through the named register calls
+        self._direct = self.type != RegisterType.FifoRegister and \
+                       self._board._fpga_board not in [BoardMake.RoachBoard, BoardMake.Roach2Board]
+
+        # Words which contain read-only or FIFO registers are updated by the firmware,
+        # so they cannot be kept in a shadow cache
+        self._cacheable = self._direct and self.size == 1 and not self._is_volatile()
+
+        self._version = self._board._register_list_version
+
+    def _is_volatile(self):
+        """ Check whether any register sharing this register's words can change on the board
+        :return: True if volatile
+        """
+        start, end = self.address, self.address + self.size * 4
+        for info in self._board.register_list.itervalues():
+            if info['device'] != self.device or info['type'] == RegisterType.Component or \
+               info['address'] >= end or info['address'] + info['size'] * 4 <= start:
+                continue
+            if info['permission'] == Permission.Read or \
+               info['type'] in [RegisterType.FifoRegister, RegisterType.Sensor]:
+                return True
+        return False
+
+    @synchronised
+    def read(self, n = 1, offset = 0, as_array = False, out = None):
+        """ Read register value
+        :param n: Number of words to read
+        :param offset: Offset in words from start of register
+        :param as_array: Return values as a numpy.uint32 array
+        :param out: numpy.uint32 array to write values into
+        :return: Values
+        """
+
+        # Check if register list has been reloaded
+        if self._version != self._board._register_list_version:
+            self._resolve()
+
+        if not self._direct:
+            return self._board.read_register(self.name, n, offset, self.device, as_array, out)
+
+        if offset + n > self.size:
+            raise LibraryError("Cannot read %d words at offset %d from register %s of size %d"
+                               % (n, offset, self.name, self.size))
+
+        address = self.address + offset * 4
+        shadow = self._board._shadow
+
+        # Unflushed writes are returned directly, while reads overlapping them need them flushed first
+        if shadow is not None and shadow.write_back:
+            if self._cacheable and shadow.is_dirty((self.device, address)):
+                word = (shadow.get((self.device, address)) & self.bitmask) >> self.shift
+                if out is not None:
+                    out[0] = word
+                    return out
+                return np.array([word], dtype = np.uint32) if as_array else word
+            if shadow.dirty_in_range(self.device, address, n):
+                self._board.flush()
+
+        # Use words from the read cache if they have not expired, otherwise read from address
+        cache, values = self._board._read_cache, None
+        ttl = cache.ttl(self) if cache is not None else 0
+        if ttl != 0:
+            words = cache.get(self.device, address, n)
+            if words is not None:
+                values = self._wrap(words, as_array, out)
+        elif cache is not None:
+            cache.bypassed += 1
+
+        if values is None:
+            values = call_read_address(self._board.id, self.device, address, n, as_array, out)
+            if values is Error.Failure:
+                raise BoardError("Failed to read register %s from board" % self.name)
+            if ttl != 0:
+                cache.set(self.device, address, self._unwrap(values, n), ttl)
+
+        # Keep a copy of the full word
+        if shadow is not None and self._cacheable:
+            shadow.set((self.device, address), int(values[0]) if as_array or out is not None else values)
+
+        # No bitmask to apply
+        if self.bitmask == 0xFFFFFFFF:
+            return values
+
+        # Apply bitmask and shift
+        if isinstance(values, np.ndarray):
+            np.bitwise_and(values, self.bitmask, out = values)
+            np.right_shift(values, self.shift, out = values)
+            return values
+        elif type(values) is list:
+            return [(v & self.bitmask) >> self.shift for v in values]
+        else:
+            return (values & self.bitmask) >> self.shift
+
+    @staticmethod
+    def _wrap(words, as_array, out):
+        """ Convert list of words to the form returned by address reads """
+        if out is not None:
+            out[:len(words)] = words
+            return out
+        if as_array:
+            return np.array(words, dtype = np.uint32)
+        return words[0] if len(words) == 1 else words
+
+    @staticmethod
+    def _unwrap(values, n):
+        """ Convert values returned by address reads to a list of words """
+        if isinstance(values, np.ndarray):
+            return [int(v) for v in values[:n]]
+        return list(values) if type(values) is list else [values]
+
+    def read_into(self, buffer, offset = 0):
+        """ Read register value into a caller-provided buffer, without allocating memory
+        :param buffer: Contiguous numpy.uint32 array, its size determines the number of words read
+        :param offset: Offset in words from start of register
+        :return: The buffer
+        """
+        return self.read(buffer.size, offset, out = buffer)
+
+    @synchronised
+    def write(self, values, offset = 0):
+        """ Write register value
+        :param values: Value or list of values to write
+        :param offset: Offset in words from start of register
+        """
+
+        # Check if register list has been reloaded
+        if self._version != self._board._register_list_version:
+            self._resolve()
+
+        if not self._direct:
+            return self._board.write_register(self.name, values, offset, self.device)
+
+        # Arrays are written word by word, in the same way as lists
+        if isinstance(values, np.ndarray):
+            values = values.tolist()
+
+        n = len(values) if type(values) is list else 1
+        if offset + n > self.size:
+            raise LibraryError("Cannot write %d words at offset %d to register %s of size %d"
+                               % (n, offset, self.name, self.size))
+
+        address = self.address + offset * 4
+        shadow = self._board._shadow
+
+        # Cached reads of these words are no longer valid
+        if self._board._read_cache is not None:
+            self._board._read_cache.discard_range(self.device, address, n)
+
+        # Use shadow cache to avoid reading back the current value of the register
+        if shadow is not None and self._cacheable and type(values) is not list:
+            word = values
+            if self.bitmask != 0xFFFFFFFF:
+                word = shadow.get((self.device, address))
+                if word is None:
+                    word = call_read_address(self._board.id, self.device, address)
+                    if word is Error.Failure:
+                        raise BoardError("Failed to read register %s from board" % self.name)
+                word = (word & ~self.bitmask & 0xFFFFFFFF) | ((values << self.shift) & self.bitmask)
+
+            if shadow.write_back:
+                shadow.set((self.device, address), word, dirty = True)
+                return
+
+            if call_write_address(self._board.id, self.device, address, word) == Error.Failure:
+                shadow.discard_range(self.device, address)
+                raise BoardError("Failed to write register %s on board" % self.name)
+
+            shadow.set((self.device, address), word)
+            return
+
+        # Words which are not cached are written directly, so any unflushed writes to them
+        # have to be sent first, after which cached copies are dropped
+        if shadow is not None:
+            if shadow.dirty_in_range(self.device, address, n):
+                self._board.flush()
+            shadow.discard_range(self.device, address, n)
+
+        # Apply bitmask, which requires the current value of the register
+        if self.bitmask != 0xFFFFFFFF:
+            current = call_read_address(self._board.id, self.device, address, n)
+            if current is Error.Failure:
+                raise BoardError("Failed to read register %s from board" % self.name)
+
+            if type(values) is list:
+                current = current if type(current) is list else [current]
+                values = [(c & ~self.bitmask & 0xFFFFFFFF) | ((v << self.shift) & self.bitmask)
+                          for c, v in zip(current, values)]
+            else:
+                values = (current & ~self.bitmask & 0xFFFFFFFF) | ((values << self.shift) & self.bitmask)
+
+        # Write to address
+        if call_write_address(self._board.id, self.device, address, values) == Error.Failure:
+            raise BoardError("Failed to write register %s on board" % self.name)
+
+    @property
+    def value(self):
+        """ Read single-word register value """
+        return self.read()
+
+    @value.setter
+    def value(self, value):
+        """ Write single-word register value """
+        self.write(value)
+
+    def __repr__(self):
+        return "RegisterHandle(%s, device=%s, address=%s, bitmask=%s, shift=%d, size=%d)" % \
+               (self.name, self.device, hex(self.address), hex(self.bitmask), self.shift, self.size)
+
+
+class ShadowCache(object):
+    """ Client-side copy of register words, used to avoid reading a word back from the
+        board before writing one of its bitfields. In write-back mode, writes only
+        update the copy and are sent to the board when flushed. Words which contain
+        read-only or FIFO registers change on the board and are never cached """
+
+    def __init__(self, write_back = False):
+        """ Class constructor
+        :param write_back: Hold writes until flushed
+        """
+        self.write_back = write_back
+        self.hits       = 0
+        self.misses     = 0
+        self._words     = {}
+        self._dirty     = set()
+
+    def get(self, key):
+        """ Get cached word
+        :param key: (device, address) tuple
+        :return: Word, or None if not cached
+        """
+        word = self._words.get(key, None)
+        if word is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return word
+
+    def set(self, key, word, dirty = False):
+        """ Update cached word
+        :param key: (device, address) tuple
+        :param word: Full register word
+        :param dirty: Word still needs to be written to board
+        """
+        self._words[key] = word
+        if dirty:
+            self._dirty.add(key)
+        else:
+            self._dirty.discard(key)
+
+    def is_dirty(self, key):
+        """ Check whether word still needs to be written to board """
+        return key in self._dirty
+
+    def dirty_in_range(self, device, address, n):
+        """ Check whether any of n words starting at address still need to be written
+        :param device: Device, None for all devices sharing the board's address space
+        """
+        return any((device is None or d == device) and address <= a < address + n * 4 for d, a in self._dirty)
+
+    def take_dirty(self):
+        """ Get words which need to be written to board, in address order, and mark them as clean
+        :return: List of ((device, address), word) tuples
+        """
+        dirty = [(key, self._words[key]) for key in sorted(self._dirty, key = lambda x: (x[0].value, x[1]))]
+        self._dirty = set()
+        return dirty
+
+    def discard_range(self, device, address, n = 1):
+        """ Drop n cached words starting at address, including unflushed writes
+        :param device: Device, None for all devices sharing the board's address space
+        """
+        if n == 1 and device is not None:
+            self._words.pop((device, address), None)
+            self._dirty.discard((device, address))
+            return
+
+        for key in [k for k in self._words.keys()
+                    if (device is None or k[0] == device) and address <= k[1] < address + n * 4]:
+            del self._words[key]
+            self._dirty.discard(key)
+
+    def clear(self):
+        """ Drop all cached words, including unflushed writes """
+        self._words = {}
+        self._dirty = set()
+
+    def __len__(self):
+        return len(self._words)
+
+
+class ReadCache(object):
+    """ Read-through cache of register words with per-register time-to-live, such that
+        registers polled by many monitoring clients are read from the board at a bounded
+        rate. The policy of each register is chosen by the first matching rule: Static
+        registers are kept until written or invalidated, Slow registers until their TTL
+        expires, while Volatile and FIFO registers are always read from the board """
+
+    # Default time-to-live in seconds for each policy, None never expires
+    DEFAULT_TTL = {CachePolicy.Static: None, CachePolicy.Slow: 1.0, CachePolicy.Volatile: 0}
+
+    # Default rules, applied after user rules. Registers matching no rule are Volatile
+    DEFAULT_RULES = [(r'(^|\.)info\.|version|date_code|magic', CachePolicy.Static),
+                     (r'temp|pll|locked', CachePolicy.Slow),
+                     (RegisterType.Sensor, CachePolicy.Slow)]
+
+    def __init__(self, ttl = None, rules = None):
+        """ Class constructor
+        :param ttl: Dictionary of time-to-live in seconds keyed by CachePolicy, overriding the defaults
+        :param rules: List of (rule, CachePolicy) tuples, checked before the default rules. A rule is
+                      a regular expression searched for in the register name, a Permission or a RegisterType
+        """
+        self.ttl_policy = dict(self.DEFAULT_TTL)
+        if ttl is not None:
+            self.ttl_policy.update(ttl)
+
+        self._rules = []
+        for rule, policy in (rules if rules is not None else []) + self.DEFAULT_RULES:
+            if type(policy) is not CachePolicy:
+                raise LibraryError("Read cache rule policy must be of type CachePolicy")
+            self._rules.append((re.compile(rule) if type(rule) is str else rule, policy))
+
+        self.hits     = 0
+        self.misses   = 0
+        self.bypassed = 0
+        self._words   = {}
+        self._ttl     = {}
+        self._devices = set()
+
+    def policy(self, name, info):
+        """ Get cache policy of a register
+        :param name: Register name
+        :param info: Register information from the board's register list
+        :return: CachePolicy
+        """
+        for rule, policy in self._rules:
+            if type(rule) is Permission:
+                matched = info['permission'] == rule
+            elif type(rule) is RegisterType:
+                matched = info['type'] == rule
+            else:
+                matched = rule.search(name) is not None
+            if matched:
+                return policy
+        return CachePolicy.Volatile
+
+    def ttl(self, handle):
+        """ Get time-to-live of a register's words
+        :param handle: RegisterHandle
+        :return: Time-to-live in seconds, None if words do not expire, 0 if they are not cached
+        """
+        ttl = self._ttl.get(handle.name, False)
+        if ttl is False:
+            if handle.type == RegisterType.FifoRegister:
+                ttl = 0
+            else:
+                ttl = self.ttl_policy[self.policy(handle.name, handle._board.register_list[handle.name])]
+            self._ttl[handle.name] = ttl
+        return ttl
+
+    def get(self, device, address, n = 1):
+        """ Get cached words which have not expired
+        :param device: Device
+        :param address: Address of first word
+        :param n: Number of words
+        :return: List of words, or None if any of them is not cached
+        """
+        now, words = time.time(), []
+        for i in range(n):
+            entry = self._words.get((device, address + i * 4), None)
+            if entry is None or (entry[1] is not None and entry[1] <= now):
+                self.misses += 1
+                return None
+            words.append(entry[0])
+        self.hits += 1
+        return words
+
+    def set(self, device, address, words, ttl):
+        """ Update cached words
+        :param device: Device
+        :param address: Address of first word
+        :param words: List of words
+        :param ttl: Time-to-live in seconds, None if words do not expire
+        """
+        expiry = None if ttl is None else time.time() + ttl
+        self._devices.add(device)
+        for i, word in enumerate(words):
+            self._words[(device, address + i * 4)] = (word, expiry)
+
+    def discard_range(self, device, address, n = 1):
+        """ Drop n cached words starting at address
+        :param device: Device, None for all devices sharing the board's address space
+        """
+        devices = self._devices if device is None else [device]
+        if n <= 64:
+            for d in devices:
+                for i in range(n):
+                    self._words.pop((d, address + i * 4), None)
+            return
+
+        for key in [k for k in self._words.keys() if k[0] in devices and address <= k[1] < address + n * 4]:
+            del self._words[key]
+
+    def clear(self):
+        """ Drop all cached words and register policies """
+        self._words   = {}
+        self._ttl     = {}
+        self._devices = set()
+
+    def statistics(self):
+        """ Get cache usage
+        :return: Dictionary with number of cached words, hits, misses and bypassed reads
+        """
+        return {'words': len(self._words), 'hits': self.hits, 'misses': self.misses, 'bypassed': self.bypassed}
+
+    def __len__(self):
+        return len(self._words)
@@ -0,0 +1,344 @@
+from Queue import Queue, Full, Empty
+import numpy as np
+import threading
+import logging
+import time
+
+from pyfabil.base.definitions import *
+
+
+class StatisticsSample(object):
+    """ Statistics of one ring buffer entry """
+
+    def __init__(self, index, timestamp, data, count = 1):
+        """ Class constructor
+        :param index: Index of the last integration included in the sample
+        :param timestamp: Time at which the last integration was read
+        :param data: Statistics array
+        :param count: Number of integrations included in the sample
+        """
+        self.index     = index
+        self.timestamp = timestamp
+        self.data      = data
+        self.count     = count
+
+    def __repr__(self):
+        return "StatisticsSample(index=%d, count=%d, shape=%s)" % (self.index, self.count, str(self.data.shape))
+
+
+class StatisticsSubscription(object):
+    """ Bounded queue of samples delivered to a consumer. Samples are dropped when
+        the queue is full, such that slow consumers never block acquisition """
+
+    def __init__(self, queue_size, callback = None):
+        """ Class constructor
+        :param queue_size: Maximum number of samples waiting to be consumed
+        :param callback: Function called with each sample on a dedicated thread
+        """
+        self._queue   = Queue(maxsize = queue_size)
+        self.dropped  = 0
+        self.active   = True
+
+        self._thread = None
+        if callback is not None:
+            self._thread = threading.Thread(target = self._dispatch, args = (callback,))
+            self._thread.daemon = True
+            self._thread.start()
+
+    def get(self, timeout = None):
+        """ Get the next sample
+        :param timeout: Time to wait for a sample in seconds, None to wait indefinitely
+        :return: StatisticsSample, or None on timeout or if the subscription was cancelled
+        """
+        try:
+            return self._queue.get(timeout = timeout)
+        except Empty:
+            return None
+
+    def _put(self, sample):
+        """ Queue sample without blocking """
+        try:
+            self._queue.put_nowait(sample)
+        except Full:
+            self.dropped += 1
+
+    def _cancel(self):
+        """ Stop delivering samples """
+        self.active = False
+        try:
+            self._queue.put_nowait(None)
+        except Full:
+            pass
+
+    def _dispatch(self, callback):
+        """ Deliver samples to callback """
+        while self.active:
+            sample = self._queue.get()
+            if sample is None:
+                continue
+            try:
+                callback(sample)
+            except Exception as e:
+                logging.warning("StatisticsMonitor: Subscriber callback failed (%s)" % str(e))
+
+
+class StatisticsMonitor(object):
+    """ Acquires statistics once per integration on a background thread and keeps
+        the last integrations in a ring buffer. Polling is aligned to the sync
+        period of a BSN source (UniBoardBsnSource or UniBoardBsnScheduler) when one
+        is provided, otherwise to a fixed period. Board accesses made by the acquisition
+        thread are serialised with those of other threads through the board's lock """
+
+    def __init__(self, statistics, bsn_source = None, blocks_per_sync = None, period = None,
+                 history = 64, downsample = 1, average = False, return_complex = False,
+                 latency = 0.01, block_period = None):
+        """ Class constructor
+        :param statistics: Statistics plugin providing read_stats, or a function returning a statistics array
+        :param bsn_source: Plugin providing read_current_bsn, used to align polling to integrations
+        :param blocks_per_sync: Number of blocks per integration, read from the BSN source if not specified
+        :param period: Integration period in seconds, used when no BSN source is provided
+        :param history: Number of samples kept in the ring buffer
+        :param downsample: Number of integrations combined into each sample
+        :param average: Average combined integrations, otherwise the last integration is kept
+        :param return_complex: Request complex statistics from statistics plugins
+        :param latency: Time to wait after an integration boundary before reading statistics, in seconds
+        :param block_period: Duration of a block (one BSN unit) in seconds, computed from the samples per
+                             block and sample frequency of the BSN source if not specified
+        """
+
+        if hasattr(statistics, 'read_stats'):
+            self._read = lambda: statistics.read_stats(return_complex = return_complex, as_array = True)
+        elif callable(statistics):
+            self._read = statistics
+        else:
+            raise LibraryError("StatisticsMonitor requires a statistics plugin or function")
+
+        # Integration timing
+        self._bsn_source = bsn_source
+        if bsn_source is not None:
+            if blocks_per_sync is None:
+                if not hasattr(bsn_source, 'read_blocks_per_sync'):
+                    raise LibraryError("StatisticsMonitor: blocks_per_sync required for BSN source")
+                blocks_per_sync = bsn_source.read_blocks_per_sync()[0]
+            if blocks_per_sync <= 0:
+                raise LibraryError("StatisticsMonitor: Invalid number of blocks per sync %d" % blocks_per_sync)
+            if block_period is None:
+                if not hasattr(bsn_source, '_samples_per_block') or not hasattr(bsn_source, '_sample_frequency'):
+                    raise LibraryError("StatisticsMonitor: block_period required for BSN source")
+                block_period = float(bsn_source._samples_per_block) / bsn_source._sample_frequency
+            self._blocks_per_sync = blocks_per_sync
+            self._block_period    = block_period
+            self.period           = blocks_per_sync * block_period
+        elif period is not None and period > 0:
+            self.period = period
+        else:
+            raise LibraryError("StatisticsMonitor requires a BSN source or an integration period")
+
+        if history < 1 or downsample < 1:
+            raise LibraryError("StatisticsMonitor: history and downsample must be positive")
+
+        self._history    = history
+        self._downsample = downsample
+        self._average    = average
+        self._latency    = latency
+
+        # Ring buffer, allocated when the first statistics are read
+        self._buffer     = None
+        self._indices    = np.zeros(history, dtype = np.int64)
+        self._timestamps = np.zeros(history, dtype = np.float64)
+        self._counts     = np.zeros(history, dtype = np.int32)
+        self._written    = 0
+        self._lock       = threading.Lock()
+
+        # Integrations being combined into the next sample
+        self._accumulator = None
+        self._accumulated = 0
+
+        # Acquisition counters
+        self.acquired   = 0
+        self.dropped    = 0
+        self.errors     = 0
+        self._last      = None
+        self._start     = None
+
+        self._subscriptions = []
+        self._thread        = None
+        self._stop          = threading.Event()
+
+    def start(self):
+        """ Start acquisition thread """
+        if self._thread is not None:
+            return
+
+        self._stop.clear()
+        self._start  = time.time()
+        self._thread = threading.Thread(target = self._run, name = "StatisticsMonitor")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """ Stop acquisition thread and cancel subscriptions """
+        if self._thread is None:
+            return
+
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+
+        with self._lock:
+            subscriptions, self._subscriptions = self._subscriptions, []
+        for subscription in subscriptions:
+            subscription._cancel()
+
+    @property
+    def running(self):
+        """ Whether the acquisition thread is running """
+        return self._thread is not None
+
+    def subscribe(self, callback = None, queue_size = 16):
+        """ Subscribe to samples as they are added to the ring buffer
+        :param callback: Function called with each sample on a dedicated thread. If not
+                         specified samples are retrieved with the subscription's get method
+        :param queue_size: Maximum number of samples waiting to be consumed, further samples are dropped
+        :return: StatisticsSubscription
+        """
+        subscription = StatisticsSubscription(queue_size, callback)
+        with self._lock:
+            self._subscriptions.append(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        """ Cancel subscription
+        :param subscription: StatisticsSubscription
+        """
+        with self._lock:
+            if subscription in self._subscriptions:
+                self._subscriptions.remove(subscription)
+        subscription._cancel()
+
+    def latest(self, n = 1):
+        """ Get the most recent samples from the ring buffer
+        :param n: Number of samples
+        :return: List of StatisticsSample in acquisition order, at most n and history long
+        """
+        with self._lock:
+            n = min(n, self._written, self._history)
+            slots = [(self._written - n + i) % self._history for i in range(n)]
+            return [StatisticsSample(int(self._indices[s]), float(self._timestamps[s]),
+                                     self._buffer[s].copy(), int(self._counts[s])) for s in slots]
+
+    def history(self):
+        """ Get all samples in the ring buffer as arrays
+        :return: (indices, timestamps, data) tuple, data having shape (samples,) + statistics shape
+        """
+        with self._lock:
+            n = min(self._written, self._history)
+            slots = (np.arange(n) + self._written - n) % self._history
+            if self._buffer is None:
+                return self._indices[:0].copy(), self._timestamps[:0].copy(), None
+            return self._indices[slots], self._timestamps[slots], self._buffer[slots]
+
+    def get_acquisition_statistics(self):
+        """ Get acquisition counters
+        :return: Dictionary of counters
+        """
+        with self._lock:
+            return {'acquired'   : self.acquired,
+                    'dropped'    : self.dropped,
+                    'errors'     : self.errors,
+                    'samples'    : self._written,
+                    'subscribers': [s.dropped for s in self._subscriptions]}
+
+    def _current_integration(self):
+        """ Get index of the current integration and time until the next one starts
+        :return: (index, seconds) tuple
+        """
+        if self._bsn_source is not None:
+            bsn = self._bsn_source.read_current_bsn()[0]
+            index = bsn // self._blocks_per_sync
+            remaining = (self._blocks_per_sync - bsn % self._blocks_per_sync) * self._block_period
+        else:
+            elapsed = time.time() - self._start
+            index = int(elapsed // self.period)
+            remaining = self.period - elapsed % self.period
+        return index, remaining
+
+    def _run(self):
+        """ Acquisition loop """
+        while not self._stop.is_set():
+            try:
+                index, remaining = self._current_integration()
+
+                # Statistics of the previous integration were already read
+                if self._last is not None and index <= self._last:
+                    self._stop.wait(remaining + self._latency)
+                    continue
+
+                stats = np.asarray(self._read())
+            except Exception as e:
+                self.errors += 1
+                logging.warning("StatisticsMonitor: Failed to read statistics (%s)" % str(e))
+                self._stop.wait(self.period)
+                continue
+
+            # Integrations missed since the last read, such as when reads stall
+            if self._last is not None and index > self._last + 1:
+                self.dropped += index - self._last - 1
+            self._last = index
+            self.acquired += 1
+
+            self._add(index, time.time(), stats)
+
+    def _add(self, index, timestamp, stats):
+        """ Combine integration into the next sample, adding the sample to the ring buffer once complete
+        :param index: Integration index
+        :param timestamp: Acquisition time
+        :param stats: Statistics array
+        """
+
+        # Accumulate integrations
+        if self._average:
+            if self._accumulated == 0:
+                dtype = np.complex128 if np.iscomplexobj(stats) else np.float64
+                if self._accumulator is None or self._accumulator.shape != stats.shape or \
+                   self._accumulator.dtype != dtype:
+                    self._accumulator = np.zeros(stats.shape, dtype = dtype)
+                else:
+                    self._accumulator.fill(0)
+            self._accumulator += stats
+        self._accumulated += 1
+
+        if self._accumulated < self._downsample:
+            return
+
+        count, self._accumulated = self._accumulated, 0
+        if self._average:
+            stats = self._accumulator
+            stats /= count
+
+        with self._lock:
+            if self._buffer is None or self._buffer.shape[1:] != stats.shape or self._buffer.dtype != stats.dtype:
+                self._buffer  = np.zeros((self._history,) + stats.shape, dtype = stats.dtype)
+                self._written = 0
+
+            slot = self._written % self._history
+            self._buffer[slot]     = stats
+            self._indices[slot]    = index
+            self._timestamps[slot] = timestamp
+            self._counts[slot]     = count
+            self._written += 1
+
+            subscriptions = list(self._subscriptions)
+
+        if len(subscriptions) > 0:
+            sample = StatisticsSample(index, timestamp, self._buffer[slot].copy(), count)
+            for subscription in subscriptions:
+                subscription._put(sample)
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+        return False
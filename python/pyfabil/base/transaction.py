@@ -0,0 +1,238 @@
+from pyfabil.base.definitions import *
+from pyfabil.base.interface import call_execute_transaction
+from pyfabil.base.utils import synchronised
+
+
+class TransactionResult(object):
+    """ Result of a read operation within a transaction. Value and error are
+        populated when the transaction is executed """
+
+    def __init__(self, key):
+        """ Class constructor
+        :param key: Register name, memory address or SPI device tuple being read
+        """
+        self.key   = key
+        self.value = None
+        self.error = None
+
+    def __repr__(self):
+        return "TransactionResult(%s, value=%s, error=%s)" % (str(self.key), str(self.value), str(self.error))
+
+
+class Transaction(object):
+    """ Collects single-word register, memory address and SPI device operations,
+        and sends them to the board in a single library call. Keys follow the
+        same conventions as board item access: a register name, a memory address
+        or an (SPI device, address) tuple """
+
+    def __init__(self, board, coalesce = False):
+        """ Class constructor
+        :param board: Board on which operations will be performed
+        :param coalesce: Merge consecutive writes to different bitfields of the same word
+                         into a single write
+        """
+        self._board      = board
+        self._coalesce   = coalesce
+        self._operations = []
+        self._results    = []
+        self._ordered    = []
+        self._words      = []
+        self._pending    = {}
+
+    def read(self, key, device = None):
+        """ Add a read operation to the transaction
+        :param key: Register name, memory address or SPI device tuple
+        :param device: Device can be explicitly specified for registers and addresses
+        :return: TransactionResult, populated when the transaction is executed
+        """
+        result = TransactionResult(key)
+        self._add_operation(key, None, device, result)
+        return result
+
+    def write(self, key, value, device = None):
+        """ Add a write operation to the transaction
+        :param key: Register name, memory address or SPI device tuple
+        :param value: Value to write
+        :param device: Device can be explicitly specified for registers and addresses
+        :return: TransactionResult, populated when the transaction is executed
+        """
+        result = TransactionResult(key)
+        self._add_operation(key, value, device, result)
+        return result
+
+    @synchronised
+    def execute(self):
+        """ Send all collected operations to the board
+        :return: List of TransactionResult, one per read or write call
+        """
+
+        # Nothing to do
+        if len(self._operations) == 0:
+            return []
+
+        # Clear transaction
+        operations, results, ordered, words = self._operations, self._results, self._ordered, self._words
+        self._operations, self._results, self._ordered, self._words, self._pending = [], [], [], [], {}
+
+        # Send unflushed shadow cache writes first, and use cached words to turn
+        # masked writes into plain writes
+        shadow = self._board._shadow
+        if shadow is not None:
+            self._board.flush()
+            for i, (op_type, device, name, address, value, bitmask) in enumerate(operations):
+                if op_type == OperationType.WriteAddressMasked and words[i] is not None and words[i][1]:
+                    word = shadow.get(words[i][0])
+                    if word is not None:
+                        word = (word & ~bitmask & 0xFFFFFFFF) | (value & bitmask)
+                        operations[i] = (OperationType.WriteAddress, device, name, address, word, 0xFFFFFFFF)
+
+        # Send operations to board
+        returned = call_execute_transaction(self._board.id, operations)
+
+        # Populate results
+        failed = []
+        for (op_type, _, _, _, value, _), op_results, (error, returned_value) in zip(operations, results, returned):
+            for result in op_results:
+                result.error = error
+                if op_type in [OperationType.ReadRegister, OperationType.ReadAddress, OperationType.ReadDevice]:
+                    result.value = returned_value
+                if error != Error.Success:
+                    failed.append(str(result.key))
+
+        # Keep shadow cache coherent with written words
+        if shadow is not None:
+            for (op_type, _, _, _, value, _), word, (error, _) in zip(operations, words, returned):
+                if word is None or op_type not in [OperationType.WriteRegister, OperationType.WriteAddress,
+                                                   OperationType.WriteAddressMasked]:
+                    continue
+                (device, address), cacheable = word
+                if op_type == OperationType.WriteAddress and cacheable and error == Error.Success:
+                    shadow.set((device, address), value)
+                else:
+                    shadow.discard_range(device, address)
+
+        # Cached reads of written words are no longer valid
+        read_cache = self._board._read_cache
+        if read_cache is not None:
+            for (op_type, _, _, _, _, _), word in zip(operations, words):
+                if word is not None and op_type in [OperationType.WriteRegister, OperationType.WriteAddress,
+                                                    OperationType.WriteAddressMasked]:
+                    read_cache.discard_range(None, word[0][1])
+
+        if len(failed) > 0:
+            raise BoardError("Failed to execute transaction operations on board: %s" % ', '.join(failed))
+
+        return ordered
+
+    def _add_operation(self, key, value, device, result):
+        """ Convert key to operation and add to transaction
+        :param key: Register name, memory address or SPI device tuple
+        :param value: Value to write, None for read operations
+        :param device: Device for register and address operations
+        :param result: Associated result
+        """
+
+        write = value is not None
+        if write and type(value) not in [int, long]:
+            raise LibraryError("Transactions only support single-word values")
+
+        # Board word affected by operation, and whether it can be kept in the shadow cache
+        word = None
+
+        # Memory address
+        if type(key) in [int, long]:
+            device = Device.FPGA_1 if device is None else device
+            op_type = OperationType.WriteAddress if write else OperationType.ReadAddress
+            operation = (op_type, device, None, key, value if write else 0, 0xFFFFFFFF)
+            word = ((device, key), False)
+
+        # SPI device
+        elif type(key) is tuple:
+            if len(key) != 2:
+                raise LibraryError("A device name and address need to be specified for SPI devices")
+            if self._board._deviceList is None or key[0] not in self._board._deviceList:
+                raise LibraryError("SPI device %s not found" % key[0])
+            op_type = OperationType.WriteDevice if write else OperationType.ReadDevice
+            operation = (op_type, None, key[0], key[1], value if write else 0, 0xFFFFFFFF)
+
+            # SPI transfers go through board registers, so no word can absorb further writes
+            self._pending = {}
+
+        # Register name
+        elif type(key) is str:
+            self._board._checks(None)
+            if key not in self._board.register_list:
+                raise LibraryError("Register %s not found" % key)
+
+            handle = self._board.register(key, device)
+            word = ((handle.device, handle.address), handle._cacheable)
+
+            # Bitfield writes are converted to masked address writes when coalescing,
+            # or when the shadow cache can provide the rest of the word
+            if write and handle._direct and handle.size == 1 and handle.bitmask != 0xFFFFFFFF and \
+               (self._coalesce or self._board._shadow is not None):
+                self._add_masked_write(word, (value << handle.shift) & handle.bitmask, handle.bitmask, result)
+                return
+
+            op_type = OperationType.WriteRegister if write else OperationType.ReadRegister
+            operation = (op_type, handle.device, self._board._remove_device(key), 0, value if write else 0, 0xFFFFFFFF)
+
+        else:
+            raise LibraryError("Unrecognised key type, must be register name, memory address or SPI device tuple")
+
+        # Word can no longer absorb bitfield writes
+        if word is not None:
+            self._pending.pop(word[0], None)
+
+        self._operations.append(operation)
+        self._results.append([result])
+        self._ordered.append(result)
+        self._words.append(word)
+
+    def _add_masked_write(self, word, value, bitmask, result):
+        """ Add a masked write to a board word, merging it with the previous masked write
+            to the same word if coalescing is enabled and the bitfields do not overlap
+        :param word: ((device, address), cacheable) tuple
+        :param value: Shifted value to write
+        :param bitmask: Bits to write
+        :param result: Associated result
+        """
+        (device, address), cacheable = word
+
+        index = self._pending.get((device, address), None) if self._coalesce else None
+        if index is not None and self._operations[index][5] & bitmask == 0:
+            _, _, _, _, merged_value, merged_mask = self._operations[index]
+            merged_value |= value
+            merged_mask  |= bitmask
+            op_type = OperationType.WriteAddress if merged_mask == 0xFFFFFFFF else OperationType.WriteAddressMasked
+            self._operations[index] = (op_type, device, None, address, merged_value, merged_mask)
+            self._results[index].append(result)
+            self._ordered.append(result)
+            return
+
+        self._pending[(device, address)] = len(self._operations)
+        self._operations.append((OperationType.WriteAddressMasked, device, None, address, value, bitmask))
+        self._results.append([result])
+        self._ordered.append(result)
+        self._words.append(word)
+
+    def __getitem__(self, key):
+        """ Add read operation """
+        return self.read(key)
+
+    def __setitem__(self, key, value):
+        """ Add write operation """
+        self.write(key, value)
+
+    def __len__(self):
+        """ Return number of operations which will be sent to the board """
+        return len(self._operations)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        """ Execute transaction unless an exception occurred within the block """
+        if exc_type is None:
+            self.execute()
+        return False
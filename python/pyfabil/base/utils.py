@@ -1,7 +1,23 @@
+import numpy as np
+import functools
 import operator
 import struct
+import threading
 import time
 
+from pyfabil.base.definitions import BoardError
+
+def synchronised(method):
+    """ Decorator which serialises calls on a board through its lock, for methods of boards
+        and of objects which access a board, such as register handles and transactions
+        :param method: Method to decorate
+    """
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with getattr(self, '_board', self).lock:
+            return method(self, *args, **kwargs)
+    return wrapper
+
 def convert_uint_to_string(data):
     """ Convert list of 32-bit unsigned integers to string
         :param data: input data
@@ -29,6 +45,49 @@ def swap32(x):
          ((x >>  8) & 0x0000FF00) |
          ((x >> 24) & 0x000000FF))
 
+def decode_statistics(words, data_width = 56, complex_pairs = False):
+    """ Decode statistics stored as pairs of 32-bit words, least significant word first,
+        into signed integers. All nodes are decoded at once
+        :param words: Array of shape (nodes, 2 * statistics) of 32-bit words
+        :param data_width: Width of statistics in bits, at most 64
+        :param complex_pairs: The first half of the statistics are real parts and the second
+                              half imaginary parts, which are combined into complex values
+        :return int64 array of shape (nodes, statistics), or complex128 array of shape
+                (nodes, statistics / 2) if complex_pairs is set
+    """
+    words = np.asarray(words, dtype = np.uint64)
+    words = words.reshape(words.shape[0] if words.ndim > 1 else 1, -1, 2)
+
+    values = (words[:, :, 1] << np.uint64(32)) | (words[:, :, 0] & np.uint64(0xFFFFFFFF))
+    if data_width < 64:
+        # Mask to data width and sign-extend
+        sign = np.int64(1 << (data_width - 1))
+        values = ((values & np.uint64((1 << data_width) - 1)).astype(np.int64) ^ sign) - sign
+    else:
+        values = values.view(np.int64)
+
+    if not complex_pairs:
+        return values
+
+    half = values.shape[1] // 2
+    stats = np.empty((values.shape[0], half), dtype = np.complex128)
+    stats.real = values[:, :half]
+    stats.imag = values[:, half:]
+    return stats
+
+def verify_statistics(stats, reference):
+    """ Compare statistics of all nodes against a reference
+        :param stats: Array of shape (nodes, statistics)
+        :param reference: Reference statistics, common to all nodes
+        :return Array of shape (mismatches, 2) containing (node index, statistic index) pairs
+    """
+    stats = np.asarray(stats)
+    reference = np.asarray(reference)
+    if reference.shape[-1] < stats.shape[-1]:
+        raise ValueError("Reference contains %d statistics, %d required" % (reference.shape[-1], stats.shape[-1]))
+
+    return np.argwhere(stats != reference[..., :stats.shape[-1]])
+
 ###############################################################################
 #
 # Copyright (C) 2012
@@ -303,6 +362,125 @@ def do_until_ne(method, val, ms_retry=10, s_timeout=4, **kwargs): return do_unti
 def do_until_ge(method, val, ms_retry=10, s_timeout=4, **kwargs): return do_until(method, val, operator.ge, ms_retry, s_timeout, **kwargs)
 def do_until_gt(method, val, ms_retry=10, s_timeout=4, **kwargs): return do_until(method, val, operator.gt, ms_retry, s_timeout, **kwargs)
 
+class WaitStatistics(object):
+    """ Durations of completed waits, keyed by wait name """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._waits = {}
+
+    def record(self, name, elapsed, polls, timed_out = False):
+        """ Record a wait
+        :param name: Wait name
+        :param elapsed: Time waited, in seconds
+        :param polls: Number of times the condition was polled
+        :param timed_out: Whether the wait reached its deadline
+        """
+        with self._lock:
+            entry = self._waits.setdefault(name, {'count': 0, 'total': 0.0, 'max': 0.0, 'last': 0.0,
+                                                  'polls': 0, 'timeouts': 0})
+            entry['count'] += 1
+            entry['total'] += elapsed
+            entry['max']    = max(entry['max'], elapsed)
+            entry['last']   = elapsed
+            entry['polls'] += polls
+            entry['timeouts'] += 1 if timed_out else 0
+
+    def summary(self):
+        """ Return copy of recorded waits
+        :return: Dictionary of count, total, max and last durations, polls and timeouts, keyed by wait name
+        """
+        with self._lock:
+            return dict([(name, dict(entry)) for name, entry in self._waits.iteritems()])
+
+    def reset(self):
+        """ Clear recorded waits """
+        with self._lock:
+            self._waits = {}
+
+    def __str__(self):
+        lines = ["%-40s %6s %10s %10s %8s" % ("Wait", "Count", "Total (s)", "Max (s)", "Timeouts")]
+        for name, entry in sorted(self.summary().iteritems()):
+            lines.append("%-40s %6d %10.3f %10.3f %8d" % (name, entry['count'], entry['total'],
+                                                         entry['max'], entry['timeouts']))
+        return '\n'.join(lines)
+
+# Statistics of all waits performed through wait_until and wait_until_all
+wait_statistics = WaitStatistics()
+
+
+def wait_until_all(conditions, timeout = 10, name = None, interval = 0.001, max_interval = 0.1, backoff = 2):
+    """ Poll conditions, such as status bits on several boards, until all of them are true.
+        Conditions are first polled immediately, after which the interval between polls grows
+        from interval to max_interval, such that short waits return quickly while long waits
+        do not flood the boards with requests. Satisfied conditions are not polled again
+    :param conditions: List of functions returning True once the awaited state is reached
+    :param timeout: Deadline in seconds, after which BoardError is raised
+    :param name: Wait name under which the duration is recorded in wait_statistics
+    :param interval: Initial interval between polls, in seconds
+    :param max_interval: Maximum interval between polls, in seconds
+    :param backoff: Factor by which the interval grows after each poll
+    :return: List of times, in seconds, after which each condition was satisfied
+    """
+    if name is None:
+        name = getattr(conditions[0], '__name__', 'wait') if len(conditions) == 1 else 'wait'
+
+    start = time.time()
+    deadline = start + timeout
+    elapsed = [None] * len(conditions)
+    pending = range(len(conditions))
+    polls = 0
+
+    while True:
+        polls += 1
+        pending = [i for i in pending if not conditions[i]()]
+        now = time.time()
+        for i in range(len(conditions)):
+            if elapsed[i] is None and i not in pending:
+                elapsed[i] = now - start
+
+        if len(pending) == 0:
+            wait_statistics.record(name, now - start, polls)
+            return elapsed
+
+        if now >= deadline:
+            wait_statistics.record(name, now - start, polls, timed_out = True)
+            raise BoardError("Timeout after %.3fs waiting for %s (%d of %d conditions not met)" %
+                             (now - start, name, len(pending), len(conditions)))
+
+        time.sleep(min(interval, deadline - now))
+        interval = min(interval * backoff, max_interval)
+
+
+def wait_until(condition, timeout = 10, name = None, **kwargs):
+    """ Poll condition until it is true, with increasing intervals between polls (see wait_until_all)
+    :param condition: Function returning True once the awaited state is reached
+    :param timeout: Deadline in seconds, after which BoardError is raised
+    :param name: Wait name under which the duration is recorded in wait_statistics
+    :return: Time waited, in seconds
+    """
+    return wait_until_all([condition], timeout, name, **kwargs)[0]
+
+
+def wait_register(boards, key, values, mask = 0xFFFFFFFF, timeout = 10, name = None, **kwargs):
+    """ Wait until the masked value of a register, memory address or SPI device register
+        is one of the expected values, on one or several boards
+    :param boards: Board, or list of boards
+    :param key: Register name, memory address or (device, address) tuple
+    :param values: Expected value, or list of expected values
+    :param mask: Bitmask applied to register value
+    :param timeout: Deadline in seconds, after which BoardError is raised
+    :param name: Wait name, the register name by default
+    :return: Time waited, in seconds
+    """
+    boards = boards if type(boards) is list else [boards]
+    values = values if type(values) in [list, tuple] else [values]
+    if name is None:
+        name = key if type(key) is str else str(key) if type(key) is tuple else hex(key)
+
+    conditions = [lambda board = board: board[key] & mask in values for board in boards]
+    return max(wait_until_all(conditions, timeout, name, **kwargs))
+
 def reverse_byte(byte):
     """
     Fast way to reverse a byte on 64-bit platforms.
@@ -320,6 +498,17 @@ def reverse_word(word):
     reversed_word = (reverse_byte(B0) << 24) | (reverse_byte(B1) << 16) | (reverse_byte(B2) << 8) | (reverse_byte(B3))
     return reversed_word
 
+# Bit-reversed value of each byte, used to bit-reverse arrays of words
+_reversed_bytes = np.array([reverse_byte(byte) for byte in range(256)], dtype = np.uint8)
+
+def reverse_words(words):
+    """
+    Bit-reverse an array of 32-bit words, as reverse_word does for a single word.
+    Each byte is reversed through a lookup table and the byte order is then swapped.
+    """
+    words = np.ascontiguousarray(words, dtype = np.uint32)
+    return _reversed_bytes[words.view(np.uint8)].view(np.uint32).byteswap()
+
 def add_list(aList, bArg):
     """
     Element by element add list b to list a or add value b to each element in list a
@@ -0,0 +1,5 @@
+__author__ = 'Alessio Magro'
+
+from pyfabil.benchmarks.harness import BenchmarkResults, Comparison, format_comparison
+from pyfabil.benchmarks.control_path import run_benchmarks, benchmark_tpm, benchmark_uniboard, \
+                                            benchmark_roach, benchmark_instrument
@@ -0,0 +1,69 @@
+# Run control path benchmarks against the simulators:
+#   python -m pyfabil.benchmarks -o results.json
+#   python -m pyfabil.benchmarks -b baseline.json -t 0.2
+from optparse import OptionParser
+import logging
+import sys
+
+from pyfabil.benchmarks.harness import BenchmarkResults, format_comparison
+from pyfabil.benchmarks.control_path import run_benchmarks, DEFAULT_BLOCK_SIZES
+
+if __name__ == "__main__":
+
+    parser = OptionParser(usage = "usage: python -m pyfabil.benchmarks [options]")
+    parser.add_option("-o", "--output", action = "store", dest = "output",
+                      default = None, help = "Save results to JSON file [default: None]")
+    parser.add_option("-b", "--baseline", action = "store", dest = "baseline",
+                      default = None, help = "Compare results with baseline JSON file [default: None]")
+    parser.add_option("-t", "--threshold", action = "store", dest = "threshold", type = "float",
+                      default = 0.1, help = "Relative change considered a regression [default: %default]")
+    parser.add_option("-i", "--iterations", action = "store", dest = "iterations", type = "int",
+                      default = 2000, help = "Calls per latency measurement [default: %default]")
+    parser.add_option("-s", "--block_sizes", action = "store", dest = "block_sizes",
+                      default = ','.join([str(s) for s in DEFAULT_BLOCK_SIZES]),
+                      help = "Comma-separated block sizes in words [default: %default]")
+    parser.add_option("-n", "--nof_boards", action = "store", dest = "nof_boards", type = "int",
+                      default = 8, help = "Boards in instrument start-up benchmark [default: %default]")
+    parser.add_option("", "--min_time", action = "store", dest = "min_time", type = "float",
+                      default = 0.2, help = "Minimum duration of throughput measurements [default: %default]")
+    parser.add_option("-l", "--latency", action = "store", dest = "latency", type = "float",
+                      default = 0, help = "Reply latency of the simulated boards in seconds [default: %default]")
+    parser.add_option("", "--skip", action = "store", dest = "skip", default = "",
+                      help = "Comma-separated benchmarks to skip: tpm, uniboard, instrument [default: None]")
+    parser.add_option("", "--roach", action = "store", dest = "roach", default = None,
+                      help = "Benchmark ROACH at ip:port, using --roach_register [default: None]")
+    parser.add_option("", "--roach_register", action = "store", dest = "roach_register", default = None,
+                      help = "ROACH register for latency measurements [default: None]")
+    parser.add_option("", "--roach_block", action = "store", dest = "roach_block", default = None,
+                      help = "ROACH memory register for throughput measurements [default: None]")
+    (conf, args) = parser.parse_args()
+
+    logging.basicConfig(format = "%(asctime)s - %(levelname)s - %(message)s", level = logging.INFO)
+
+    roach = None
+    if conf.roach is not None:
+        if conf.roach_register is None:
+            parser.error("--roach requires --roach_register")
+        ip, port = conf.roach.split(':')
+        roach = {'ip': ip, 'port': int(port), 'register': conf.roach_register, 'block_register': conf.roach_block}
+
+    skip = [s.strip().lower() for s in conf.skip.split(',')]
+    results = run_benchmarks(tpm = 'tpm' not in skip, uniboard = 'uniboard' not in skip,
+                             instrument = 'instrument' not in skip, roach = roach,
+                             iterations = conf.iterations, nof_boards = conf.nof_boards,
+                             block_sizes = [int(s) for s in conf.block_sizes.split(',')],
+                             min_time = conf.min_time, latency = conf.latency)
+    print results
+
+    if conf.output is not None:
+        results.save(conf.output)
+        logging.info("Saved results to %s" % conf.output)
+
+    # Compare with baseline, exiting with an error on regressions
+    if conf.baseline is not None:
+        comparisons = results.compare(BenchmarkResults.load(conf.baseline), conf.threshold)
+        print format_comparison(comparisons)
+        regressed = [c.name for c in comparisons if c.regressed]
+        if len(regressed) > 0:
+            logging.error("%d metrics regressed by more than %.0f%%" % (len(regressed), conf.threshold * 100))
+            sys.exit(1)
@@ -0,0 +1,308 @@
+from timeit import default_timer
+import numpy as np
+import tempfile
+import logging
+import shutil
+import os
+
+from pyfabil.base.definitions import *
+from pyfabil.boards.tpm import TPM
+from pyfabil.boards.roach import Roach
+from pyfabil.boards.uniboard import UniBoard
+from pyfabil.benchmarks.harness import BenchmarkResults, time_calls, time_repeated
+from pyfabil.tests.ucp_simulator import UCPSimulator
+from pyfabil.plugins.uniboard.epcs import UniBoardEpcs
+from pyfabil.tests.uniboard_simulator import ROM_ADDRESS, SimulatedEpcs, uniboard_rom
+
+# Block sizes, in words, used for throughput measurements
+DEFAULT_BLOCK_SIZES = [1, 16, 256, 1024, 16384, 262144]
+
+# Base address of the memory block in generated memory maps
+BLOCK_ADDRESS = 0x100000
+
+# Number of SPI device registers in the configuration sequence benchmark
+SPI_SEQUENCE_LENGTH = 64
+
+# Size of the image programmed to UniBoard flash, in 256-byte pages
+EPCS_IMAGE_PAGES = 64
+
+
+def generate_memory_map(filepath, nof_registers = 0, block_size = max(DEFAULT_BLOCK_SIZES)):
+    """ Generate TPM memory map with control, SPI and memory block registers
+    :param filepath: XML file path
+    :param nof_registers: Number of additional registers, used to scale XML parsing time
+    :param block_size: Size of memory block register, in words
+    """
+    lines = ['<?xml version="1.0" encoding="ISO-8859-1"?>', '<node>', '   <node id="board">',
+             '      <node id="regfile" address="0x00000000">',
+             '         <node id="control" address="0x0" permission="rw">',
+             '            <node id="enable" mask="0x0000000F" permission="rw"/>',
+             '            <node id="mode" mask="0x000000F0" permission="rw"/>',
+             '         </node>',
+             '      </node>',
+             '      <node id="spi" address="0x00001000">',
+             '         <node id="address" address="0x0" mask="0x0000FFFF" permission="rw"/>',
+             '         <node id="write_data" address="0x4" mask="0x0000FF00" permission="rw"/>',
+             '         <node id="read_data" address="0x8" mask="0x000000FF" permission="r"/>',
+             '         <node id="chip_select" address="0xC" mask="0x0000FFFF" permission="rw"/>',
+             '         <node id="sclk" address="0x10" mask="0x0000FFFF" permission="rw"/>',
+             '         <node id="cmd" address="0x14" permission="rw">',
+             '            <node id="start" mask="0x00000001" permission="rw"/>',
+             '            <node id="rnw" mask="0x00000002" permission="rw"/>',
+             '         </node>',
+             '      </node>',
+             '      <node id="memory" address="%#010x">' % BLOCK_ADDRESS,
+             '         <node id="block" address="0x0" size="%d" permission="rw"/>' % block_size,
+             '      </node>',
+             '      <node id="fill" address="0x00010000">']
+    for i in range(nof_registers):
+        lines.append('         <node id="register%d" address="%#x" permission="rw"/>' % (i, i * 4))
+    lines += ['      </node>', '   </node>', '</node>']
+
+    with open(filepath, 'w') as f:
+        f.write('\n'.join(lines))
+
+
+def generate_spi_devices(filepath):
+    """ Generate SPI device file for generated memory maps
+    :param filepath: XML file path
+    """
+    with open(filepath, 'w') as f:
+        f.write('<?xml version="1.0" encoding="ISO-8859-1"?>\n<node>\n'
+                '   <node id="pll" spi_sclk="0" spi_en="0"/>\n'
+                '   <node id="adc0" spi_sclk="1" spi_en="1"/>\n</node>')
+
+
+def _block_throughput(results, name, board, address, block_sizes, min_time):
+    """ Measure read and write throughput of a memory area for a range of block sizes """
+    for size in block_sizes:
+        buffer = np.zeros(size, dtype = np.uint32)
+        values = range(size)
+        read  = time_repeated(board.read_into, min_time, 3, address, buffer)
+        write = time_repeated(board.write_address, min_time, 3, address, values)
+        results.add("%s.read_block.%d.throughput" % (name, size), size * 4 / read / 1e6, 'MB/s', True)
+        results.add("%s.write_block.%d.throughput" % (name, size), size * 4 / write / 1e6, 'MB/s', True)
+
+
+def benchmark_tpm(results, iterations = 2000, block_sizes = DEFAULT_BLOCK_SIZES, nof_registers = 5000,
+                  firmware_repeats = 5, min_time = 0.2, ip = "127.0.0.1", latency = 0):
+    """ Benchmark the TPM control path against a simulated TPM
+    :param results: BenchmarkResults to which metrics are added
+    :param iterations: Number of calls per latency measurement
+    :param block_sizes: Block sizes, in words, for throughput measurements
+    :param nof_registers: Number of registers in the memory map used to time load_firmware
+    :param firmware_repeats: Number of times load_firmware is timed
+    :param min_time: Minimum duration of each throughput measurement, in seconds
+    :param ip: Loopback address used for the simulated board
+    :param latency: Reply latency of the simulated board, in seconds
+    """
+    directory = tempfile.mkdtemp()
+    try:
+        memory_map, spi_devices = os.path.join(directory, "tpm.xml"), os.path.join(directory, "spi.xml")
+        generate_memory_map(memory_map, nof_registers, max(block_sizes))
+        generate_spi_devices(spi_devices)
+
+        with UCPSimulator() as simulator:
+            board = simulator.add_board(ip = ip, memory_map = memory_map, spi_devices = spi_devices, latency = latency)
+            tpm = TPM(simulator = True, ip = ip, port = board.port)
+
+            # Memory map loading, dominated by XML parsing and register list population
+            durations = time_calls(tpm.load_firmware, firmware_repeats, Device.Board, memory_map)
+            results.add("tpm.load_firmware.time", np.median(durations) * 1e3, 'ms')
+            results.add("tpm.load_firmware.registers", len(tpm.register_list), 'registers', True)
+            tpm.load_spi_devices(Device.Board, spi_devices)
+            tpm.get_device_list(reset = True)
+
+            # Single register latency
+            results.add_latencies("tpm.read_register", time_calls(tpm.read_register, iterations,
+                                                                  'board.regfile.control'))
+            results.add_latencies("tpm.write_register", time_calls(tpm.write_register, iterations,
+                                                                   'board.regfile.control', 1))
+            results.add_latencies("tpm.write_register.masked", time_calls(tpm.write_register, iterations,
+                                                                          'board.regfile.control.mode', 2))
+
+            # Block throughput
+            _block_throughput(results, "tpm", tpm, BLOCK_ADDRESS, block_sizes, min_time)
+
+            # SPI devices
+            results.add_latencies("tpm.read_device", time_calls(tpm.read_device, iterations / 4, 'pll', 0x10))
+            results.add_latencies("tpm.write_device", time_calls(tpm.write_device, iterations / 4, 'pll', 0x10, 1))
+
+            # Device configuration sequence, written register by register and as an SPI batch
+            sequence = [(address, address & 0xFF) for address in range(0x100, 0x100 + SPI_SEQUENCE_LENGTH)]
+            single = time_repeated(lambda: [tpm.write_device('pll', a, v) for a, v in sequence], min_time)
+            batch = time_repeated(tpm.spi_batch, min_time, 3, 'pll', sequence)
+            results.add("tpm.spi_sequence.write_device", single / len(sequence) * 1e6, 'us')
+            results.add("tpm.spi_sequence.spi_batch", batch / len(sequence) * 1e6, 'us')
+            results.add("tpm.spi_sequence.speedup", single / batch, 'x', True)
+
+            tpm.disconnect()
+    finally:
+        shutil.rmtree(directory)
+
+
+def benchmark_uniboard(results, iterations = 1000, block_sizes = DEFAULT_BLOCK_SIZES, min_time = 0.2,
+                       nof_nodes = 8, epcs_pages = EPCS_IMAGE_PAGES, latency = 0):
+    """ Benchmark the UniBoard control path against simulated nodes, listening on
+        127.0.0.1 onwards as node addresses are derived from the board address
+    :param results: BenchmarkResults to which metrics are added
+    :param iterations: Number of calls per latency measurement
+    :param block_sizes: Block sizes, in words, for throughput measurements
+    :param min_time: Minimum duration of each throughput measurement, in seconds
+    :param nof_nodes: Number of nodes
+    :param epcs_pages: Size of the image programmed to the flash of all nodes, in pages, 0 to skip
+    :param latency: Reply latency of the simulated nodes, in seconds
+    """
+    rom = uniboard_rom([("REG_BENCHMARK", 0x2000, 1), ("RAM_BENCHMARK", BLOCK_ADDRESS, max(block_sizes))] +
+                       SimulatedEpcs.REGISTERS)
+
+    with UCPSimulator() as simulator:
+        port = None
+        for i in range(nof_nodes):
+            node = simulator.add_board(ip = "127.0.0.%d" % (i + 1), port = 0 if port is None else port,
+                                       latency = latency)
+            SimulatedEpcs(node)
+            node.write(ROM_ADDRESS, rom)
+            port = node.port
+
+        # The register list is read from the node ROMs when connecting
+        nodelist = [(i, 'F' if i < nof_nodes / 2 else 'B') for i in range(nof_nodes)]
+        start = default_timer()
+        unb = UniBoard(nodelist = nodelist, ip = "127.0.0.1", port = port)
+        unb.get_register_list(reset = True)
+        results.add("uniboard.connect.time", (default_timer() - start) * 1e3, 'ms')
+
+        # Single register latency, on one node and on all nodes
+        results.add_latencies("uniboard.read_register.node", time_calls(unb.read_register, iterations,
+                                                                        'fpga1.REG_BENCHMARK'))
+        results.add_latencies("uniboard.read_register.all", time_calls(unb.read_register, iterations,
+                                                                       'all.REG_BENCHMARK'))
+        results.add_latencies("uniboard.write_register.all", time_calls(unb.write_register, iterations,
+                                                                        'all.REG_BENCHMARK', 1))
+
+        # Block throughput on a single node
+        for size in block_sizes:
+            buffer = np.zeros((1, size), dtype = np.uint32)
+            read = time_repeated(unb.read_register, min_time, 3, 'fpga1.RAM_BENCHMARK', size, out = buffer)
+            results.add("uniboard.read_block.%d.throughput" % size, size * 4 / read / 1e6, 'MB/s', True)
+
+        # Flash programming and verification of an image on all nodes
+        if epcs_pages > 0:
+            directory = tempfile.mkdtemp()
+            try:
+                rbf = os.path.join(directory, "image.rbf")
+                np.random.randint(0, 256, epcs_pages * 256).astype(np.uint8).tofile(rbf)
+                epcs = UniBoardEpcs(unb, nodes = range(nof_nodes))
+
+                start = default_timer()
+                epcs.write_raw_binary_file("user", rbf)
+                results.add("uniboard.epcs.write.time", (default_timer() - start) * 1e3, 'ms')
+
+                start = default_timer()
+                epcs.read_and_verify_raw_binary_file("user", rbf)
+                results.add("uniboard.epcs.verify.time", (default_timer() - start) * 1e3, 'ms')
+            finally:
+                shutil.rmtree(directory)
+
+        unb.disconnect()
+
+
+def benchmark_roach(results, ip, port, register, iterations = 1000, block_register = None,
+                    block_sizes = DEFAULT_BLOCK_SIZES, min_time = 0.2):
+    """ Benchmark the ROACH control path. There is no KATCP simulator, so a running
+        ROACH (or KATCP server) is required
+    :param results: BenchmarkResults to which metrics are added
+    :param ip: ROACH IP
+    :param port: KATCP port
+    :param register: Single-word register used for latency measurements
+    :param iterations: Number of calls per latency measurement
+    :param block_register: Memory register used for throughput measurements
+    :param block_sizes: Block sizes, in words, for throughput measurements
+    :param min_time: Minimum duration of each throughput measurement, in seconds
+    """
+    roach = Roach(ip = ip, port = port)
+    results.add_latencies("roach.read_register", time_calls(roach.read_register, iterations, register))
+    results.add_latencies("roach.write_register", time_calls(roach.write_register, iterations, register, 1))
+
+    if block_register is not None:
+        for size in [s for s in block_sizes if s <= roach.register_list[block_register]['size']]:
+            buffer = np.zeros(size, dtype = np.uint32)
+            read = time_repeated(roach.read_register, min_time, 3, block_register, size, out = buffer)
+            results.add("roach.read_block.%d.throughput" % size, size * 4 / read / 1e6, 'MB/s', True)
+
+    roach.disconnect()
+
+
+def benchmark_instrument(results, nof_boards = 8, nof_registers = 1000):
+    """ Benchmark start-up of an instrument composed of simulated TPMs, each listening
+        on its own loopback address
+    :param results: BenchmarkResults to which metrics are added
+    :param nof_boards: Number of boards in the instrument
+    :param nof_registers: Number of registers in the memory map loaded on each board
+    """
+    from pyfabil.instruments.instrument import Instrument
+
+    directory = tempfile.mkdtemp()
+    try:
+        memory_map = os.path.join(directory, "tpm.xml")
+        generate_memory_map(memory_map, nof_registers, 1024)
+
+        with UCPSimulator() as simulator:
+            boards = [simulator.add_board(ip = "127.0.0.%d" % (i + 1), memory_map = memory_map)
+                      for i in range(nof_boards)]
+
+            config = os.path.join(directory, "instrument.xml")
+            with open(config, 'w') as f:
+                f.write("<instrument>\n   <boards>\n")
+                for i, board in enumerate(boards):
+                    f.write('      <TPM id="tpm%d" ip="127.0.0.%d" port="%d" firmware="%s" simulator="True"/>\n' %
+                            (i, i + 1, board.port, memory_map))
+                f.write("   </boards>\n</instrument>\n")
+
+            start = default_timer()
+            instrument = Instrument(config)
+            results.add("instrument.startup.%d.time" % nof_boards, (default_timer() - start) * 1e3, 'ms')
+            instrument.close()
+    finally:
+        shutil.rmtree(directory)
+
+
+def run_benchmarks(tpm = True, uniboard = True, instrument = True, roach = None, iterations = 2000,
+                   block_sizes = DEFAULT_BLOCK_SIZES, nof_boards = 8, min_time = 0.2, latency = 0):
+    """ Run control path benchmarks. Benchmarks which fail are logged and skipped
+    :param tpm: Run TPM benchmarks
+    :param uniboard: Run UniBoard benchmarks
+    :param instrument: Run instrument start-up benchmark
+    :param roach: Dictionary of benchmark_roach arguments (ip, port, register, block_register), None to skip
+    :param iterations: Number of calls per latency measurement
+    :param block_sizes: Block sizes, in words, for throughput measurements
+    :param nof_boards: Number of boards in the instrument start-up benchmark
+    :param min_time: Minimum duration of each throughput measurement, in seconds
+    :param latency: Reply latency of the simulated TPM and UniBoard nodes, in seconds
+    :return: BenchmarkResults
+    """
+    results = BenchmarkResults({'iterations': iterations, 'block_sizes': block_sizes, 'nof_boards': nof_boards,
+                                'latency': latency})
+
+    benchmarks = []
+    if tpm:
+        benchmarks.append(("TPM", benchmark_tpm, dict(iterations = iterations, block_sizes = block_sizes,
+                                                      min_time = min_time, latency = latency)))
+    if uniboard:
+        benchmarks.append(("UniBoard", benchmark_uniboard, dict(iterations = iterations / 2, block_sizes = block_sizes,
+                                                                min_time = min_time, latency = latency)))
+    if roach is not None:
+        kwargs = dict(iterations = iterations / 2, block_sizes = block_sizes, min_time = min_time)
+        kwargs.update(roach)
+        benchmarks.append(("ROACH", benchmark_roach, kwargs))
+    if instrument:
+        benchmarks.append(("Instrument", benchmark_instrument, dict(nof_boards = nof_boards)))
+
+    for name, benchmark, kwargs in benchmarks:
+        logging.info("Running %s benchmarks" % name)
+        try:
+            benchmark(results, **kwargs)
+        except Exception as e:
+            logging.error("%s benchmarks failed (%s)" % (name, str(e)))
+
+    return results
@@ -0,0 +1,145 @@
+from collections import namedtuple
+from timeit import default_timer
+import numpy as np
+import platform
+import json
+import time
+
+from pyfabil.base.definitions import *
+
+# Outcome of comparing a metric against its baseline
+Comparison = namedtuple('Comparison', ['name', 'baseline', 'current', 'change', 'unit', 'regressed'])
+
+
+def percentiles(samples, points = (50, 90, 99)):
+    """ Compute percentiles of a list of samples
+    :param samples: List or array of samples
+    :param points: Percentiles to compute
+    :return: Dictionary of percentile values, keyed by 'p<point>'
+    """
+    values = np.percentile(np.asarray(samples, dtype = np.float64), points)
+    return dict([("p%d" % point, float(value)) for point, value in zip(points, values)])
+
+
+def time_calls(func, iterations, *args, **kwargs):
+    """ Time individual calls to a function
+    :param func: Function to call
+    :param iterations: Number of calls
+    :return: numpy array of call durations, in seconds
+    """
+    durations = np.zeros(iterations, dtype = np.float64)
+    for i in range(iterations):
+        start = default_timer()
+        func(*args, **kwargs)
+        durations[i] = default_timer() - start
+    return durations
+
+
+def time_repeated(func, min_time = 0.2, min_iterations = 3, *args, **kwargs):
+    """ Call a function repeatedly until a minimum amount of time has passed
+    :param func: Function to call
+    :param min_time: Minimum total duration, in seconds
+    :param min_iterations: Minimum number of calls
+    :return: Mean duration of a call, in seconds
+    """
+    iterations = 0
+    start = default_timer()
+    while True:
+        func(*args, **kwargs)
+        iterations += 1
+        elapsed = default_timer() - start
+        if iterations >= min_iterations and elapsed >= min_time:
+            return elapsed / iterations
+
+
+class BenchmarkResults(object):
+    """ Collection of benchmark metrics. Each metric has a value, a unit and a direction
+        which determines whether an increase is a regression """
+
+    def __init__(self, metadata = None):
+        """ Class constructor
+        :param metadata: Dictionary describing the benchmark run
+        """
+        self.metrics  = {}
+        self.metadata = {'timestamp': time.time(),
+                         'host'     : platform.node(),
+                         'python'   : platform.python_version(),
+                         'numpy'    : np.__version__}
+        if metadata is not None:
+            self.metadata.update(metadata)
+
+    def add(self, name, value, unit, higher_is_better = False):
+        """ Add metric
+        :param name: Metric name, such as tpm.read_register.latency.p50
+        :param value: Metric value
+        :param unit: Metric unit
+        :param higher_is_better: Whether larger values are an improvement, as for throughput
+        """
+        self.metrics[name] = {'value': float(value), 'unit': unit, 'higher_is_better': higher_is_better}
+
+    def add_latencies(self, name, durations):
+        """ Add latency percentiles and rate of a set of timed calls
+        :param name: Metric name prefix
+        :param durations: Call durations in seconds
+        """
+        for point, value in sorted(percentiles(durations).iteritems()):
+            self.add("%s.latency.%s" % (name, point), value * 1e6, 'us')
+        self.add("%s.rate" % name, len(durations) / np.sum(durations), 'ops/s', higher_is_better = True)
+
+    def save(self, filepath):
+        """ Save results as JSON
+        :param filepath: Output file path
+        """
+        with open(filepath, 'w') as f:
+            json.dump({'metadata': self.metadata, 'metrics': self.metrics}, f, indent = 2, sort_keys = True)
+
+    @staticmethod
+    def load(filepath):
+        """ Load results saved with save
+        :param filepath: JSON file path
+        :return: BenchmarkResults
+        """
+        try:
+            with open(filepath) as f:
+                content = json.load(f)
+        except (IOError, ValueError) as e:
+            raise LibraryError("Could not load benchmark results from %s (%s)" % (filepath, str(e)))
+
+        results = BenchmarkResults()
+        results.metadata = content.get('metadata', {})
+        results.metrics  = content.get('metrics', {})
+        return results
+
+    def compare(self, baseline, threshold = 0.1):
+        """ Compare metrics with a baseline. Only metrics present in both are compared
+        :param baseline: BenchmarkResults to compare against
+        :param threshold: Relative change in the worse direction above which a metric has regressed
+        :return: List of Comparison, sorted by metric name
+        """
+        comparisons = []
+        for name in sorted(set(self.metrics.keys()) & set(baseline.metrics.keys())):
+            current, reference = self.metrics[name], baseline.metrics[name]
+            if reference['value'] == 0:
+                change = 0.0
+            else:
+                change = (current['value'] - reference['value']) / abs(reference['value'])
+            worse = -change if current['higher_is_better'] else change
+            comparisons.append(Comparison(name, reference['value'], current['value'], change,
+                                          current['unit'], worse > threshold))
+        return comparisons
+
+    def __str__(self):
+        return '\n'.join(["%-60s %14.3f %s" % (name, metric['value'], metric['unit'])
+                          for name, metric in sorted(self.metrics.iteritems())])
+
+
+def format_comparison(comparisons):
+    """ Format comparisons as a table
+    :param comparisons: List of Comparison
+    :return: String
+    """
+    lines = []
+    for c in comparisons:
+        lines.append("%-60s %14.3f %14.3f %+8.1f%% %-6s %s" % (c.name, c.baseline, c.current, c.change * 100,
+                                                                c.unit, "REGRESSED" if c.regressed else ""))
+    return '\n'.join(lines)
@@ -0,0 +1,137 @@
+from pyfabil.boards.fpgaboard import FPGABoard
+from pyfabil.boards.tpm import TPM
+from pyfabil.base.definitions import *
+from concurrent import futures
+
+
+def gather(pending, timeout = None):
+    """ Wait for futures to complete and return their results
+    :param pending: List of futures
+    :param timeout: Maximum time to wait in seconds, None to wait indefinitely
+    :return: List of results, in the order of the futures. The exception of the first
+             failed future, in that order, is raised
+    """
+    done, not_done = futures.wait(pending, timeout = timeout)
+    if len(not_done) > 0:
+        raise futures.TimeoutError("%d of %d operations did not complete" % (len(not_done), len(pending)))
+    return [f.result() for f in pending]
+
+
+class AsyncFPGABoard(object):
+    """ Non-blocking facade for an FPGABoard. Operations are performed on a dedicated I/O
+        thread for the board and return futures, such that a single thread can keep many
+        operations outstanding on many boards. Operations on a board are performed in the
+        order in which they were submitted, while different boards are accessed concurrently
+        as calls into the library release the interpreter lock """
+
+    def __init__(self, board):
+        """ Class constructor
+        :param board: FPGABoard instance
+        """
+        if not isinstance(board, FPGABoard):
+            raise LibraryError("AsyncFPGABoard requires an FPGABoard instance")
+
+        self.board = board
+        self._executor = futures.ThreadPoolExecutor(max_workers = 1)
+
+    def submit(self, func, *args, **kwargs):
+        """ Schedule a call on the board's I/O thread
+        :param func: Function to call
+        :return: Future
+        """
+        return self._executor.submit(func, *args, **kwargs)
+
+    def connect(self, ip, port, window_size = None):
+        """ Connect to board
+        :return: Future
+        """
+        return self.submit(self.board.connect, ip, port, window_size)
+
+    def disconnect(self):
+        """ Disconnect from board, once pending operations are complete
+        :return: Future
+        """
+        return self.submit(self.board.disconnect)
+
+    def load_firmware(self, *args, **kwargs):
+        """ Load firmware, with the arguments of the board's load_firmware
+        :return: Future
+        """
+        return self.submit(self.board.load_firmware, *args, **kwargs)
+
+    def read_register(self, register, n = 1, offset = 0, device = None, **kwargs):
+        """ Read register
+        :return: Future resolving to the register value(s)
+        """
+        return self.submit(self.board.read_register, register, n, offset, device, **kwargs)
+
+    def write_register(self, register, values, offset = 0, device = None):
+        """ Write register
+        :return: Future
+        """
+        return self.submit(self.board.write_register, register, values, offset, device)
+
+    def read_address(self, address, n = 1, **kwargs):
+        """ Read from memory address
+        :return: Future resolving to the value(s)
+        """
+        return self.submit(self.board.read_address, address, n, **kwargs)
+
+    def write_address(self, address, values):
+        """ Write to memory address
+        :return: Future
+        """
+        return self.submit(self.board.write_address, address, values)
+
+    def read_device(self, device, address):
+        """ Read from SPI device
+        :return: Future resolving to the value
+        """
+        return self.submit(self.board.read_device, device, address)
+
+    def write_device(self, device, address, value):
+        """ Write to SPI device
+        :return: Future
+        """
+        return self.submit(self.board.write_device, device, address, value)
+
+    def close(self, wait = True):
+        """ Stop the I/O thread. Operations which are already submitted are performed
+        :param wait: Wait for pending operations to complete
+        """
+        self._executor.shutdown(wait = wait)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+        return False
+
+
+class AsyncTPM(AsyncFPGABoard):
+    """ Non-blocking facade for a TPM. Connecting is itself performed on the I/O thread,
+        so a station can be brought up by creating all tiles before waiting on any of them """
+
+    def __init__(self, **kwargs):
+        """ Class constructor, accepts the arguments of TPM. If ip and port are specified the
+            connection is scheduled immediately, and can be waited on through the connected future
+        """
+        ip, port = kwargs.pop('ip', None), kwargs.pop('port', None)
+        super(AsyncTPM, self).__init__(TPM(**kwargs))
+
+        self.connected = None
+        if ip is not None and port is not None:
+            self.connected = self.connect(ip, port, kwargs.get('window_size', None))
+
+    def download_firmware(self, device, bitfile, **kwargs):
+        """ Download bitfile to FPGA
+        :return: Future
+        """
+        return self.submit(self.board.download_firmware, device, bitfile, **kwargs)
+
+    def get_firmware_list(self, device = Device.Board):
+        """ Get list of firmware on the board
+        :return: Future resolving to the firmware list
+        """
+        return self.submit(self.board.get_firmware_list, device)
@@ -1,6 +1,7 @@
 # noinspection PyUnresolvedReferences
 from pyfabil.plugins import *
 from pyfabil.base.interface import *
+import threading
 import inspect
 import logging
 import sys
@@ -8,6 +9,9 @@ import re
 
 # --------------- Helpers ------------------------------
 from pyfabil.plugins.firmwareblock import FirmwareBlock
+from pyfabil.base.transaction import Transaction
+from pyfabil.base.register import RegisterHandle, ShadowCache, ReadCache
+from pyfabil.base.utils import synchronised
 
 DeviceNames = { Device.Board  : "Board", Device.FPGA_1 : "FPGA 1", Device.FPGA_2 : "FPGA 2",
                 Device.FPGA_3 : "FPGA 3", Device.FPGA_4 : "FPGA 4", Device.FPGA_5 : "FPGA 5",
@@ -32,6 +36,21 @@ class FPGABoard(object):
         self.id            = None
         self._logger       = None
         self._string_id    = "Board"
+        self._window_size  = None
+
+        # Register handles are cached per register list version
+        self._register_handles      = {}
+        self._register_list_version = 0
+
+        # Optional shadow cache of register words
+        self._shadow = None
+
+        # Optional read cache of register words
+        self._read_cache = None
+
+        # Serialises board access between threads, such as a StatisticsMonitor and its caller.
+        # Hold it to perform a sequence of accesses without other threads interleaving
+        self.lock = threading.RLock()
 
         # Override to make this compatible with IPython
         self.__methods__        = None
@@ -66,6 +85,9 @@ class FPGABoard(object):
         # Check if filepath is included in arguments
         filepath = kwargs.get('library', None)
 
+        # Number of packets kept in flight, None uses library default
+        self._window_size = kwargs.get('window_size', None)
+
         # Initialise library
         initialise_library(filepath)
 
@@ -308,10 +330,11 @@ class FPGABoard(object):
 
     # ---------------------------- FPBA Board functionality --------------------------
 
-    def connect(self, ip, port):
+    def connect(self, ip, port, window_size = None):
         """ Connect to board
         :param ip: Board IP
         :param port: Port to connect to
+        :param window_size: Number of packets kept in flight for multi-packet transfers
         """
 
         # Check if IP is valid, and if a hostname is provided, check whether it
@@ -326,7 +349,9 @@ class FPGABoard(object):
                 raise BoardError("Provided IP address (%s) is invalid or does not exist")
 
         # Connect to board
-        board_id = call_connect_board(self._fpga_board.value, ip, port)
+        if window_size is not None:
+            self._window_size = window_size
+        board_id = call_connect_board(self._fpga_board.value, ip, port, self._window_size)
         if board_id == 0:
             self.status[Device.Board] = Status.NetworkError
             raise BoardError("Could not connect to board with ip %s" % ip)
@@ -335,6 +360,59 @@ class FPGABoard(object):
             self.id = board_id
             self.status[Device.Board] = Status.OK
 
+    def set_window_size(self, window_size):
+        """ Set the number of packets kept in flight for multi-packet transfers
+        :param window_size: Maximum number of packets in flight, 1 disables pipelining
+        """
+
+        # Check if board is connected
+        if self.id is None:
+            raise LibraryError("Cannot set window size on board which is not connected")
+
+        if call_set_window_size(self.id, window_size) != Error.Success:
+            raise BoardError("Failed to set window size %s" % str(window_size))
+
+        self._window_size = window_size
+
+    def set_timeout_policy(self, timeout, max_timeout = None, max_retries = 3):
+        """ Set reply timeout policy. The timeout is doubled every time a reply is
+            not received in time, up to max_timeout, and lost requests are re-sent
+            at most max_retries times before the operation fails
+        :param timeout: Reply timeout in seconds
+        :param max_timeout: Maximum reply timeout in seconds, defaults to 8 times the timeout
+        :param max_retries: Maximum number of times a lost request is re-sent
+        """
+
+        # Check if board is connected
+        if self.id is None:
+            raise LibraryError("Cannot set timeout policy on board which is not connected")
+
+        if max_timeout is None:
+            max_timeout = timeout * 8
+
+        # Library expects microseconds
+        ret = call_set_timeout_policy(self.id, int(timeout * 1e6), int(max_timeout * 1e6), max_retries)
+        if ret != Error.Success:
+            raise BoardError("Failed to set timeout policy (timeout %s, max_timeout %s)" % (str(timeout), str(max_timeout)))
+
+    def get_link_statistics(self, reset = False):
+        """ Get communication statistics for board. Latency histogram bin i counts
+            replies received within [2^i, 2^(i+1)) microseconds of their request
+        :param reset: Clear statistics after reading them
+        :return: Dictionary of packet, retry, timeout, duplicate and failure counters and latency histogram
+        """
+
+        # Check if board is connected
+        if self.id is None:
+            raise LibraryError("Cannot get link statistics from board which is not connected")
+
+        stats = call_get_link_statistics(self.id, reset)
+        if stats is None:
+            raise BoardError("Failed to get link statistics")
+
+        return stats
+
+    @synchronised
     def disconnect(self):
         """ Disconnect from board """
 
@@ -342,9 +420,14 @@ class FPGABoard(object):
         if self.id is None:
             self._logger.warn(self.log("Call disconnect on board which was not connected"))
 
+        # Unflushed writes would otherwise be dropped with the shadow cache
+        if self.id is not None:
+            self.flush()
+
         ret = call_disconnect_board(self.id)
         if ret == Error.Success:
             self.register_list = None
+            self._invalidate_register_handles()
             self.unload_all_plugins()
             self._logger.info(self.log("Disconnected from board with ID %s" % self.id))
             self.id = None
@@ -377,6 +460,7 @@ class FPGABoard(object):
 
         return self._firmwareList
 
+    @synchronised
     def load_firmware(self, device, filepath = None, load_values = False, base_address = 0):
         """ Blocking call to load firmware
          :param device: Device on board to load firmware to
@@ -396,6 +480,9 @@ class FPGABoard(object):
         if not type(device) is Device:
             raise LibraryError("Device argument for load_firmware should be of type Device")
 
+        # Unflushed writes refer to the firmware being replaced
+        self.flush()
+
         # All OK, call function
         self.status[device] = Status.LoadingFirmware
         err = call_load_firmware(self.id, device, filepath, base_address)
@@ -419,6 +506,7 @@ class FPGABoard(object):
         """
         raise LibraryError("Download firmware not implemented")
 
+    @synchronised
     def get_register_list(self, reset = False, load_values = False):
         """ Get list of registers
         :param load_values: Load register values
@@ -428,13 +516,16 @@ class FPGABoard(object):
         if self.register_list is not None and not reset:
             return self.register_list
 
-        # Check if device is programmed
-        # TODO: Make this compatible with UniBoard
-        if not self._programmed[Device.Board]:
+        # Check if any device is programmed
+        if not any(self._programmed.values()):
            raise LibraryError("Cannot get_register_list from board which has not been programmed")
 
+        # Send unflushed writes before the shadow cache is dropped along with the old register list
+        self.flush()
+
         # Call function
         self.register_list = call_get_register_list(self.id, load_values)
+        self._invalidate_register_handles()
         self._logger.debug(self.log("Called get_register_list on board"))
 
         # All done, return
@@ -454,12 +545,15 @@ class FPGABoard(object):
         # All done, return
         return self._deviceList
 
-    def read_register(self, register, n = 1, offset = 0, device = None):
+    @synchronised
+    def read_register(self, register, n = 1, offset = 0, device = None, as_array = False, out = None):
         """" Get register value
          :param register: Register name
          :param n: Number of words to read
          :param offset: Memory address offset to read from
          :param device: Device/node can be explicitly specified
+         :param as_array: Return values as a numpy.uint32 array
+         :param out: numpy.uint32 array to write values into
          :return: Values
          """
 
@@ -467,6 +561,14 @@ class FPGABoard(object):
         if not self._checks(device):
             return
 
+        # When the shadow or read cache is enabled, registers are accessed through their handle
+        if self._shadow is not None or self._read_cache is not None:
+            handle = self.register(register, device)
+            if handle._direct:
+                return handle.read(n, offset, as_array, out)
+            if self._read_cache is not None:
+                self._read_cache.bypassed += 1
+
         # Extract device from register name
         if device is None:
             device = self._get_device(register)
@@ -478,28 +580,46 @@ class FPGABoard(object):
         if not type(device) is Device:
             raise LibraryError("Device argument for read_register should be of type Device")
 
-        # Call function
-        if self.register_list[register]['type'] == RegisterType.FifoRegister:
-            values = call_read_fifo_register(self.id, device, self._remove_device(register), n)
+        # Values are read directly into the output array, or into a pooled buffer. FIFO
+        # registers are handled by the library
+        if out is not None:
+            buf = check_buffer(out, n)
+        elif as_array:
+            buf = np.empty(n, dtype = np.uint32)
         else:
-            values = call_read_register(self.id, device, self._remove_device(register), n, offset)
+            buf = get_buffer(n)
 
+        err = call_read_register_into(self.id, device, self._remove_device(register), buf, n, offset)
         self._logger.debug(self.log("Called read_register"))
 
         # Check if value succeeded, otherwise return
-        if values.error == Error.Failure.value:
+        if err == Error.Failure:
             raise BoardError("Failed to read_register %s from board" % register)
 
         # Read succeeded, wrap data and return
-        valptr = ctypes.cast(values.values, ctypes.POINTER(ctypes.c_uint32))
-
-        self._logger.debug(self.log("Called read_register on board"))
+        if out is not None or as_array:
+            return buf
+        return int(buf[0]) if n == 1 else buf[:n].tolist()
+
+    @synchronised
+    def read_into(self, key, buffer, offset = 0, device = None):
+        """ Read register or memory area into a caller-provided buffer. No memory is
+            allocated for the values, such that monitoring loops can reuse the same buffer
+        :param key: Register name or memory address
+        :param buffer: Contiguous numpy.uint32 array, its size determines the number of words read
+        :param offset: Offset in words from start of register, ignored for addresses
+        :param device: Device/node can be explicitly specified
+        :return: The buffer
+        """
 
-        if n == 1:
-            return valptr[0]
+        if type(key) in [int, long]:
+            return self.read_address(key, buffer.size, out = buffer)
+        elif type(key) is str:
+            return self.read_register(key, buffer.size, offset, device, out = buffer)
         else:
-            return [valptr[i] for i in range(n)]
+            raise LibraryError("Unrecognised key type, must be register name or memory address")
 
+    @synchronised
     def write_register(self, register, values, offset = 0, device = None):
         """ Set register value
          :param register: Register name
@@ -512,6 +632,14 @@ class FPGABoard(object):
         if not self._checks(device):
             return
 
+        # When the shadow or read cache is enabled, registers are accessed through their handle
+        if self._shadow is not None or self._read_cache is not None:
+            handle = self.register(register, device)
+            if handle._direct:
+                return handle.write(values, offset)
+            if self._read_cache is not None:
+                self._read_cache.discard_range(handle.device, handle.address, handle.size)
+
         # Extract device from register name
         if device is None:
             device = self._get_device(register)
@@ -529,33 +657,70 @@ class FPGABoard(object):
         if err == Error.Failure:
             raise BoardError("Failed to write_register %s on board" % register)
 
-    def read_address(self, address, n = 1):
+    @synchronised
+    def read_address(self, address, n = 1, as_array = False, out = None):
         """" Get register value
          :param address: Memory address to read from
          :param n: Number of words to read
+         :param as_array: Return values as a numpy.uint32 array
+         :param out: numpy.uint32 array to write values into
          :return: Values
          """
 
+        # Send unflushed writes to these addresses first
+        if self._shadow is not None and self._shadow.dirty_in_range(None, address, n):
+            self.flush()
+
         # Call function and return
-        ret = call_read_address(self.id, Device.FPGA_1, address, n)
+        ret = call_read_address(self.id, Device.FPGA_1, address, n, as_array, out)
         self._logger.debug(self.log("Called read_address"))
-        if ret == Error.Failure:
+        if ret is Error.Failure:
             raise BoardError("Failed to read_address %s on board" % hex(address))
         else:
             return ret
 
+    @synchronised
     def write_address(self, address, values):
         """ Set register value
          :param address: Memory address to write to
          :param values: Values to write
          """
 
+        # Drop cached copies of these addresses
+        n = len(values) if type(values) in [list, np.ndarray] else 1
+        if self._shadow is not None:
+            self._shadow.discard_range(None, address, n)
+        if self._read_cache is not None:
+            self._read_cache.discard_range(None, address, n)
+
         # Call function and return
         err = call_write_address(self.id, Device.FPGA_1, address, values)
         self._logger.debug(self.log("Called write_address"))
         if err == Error.Failure:
             raise BoardError("Failed to write_address %s on board" % hex(address))
 
+    @synchronised
+    def write_stream(self, address, values):
+        """ Write values to a single address, such as a memory-mapped FIFO. Values are split
+            into packets which are all written to the address in order, one packet at a time.
+            Lost packets are not re-sent, so the whole stream should be repeated on failure
+         :param address: Memory address to write to
+         :param values: List or numpy array of values to write
+         """
+
+        # Drop cached copy of this address
+        if self._shadow is not None:
+            self._shadow.discard_range(None, address)
+        if self._read_cache is not None:
+            self._read_cache.discard_range(None, address)
+
+        # Call function and return
+        err = call_write_stream(self.id, Device.FPGA_1, address, values)
+        self._logger.debug(self.log("Called write_stream"))
+        if err == Error.Failure:
+            raise BoardError("Failed to write_stream %s on board" % hex(address))
+
+    @synchronised
     def read_device(self, device, address):
         """" Get device value
          :param device: SPI Device to read from
@@ -575,6 +740,7 @@ class FPGABoard(object):
         else:
             return ret
 
+    @synchronised
     def write_device(self, device, address, value):
         """ Set device value
         :param device: SPI device to write to
@@ -600,6 +766,166 @@ class FPGABoard(object):
         """
         return call_load_spi_devices(self.id, device, filepath)
 
+    def register(self, register, device = None):
+        """ Get a pre-resolved handle for a register, whose reads and writes go straight
+            to address-level I/O. Handles are cached, so calling this repeatedly is cheap
+        :param register: Register name
+        :param device: Device/node can be explicitly specified
+        :return: RegisterHandle
+        """
+
+        # Check if handle was already created
+        handle = self._register_handles.get((register, device), None)
+        if handle is not None:
+            return handle
+
+        # Perform basic checks
+        self._checks(None)
+
+        handle = RegisterHandle(self, register, device)
+        self._register_handles[(register, device)] = handle
+        return handle
+
+    @synchronised
+    def enable_shadow_cache(self, write_back = False):
+        """ Keep a client-side copy of register words, such that writing a bitfield does
+            not require the word to be read back from the board first. Words containing
+            read-only or FIFO registers are never cached. Writing to the board through
+            other clients will make the copy stale, use invalidate() when this happens
+        :param write_back: Hold writes in the cache until flush() is called
+        """
+        if self._shadow is not None:
+            self.flush()
+        self._shadow = ShadowCache(write_back)
+
+    @synchronised
+    def disable_shadow_cache(self):
+        """ Flush and drop the shadow cache """
+        if self._shadow is not None:
+            self.flush()
+        self._shadow = None
+
+    @synchronised
+    def flush(self):
+        """ Write all unflushed words held in the shadow cache to the board """
+
+        # Nothing to do
+        if self._shadow is None:
+            return
+
+        dirty = self._shadow.take_dirty()
+        if len(dirty) == 0:
+            return
+
+        # Cached reads of these words are no longer valid
+        if self._read_cache is not None:
+            for (device, address), _ in dirty:
+                self._read_cache.discard_range(device, address)
+
+        # Write all words in a single transaction
+        results = call_execute_transaction(self.id, [(OperationType.WriteAddress, device, None, address, word)
+                                                     for (device, address), word in dirty])
+
+        # Words which could not be written are dropped from the cache
+        failed = []
+        for ((device, address), _), (error, _) in zip(dirty, results):
+            if error != Error.Success:
+                self._shadow.discard_range(device, address)
+                failed.append(hex(address))
+
+        if len(failed) > 0:
+            raise BoardError("Failed to flush shadow cache words at %s" % ', '.join(failed))
+
+    @synchronised
+    def invalidate(self, register = None, device = None):
+        """ Drop cached words from the shadow and read caches, including any unflushed writes
+        :param register: Only drop words of this register, all words are dropped if None
+        :param device: Device/node can be explicitly specified
+        """
+
+        for cache in [self._shadow, self._read_cache]:
+            if cache is None:
+                continue
+            if register is None:
+                cache.clear()
+            else:
+                handle = self.register(register, device)
+                cache.discard_range(handle.device, handle.address, handle.size)
+
+    def get_shadow_cache_statistics(self):
+        """ Get shadow cache usage
+        :return: Dictionary with number of cached words, hits and misses
+        """
+        if self._shadow is None:
+            return None
+        return {'words': len(self._shadow), 'hits': self._shadow.hits, 'misses': self._shadow.misses}
+
+    @synchronised
+    def enable_read_cache(self, ttl = None, rules = None):
+        """ Serve register reads from a client-side cache while their values are fresh, such
+            that the read rate on the control link stays bounded however many monitoring clients
+            poll the board. Each register has a policy: Static registers (firmware information,
+            versions) are kept until written, Slow registers (temperatures, PLL status, sensors)
+            for a short time-to-live, while Volatile registers, the default, and FIFO registers
+            are always read from the board. Writes through this board drop cached words, writes
+            by other clients become visible when the time-to-live expires
+        :param ttl: Dictionary of time-to-live in seconds keyed by CachePolicy, None never expires
+        :param rules: List of (rule, CachePolicy) tuples checked before the default rules. A rule is a
+                      regular expression searched for in the register name, a Permission or a RegisterType
+        """
+        self._read_cache = ReadCache(ttl, rules)
+
+    @synchronised
+    def disable_read_cache(self):
+        """ Drop the read cache """
+        self._read_cache = None
+
+    def get_read_cache_statistics(self):
+        """ Get read cache usage
+        :return: Dictionary with number of cached words, hits, misses and bypassed reads
+        """
+        if self._read_cache is None:
+            return None
+        return self._read_cache.statistics()
+
+    def transaction(self, coalesce = False):
+        """ Create a transaction which collects single-word register, address and SPI device
+            operations, and sends them to the board in a single call when executed. When used
+            as a context manager, the transaction is executed when the block exits
+        :param coalesce: Merge writes to different bitfields of the same word into a single write.
+                         Writes to overlapping bitfields are never merged, so pulses are preserved
+        :return: Transaction
+        """
+
+        # Check if board is connected
+        if self.id is None:
+            raise LibraryError("Cannot perform operation on unconnected board")
+
+        return Transaction(self, coalesce)
+
+    @synchronised
+    def read_many(self, keys):
+        """ Read a list of registers, memory addresses or SPI device tuples in a single call
+        :param keys: List of register names, addresses or (SPI device, address) tuples
+        :return: List of values
+        """
+        transaction = self.transaction()
+        results = [transaction.read(key) for key in keys]
+        transaction.execute()
+        self._logger.debug(self.log("Called read_many"))
+        return [result.value for result in results]
+
+    @synchronised
+    def write_many(self, operations):
+        """ Write to a list of registers, memory addresses or SPI device tuples in a single call
+        :param operations: List of (key, value) tuples
+        """
+        transaction = self.transaction()
+        for key, value in operations:
+            transaction.write(key, value)
+        transaction.execute()
+        self._logger.debug(self.log("Called write_many"))
+
     def list_register_names(self):
         """ Print list of register names """
 
@@ -724,6 +1050,18 @@ class FPGABoard(object):
 
         return True
 
+    def _invalidate_register_handles(self):
+        """ Clear register handle cache when the register list changes. Existing
+            handles re-resolve themselves on their next access """
+        self._register_handles = {}
+        self._register_list_version += 1
+
+        # Cached words refer to the previous register list
+        if self._shadow is not None:
+            self._shadow.clear()
+        if self._read_cache is not None:
+            self._read_cache.clear()
+
     def log(self, string):
         """ Format string for logging output
         :param string: String to log
@@ -739,10 +1077,8 @@ class FPGABoard(object):
             device = name.split('.')[0].upper()
             if device == "BOARD":
                 return Device.Board
-            elif device == "FPGA1":
-                return Device.FPGA_1
-            elif device == "FPGA2":
-                return Device.FPGA_2
+            elif re.match("^FPGA[1-8]$", device):
+                return Device["FPGA_%s" % device[4]]
             else:
                 return None
         except KeyError:
@@ -757,7 +1093,7 @@ class FPGABoard(object):
 
         try:
             device = name.split('.')[0].upper()
-            if device in ["BOARD", "FPGA1", "FPGA2"]:
+            if device == "BOARD" or re.match("^FPGA[1-8]$", device):
                 return '.'.join(name.split('.')[1:])
             else:
                 return name
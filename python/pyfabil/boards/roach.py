@@ -9,15 +9,16 @@ class Roach(FPGABoard):
         kwargs['fpgaBoard'] = BoardMake.RoachBoard
         super(Roach, self).__init__(**kwargs)
 
-    def connect(self, ip, port):
+    def connect(self, ip, port, window_size = None):
         """ Add functionality to connect in order to check whether the
             roach is already programmed
         :param ip: ROACH IP
         :param port: port
+        :param window_size: Not used by KATCP, kept for interface compatibility
         """
 
         # Connect to board
-        super(Roach, self).connect(ip, port)
+        super(Roach, self).connect(ip, port, window_size)
 
         # Check if ROACH is programmed (has any registers loaded)
         self._programmed = {Device.Board : True, Device.FPGA_1 : True }
@@ -51,9 +52,10 @@ class Roach(FPGABoard):
         """ Roach helper for getFirmwareList """
         return super(Roach, self).get_firmware_list(device)
 
-    def read_register(self, register, n = 1, offset = 0, device = Device.FPGA_1):
+    def read_register(self, register, n = 1, offset = 0, device = Device.FPGA_1, as_array = False, out = None):
         """ Roach helper for readRegister """
-        return super(Roach, self).read_register(register, n, offset, device = Device.FPGA_1)
+        return super(Roach, self).read_register(register, n, offset, device = Device.FPGA_1,
+                                                as_array = as_array, out = out)
 
     def write_register(self, register, values, offset = 0, device = Device.FPGA_1):
         """ Roach helper for writeRegister"""
@@ -1,11 +1,15 @@
 import os
-from time import sleep
 import math
-from pyfabil.base.utils import swap32
+from pyfabil.base.utils import swap32, wait_until_all, wait_register, synchronised
+from pyfabil.base.memory_map import MemoryMapCache
+from pyfabil.base.spi import SpiBatch
 from pyfabil.boards.fpgaboard import FPGABoard, DeviceNames
 from pyfabil.base.definitions import *
 from math import ceil
-import binascii
+import numpy as np
+import tempfile
+import struct
+import time
 import zlib
 
 
@@ -25,17 +29,25 @@ class TPM(FPGABoard):
         # Set hardcoded cpld xml offset address
         self._cpld_xml_offset         = 0x80000004
 
+        # On-disk cache for XML memory maps read from the board
+        self._memory_map_cache = MemoryMapCache(kwargs.get('cache_directory', None)) \
+                                 if kwargs.get('memory_map_cache', True) else None
+
+        # Statistics of the last SPI batch
+        self.spi_statistics = {}
+
         # Call superclass initialiser
         super(TPM, self).__init__(**kwargs)
 
-    def connect(self, ip, port):
+    def connect(self, ip, port, window_size = None):
         """ Overload connect method
         :param ip: IP address to connect to
         :param port: Port to connect to
+        :param window_size: Number of packets kept in flight for multi-packet transfers
         """
 
         # Call connect on super class
-        super(TPM, self).connect(ip, port)
+        super(TPM, self).connect(ip, port, window_size)
 
         # Load CPLD XML file from the board if not simulating
         if (not self._simulator) and self.id is not None:
@@ -71,14 +83,23 @@ class TPM(FPGABoard):
         # All done, return
         return firmware
 
-    def download_firmware(self, device, bitfile):
-        """ Download bitfile to FPGA
-        :param device: FPGA to download bitfile
-        :param bifile: Bitfile to download
+    @synchronised
+    def download_firmware(self, device, bitfile, block_size = 1 << 20, progress = None):
+        """ Download bitfile to FPGA. The bitfile is memory-mapped and streamed to the
+            programming FIFO in blocks, so it is never loaded in memory as a whole. All
+            specified FPGAs are programmed concurrently from the same stream
+        :param device: FPGA, or list of FPGAs, to download bitfile to
+        :param bitfile: Bitfile to download
+        :param block_size: Number of bytes written between progress updates
+        :param progress: Function called with the number of bytes written and the bitfile size
         """
 
+        devices = device if type(device) is list else [device]
+        if len(devices) == 0 or any([d not in [Device.FPGA_1, Device.FPGA_2] for d in devices]):
+            raise LibraryError("Firmware can only be downloaded to FPGA_1 and FPGA_2")
+
         # Temporary
-        xil_registers    = [0x50000004, 0x50000008]
+        xil_registers   = [0x50000004 if d == Device.FPGA_1 else 0x50000008 for d in devices]
         global_register = 0x50000000
         fifo_register   = 0x50001000
 
@@ -87,41 +108,44 @@ class TPM(FPGABoard):
             if self[xil_register] & 0x1 != 0:
                 self[xil_register] = 0x10  # Select FPGA
                 self[global_register] = 0x1  # PROG = 0
-                while self[xil_register] & 0x1 == 1:
-                    sleep(0.1)
+                wait_register(self, xil_register, 0x0, mask = 0x1, timeout = 30, name = "tpm.fpga_erase")
                 self[global_register] = 0x3
-                while self[xil_register] & 0x1 == 0:
-                    sleep(0.1)
+                wait_register(self, xil_register, 0x1, mask = 0x1, timeout = 30, name = "tpm.fpga_init")
                 self[xil_register] = 0x0
 
-        # Read bistream
-        with open(bitfile, "rb") as fp:
-            data  = fp.read()
+        # Memory-map bitstream. Each group of four bytes is a little endian word, so
+        # words can be used in place on little endian hosts
+        num_words = os.path.getsize(bitfile) / 4
+        if num_words == 0:
+            raise LibraryError("Bitfile %s is empty" % bitfile)
+        data = np.memmap(bitfile, dtype = np.dtype('<u4'), mode = 'r', shape = (num_words,))
 
         for xil_register in xil_registers:
             self[xil_register] = 0x10
         self[global_register] = 0x2
 
-        # Group bytes into word and correct endiannes of bitfile content
-        formatted_data = [(ord(d) << 24 | ord(c) << 16 | ord(b) << 8 | ord(a))  for (a, b, c, d) in zip(*[iter(data)]*4)]
+        # Write bitfile to FPGA, one block at a time
+        words_per_block = max(block_size / 4, 1)
+        start = time.time()
+        for offset in range(0, num_words, words_per_block):
+            block = data[offset : offset + words_per_block]
+            self.write_stream(fifo_register, block if block.dtype.isnative else block.astype(np.uint32))
+            if progress is not None:
+                progress(min(offset + words_per_block, num_words) * 4, num_words * 4)
+        elapsed = time.time() - start
+        del data
 
-        # Write bitfile to FPGA
-        packet_size = 256
-        num = int(math.floor(len(formatted_data) / float(packet_size)))
-        for i in range(num):
-            self[fifo_register] = formatted_data[i * packet_size : i * packet_size + packet_size]
-        self[fifo_register] = formatted_data[num * packet_size:]
+        self._logger.info(self.log("Downloaded %d bytes from %s in %.2fs (%.2f MB/s)" %
+                                   (num_words * 4, bitfile, elapsed, num_words * 4 / (max(elapsed, 1e-6) * 1e6))))
 
-        # Wait for operation to complete
-        for xil_register in xil_registers:
-            while self[xil_register] & 0x10 == 0:
-                sleep(0.1)
+        # Wait for all FPGAs to complete configuration
+        wait_until_all([lambda r = xil_register: self[r] & 0x10 != 0 for xil_register in xil_registers],
+                       timeout = 30, name = "tpm.fpga_done")
 
         self[global_register] = 0x3
         for xil_register in xil_registers:
             self[xil_register] = 0x0
 
-
     def load_firmware(self, device, filepath = None, load_values = False):
         """ Override uperclass load_firmware to extract memory map from the bitfile
             This is saved in a tmp directory and forwarded to the superclass for
@@ -152,22 +176,25 @@ class TPM(FPGABoard):
             if not self.register_list.has_key(register):
                 raise LibraryError("CPLD XML file must be loaded prior to loading firmware")
 
-            # Get XML file offset and read XML file from board
-            zipped_xml = self._get_xml_file(self[register])
+            # Firmware design and version, if available, identify the XML file in the memory map cache
+            name = 'fpga1' if device == Device.FPGA_1 else 'fpga2'
+            info = [p for p in getattr(self, 'tpm_firmware_information', []) if p.get_firmware_number() == loaded]
+            if len(info) != 0 and info[0].get_design():
+                name = "%s_%s_%d.%d" % (name, info[0].get_design(), info[0].get_major_version(),
+                                        info[0].get_minor_version())
 
-            # Process
-            filepath = "/tmp/file.xml"
-            with open(filepath, "w") as f:
-                # Add necessary XML and write to file
-                f.write("%s%s%s" % ('<node>\n', zipped_xml.replace('id="tpm_test"', 'id="fpga1"'), "</node>"))
-                f.flush()
+            # Get XML file from cache or board, adding necessary XML
+            filepath, temporary = self._get_memory_map(
+                self[register], name,
+                lambda xml: "%s%s%s" % ('<node>\n', xml.replace('id="tpm_test"', 'id="fpga1"'), "</node>"))
 
-                # Call superclass with this file
+            # Call superclass with this file
+            try:
                 super(TPM, self).load_firmware(device = device, filepath = filepath,
                                                base_address = base_address, load_values = load_values)
-
-                # Delete file
-		os.remove(filepath)
+            finally:
+                if temporary:
+                    os.remove(filepath)
         else:
             # Check if file exists
             if not os.path.exists(filepath):
@@ -175,7 +202,7 @@ class TPM(FPGABoard):
 
             # If file is an XML file, call superclass method directly, otherwise assume that it's a
             # bistream and load bitstream to FPGA first
-            if not filepath.endswidth(".xml"):
+            if not filepath.endswith(".xml"):
 
                 # Check that we're trying to program an FPGA not the CPLD
                 if device not in [Device.Board, Device.FPGA_1, Device.FPGA_2]:
@@ -184,50 +211,55 @@ class TPM(FPGABoard):
             # Call load firmware method on super class
             super(TPM, self).load_firmware(device = device, filepath = filepath, load_values = load_values)
 
+    @synchronised
+    def spi_batch(self, device, operations, verify = False):
+        """ Perform a sequence of SPI device operations with few round trips
+        :param device: SPI device name
+        :param operations: List of operations (see pyfabil.base.spi), (address, value) tuples being writes
+        :param verify: Read back all written registers at the end of the batch and check their values
+        :return: List of values returned by read operations
+        """
+        batch = SpiBatch(self)
+        try:
+            return batch.run(device, operations, verify = verify)
+        finally:
+            self.spi_statistics = batch.statistics
+            self._logger.debug(self.log("Called spi_batch on %s (%d accesses, %d polls, %.3fs)" %
+                                        (device, batch.statistics.get('accesses', 0),
+                                         batch.statistics.get('polls', 0), batch.statistics.get('elapsed', 0))))
+
     def _initialise_board(self):
         """ Initialise the TPM board """
 
-        # Get XML file
-        cpld_xml =  self._get_xml_file(self.read_address(self._cpld_xml_offset))
-
-        # Process XML file
-        filepath = "/tmp/cpld.xml"
-        with open(filepath, "w") as f:
-            # Add necessary XML and write to temporary file
-            cpld_xml = "%s%s%s" % ('<node>\n', cpld_xml, "</node>")
-            f.write(cpld_xml)
-            f.flush()
+        # Get CPLD XML file from cache or board, adding necessary XML
+        filepath, temporary = self._get_memory_map(self.read_address(self._cpld_xml_offset), 'cpld',
+                                                   lambda xml: "%s%s%s" % ('<node>\n', xml, "</node>"))
 
-            # Initialise memory map
-            try:
-                super(TPM, self).load_firmware(device = Device.Board, filepath = filepath)
-            except:
-                raise LibraryError("Failed to load CPLD XML file from TPM")
-
-            # Remove file
-	    os.remove(filepath)
+        # Initialise memory map
+        try:
+            super(TPM, self).load_firmware(device = Device.Board, filepath = filepath)
+        except:
+            raise LibraryError("Failed to load CPLD XML file from TPM")
+        finally:
+            if temporary:
+                os.remove(filepath)
 
         # Load SPI file, if exists
         if self.register_list.has_key('board.info.spi_xml_offset'):
 
-            # Get SPI XML file
-            spi_xml = self._get_xml_file(self.read_register("board.info.spi_xml_offset"))
-
-            # Write to file
-            spi_filepath = '/tmp/spi.xml'
-            with open(spi_filepath, 'w') as sf:
-                sf.write(spi_xml)
-                sf.flush()
+            # Get SPI XML file from cache or board
+            spi_filepath, temporary = self._get_memory_map(self.read_register("board.info.spi_xml_offset"), 'spi')
 
-                # Load XML devices on board
+            # Load XML devices on board
+            try:
                 if self.load_spi_devices(Device.Board, spi_filepath) == Error.Failure:
                     raise LibraryError("Failed to process SPI XML file")
+            finally:
+                if temporary:
+                    os.remove(spi_filepath)
 
-                # Update device list
-                self.get_device_list(reset = True)
-
-                # Delete file
-		os.remove(filepath)
+            # Update device list
+            self.get_device_list(reset = True)
 
         # Update firmware information
         [info.update_information() for info in self.tpm_firmware_information]
@@ -269,11 +301,61 @@ class TPM(FPGABoard):
         xml_len = self.read_address(xml_offset)
 
         # Read XML file from board
-        zipped_xml = self.read_address(xml_offset + 4, int(ceil(xml_len / 4.0)))
+        zipped_xml = self.read_address(xml_offset + 4, int(ceil(xml_len / 4.0)), as_array = True)
+
+        # Convert to string (words are stored big endian), decompress and return
+        return zlib.decompress(zipped_xml.astype('>u4').tostring()[:xml_len])
+
+    def _get_xml_checksum(self, xml_offset):
+        """ Get length and checksum of XML file stored on board. The compressed file
+            ends with the Adler-32 checksum of the XML file, so only the length and
+            last words need to be read
+        :param xml_offset: Memory offset where XML file is stored
+        :return: Length of compressed XML file and checksum
+        """
+        xml_len = self.read_address(xml_offset)
+        if xml_len < 4:
+            raise LibraryError("Invalid XML file length %d at offset %s" % (xml_len, hex(xml_offset)))
 
-        # Convert to string, decompress and return
-        zipped_xml = ''.join([format(n, '08x') for n in zipped_xml])
-        return  zlib.decompress(binascii.unhexlify(zipped_xml[: 2 * xml_len]))
+        # Read the (one or two) words containing the checksum
+        first, last = (xml_len - 4) / 4, (xml_len - 1) / 4
+        words = self.read_address(xml_offset + 4 + first * 4, last - first + 1)
+        words = words if type(words) is list else [words]
+
+        data = struct.pack('>%dI' % len(words), *words)
+        start = xml_len - 4 - first * 4
+        return xml_len, struct.unpack('>I', data[start : start + 4])[0]
+
+    def _get_memory_map(self, xml_offset, name, process = None):
+        """ Get XML file stored on board as a local file. If the memory map cache contains
+            the file, only its length and checksum are read from the board
+        :param xml_offset: Memory offset where XML file is stored
+        :param name: Name identifying the XML file in the cache
+        :param process: Function applied to the XML file before it is stored
+        :return: File path, and whether it is a temporary file which should be removed after use
+        """
+        if self._memory_map_cache is not None:
+            length, checksum = self._get_xml_checksum(xml_offset)
+            filepath = self._memory_map_cache.get(name, length, checksum)
+            if filepath is not None:
+                return filepath, False
+
+        # Read XML file from board
+        xml = self._get_xml_file(xml_offset)
+        if process is not None:
+            xml = process(xml)
+
+        # Store in cache
+        if self._memory_map_cache is not None:
+            filepath = self._memory_map_cache.put(name, length, checksum, xml)
+            if filepath is not None:
+                return filepath, False
+
+        # Cache not available, use temporary file
+        fd, filepath = tempfile.mkstemp(suffix = '.xml')
+        with os.fdopen(fd, 'w') as f:
+            f.write(xml)
+        return filepath, True
 
     ####################### Methods for syntax candy ###########################
 
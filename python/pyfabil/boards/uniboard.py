@@ -2,6 +2,34 @@ from pyfabil.boards.fpgaboard import FPGABoard, DeviceNames
 from pyfabil.base.interface import *
 from concurrent import futures
 from math import log
+import numpy as np
+
+
+class NodeExecutor(object):
+    """ Long-lived worker threads for the nodes of a UniBoard. Each node has its own
+        worker, such that requests to a node are performed in the order in which they
+        were submitted while requests to different nodes are performed concurrently """
+
+    def __init__(self, nodes):
+        """ Class constructor
+        :param nodes: List of node devices
+        """
+        self._workers = dict([(node, futures.ThreadPoolExecutor(max_workers = 1)) for node in nodes])
+
+    def submit(self, node, func, *args, **kwargs):
+        """ Schedule a call on a node's worker
+        :param node: Node device
+        :param func: Function to call
+        :return: Future
+        """
+        return self._workers[node].submit(func, *args, **kwargs)
+
+    def shutdown(self, wait = True):
+        """ Stop all workers
+        :param wait: Wait for pending requests to complete
+        """
+        for worker in self._workers.itervalues():
+            worker.shutdown(wait = wait)
 
 
 class UniBoard(FPGABoard):
@@ -46,12 +74,15 @@ class UniBoard(FPGABoard):
         for k, v in self.nodes.iteritems():
             self._device_node_map[v['device']] = k
 
+        # Node workers, started when connected to the board
+        self._node_executor = None
+
         # Call super class initialiser
         kwargs['fpgaBoard'] = BoardMake.UniboardBoard
         super(UniBoard, self).__init__(**kwargs)
 
         # Nodes on the UniBoard are always programmed
-        self._programmed = True
+        self._programmed = dict([(device, True) for device in Device])
 
         # Since nodes are always loaded, we can load the register list
         if self.status == Status.OK:
@@ -66,10 +97,11 @@ class UniBoard(FPGABoard):
         self.ST_UNPACK_ERR   = 5
         self.ST_SIZE_ERR     = 6
 
-    def connect(self, ip, port):
+    def connect(self, ip, port, window_size = None):
         """ Connect to board
         :param ip: Board IP
         :param port: Port to connect to
+        :param window_size: Number of packets kept in flight for multi-packet transfers
         """
 
         # Check if IP is valid, and if a hostname is provided, check whether it
@@ -84,7 +116,9 @@ class UniBoard(FPGABoard):
                 raise BoardError("Provided IP address (%s) is invalid or does not exist")
 
         # Connect to board
-        board_id = call_connect_board(self._fpga_board.value, ip, port)
+        if window_size is not None:
+            self._window_size = window_size
+        board_id = call_connect_board(self._fpga_board.value, ip, port, self._window_size)
         if board_id == 0:
             self.status = Status.NetworkError
             raise BoardError("Could not connect to board with ip %s" % ip)
@@ -93,6 +127,18 @@ class UniBoard(FPGABoard):
             self.id = board_id
             self.status = Status.OK
 
+            # Start node workers
+            if self._node_executor is None:
+                self._node_executor = NodeExecutor([v['device'] for v in self.nodes.itervalues()])
+
+    def disconnect(self):
+        """ Disconnect from board, stopping node workers once pending requests complete """
+        if self._node_executor is not None:
+            self._node_executor.shutdown(wait = True)
+            self._node_executor = None
+
+        super(UniBoard, self).disconnect()
+
     def reset(self, nodes):
         """ Override reset board
         :param nodes: nodes to reset """
@@ -147,24 +193,19 @@ class UniBoard(FPGABoard):
             epcs.write_raw_binary_file("user", filepath)
             epcs.read_and_verify_raw_binary_file("user", filepath)
 
-        if len(nodes) == 1:
-            result = [call_load_firmware(self.id, nodes[0], filepath)]
-        else:
-            result = []
-            # Use thread pool to parallelise calls over nodes
-            with futures.ThreadPoolExecutor(max_workers = len(nodes)) as executor:
-                for res in executor.map(lambda p: call_load_firmware(*p), [(self.id, node, filepath) for node in nodes]):
-                    result.append(res)
+        # Load firmware on all nodes concurrently
+        result = [f.result() for f in [self._submit(node, call_load_firmware, self.id, node, filepath)
+                                       for node in nodes]]
 
         # If call succeeded, get register and device list
         if all([r == Error.Success for r in result]):
-            self._programmed = True
+            self._programmed = dict([(device, True) for device in Device])
             self.status = Status.OK
             self.get_register_list()
             self.get_device_list()
             self._logger.info(self.log("Successfully loaded firmware %s on board" % filepath))
         else:
-            self._programmed = False
+            self._programmed = dict([(device, False) for device in Device])
             self.status = Status.LoadingFirmwareError
             raise BoardError("load_firmware failed on board")
 
@@ -183,28 +224,28 @@ class UniBoard(FPGABoard):
         if not self._checks():
             return
 
-        # If list of devices is specified, check whether they are valid and get associated nodes
-        nodes = None
-        if device is not None:
-            nodes = self._get_nodes(device)
-        else:
-            # List of devices not provided, extract device from register name
-            try:
-                device = register.split('.')[0].upper()
-                nodes = self._convert_node_to_device(device)
-            except KeyError:
-                pass
-
-        # Change nodes to list if it is not already a list
-        nodes = nodes if type(nodes) is list else [nodes]
+        # Wait for writes on all nodes
+        failed = []
+        for node, future in self.write_register_async(register, values, offset, device):
+            if future.result() == Error.Failure:
+                failed.append(str(node))
 
-        # Extract device name from register if present
-        if register.find('.') > 0:
-            if register.split('.')[0].upper() in self._names:
-                register = '.'.join(register.split('.')[1:])
+        self._logger.debug(self.log("Called write_register"))
+        if len(failed) > 0:
+            raise BoardError("Failed to write_register %s on nodes %s" % (register, ', '.join(failed)))
+
+    def write_register_async(self, register, values, offset = 0, device = None):
+        """ Write register on nodes without waiting for the writes to complete. Writes are
+            performed by the node workers, so they are ordered with respect to other
+            requests to the same node
+        :param register: The register name, as in write_register
+        :param values:   The value to write to the register
+        :param offset:   Register offset
+        :param device:   List of nodes can be explicitly specified
+        :return: List of (node, future) tuples, each future resolving to Success or Failure
+        """
 
-        # We need at least one node to check the whether the register is fifo or not
-        reg_str = 'fpga%d.%s' % (int(log(nodes[0].value, 2) + 1), register)
+        nodes, register, reg_str = self._resolve_nodes(register, device)
 
         # Check if write length is valid
         if (len(values) if type(values) is list else 1) * 4 + offset > \
@@ -213,33 +254,18 @@ class UniBoard(FPGABoard):
             #raise LibraryError("Too much data to write to register %s on nodes %s" %
             #                   (register, ', '.join([str(node) for node in nodes])))
 
-        result = []
         if self.register_list[reg_str]['type'] == RegisterType.FifoRegister:
             # Write to be performed on a FIFO register
-            if len(nodes) == 1:
-                result.append([call_write_fifo_register(self.id, nodes[0], register, values)])
-            else:
-                # Use thread pool to parallelise calls over nodes
-                with futures.ThreadPoolExecutor(max_workers=len(nodes)) as executor:
-                    for res in executor.map(lambda p: call_write_fifo_register(*p),
-                                            [(self.id, node, register, values) for node in nodes]):
-                        result.append(res)
+            return [(self._device_node_map[node],
+                     self._submit(node, call_write_fifo_register, self.id, node, register, values))
+                    for node in nodes]
         else:
             # Write to be performed on a normal register or memory block
-            if len(nodes) == 1:
-                result.append([call_write_register(self.id, nodes[0], register, values, offset)])
-            else:
-                # Use thread pool to parallelise calls over nodes
-                with futures.ThreadPoolExecutor(max_workers=len(nodes)) as executor:
-                    for res in executor.map(lambda p: call_write_register(*p),
-                                            [(self.id, node, register, values, offset) for node in nodes]):
-                        result.append(res)
+            return [(self._device_node_map[node],
+                     self._submit(node, call_write_register, self.id, node, register, values, offset))
+                    for node in nodes]
 
-        self._logger.debug(self.log("Called write_register"))
-        if any([True for res in result if res == Error.Failure]):
-            raise BoardError("Failed to write_register %s on nodes %s" % (register, ', '.join([str(node) for node in nodes])))
-
-    def read_register(self, register, n = 1, offset = 0, device = None):
+    def read_register(self, register, n = 1, offset = 0, device = None, as_array = False, out = None):
         """" Get register value
          :param register: The register name. The first component of the register name
                           typically represents the device. In this case, it can also be
@@ -247,6 +273,8 @@ class UniBoard(FPGABoard):
          :param n: Number of words to read
          :param offset: Memory address offset to read from
          :param device: List of nodes can be explicitly specified
+         :param as_array: Return values for each node as a numpy.uint32 array
+         :param out: numpy.uint32 array of shape (nodes, n) to write values into, one row per node
          :return: Values
          """
 
@@ -254,6 +282,98 @@ class UniBoard(FPGABoard):
         if not self._checks():
             return
 
+        # Finished reading, wait for all nodes
+        return_values, failed = [], []
+        for node, future in self.read_register_async(register, n, offset, device, as_array, out):
+            try:
+                return_values.append((node, Error.Success.value, future.result()))
+            except BoardError:
+                failed.append(str(node))
+
+        if len(failed) > 0:
+            raise BoardError("Failed to read_register %s from nodes %s" % (register, ', '.join(failed)))
+
+        # Single-word reads are returned as lists for consistency across nodes
+        if n == 1 and not as_array and out is None:
+            return_values = [(node, error, [values]) for node, error, values in return_values]
+
+        return return_values
+
+    def read_register_async(self, register, n = 1, offset = 0, device = None, as_array = False, out = None):
+        """ Read register from nodes without waiting for the reads to complete. Reads are
+            performed by the node workers, so they are ordered with respect to other
+            requests to the same node
+        :param register: The register name, as in read_register
+        :param n: Number of words to read
+        :param offset: Memory address offset to read from
+        :param device: List of nodes can be explicitly specified
+        :param as_array: Return values for each node as a numpy.uint32 array
+        :param out: numpy.uint32 array of shape (nodes, n) to write values into, one row per node
+        :return: List of (node, future) tuples, each future resolving to the node's values
+                 or raising BoardError if the read failed
+        """
+
+        nodes, register, reg_str = self._resolve_nodes(register, device)
+
+        # Check if write length is valid
+        if n * 4 + offset > self.register_list[reg_str]['size'] * 4:
+            raise LibraryError("Too much data to read from register %s on nodes %s" %
+                               (register, ', '.join([str(node) for node in nodes])))
+
+        # Check if output array can hold values for all nodes
+        if out is not None and (not isinstance(out, np.ndarray) or out.ndim != 2 or
+                                out.shape[0] < len(nodes) or out.shape[1] < n):
+            raise LibraryError("Output array must be a numpy.uint32 array of shape (%d, %d)" % (len(nodes), n))
+
+        # FIFO registers are handled by the library
+        return [(self._device_node_map[node],
+                 self._submit(node, self._read_node, node, register, n, offset, as_array,
+                              out[i, :n] if out is not None else None))
+                for i, node in enumerate(nodes)]
+
+    def _read_node(self, node, register, n, offset, as_array, out):
+        """ Read register from a single node, called by the node's worker
+        :param node: Node device
+        :param register: Register name, without node
+        :param n: Number of words to read
+        :param offset: Memory address offset to read from
+        :param as_array: Return values as a numpy.uint32 array
+        :param out: numpy.uint32 array to write values into
+        :return: Values
+        """
+
+        # Values are read directly into the output array, or into the worker's pooled buffer
+        if out is not None:
+            buf = check_buffer(out, n)
+        elif as_array:
+            buf = np.empty(n, dtype = np.uint32)
+        else:
+            buf = get_buffer(n)
+
+        if call_read_register_into(self.id, node, register, buf, n, offset) == Error.Failure:
+            raise BoardError("Failed to read_register %s from node %d" % (register, self._device_node_map[node]))
+
+        if out is not None or as_array:
+            return buf
+        return int(buf[0]) if n == 1 else buf[:n].tolist()
+
+    def _submit(self, node, func, *args):
+        """ Schedule a call on a node's worker
+        :param node: Node device
+        :param func: Function to call
+        :return: Future
+        """
+        if self._node_executor is None:
+            raise LibraryError("Not connected to board, node workers are not running")
+        return self._node_executor.submit(node, func, *args)
+
+    def _resolve_nodes(self, register, device):
+        """ Get nodes to operate upon and strip node from register name
+        :param register: The register name
+        :param device: List of nodes, can be None
+        :return: List of node devices, register name without node and full name of register on first node
+        """
+
         # If list of devices is specified, check whether they are valid and get associated nodes
         nodes = None
         if device is not None:
@@ -274,57 +394,10 @@ class UniBoard(FPGABoard):
             if register.split('.')[0].upper() in self._names:
                 register = '.'.join(register.split('.')[1:])
 
-        # Get the register type (whether firo or normal)
+        # We need at least one node to check the whether the register is fifo or not
         reg_str = 'fpga%d.%s' % (int(log(nodes[0].value, 2) + 1), register)
-        register_type = self.register_list[reg_str]['type']
-
-        # Check if write length is valid
-        if n * 4 + offset > self.register_list[reg_str]['size'] * 4:
-            raise LibraryError("Too much data to read from register %s on nodes %s" %
-                               (register, ', '.join([str(node) for node in nodes])))
 
-        result = []
-        if register_type == RegisterType.FifoRegister:
-            # Write to be performed on a FIFO register
-            if len(nodes) == 1:
-                values = call_read_fifo_register(self.id, nodes[0], register, n, offset)
-                result.append((nodes[0], values.error, values.values))
-            else:
-                # Use thread pool to parallelise calls over nodes
-                with futures.ThreadPoolExecutor(max_workers=len(nodes)) as executor:
-                    for node in nodes:
-                        result.append((node, executor.submit(lambda p: call_read_fifo_register(*p),
-                                                             [self.id, node, register, n, offset])))
-        else:
-            # Write to be performed on a normal register or memory block
-            if len(nodes) == 1:
-                values = call_read_register(self.id, nodes[0], register, n, offset)
-                result.append((nodes[0], values.error, values.values))
-            else:
-                # Use thread pool to parallelise calls over nodes
-                with futures.ThreadPoolExecutor(max_workers=len(nodes)) as executor:
-                    for node in nodes:
-                        result.append((node, executor.submit(lambda p: call_read_register(*p),
-                                                             [self.id, node, register, n, offset])))
-
-        # Finished reading, process return values
-        return_values = []
-        if len(nodes) == 1:
-            for node, error, values in result:
-                if error == Error.Failure:
-                    raise BoardError("Failed to read_register %s from node %s" % ('1', '2'))
-                else:
-                    return_values.append((self._device_node_map[node], error, [values[i] for i in range(n)]))
-        else:
-            for node, future in result:
-                result = future.result()
-                if result.error == Error.Failure:
-                    raise BoardError("Failed to read_register %s from node %s" % ('1', '2'))
-                else:
-                    return_values.append((self._device_node_map[node], result.error,
-                                          [result.values[i] for i in range(n)]))
-
-        return return_values
+        return nodes, register, reg_str
 
     def _convert_node_to_device(self, node):
         """ Convert a node from a nodelist to a device
@@ -418,7 +491,7 @@ class UniBoard(FPGABoard):
     def __str__(self):
         """ Override __str__ to print register information in a human readable format """
 
-        if not self._programmed:
+        if not self._programmed[Device.Board]:
             return ""
 
         # Run checks
@@ -1,4 +1,6 @@
 import xml.etree.ElementTree as ET
+from concurrent import futures
+from time import time
 
 from pyfabil.boards.fpgaboard import *
 from pyfabil.base.definitions import *
@@ -25,7 +27,7 @@ class ConfigHandler(object):
         root = tree.getroot()
 
         # Get list of board types implemented in the access layer
-        available_boards = [cls.__name__ for cls in sys.modules['accesslayer'].FPGABoard.__subclasses__()]
+        available_boards = [cls.__name__ for cls in FPGABoard.__subclasses__()]
 
         # Set class attributes to be populated
         self.instrument = { }
@@ -114,12 +116,39 @@ class ConfigHandler(object):
 
 # --------------------------- Instrument -----------------------
 
+class BoardResult(object):
+    """ Outcome of an operation performed on a single board of an instrument """
+
+    def __init__(self, board_id):
+        """ Class constructor
+        :param board_id: Board identifier, as specified in the configuration file
+        """
+        self.board_id  = board_id
+        self.value     = None
+        self.exception = None
+        self.elapsed   = None
+
+    @property
+    def success(self):
+        """ Whether the operation completed without raising an exception """
+        return self.exception is None
+
+    def __repr__(self):
+        if self.success:
+            return "BoardResult(%s, value=%s, elapsed=%.3fs)" % (self.board_id, str(self.value), self.elapsed)
+        return "BoardResult(%s, exception=%s, elapsed=%.3fs)" % (self.board_id, repr(self.exception), self.elapsed)
+
+
 class Instrument(object):
     """ Instrument class """
 
-    def __init__(self, config_file):
+    # Default maximum number of boards which are operated on concurrently
+    DEFAULT_MAX_WORKERS = 8
+
+    def __init__(self, config_file, max_workers = None):
         """ Initialise instrument
         :param config_file: Configuration file
+        :param max_workers: Maximum number of boards operated on concurrently
         """
 
         # Set instrument status
@@ -138,11 +167,23 @@ class Instrument(object):
         else:
             self._logger = logging.getLogger('dummy')
 
-        # Create board and initialise instances
+        # Thread pool shared by all operations performed on the instrument's boards
+        if max_workers is None:
+            max_workers = min(max(len(self._config.boards), 1), self.DEFAULT_MAX_WORKERS)
+        self._executor = futures.ThreadPoolExecutor(max_workers = max_workers)
+
+        # Create board instances. Boards marked as simulated do not initialise hardware on connection
+        board_classes = dict([(cls.__name__, cls) for cls in FPGABoard.__subclasses__()])
         self.boards = { }
         for k, v in self._config.boards.iteritems():
-            self.boards[k] = eval(v['board_class'])()
-            self.boards[k].initialise(v)
+            simulator = v.get('simulator', 'false').strip().lower() == 'true'
+            self.boards[k] = board_classes[v['board_class']](simulator = simulator)
+
+        # Initialise boards
+        results = self._execute("initialise", dict([(k, (self.boards[k].initialise, (v,)))
+                                                    for k, v in self._config.boards.iteritems()]))
+        self._check_results("initialise", results)
+        for k in self.boards.keys():
             self._logger.info("Initialised board %s, has internal id %d" % (k, self.boards[k].id))
 
         # Check status
@@ -150,15 +191,40 @@ class Instrument(object):
 
         self._logger.info("Initialised intrument")
 
+    def run(self, func, boards = None, *args, **kwargs):
+        """ Call a function on each board concurrently. The function is called with the board
+            instance as its first argument, followed by any additional arguments
+        :param func: Function to call
+        :param boards: List of board identifiers, all boards if not specified
+        :return: Dictionary of BoardResult, keyed by board identifier
+        """
+        name = getattr(func, '__name__', 'operation')
+        return self._execute(name, dict([(k, (func, (self.boards[k],) + args, kwargs))
+                                         for k in self._get_boards(boards)]))
+
+    def load_firmware(self, device, filepath = None, boards = None):
+        """ Load firmware on boards concurrently
+        :param device: Device on which to load firmware
+        :param filepath: Firmware file path
+        :param boards: List of board identifiers, all boards if not specified
+        :return: Dictionary of BoardResult, keyed by board identifier
+        """
+        results = self._execute("load_firmware", dict([(k, (self.boards[k].load_firmware, (device, filepath)))
+                                                      for k in self._get_boards(boards)]))
+        self._check_results("load_firmware", results)
+        return results
+
     def status_check(self):
         """ Check instrument status
         :return: Status
         """
 
-        # Check status of all boards
+        # Check status of all boards concurrently. Boards which could not be checked are in error
+        results = self._execute("status_check", dict([(k, (v.status_check, ()))
+                                                     for k, v in self.boards.iteritems()]))
         status = { }
-        for k, v in self.boards.iteritems():
-            status[k] = self.boards[k].status_check()
+        for k, result in results.iteritems():
+            status[k] = result.value if result.success else Status.BoardError
 
         # Set instrument status
         stat = set([v for k, v in status.iteritems()]) - set([Status.OK])
@@ -169,6 +235,61 @@ class Instrument(object):
 
         return status
 
+    def close(self):
+        """ Disconnect all boards and release the thread pool """
+        self._execute("disconnect", dict([(k, (v.disconnect, ())) for k, v in self.boards.iteritems()]))
+        self._executor.shutdown(wait = True)
+
+    def _get_boards(self, boards):
+        """ Check and return list of board identifiers
+        :param boards: List of board identifiers, or None for all boards
+        :return: List of board identifiers
+        """
+        if boards is None:
+            return self.boards.keys()
+
+        for k in boards:
+            if k not in self.boards:
+                raise InstrumentError("Board %s is not part of the instrument" % k)
+        return boards
+
+    def _execute(self, name, calls):
+        """ Perform calls on the thread pool and wait for all of them to complete
+        :param name: Operation name, used for logging
+        :param calls: Dictionary of (function, args[, kwargs]) tuples keyed by board identifier
+        :return: Dictionary of BoardResult, keyed by board identifier
+        """
+
+        def timed_call(board_id, call):
+            result = BoardResult(board_id)
+            func, args, kwargs = call if len(call) == 3 else call + ({},)
+            start = time()
+            try:
+                result.value = func(*args, **kwargs)
+            except Exception as e:
+                result.exception = e
+            result.elapsed = time() - start
+
+            if result.success:
+                self._logger.info("Board %s: %s completed in %.3fs" % (board_id, name, result.elapsed))
+            else:
+                self._logger.error("Board %s: %s failed after %.3fs (%s)" % (board_id, name, result.elapsed,
+                                                                          str(result.exception)))
+            return result
+
+        pending = [self._executor.submit(timed_call, k, v) for k, v in calls.iteritems()]
+        return dict([(f.result().board_id, f.result()) for f in pending])
+
+    @staticmethod
+    def _check_results(name, results):
+        """ Raise an error if an operation failed on any board
+        :param name: Operation name
+        :param results: Dictionary of BoardResult
+        """
+        failed = ["%s (%s)" % (k, str(v.exception)) for k, v in sorted(results.iteritems()) if not v.success]
+        if len(failed) > 0:
+            raise InstrumentError("%s failed on boards: %s" % (name, ', '.join(failed)))
+
     def configure_logging(self, log_filename = None, log_level = logging.DEBUG):
         """ Basic logging configuration
         :param log_filename: Log filename
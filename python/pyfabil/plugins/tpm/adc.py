@@ -3,10 +3,50 @@ __author__ = 'lessju'
 from pyfabil.plugins.firmwareblock import FirmwareBlock
 from pyfabil.base.definitions import *
 from pyfabil.base.utils import *
-from time import sleep
+from pyfabil.base.spi import spi_write, spi_wait, spi_check
 import logging
 
 
+# ADC configuration and initialization sequence
+ADC_START_SEQUENCE = [
+    spi_write(0x0, 0x81, verify = False),   # Soft reset
+    spi_wait(0x0, 0x0, mask = 0x81, timeout = 0.1, required = False),    # Reset done, at most the old 0.1 s sleep
+
+    (0x18, 0x44),     # Input buffer current 3.0X
+    (0x120, 0x0),     # sysref
+    (0x550, 0x00),
+    (0x573, 0x00),
+
+    (0x571, 0x15),
+    (0x572, 0x10),    # SYNC CMOS level
+
+    (0x58b, 0x81),
+    (0x58d, 0x1f),
+
+    (0x58f, 0x7),
+    (0x590, 0x27),
+    (0x570, 0x48),
+    (0x58b, 0x81),
+    (0x590, 0x27),
+
+    # Lane remap
+    (0x5b2, 0x00),
+    (0x5b3, 0x01),
+    (0x5b5, 0x00),
+    (0x5b6, 0x01),
+    (0x5b0, 0xFA),    # xTPM unused lane power down
+
+    (0x571, 0x14),
+
+    spi_wait(0x56F, 0x80, required = False),    # PLL locked, not enforced as in the ADI demo procedure
+
+    spi_check(0x58b, 0x81, message = "Number of lane is not correct"),
+    spi_check(0x58c, 0x0,  message = "Number of octets per frame is not correct"),
+    spi_check(0x58d, 0x1f, message = "Number of frame per multiframe is not correct"),
+    spi_check(0x58e, 0x1,  message = "Number of virtual converters is not correct")
+]
+
+
 class TpmAdc(FirmwareBlock):
     """ TpmAdc tests class """
 
@@ -25,50 +65,18 @@ class TpmAdc(FirmwareBlock):
 
     #######################################################################################
 
-    def adc_single_start(self):
-        """ Perform the ADC configuration and initialization procedure as implemented in ADI demo """
-
-        self.board[(self._adc_id, 0x0)] = 0x81
-
-        # do_until_eq(lambda : self.board[(self._adc_id, 0x0)] & 0x1, 0, ms_retry=100, s_timeout=10)
-        sleep(0.1)
-
-        self.board[(self._adc_id, 0x18)] =  0x44 # Input buffer current 3.0X
-        self.board[(self._adc_id, 0x120)] = 0x0  # sysref
-        self.board[(self._adc_id, 0x550)] = 0x00
-        self.board[(self._adc_id, 0x573)] = 0x00
-
-        self.board[(self._adc_id, 0x571)] = 0x15
-        self.board[(self._adc_id, 0x572)] = 0x10  # SYNC CMOS level
-
-        self.board[(self._adc_id, 0x58b)] = 0x81
-        self.board[(self._adc_id, 0x58d)] = 0x1f
-
-        self.board[(self._adc_id, 0x58f)] = 0x7
-        self.board[(self._adc_id, 0x590)] = 0x27
-        self.board[(self._adc_id, 0x570)] = 0x48
-        self.board[(self._adc_id, 0x58b)] = 0x81
-        self.board[(self._adc_id, 0x590)] = 0x27
-
-        # Lane remap
-        self.board[(self._adc_id, 0x5b2)] = 0x00
-        self.board[(self._adc_id, 0x5b3)] = 0x01
-        self.board[(self._adc_id, 0x5b5)] = 0x00
-        self.board[(self._adc_id, 0x5b6)] = 0x01
-        self.board[(self._adc_id, 0x5b0)] = 0xFA  # xTPM unused lane power down
-
-        self.board[(self._adc_id, 0x571)] = 0x14
-
-        do_until_eq(lambda : self.board[(self._adc_id, 0x56F)] == 0x80, 1, ms_retry=100, s_timeout=10)
-
-        if self.board[(self._adc_id, 0x58b)] != 0x81:  # jesd lane number
-            raise PluginError("TpmAdc: Number of lane is not correct")
-        if self.board[(self._adc_id, 0x58c)] != 0:  # octets per frame
-            raise PluginError("TpmAdc: Number of octets per frame is not correct")
-        if self.board[(self._adc_id, 0x58d)] != 0x1f:  # frames per multiframe
-            raise PluginError("TpmAdc: Number of frame per multiframe is not correct")
-        if self.board[(self._adc_id, 0x58e)] != 1:  # virtual converters
-            raise PluginError("TpmAdc: Number of virtual converters is not correct")
+    def adc_single_start(self, verify = False):
+        """ Perform the ADC configuration and initialization procedure as implemented in ADI demo
+        :param verify: Read back configured registers and check their values
+        """
+        try:
+            self.board.spi_batch(self._adc_id, ADC_START_SEQUENCE, verify = verify)
+        except BoardError as e:
+            raise PluginError("TpmAdc: %s" % str(e))
+
+        statistics = self.board.spi_statistics
+        logging.debug("TpmAdc: %s configured in %.3fs (%d SPI accesses)" % (self._adc_id, statistics['elapsed'],
+                                                                          statistics['accesses']))
 
        #  print "ADC " + str(self._adc_id) + " configured!"
 
@@ -34,6 +34,9 @@ class TpmFpga(FirmwareBlock):
 
         self._nof_inputs = 16
 
+        # Register handles, resolved once the register list is available
+        self._registers = None
+
     #######################################################################################
 
     def fpga_start(self, input_list, enabled_list):
@@ -60,27 +63,29 @@ class TpmFpga(FirmwareBlock):
             mask = 1 << item
             disabled_input ^= mask
 
-        self.board['board.regfile.ctrl'] = 0x1  # Power down ADCs
-        self.board['board.regfile.ada_ctrl'] = 0x0000 # 0x1 Turns on ADS
-        self.board['board.regfile.ethernet_pause'] = 0x0
+        regs = self._get_registers()
 
-        self.board['%s.jesd_buffer.bit_per_sample' % self._device] = 0x8  # bits per sample
-        self.board['%s.jesd204_if.regfile_channel_disable' % self._device] = disabled_input
-        self.board['%s.jesd_buffer.test_pattern_enable' % self._device] = 0x0
-        self.board['%s.jesd204_if.regfile_ctrl.reset_n' % self._device] = 0x0
+        regs['ctrl'].write(0x1)  # Power down ADCs
+        regs['ada_ctrl'].write(0x0000) # 0x1 Turns on ADS
+        regs['ethernet_pause'].write(0x0)
 
-        self.board['%s.jesd204_if.regfile_ctrl.reset_n' % self._device] = 0x1
+        regs['bit_per_sample'].write(0x8)  # bits per sample
+        regs['channel_disable'].write(disabled_input)
+        regs['test_pattern_enable'].write(0x0)
+        regs['reset_n'].write(0x0)
 
-        if do_until_eq(lambda : self.board['%s.jesd204_if.regfile_status.qpll_locked' % self._device], 1, ms_retry = 100, s_timeout = 10) is None:
+        regs['reset_n'].write(0x1)
+
+        if do_until_eq(lambda : regs['qpll_locked'].read(), 1, ms_retry = 100, s_timeout = 10) is None:
             print "QPLL not locked"
 
         # Setting default buffer configuration
         for n in range(self._nof_inputs):
-            self.board['%s.jesd_buffer.read_first_%d' % (self._device, n)] = n
-            self.board['%s.jesd_buffer.read_last_%d' % (self._device, n)] = n
-            self.board['%s.jesd_buffer.write_mux_config_%d' % (self._device, n)] = n
-        self.board['%s.jesd_buffer.write_mux_we' % self._device] = 0xFFFF # Write mux we
-        self.board['%s.jesd_buffer.write_mux_we_shift' % self._device] = 0x0 # Write mux we shift
+            regs['read_first'][n].write(n)
+            regs['read_last'][n].write(n)
+            regs['write_mux_config'][n].write(n)
+        regs['write_mux_we'].write(0xFFFF) # Write mux we
+        regs['write_mux_we_shift'].write(0x0) # Write mux we shift
 
         # Setting buffer configuration
         nof_input = len(filter_list)
@@ -91,22 +96,22 @@ class TpmFpga(FirmwareBlock):
 
         k = 0
         for n in sorted(filter_list):
-            self.board['%s.jesd_buffer.read_first_%d' % (self._device, n)] = k
-            self.board['%s.jesd_buffer.read_last_%d' % (self._device, n)] = k + (slot_per_input - 1)
+            regs['read_first'][n].write(k)
+            regs['read_last'][n].write(k + (slot_per_input - 1))
             k += slot_per_input
 
         for n in range(16):
             if n / slot_per_input < len(filter_list):
-                self.board['%s.jesd_buffer.write_mux_config_%d' % (self._device, n)] = sorted(filter_list)[n / slot_per_input]  # write mux
+                regs['write_mux_config'][n].write(sorted(filter_list)[n / slot_per_input])  # write mux
 
         mask = 0
         for n in range(nof_input):
             mask <<= slot_per_input
             mask |= 0x1
-        self.board['%s.jesd_buffer.write_mux_we' % self._device] = mask
-        self.board['%s.jesd_buffer.write_mux_we_shift' % self._device] = 0x0
+        regs['write_mux_we'].write(mask)
+        regs['write_mux_we_shift'].write(0x0)
 
-        self.board['%s.regfile.stream_demux' % self._device] = 0x1
+        regs['stream_demux'].write(0x1)
 
     def fpga_stop(self):
         """ Stop FPGA acquisition and data downloading through 1Gbit Ethernet """
@@ -131,12 +136,48 @@ class TpmFpga(FirmwareBlock):
         """ Apply synchronous operation delay """
         self.board["%s.pps_manager.sync_time_arm_val" % self._device] = delay
 
+    def _get_registers(self):
+        """ Resolve handles for registers used by fpga_start, such that register names
+            are only formatted and looked up once
+        :return: Dictionary of register handles
+        """
+        if self._registers is not None:
+            return self._registers
+
+        device, register = self._device, self.board.register
+        self._registers = {
+            'ctrl'                : register('board.regfile.ctrl'),
+            'ada_ctrl'            : register('board.regfile.ada_ctrl'),
+            'ethernet_pause'      : register('board.regfile.ethernet_pause'),
+            'bit_per_sample'      : register('%s.jesd_buffer.bit_per_sample' % device),
+            'channel_disable'     : register('%s.jesd204_if.regfile_channel_disable' % device),
+            'test_pattern_enable' : register('%s.jesd_buffer.test_pattern_enable' % device),
+            'reset_n'             : register('%s.jesd204_if.regfile_ctrl.reset_n' % device),
+            'qpll_locked'         : register('%s.jesd204_if.regfile_status.qpll_locked' % device),
+            'valid'               : register('%s.jesd204_if.regfile_status.valid' % device),
+            'write_mux_we'        : register('%s.jesd_buffer.write_mux_we' % device),
+            'write_mux_we_shift'  : register('%s.jesd_buffer.write_mux_we_shift' % device),
+            'stream_demux'        : register('%s.regfile.stream_demux' % device),
+            'read_first'          : [register('%s.jesd_buffer.read_first_%d' % (device, n))
+                                     for n in range(self._nof_inputs)],
+            'read_last'           : [register('%s.jesd_buffer.read_last_%d' % (device, n))
+                                     for n in range(self._nof_inputs)],
+            'write_mux_config'    : [register('%s.jesd_buffer.write_mux_config_%d' % (device, n))
+                                     for n in range(self._nof_inputs)]
+        }
+        return self._registers
+
     ##################### Superclass method implementations ###############################
 
 
     def initialise(self):
-        """ Initialise TpmPll """
-        logging.info("TpmPll has been initialised")
+        """ Initialise TpmFpga """
+
+        # Pre-compute register handles if firmware is already loaded
+        if self.board.register_list is not None:
+            self._get_registers()
+
+        logging.info("TpmFpga has been initialised")
         return True
 
 
@@ -147,8 +188,8 @@ class TpmFpga(FirmwareBlock):
         logging.info("TpmPll : Checking status")
 
         # Check FPGA PLL is locked and receiving data from the FPGA
-        if self.board['%s.jesd204_if.regfile_status.qpll_locked' % self._device] == 0x1 and \
-           self.board['%s.jesd204_if.regfile_status.valid' % self._device] == 0x1:
+        regs = self._get_registers()
+        if regs['qpll_locked'].read() == 0x1 and regs['valid'].read() == 0x1:
             print 'FPGA %s already initialised' % self._device
             return Status.OK
         else:
@@ -3,9 +3,76 @@ __author__ = 'lessju'
 from pyfabil.plugins.firmwareblock import FirmwareBlock
 from pyfabil.base.definitions import *
 from pyfabil.base.utils import *
+from pyfabil.base.spi import spi_write, spi_wait
 import logging
 
 
+# IO update, transferring buffered register values to the active registers. Self-clearing
+PLL_IO_UPDATE = spi_write(0xF, 0x1, verify = False)
+
+# Input and reference configuration, per board type
+PLL_INPUT_CONFIG = {
+    'XTPM': [(0x100, 0x1),
+             (0x102, 0x1),
+             (0x104, 0xA),    # VCXO100MHz
+             (0x106, 0x14),   # VCXO100MHz ##mod
+             (0x107, 0x13),   # Not disable holdover
+             (0x108, 0x38),   # VCXO100MHz ##mod  ##10MHZ: 0x38
+             (0x109, 0x4),
+             (0x10A, 0x2)],   ###10MHZ: 0x2
+    'TPM':  [(0x100, 0x1),
+             (0x102, 0x1),
+             (0x104, 0x8),
+             (0x106, 0x14),
+             (0x107, 0x13),
+             (0x108, 0x2A),
+             (0x109, 0x4),
+             (0x10A, 0x0)]
+}
+
+# VCO and output divider configuration, per board type and output frequency
+PLL_FREQUENCY_CONFIG = {
+    ('XTPM', 1000): [(0x200, 0xE6), (0x201, 0x10), (0x202, 0x33), (0x203, 0x10),
+                     (0x204, 0x4),    # M1
+                     (0x205, 0x2), (0x207, 0x2),
+                     (0x208, 0x9)],   # N2
+    ('XTPM', 800):  [(0x200, 0xE6), (0x201, 0x10), (0x202, 0x33), (0x203, 0x10),
+                     (0x204, 0x5),    # M1
+                     (0x205, 0x2), (0x207, 0x2),
+                     (0x208, 0x7)],   # N2
+    ('XTPM', 700):  [(0x200, 0xE6), (0x201, 0xC8), (0x202, 0x33), (0x203, 0x10),
+                     (0x204, 0x5),    # M1
+                     (0x205, 0x2), (0x207, 0x2),
+                     (0x208, 0x6)],   # N2
+    ('TPM', 1000):  [(0x200, 0xE6), (0x201, 0x19), (0x202, 0x13), (0x203, 0x10),
+                     (0x204, 0x4), (0x205, 0x2), (0x207, 0x2), (0x208, 0x18)],
+    ('TPM', 800):   [(0x200, 0xE6), (0x201, 0x46), (0x202, 0x33), (0x203, 0x10),
+                     (0x204, 0x5), (0x205, 0x2), (0x207, 0x1), (0x208, 0x4)],
+    ('TPM', 700):   [(0x200, 0xE6), (0x201, 0xEB), (0x202, 0x13), (0x203, 0x10),
+                     (0x204, 0x5), (0x205, 0x2), (0x207, 0x4), (0x208, 0x22)]
+}
+
+# SYSREF configuration
+PLL_SYSREF_CONFIG = [(0x400, 0x14), (0x403, 0x96), (0x500, 0x10)]
+
+# Calibration, SYSREF request and lock sequence, performed once the PLL is configured
+PLL_SYNC_SEQUENCE = [
+    spi_wait(0xF, 0),
+    (0x203, 0x10), spi_wait(0xF, 0), PLL_IO_UPDATE,
+    (0x203, 0x11), spi_wait(0xF, 0), PLL_IO_UPDATE,
+    (0x403, 0x97), spi_wait(0xF, 0), PLL_IO_UPDATE,
+    (0x32A, 0x1),  spi_wait(0xF, 0), PLL_IO_UPDATE,
+    (0x32A, 0x0),  spi_wait(0xF, 0), PLL_IO_UPDATE,
+    (0x203, 0x10), PLL_IO_UPDATE,
+    (0x203, 0x11), PLL_IO_UPDATE,
+    spi_wait(0x509, 0x0, mask = 0x1),     # VCO calibration complete
+    (0x403, 0x97), PLL_IO_UPDATE,
+    (0x32A, 0x1),  PLL_IO_UPDATE,
+    (0x32A, 0x0),  PLL_IO_UPDATE,
+    spi_wait(0x508, [0xF2, 0xE7])         # PLL locked
+]
+
+
 class TpmPll(FirmwareBlock):
     """ FirmwareBlock tests class """
 
@@ -83,9 +150,10 @@ class TpmPll(FirmwareBlock):
 
         return reg0, reg1, reg2
 
-    def pll_start(self, freq):
+    def pll_start(self, freq, verify = False):
         """ Perform the PLL initialization procedure as implemented in ADI demo
         :param freq: PLL output frequency in MHz. Supported frequency are 700, 800, 1000 MHz
+        :param verify: Read back configured registers and check their values
         """
 
         # Check if PLL has already been programmed
@@ -104,159 +172,30 @@ class TpmPll(FirmwareBlock):
         self.board['board.regfile.ctrl.ad9528_rst'] = 1
         time.sleep(0.2)
 
-    #    self.board[('pll', 0x0)] = 0x1
-    #    if do_until_eq(lambda : self.board[('pll', 0x0)] & 0x1, 0, ms_retry = 100, s_timeout = 10) is None:
-    #        raise PluginError("PLL timeout error")
-        self.board[('pll', 0xF)] = 0x1
-
-        if self._board_type == "XTPM":
-            self.board[('pll', 0x100)] = 0x1
-            self.board[('pll', 0x102)] = 0x1
-            self.board[('pll', 0x104)] = 0xA   # VCXO100MHz
-            self.board[('pll', 0x106)] = 0x14  # VCXO100MHz ##mod
-            self.board[('pll', 0x107)] = 0x13  # Not disable holdover
-            self.board[('pll', 0x108)] = 0x38 # VCXO100MHz ##mod  ##10MHZ: 0x38
-            self.board[('pll', 0x109)] = 0x4
-            self.board[('pll', 0x10A)] = 0x2  ###10MHZ: 0x2
-        else:
-            self.board[('pll', 0x100)] = 0x1
-            self.board[('pll', 0x102)] = 0x1
-            self.board[('pll', 0x104)] = 0x8
-            self.board[('pll', 0x106)] = 0x14
-            self.board[('pll', 0x107)] = 0x13
-            self.board[('pll', 0x108)] = 0x2A
-            self.board[('pll', 0x109)] = 0x4
-            self.board[('pll', 0x10A)] = 0x0
-
-        if self._board_type == "XTPM":
-            self.board[('pll', 0x200)] = 0xE6
-
-            if freq == 1000:
-                self.board[('pll', 0x201)] = 0x10
-                self.board[('pll', 0x202)] = 0x33
-                self.board[('pll', 0x203)] = 0x10
-                self.board[('pll', 0x204)] = 0x4 # M1
-                self.board[('pll', 0x205)] = 0x2
-                self.board[('pll', 0x207)] = 0x2
-                self.board[('pll', 0x208)] = 0x9 # N2
-            elif freq == 800:
-                self.board[('pll', 0x201)] = 0x10
-                self.board[('pll', 0x202)] = 0x33
-                self.board[('pll', 0x203)] = 0x10
-                self.board[('pll', 0x204)] = 0x5 # M1
-                self.board[('pll', 0x205)] = 0x2
-                self.board[('pll', 0x207)] = 0x2
-                self.board[('pll', 0x208)] = 0x7 # N2
-            elif freq == 700:
-                self.board[('pll', 0x201)] = 0xC8
-                self.board[('pll', 0x202)] = 0x33
-                self.board[('pll', 0x203)] = 0x10
-                self.board[('pll', 0x204)] = 0x5 # M1
-                self.board[('pll', 0x205)] = 0x2
-                self.board[('pll', 0x207)] = 0x2
-                self.board[('pll', 0x208)] = 0x6 # N2
-            else:
-                raise PluginError("TpmPll: Frequency not supported")
-        else:
-            self.board[('pll', 0x200)] = 0xE6
-            if freq == 1000:
-                self.board[('pll', 0x201)] = 0x19
-                self.board[('pll', 0x202)] = 0x13
-                self.board[('pll', 0x203)] = 0x10
-                self.board[('pll', 0x204)] = 0x4
-                self.board[('pll', 0x205)] = 0x2
-                self.board[('pll', 0x207)] = 0x2
-                self.board[('pll', 0x208)] = 0x18
-            elif freq == 800:
-                self.board[('pll', 0x201)] = 0x46
-                self.board[('pll', 0x202)] = 0x33
-                self.board[('pll', 0x203)] = 0x10
-                self.board[('pll', 0x204)] = 0x5
-                self.board[('pll', 0x205)] = 0x2
-                self.board[('pll', 0x207)] = 0x1
-                self.board[('pll', 0x208)] = 0x4
-            elif freq == 700:
-                self.board[('pll', 0x201)] = 0xEB
-                self.board[('pll', 0x202)] = 0x13
-                self.board[('pll', 0x203)] = 0x10
-                self.board[('pll', 0x204)] = 0x5
-                self.board[('pll', 0x205)] = 0x2
-                self.board[('pll', 0x207)] = 0x4
-                self.board[('pll', 0x208)] = 0x22
-            else:
-                raise PluginError("TpmPll: Frequency not supported")
-
         # Setting PLL Outputs
+        outputs = []
         for n in range(14):
             reg0, reg1, reg2 = self.pll_out_set(n)
-            self.board[('pll', 0x300 + 3 * n + 0)] = reg0
-            self.board[('pll', 0x300 + 3 * n + 1)] = reg1
-            self.board[('pll', 0x300 + 3 * n + 2)] = reg2
-
-        # Setting SYSREF
-        self.board[('pll', 0x400)] = 0x14
-        self.board[('pll', 0x403)] = 0x96
-        self.board[('pll', 0x500)] = 0x10
+            outputs.extend([(0x300 + 3 * n + 0, reg0), (0x300 + 3 * n + 1, reg1), (0x300 + 3 * n + 2, reg2)])
 
+        # Power down unused outputs
         pd = 0
         for c in range(14):
             if self._pll_out_config[c] == "unused":
                 pd |= 2 ** c
 
-        self.board[('pll', 0x501)] = pd & 0xFF
-        self.board[('pll', 0x502)] = (pd & 0xFF00) >> 8
-
-        for i in range(10):
-            if self.board[('pll', 0xF)] == 0:
-                break
-            if i == 9:
-                raise PluginError("TpmPll: ")
-            time.sleep(1)
-
-        self.board[('pll', 0x203)] = 0x10
-        if do_until_eq(lambda : self.board[('pll', 0xF)], 0, ms_retry = 100, s_timeout = 10):
-            raise PluginError("PLL timeout error")
-        self.board[('pll', 0xF)] = 0x1
-
-        self.board[('pll', 0x203)] = 0x11
-        if do_until_eq(lambda: self.board[('pll', 0xF)], 0, ms_retry = 100, s_timeout = 10) is None:
-            raise PluginError("PLL timeout error")
-        self.board[('pll', 0xF)] = 0x1
-
-        self.board[('pll', 0x403)] = 0x97
-        if do_until_eq(lambda : self.board[('pll', 0xF)], 0, ms_retry = 100, s_timeout = 10) is None:
-            raise PluginError("PLL timeout error")
-        self.board[('pll', 0xF)] = 0x1
-
-        self.board[('pll', 0x32A)] = 0x1
-        if do_until_eq(lambda : self.board[('pll', 0xF)], 0, ms_retry = 100, s_timeout = 10) is None:
-            raise PluginError("PLL timeout error")
-        self.board[('pll', 0xF)] = 0x1
-
-        self.board[('pll', 0x32A)] = 0x0
-        if do_until_eq(lambda : self.board[('pll', 0xF)], 0, ms_retry = 100, s_timeout = 10) is None:
-            raise PluginError("PLL timeout error")
-        self.board[('pll', 0xF)] = 0x1
-
-        self.board[('pll', 0x203)] = 0x10
-        self.board[('pll', 0xF)] = 0x1
-        self.board[('pll', 0x203)] = 0x11
-        self.board[('pll', 0xF)] = 0x1
-
-        if do_until_eq(lambda : self.board[('pll', 0x509)] & 0x1, 0x0, ms_retry = 100, s_timeout = 10) is None:
-            raise PluginError("PLL timeout error")
-
-        self.board[('pll', 0x403)] = 0x97
-        self.board[('pll', 0xF)] = 0x1
-
-        self.board[('pll', 0x32A)] = 0x1
-        self.board[('pll', 0xF)] = 0x1
+        board_type = "XTPM" if self._board_type == "XTPM" else "TPM"
+        sequence = [PLL_IO_UPDATE] + PLL_INPUT_CONFIG[board_type] + \
+                   PLL_FREQUENCY_CONFIG[(board_type, freq)] + outputs + PLL_SYSREF_CONFIG + \
+                   [(0x501, pd & 0xFF), (0x502, (pd & 0xFF00) >> 8)] + PLL_SYNC_SEQUENCE
 
-        self.board[('pll', 0x32A)] = 0x0
-        self.board[('pll', 0xF)] = 0x1
+        try:
+            self.board.spi_batch('pll', sequence, verify = verify)
+        except BoardError as e:
+            raise PluginError("TpmPll: %s" % str(e))
 
-        if do_until_eq(lambda : self.board[('pll', 0x508)] in [0xF2, 0xE7], 0x0, ms_retry = 100, s_timeout = 10) is None:
-            raise PluginError("PLL not locked")
+        statistics = self.board.spi_statistics
+        logging.info("TpmPll: configured in %.3fs (%d SPI accesses)" % (statistics['elapsed'], statistics['accesses']))
 
 # def write_tag_ram(self, tag):
 #     print "Writing TAG ram..."
@@ -90,10 +90,11 @@ class UniBoardDpmm(FirmwareBlock):
                 self.board.read_register(self._ctrl_reg_addr[i], offset = self._reg_usedw, n = 1, device = self._nodes)]
 
 
-    def read_data(self, nof):
+    def read_data(self, nof, nodes = None):
         return [node_data for i in range(len(self._instance_number))
                 for (node, status, node_data) in
-                self.board.read_register(self._data_reg_addr[i], n = nof, device = self._nodes)]
+                self.board.read_register(self._data_reg_addr[i], n = nof,
+                                         device = self._nodes if nodes is None else nodes)]
 
     ##################### Superclass method implementations #################################
 
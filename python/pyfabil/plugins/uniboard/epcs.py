@@ -3,8 +3,10 @@ __author__ = 'lessju'
 from pyfabil.plugins.firmwareblock import FirmwareBlock
 from pyfabil.base.definitions import *
 from pyfabil.base.utils import *
-import filecmp
+from concurrent import futures
+import numpy as np
 import logging
+import time
 
 """Peripheral epcs
 
@@ -90,47 +92,74 @@ class UniBoardEpcs(FirmwareBlock):
         self._user_page_start      = self._user_sector_start * self._pages_per_sector
 
     #######################################################################################
-    def write_rden(self, data = 1):
-         self.board.write_register(self._reg_address, data, offset = self._reg_rden, device = self._nodes)
+    def write_rden(self, data = 1, nodes = None):
+         self.board.write_register(self._reg_address, data, offset = self._reg_rden,
+                                   device = self._nodes if nodes is None else nodes)
 
-    def write_read(self, data = 1):
-        self.board.write_register(self._reg_address, data, offset = self._reg_read, device = self._nodes)
+    def write_read(self, data = 1, nodes = None):
+        self.board.write_register(self._reg_address, data, offset = self._reg_read,
+                                  device = self._nodes if nodes is None else nodes)
 
-    def write_write(self, data = 1):
-         self.board.write_register(self._reg_address, data, offset = self._reg_write, device = self._nodes)
+    def write_write(self, data = 1, nodes = None):
+         self.board.write_register(self._reg_address, data, offset = self._reg_write,
+                                   device = self._nodes if nodes is None else nodes)
 
-    def write_addr(self, addr = None, page = None):
+    def write_addr(self, addr = None, page = None, nodes = None):
         if page is not None:
             addr = page * self._page_size_bytes
-        self.board.write_register(self._reg_address, addr, offset = self._reg_addr, device = self._nodes)
+        self.board.write_register(self._reg_address, addr, offset = self._reg_addr,
+                                  device = self._nodes if nodes is None else nodes)
 
-    def write_sector_erase(self, data=1):
-        self.board.write_register(self._reg_address, data, offset = self._reg_sector_erase, device = self._nodes)
+    def write_sector_erase(self, data=1, nodes = None):
+        self.board.write_register(self._reg_address, data, offset = self._reg_sector_erase,
+                                  device = self._nodes if nodes is None else nodes)
 
-    def write_erase_sector(self, sector):
+    def write_erase_sector(self, sector, nodes = None):
         # We need to write any address in the target sector's address range to select that sector for erase.
         # We'll use the base (lowest) address of the sectors for this: sector 0 starts at 0x0, sector 1 starts
         # at 0x40000 etc.
-        self.write_addr(sector * 0x40000)
-        self.write_sector_erase()
+        self.write_addr(sector * 0x40000, nodes = nodes)
+        self.write_sector_erase(nodes = nodes)
 
-    def read_busy(self):
-        data = self.board.read_register(self._reg_address, offset = self._reg_busy, n = 1, device = self._nodes)
+    def read_busy(self, nodes = None):
+        data = self.board.read_register(self._reg_address, offset = self._reg_busy, n = 1,
+                                        device = self._nodes if nodes is None else nodes)
         return [node_data for (node, status, node_data) in data]
 
+    def wait_idle(self, timeout = 10, nodes = None):
+        """ Wait until the flash controller of all nodes is no longer busy
+        :param timeout: Deadline in seconds, sector erases take up to a few seconds
+        :param nodes: Nodes to wait on, all nodes by default
+        """
+        wait_until(lambda: all([busy == 0 for busy in flatten(self.read_busy(nodes))]), timeout, "epcs.busy",
+                   interval = 0.0005)
+
     def read_page(self, page = 0):
         addr = page * self._page_size_bytes
         self.write_addr(addr)
         self.write_rden()
         self.write_read()
-        do_until_eq(self.read_busy, 0)
+        self.wait_idle()
         self._dpmm.read_usedw()
         self.read_page_to_file(self._rbf_dir + "/page.bin")
         self.write_rden(0)
 
+    def load_raw_binary_file(self, rbf_file):
+        """ Load raw binary file and convert it to the words stored in flash. Each word is
+            bit-reversed, and the last word is padded with null bytes
+        :param rbf_file: Raw binary file
+        :return: numpy.uint32 array of flash words, and file size in bytes
+        """
+        data = np.fromfile(rbf_file, dtype = np.uint8)
+        words = np.zeros(ceil_div(data.size, 4) * 4, dtype = np.uint8)
+        words[:data.size] = data
+        return reverse_words(words.view(np.uint32)), data.size
 
     def write_raw_binary_file(self, fact_or_usr, rbf_file):
-        rbf = open(rbf_file, "rb")
+        """ Erase the image area and write a raw binary file to flash, on all nodes in parallel
+        :param fact_or_usr: "user" or "factory" image
+        :param rbf_file: Raw binary file
+        """
         if fact_or_usr == "user":
             sector_start = self._user_sector_start
             page_start   = self._user_page_start
@@ -141,161 +170,129 @@ class UniBoardEpcs(FirmwareBlock):
             reserved_sector_span = self._factory_sector_span
 
         # Calculate the required number of pages (RBF file size is rarely a multiple of 256 bytes)
-        rbf_size_bytes = os.path.getsize(rbf_file)
+        words, rbf_size_bytes = self.load_raw_binary_file(rbf_file)
         print '(%s) Raw Binary File: %s'  % (fact_or_usr, rbf_file)
         print '    Size: %d bytes' % rbf_size_bytes
         rbf_page_span = ceil_div(rbf_size_bytes, self._page_size_bytes)
         print '    Span: %d pages'%rbf_page_span
 
-        # Convert page span to sector span, call write_erase_sector for this span
+        # Convert page span to sector span
         rbf_sector_span =  ceil_div(rbf_page_span, self._pages_per_sector)
         print '    Span: %d sectors'%rbf_sector_span
 
         if rbf_sector_span>reserved_sector_span:
-            print 'ERROR: RBF span (%d sectors) exceeds reserved %s image span (%d sectors) !' % \
-                  (rbf_sector_span, fact_or_usr, reserved_sector_span)
-
-        # Erase the sectors we're going to write with the RBF
-        print 'Erasing %d sectors...'% rbf_sector_span
-        for sector in range(sector_start, sector_start+rbf_sector_span):
-            print '    %d of [%d..%d]' % (sector, sector_start, sector_start + rbf_sector_span - 1)
-            self.write_erase_sector(sector)
-            do_until_eq(self.read_busy, 0)
-
-        # Now write all pages
-        print 'Writing %d pages [%d..%d]...' % (rbf_page_span, page_start, page_start + rbf_page_span - 1)
-        for page in range(0, rbf_page_span):
-
-            do_until_eq( self.read_busy, 0)
-            self.write_addr(page=page_start+page)
-
-            reversed_words = []
-            # Write one page to the MM->DP FIFO at a time
-            for word in range(0, self._page_size_words):
-                # Read a word from the file
-                word_read = rbf.read(4)
-
-                # EPCS allows us to write less than the page size, too. So simply break the loop when we've
-                # written the entire file, no need to pad the remaining bytes in this page.fact_or_usr
-                if not word_read:
-                    print '    End of Raw Binary File found after writing word %d in page %d.' % (word - 1, page)
-                    print '(%s) Raw Binary File: %s successfully written to flash.'  % (fact_or_usr, rbf_file)
-                    break
-
-                if len(word_read) < 4:
-                    nof_pad_bytes = 4 - len(word_read)
-                    # The last word read might be less than 4 bytes. Pad with null chars.
-                    rbf_word = struct.unpack('I', word_read + nof_pad_bytes*'\0' )[0]
-                else:
-                    rbf_word = struct.unpack('I',  word_read)[0]
-
-                # (bit) reverse and append to our word list
-                reversed_words.append(reverse_word(rbf_word))
-
-            # Now write the reversed word list to the MM->DP FIFO
-            self._mmdp.write_data(reversed_words)
+            raise PluginError("UniBoardEpcs: RBF span (%d sectors) exceeds reserved %s image span (%d sectors)" %
+                              (rbf_sector_span, fact_or_usr, reserved_sector_span))
+
+        # Erase and write all nodes in parallel
+        print 'Erasing %d sectors and writing %d pages [%d..%d] on %d nodes...' % \
+              (rbf_sector_span, rbf_page_span, page_start, page_start + rbf_page_span - 1, len(self._nodes))
+        start = time.time()
+        self._for_each_node(self._write_node, words, sector_start, rbf_sector_span, page_start, rbf_page_span)
+        print '(%s) Raw Binary File: %s successfully written to flash in %.1fs.' % \
+              (fact_or_usr, rbf_file, time.time() - start)
+
+    def _write_node(self, node, words, sector_start, sector_span, page_start, page_span):
+        """ Erase sectors and write pages on a single node. Pages are written back-to-back,
+            waiting only for the flash controller to finish the previous page """
+        for sector in range(sector_start, sector_start + sector_span):
+            self.write_erase_sector(sector, nodes = node)
+            self.wait_idle(nodes = node)
+
+        for page in range(page_span):
+            self.write_addr(page = page_start + page, nodes = node)
+
+            # EPCS allows us to write less than the page size, so the last page is not padded
+            self._mmdp.write_data(words[page * self._page_size_words:
+                                        (page + 1) * self._page_size_words].tolist(), nodes = node)
 
             # ...and assert 'write'.
-            self.write_write()
-
-        rbf.close()
+            self.write_write(nodes = node)
+            self.wait_idle(nodes = node)
 
     def read_page_to_file(self, filename):
 
-        data_file = open(filename, "wb")
-
         print 'Saving one page (256 bytes) from read FIFO to file.'
 
         # Reverse the bits in the read word. On unix, use 'od -t x4 -w128 [file]' to compare.
         data = self._dpmm.read_data(self._page_size_words)[0]
+        reverse_words(data).tofile(filename)
 
-        for word64 in data:
-            reversed_word64 = reverse_word(word64)
-            word32 = struct.pack("I", reversed_word64)
-            data_file.write(word32)
-
-        data_file.close()
-
+    def read_raw_binary_file(self, page_start, page_span):
+        """ Read pages from flash into memory, on all nodes in parallel
+        :param page_start: First page
+        :param page_span: Number of pages
+        :return: numpy.uint32 array of shape (nodes, words) with the flash words of each node
+        """
+        words = np.zeros((len(self._nodes), page_span * self._page_size_words), dtype = np.uint32)
+        self._for_each_node(lambda node, i: self._read_node(node, page_start, page_span, words[i]),
+                            range(len(self._nodes)))
+        return words
+
+    def _read_node(self, node, page_start, page_span, words):
+        """ Read pages from flash on a single node into the words array """
+        for page in range(page_span):
+            # Read one page size at a time. Wait for the page to be read before collecting it
+            self.write_addr(page = page_start + page, nodes = node)
+            self.write_rden(nodes = node)
+            self.write_read(nodes = node)
+            self.wait_idle(nodes = node)
+            self.write_rden(0, nodes = node)
+
+            words[page * self._page_size_words:(page + 1) * self._page_size_words] = \
+                self._dpmm.read_data(self._page_size_words, nodes = node)[0]
 
     def read_and_verify_raw_binary_file(self, fact_or_usr, base_rbf_file):
+        """ Read image back from flash and compare it with a raw binary file
+        :param fact_or_usr: "user" or "factory" image
+        :param base_rbf_file: Raw binary file
+        :return: True if the image was verified on all nodes
+        """
 
         if fact_or_usr=="user":
             page_start   = self._user_page_start
         else:
             page_start   = self._factory_page_start
 
-        # Open the original RBF that's supposed to be stored in flash
-        base_rbf = open(base_rbf_file, "rb")
-
         # Calculate the required number of pages (RBF file size is rarely a multiple of 256 bytes)
-        rbf_size_bytes = os.path.getsize(base_rbf_file)
+        expected = np.fromfile(base_rbf_file, dtype = np.uint8)
+        rbf_size_bytes = expected.size
         print '(%s) Raw Binary File: %s: starting verification' %(fact_or_usr,base_rbf_file)
         print '    Size: %d bytes' % rbf_size_bytes
 
         rbf_page_span = ceil_div(rbf_size_bytes, self._page_size_bytes)
         print '    Span: %d pages'%rbf_page_span
 
-        print 'Reading %s RBF from flash, saving to file(s) "rbf/.read_ver_[node].rbf".' %fact_or_usr
         print '    Reading %d pages [%d..%d] from %d nodes...' % (rbf_page_span, page_start, page_start + rbf_page_span - 1,
                                                                   len(self._nodes))
+        words = self.read_raw_binary_file(page_start, rbf_page_span)
+
+        # Convert flash words back to file contents and compare
+        verified = True
+        for i in range(len(self._nodes)):
+            mismatched = np.count_nonzero(reverse_words(words[i]).view(np.uint8)[:rbf_size_bytes] != expected)
+            if mismatched == 0:
+                print '    (%s) Raw Binary File verified on node %d, OK.' % \
+                      (fact_or_usr, self.board.device_to_fpga(self._nodes[i]))
+            else:
+                verified = False
+                print '    (%s) Raw Binary File mismatch on node %d (%d bytes differ)!' % \
+                      (fact_or_usr, self.board.device_to_fpga(self._nodes[i]), mismatched)
 
-        words_to_write = ceil_div(rbf_size_bytes, 4)
-        # We write to the file on 32-bit bounaries. If our file size is not an exact multiple of 32-bits,
-        # we need to compensate (remove) excess bytes from the last word written to the file.
-        excess_bytes = (words_to_write * 4) - rbf_size_bytes
-
-        filenames=[]
-        files=[]
-        words_written = []
+        return verified
 
-        for node in self._nodes:
-            # now create a new binary file that we'll write our flash data to
-            filename = self._rbf_dir + "/.read_ver_" + str(node) + ".rbf"
-            filenames.append(filename)
-            files.append(open(filename, "wb"))
-            words_written.append(0)
-
-        for page in range(page_start, page_start+rbf_page_span):
-
-            do_until_eq( self.read_busy, 0)
-
-            # Write address
-            self.write_addr(page=page)
-            time.sleep(0.0001) # Note: sleeps added because on faster PCs readback failed
-            # Read one page size at a time, append to file.
-            self.write_rden()
-            time.sleep(0.0001)
-            self.write_read()
-            time.sleep(0.0001)
-            self.write_rden(0)
-            time.sleep(0.0001)
-
-            # collect this page from all targeted nodes
-            data = self._dpmm.read_data(self._page_size_words)
-
-            # write this page to the corresponding file
-            for i in range(0, len(self._nodes)):
-                for word64 in data[i]:
-                    reversed_word64 = reverse_word(word64)
-                    word32 = struct.pack("I", reversed_word64)
-                    # Stop writing if file size matches base file size
-                    if words_written[i] < words_to_write:
-                        if words_written[i] == words_to_write-1: # last word; remove any excess bytes
-                            files[i].write(word32[0:4-excess_bytes])
-                        else:
-                            files[i].write(word32)
-                        words_written[i] += 1
-
-        base_rbf.close()
-
-        for i in range(0, len(self._nodes)):
-            files[i].close()
-            print 'Comparing %s to %s.' % (filenames[i], base_rbf_file)
-
-            if filecmp.cmp(filenames[i], base_rbf_file):
-                print '    (%s) Raw Binary file %s verified, OK.'%(fact_or_usr, filenames[i])
-            else:
-                print '    (%s) Raw Binary File %s mismatch!'%(fact_or_usr, filenames[i])
+    def _for_each_node(self, func, *args):
+        """ Call function for each node concurrently, with the node as first argument.
+            Further arguments which are lists are distributed, one item per node
+        :return: List of results, in node order
+        """
+        executor = futures.ThreadPoolExecutor(max_workers = len(self._nodes))
+        try:
+            pending = [executor.submit(func, node, *[a[i] if type(a) is list else a for a in args])
+                       for i, node in enumerate(self._nodes)]
+            return [f.result() for f in pending]
+        finally:
+            executor.shutdown(wait = True)
 
     def write_ver_raw_binary_file(self, fact_or_usr, rbf_file):
         self.write_raw_binary_file(fact_or_usr, rbf_file)
@@ -317,37 +314,10 @@ class UniBoardEpcs(FirmwareBlock):
         print '    Reading %d pages [%d..%d] from %d nodes...' % (rbf_page_span, page_start, page_start + rbf_page_span - 1,
                                                                   len(self._nodes))
 
-        filenames=[]
-        files=[]
-
-        for node in self._nodes:
-            # now create a new binary file that we'll write our flash data to
-            filename=self._rbf_dir+"/.read_sav_"+str(node)+".rbf"
-            filenames.append(filename)
-            files.append(open(filename, "wb"))
-
-
-        for page in range(page_start, page_start+rbf_page_span):
-
-            do_until_eq( self.read_busy, 0)
-
-            # Write address
-            self.write_addr(page=page)
-
-            # Read one page size at a time, append to file.
-            self.write_rden()
-            self.write_read()
-            self.write_rden(0)
-
-            # collect this page from all targeted nodes
-            data = self._dpmm.read_data(self._page_size_words)
-
-            # write this page to the corresponding file
-            for i in range(0, len(self._nodes)):
-                for word64 in data[i]:
-                    reversed_word64 = reverse_word(word64)
-                    word32 = struct.pack("I", reversed_word64)
-                    files[i].write(word32)
+        words = self.read_raw_binary_file(page_start, rbf_page_span)
+        for i, node in enumerate(self._nodes):
+            # Save flash data of each node to its own file
+            reverse_words(words[i]).tofile(self._rbf_dir + "/.read_sav_" + str(node) + ".rbf")
 
         print '    Done.'
 
@@ -98,8 +98,8 @@ class UniBoardMmdp(FirmwareBlock):
                 for (node, status, node_data) in
                 self.board.read_register(self._ctrl_reg_addr[i], offset = self._reg_availw, n = 1, device = self._nodes)]
 
-    def write_data(self, wr_data):
-        [self.board.write_register(self._data_reg_addr[i], wr_data, device = self._nodes)
+    def write_data(self, wr_data, nodes = None):
+        [self.board.write_register(self._data_reg_addr[i], wr_data, device = self._nodes if nodes is None else nodes)
          for i in range(0, len(self._instance_number))]
 
         # [self.board.writeFifo(self._data_reg_addr[i], wr_data, device = self._nodes)
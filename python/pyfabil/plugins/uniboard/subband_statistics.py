@@ -50,11 +50,15 @@ class UniBoardSubbandStatistics(FirmwareBlock):
         self._stat_data_width       = kwargs.get('stat_data_width', 56)
         self._reg_span = 2
 
+        # Buffer which raw statistics of all nodes are read into
+        self._buffer = None
+
         self._ram_address = 'RAM_ST_SST'
         self._reg_address = 'REG_ST_SST'
 
         # Check if list of nodes are valid and all are front nodes
         self._nodes = self.board._get_nodes(kwargs['nodes'])
+        self._nodes = self._nodes if type(self._nodes) is list else [self._nodes]
         for node in self._nodes:
             if self.board.nodes[self.board._device_node_map[node]]['type'] != 'B':
                 raise PluginError("UniBoardSubbandStatistics: Specified node must be a back node")
@@ -73,77 +77,67 @@ class UniBoardSubbandStatistics(FirmwareBlock):
 
     #########################################################################################
 
-    def read_and_verify_stats(self, reference = None):
-
-        # Get the statistics from the node(s)
-        addr_offset = self._instance_number * self._nof_regs_per_instance
-        data = self.board.read_register(self._ram_address, offset = addr_offset, n = self._nof_regs_per_instance, device = self._nodes)
-        reference = [] if reference is None else reference
-
-        # Evaluate per node
-        result = []
-        for (node, status, node_data) in data:
-
-            ni_stats = []
-            ni_complex_stats=[]
-
-            for k in xrange(0, self._nof_stats):
-                temp =long((node_data[2*k+1] << c_word_w) + (node_data[2*k] & (c_word_mod-1)) & 2**self._stat_data_width-1)
-                if temp & 2**(self._stat_data_width-1):
-                    temp += -2 ** self._stat_data_width
-                ni_stats.append(temp)
-            print 'FN %d Read statistics (instance = %d)' % (node, self._instance_number)
-
-            # make complex list and verify
-            err_cnt = 0
-            if self._xst_enable:
-                for k in xrange(0, self._nof_stats/c_nof_complex):
-                    ni_complex_stats.append(complex(ni_stats[k], ni_stats[k+self._nof_stats/c_nof_complex]))
-                    if reference[k] != ni_complex_stats[k]:
-                        err_cnt += 1
-                        print 'Bf ='+ str(ni_complex_stats[k]) + 'Reference = ' + str(reference[k])
-            else:
-                for k in xrange(0, self._nof_stats):
-                    ni_complex_stats.append(complex(ni_stats[k], 0))
-                    if reference[k] != ni_complex_stats[k]:
-                        err_cnt +=1
-                        print 'Bf ='+ str(ni_complex_stats[k]) + 'Reference = ' + str(reference[k])
-            if err_cnt > 0:
-                print 'Verify statistics from instance = %d got %d errors' % (self._instance_number, err_cnt)
+    def read_and_verify_stats(self, reference = None, as_array = False):
+        """ Read statistics from all nodes and compare them against a reference
+        :param reference: Reference statistics, common to all nodes
+        :param as_array: Return a numpy array of shape (node, statistic) instead of lists
+        :return: Complex statistics per node
+        """
+        stats = self._read_stats(True)
+        if reference is None:
+            raise PluginError("%s: A reference is required to verify statistics" % self.__class__.__name__)
+
+        mismatches = self.verify_stats(reference, stats)
+        for i, node in enumerate(self._nodes):
+            errors = mismatches[mismatches[:, 0] == i, 1]
+            if len(errors) > 0:
+                logging.warning("Verify statistics on node %d from instance = %d got %d errors, first at statistic %d"
+                                % (self.board._device_node_map[node], self._instance_number, len(errors), errors[0]))
             else:
-                print 'Verify statistics from instance = %d went OK' % self._instance_number
-            result.append(ni_complex_stats)
-        return result
+                logging.info("Verify statistics on node %d from instance = %d went OK"
+                             % (self.board._device_node_map[node], self._instance_number))
 
+        return stats if as_array else stats.tolist()
+
+    def verify_stats(self, reference, stats = None):
+        """ Compare statistics against a reference
+        :param reference: Reference statistics, common to all nodes
+        :param stats: Complex statistics of shape (node, statistic), read from the nodes if not specified
+        :return: Array of (node index, statistic index) pairs which do not match the reference
+        """
+        if stats is None:
+            stats = self._read_stats(True)
+        return verify_statistics(stats, reference)
+
+    def read_stats(self, return_complex = True, as_array = False):
+        """ Read statistics from all nodes
+        :param return_complex: Return statistics as complex values
+        :param as_array: Return a numpy array of shape (node, statistic) instead of lists
+        :return: Statistics per node
+        """
+        stats = self._read_stats(return_complex)
+        return stats if as_array else stats.tolist()
+
+    def _read_stats(self, return_complex):
+        """ Read and decode statistics from all nodes
+        :param return_complex: Return statistics as complex values
+        :return: int64 or complex128 array of shape (node, statistic)
+        """
+
+        # Get the statistics from the node(s), reusing the same buffer for every read
+        if self._buffer is None:
+            self._buffer = np.empty((len(self._nodes), self._nof_regs_per_instance), dtype = np.uint32)
 
-    def read_stats(self, return_complex=True):
-        # Get the statistics from the node(s)
         addr_offset = self._instance_number * self._nof_regs_per_instance
-        data = self.board.read_register(self._ram_address, offset = addr_offset, n = self._nof_regs_per_instance, device = self._nodes)
-
-        # Evaluate per node
-        result = []
-        for (node, status, node_data) in data:
-            ni_stats = []
-            ni_complex_stats=[]
-            for k in xrange(0, self._nof_stats):
-                temp =long((node_data[2*k+1] << c_word_w) + (node_data[2*k] & (c_word_mod-1)) & 2**self._stat_data_width-1)
-                if temp & 2**(self._stat_data_width-1):
-                    temp += -2 ** self._stat_data_width
-                ni_stats.append(temp)
-            print 'FN %d Read statistics (instance = %d)' % (node, self._instance_number)
-
-            if self._xst_enable:
-                for k in xrange(0, self._nof_stats/c_nof_complex):
-                     ni_complex_stats.append(complex(ni_stats[k], ni_stats[k+self._nof_stats/c_nof_complex]))
-            else:
-                for k in xrange(0, self._nof_stats):
-                     ni_complex_stats.append(complex(ni_stats[k], 0))
-            if return_complex:
-                result.append(ni_complex_stats)
-            else:
-                result.append(ni_stats)
-        return result
+        self.board.read_register(self._ram_address, offset = addr_offset, n = self._nof_regs_per_instance,
+                                 device = self._nodes, out = self._buffer)
+        logging.debug("%s: Read statistics (instance = %d)" % (self.__class__.__name__, self._instance_number))
+
+        # Decode statistics of all nodes at once
+        stats = decode_statistics(self._buffer, self._stat_data_width, self._xst_enable and return_complex)
+        if return_complex and not self._xst_enable:
+            stats = stats.astype(np.complex128)
+        return stats
 
     def read_treshold(self):
         # Write the treshold to the node(s)
@@ -0,0 +1,21 @@
+# pytest fixtures providing simulated boards
+import pytest
+import os
+
+from pyfabil.tests.ucp_simulator import UCPSimulator
+
+TPM_TEST_MAP = os.path.join(os.path.dirname(__file__), "files", "tpm_test_map.xml")
+
+
+@pytest.fixture
+def ucp_simulator():
+    """ Running simulator, boards are added with add_board and stopped when the test finishes """
+    simulator = UCPSimulator().start()
+    yield simulator
+    simulator.stop()
+
+
+@pytest.fixture
+def tpm_simulator(ucp_simulator):
+    """ Simulated board loaded with the TPM test memory map, listening on a free port """
+    return ucp_simulator.add_board(ip = "127.0.0.1", memory_map = TPM_TEST_MAP)
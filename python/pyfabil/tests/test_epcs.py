@@ -0,0 +1,73 @@
+# UniBoard EPCS flash programming tests, against simulated nodes
+import numpy as np
+import tempfile
+import os
+
+from pyfabil import UniBoard
+from pyfabil.base.utils import reverse_word, reverse_words
+from pyfabil.plugins.uniboard.epcs import UniBoardEpcs
+from pyfabil.tests.uniboard_simulator import SimulatedEpcs
+
+# Words at the edges of the value range and of each byte
+BOUNDARY_WORDS = [0, 1, 0x7FFFFFFF, 0x80000000, 0xFFFFFFFE, 0xFFFFFFFF, 0xFF, 0xFF00, 0xFF000000, 0x01000000,
+                  0x12345678, 0x55555555, 0xAAAAAAAA]
+
+
+def test_reverse_words():
+    """ Check that the vectorised word reversal matches per-word reversal """
+
+    words = np.concatenate([np.array(BOUNDARY_WORDS, dtype = np.uint32),
+                            np.random.RandomState(0).randint(0, 2 ** 32, 1000, dtype = np.uint64).astype(np.uint32)])
+    expected = [reverse_word(int(w)) for w in words]
+
+    assert reverse_words(words).tolist() == expected
+    assert reverse_words(words.tolist()).tolist() == expected
+    assert reverse_words(words[::3]).tolist() == expected[::3]
+    assert reverse_words(reverse_words(words)).tolist() == words.tolist()
+    assert reverse_words(np.array([], dtype = np.uint32)).size == 0
+
+
+def test_flash_round_trip(ucp_simulator):
+    """ Program an image on several nodes in parallel and read it back for verification """
+
+    nof_nodes = 8
+    nodes = [ucp_simulator.add_board(ip = "127.0.1.1")]
+    nodes += [ucp_simulator.add_board(ip = "127.0.1.%d" % (i + 1), port = nodes[0].port) for i in range(1, nof_nodes)]
+    flash = [SimulatedEpcs(node) for node in nodes]
+
+    # Image with a partial last word and page, spanning several pages
+    image = np.random.RandomState(1).randint(0, 256, 1003).astype(np.uint8)
+    padded = np.zeros(1004, dtype = np.uint8)
+    padded[:image.size] = image
+    expected = [reverse_word(int(w)) for w in padded.view(np.uint32)]
+
+    directory = tempfile.mkdtemp()
+    rbf = os.path.join(directory, "image.rbf")
+    image.tofile(rbf)
+
+    unb = UniBoard(ip = "127.0.1.1", port = nodes[0].port, nodelist = [(i, 'B') for i in range(nof_nodes)])
+    try:
+        programmed = [1, 2, 5, 6]
+        epcs = UniBoardEpcs(unb, nodes = programmed)
+        epcs.write_raw_binary_file("user", rbf)
+
+        first_page = 26 * SimulatedEpcs.SECTOR_PAGES
+        for i in range(nof_nodes):
+            if i not in programmed:
+                assert flash[i].statistics == {'erased': 0, 'written': 0, 'read': 0}
+                continue
+            assert flash[i].erased == set([26])
+            words = np.concatenate([flash[i].page(first_page + p) for p in range(4)])
+            assert words[:len(expected)].tolist() == expected
+            assert np.all(words[len(expected):] == 0xFFFFFFFF)
+
+        assert epcs.read_and_verify_raw_binary_file("user", rbf)
+
+        # A single flipped bit on one node fails verification
+        page = flash[5].pages[first_page + 2]
+        page[10] ^= 0x1
+        assert not epcs.read_and_verify_raw_binary_file("user", rbf)
+    finally:
+        unb.disconnect()
+        os.remove(rbf)
+        os.rmdir(directory)
@@ -0,0 +1,185 @@
+from threading import Event
+import numpy as np
+import unittest
+import time
+
+from pyfabil import StatisticsMonitor
+from pyfabil.base.definitions import LibraryError
+from pyfabil.base.utils import decode_statistics, verify_statistics
+
+
+class BsnSource(object):
+    """ BSN source whose block counter advances with wall-clock time """
+
+    def __init__(self, samples_per_block, sample_frequency, blocks_per_sync):
+        self._samples_per_block = samples_per_block
+        self._sample_frequency  = sample_frequency
+        self._blocks_per_sync   = blocks_per_sync
+        self._start             = time.time()
+
+    def read_blocks_per_sync(self):
+        return [self._blocks_per_sync]
+
+    def read_current_bsn(self):
+        return [int((time.time() - self._start) * self._sample_frequency / self._samples_per_block)]
+
+
+class TestStatistics(unittest.TestCase):
+
+    @staticmethod
+    def _encode(values):
+        """ Split signed integers into pairs of 32-bit words, least significant word first """
+        values = np.asarray(values, dtype = np.int64).view(np.uint64)
+        words = np.empty(values.shape[:-1] + (values.shape[-1] * 2,), dtype = np.uint64)
+        words[..., 0::2] = values & np.uint64(0xFFFFFFFF)
+        words[..., 1::2] = values >> np.uint64(32)
+        return words
+
+    def test_decode_sign_extension(self):
+        """ Check that statistics are masked to their data width and sign-extended """
+
+        values = [[0, 1, -1, (1 << 55) - 1, -(1 << 55)],
+                  [5, -5, 1 << 40, -(1 << 40), 0x12345678]]
+        stats = decode_statistics(self._encode(values), data_width = 56)
+        self.assertEqual(stats.dtype, np.int64)
+        self.assertEqual(stats.tolist(), values)
+
+        # Bits above the data width are ignored
+        words = self._encode([[7, -7]])
+        words[0, 1] |= np.uint64(0xFF000000)
+        self.assertEqual(decode_statistics(words, data_width = 56).tolist(), [[7, -7]])
+
+        # Single node, given as a flat list of words
+        self.assertEqual(decode_statistics([0xFFFFFFFF, 0x0000FFFF], data_width = 48).tolist(), [[-1]])
+
+    def test_decode_64_bit(self):
+        """ Check that 64-bit statistics are used as they are """
+
+        values = [[np.iinfo(np.int64).max, np.iinfo(np.int64).min, -1, 3]]
+        self.assertEqual(decode_statistics(self._encode(values), data_width = 64).tolist(), values)
+
+    def test_decode_complex_pairs(self):
+        """ Check that real and imaginary halves are combined into complex statistics """
+
+        values = [[1, -2, 3, 4, -5, 6],
+                  [0, 7, -8, -9, 10, 0]]
+        stats = decode_statistics(self._encode(values), complex_pairs = True)
+        self.assertEqual(stats.dtype, np.complex128)
+        self.assertEqual(stats.shape, (2, 3))
+        self.assertEqual(stats.tolist(), [[1 + 4j, -2 - 5j, 3 + 6j],
+                                          [0 - 9j, 7 + 10j, -8 + 0j]])
+
+    def test_verify_statistics(self):
+        """ Check that mismatches are reported as (node, statistic) indices """
+
+        reference = np.arange(8)
+        stats = np.tile(reference[:6], (3, 1))
+        self.assertEqual(verify_statistics(stats, reference).shape, (0, 2))
+
+        stats[0, 5] = 0
+        stats[2, 1] = -1
+        stats[2, 3] = 100
+        self.assertEqual(verify_statistics(stats, reference).tolist(), [[0, 5], [2, 1], [2, 3]])
+
+        # Per-node references are compared node by node
+        per_node = np.tile(reference, (3, 1))
+        per_node[1, 0] = 9
+        self.assertEqual(verify_statistics(stats, per_node).tolist(), [[0, 5], [1, 0], [2, 1], [2, 3]])
+
+        self.assertRaises(ValueError, verify_statistics, stats, reference[:4])
+
+
+class TestStatisticsMonitor(unittest.TestCase):
+
+    def test_cadence(self):
+        """ Check that statistics are read once per integration of the BSN source """
+
+        source = BsnSource(samples_per_block = 1000, sample_frequency = 1e5, blocks_per_sync = 5)
+        reads = []
+        monitor = StatisticsMonitor(lambda: reads.append(time.time()) or np.arange(4), bsn_source = source,
+                                    history = 8, latency = 0.002)
+        self.assertAlmostEqual(monitor.period, 0.05)
+
+        with monitor:
+            time.sleep(0.5)
+
+        self.assertTrue(8 <= monitor.acquired <= 11)
+        self.assertEqual(monitor.dropped, 0)
+        self.assertEqual(len(reads), monitor.acquired)
+        self.assertTrue(all(0.03 < interval < 0.07 for interval in np.diff(reads)))
+
+        # Ring buffer keeps the latest integrations, in order
+        indices, timestamps, data = monitor.history()
+        self.assertEqual(len(indices), 8)
+        self.assertEqual(np.diff(indices).tolist(), [1] * 7)
+        self.assertEqual(data.shape, (8, 4))
+        self.assertEqual([sample.index for sample in monitor.latest(3)], indices[-3:].tolist())
+
+        # Block period cannot be computed from sources without sample information
+        self.assertRaises(LibraryError, StatisticsMonitor, np.zeros, bsn_source = object(), blocks_per_sync = 5)
+
+    def test_dropped_integrations(self):
+        """ Check that integrations missed by stalled reads are counted as dropped, and failed reads as errors """
+
+        calls = []
+
+        def read():
+            calls.append(time.time())
+            if len(calls) == 3:
+                time.sleep(0.17)
+            if len(calls) == 5:
+                raise IOError("Read failed")
+            return np.zeros(2)
+
+        with StatisticsMonitor(read, period = 0.05, latency = 0.002) as monitor:
+            time.sleep(0.5)
+
+        statistics = monitor.get_acquisition_statistics()
+        self.assertEqual(statistics['errors'], 1)
+        self.assertTrue(statistics['dropped'] >= 2)
+        self.assertEqual(statistics['acquired'], statistics['samples'])
+
+        indices = monitor.history()[0]
+        self.assertEqual(np.diff(indices).sum(), len(indices) - 1 + statistics['dropped'])
+
+    def test_downsample(self):
+        """ Check that integrations are combined into samples, keeping the last one or their average """
+
+        monitor = StatisticsMonitor(np.zeros, period = 1, history = 4, downsample = 3)
+        for i in range(7):
+            monitor._add(i, float(i), np.full(2, i))
+        samples = monitor.latest(4)
+        self.assertEqual([(s.index, s.count, s.data.tolist()) for s in samples], [(2, 3, [2, 2]), (5, 3, [5, 5])])
+
+        monitor = StatisticsMonitor(np.zeros, period = 1, history = 2, downsample = 2, average = True)
+        for i in range(6):
+            monitor._add(i, float(i), np.array([i, 10 * i + 1j]))
+        indices, _, data = monitor.history()
+        self.assertEqual(indices.tolist(), [3, 5])
+        self.assertEqual(data.tolist(), [[2.5, 25 + 1j], [4.5, 45 + 1j]])
+
+    def test_subscriber_overflow(self):
+        """ Check that full subscriber queues drop samples without affecting other subscribers """
+
+        monitor = StatisticsMonitor(np.zeros, period = 1, history = 4)
+        slow = monitor.subscribe(queue_size = 2)
+        received, done = [], Event()
+        monitor.subscribe(callback = lambda sample: received.append(sample.index) or
+                                                    (len(received) == 6 and done.set()), queue_size = 8)
+
+        for i in range(6):
+            monitor._add(i, float(i), np.full(3, i))
+
+        self.assertTrue(done.wait(1))
+        self.assertEqual(received, range(6))
+        self.assertEqual(slow.dropped, 4)
+        self.assertEqual([slow.get(0).index, slow.get(0).index, slow.get(0)], [0, 1, None])
+        self.assertEqual(monitor.get_acquisition_statistics()['subscribers'], [4, 0])
+
+        monitor.unsubscribe(slow)
+        monitor._add(6, 6.0, np.zeros(3))
+        self.assertIsNone(slow.get(0.01))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,283 @@
+from time import sleep
+import numpy as np
+import subprocess
+import unittest
+import sys
+import os
+
+from pyfabil import TPM, AsyncTPM, Device, CachePolicy, StatisticsMonitor, gather
+from pyfabil.base.definitions import BoardError, LibraryError
+from pyfabil.base.spi import spi_read, spi_check, spi_wait
+from pyfabil.base.utils import wait_register, wait_statistics
+from pyfabil.boards.fpgaboard import FPGABoard
+
+
+class TestTPM(unittest.TestCase):
+
+    def __init__(self, *args, **kwargs):
+        super(TestTPM, self).__init__(*args, **kwargs)
+        self._simulator = None
+        self._ip        = "127.0.0.1"
+        self._port      = 10000
+
+        # Register map and SPI devices for testing
+        self._config_file  = os.path.join(os.getcwd(), "tests/files/tpm_test_map.xml")
+        if not os.path.exists(self._config_file):
+            self._config_file = os.path.join(os.getcwd(), "files/tpm_test_map.xml")
+        self._spi_file = os.path.join(os.path.dirname(self._config_file), "tpm_test_spi.xml")
+
+    def setUp(self):
+        """ Start the mock TPM script """
+        with open(os.devnull, 'w') as devnull:
+            self._simulator = subprocess.Popen([sys.executable, os.path.join(os.path.dirname(__file__),
+                                                                             "tpm_simulator.py"),
+                                                "-m", self._config_file, "-s", self._spi_file],
+                                               stdout = devnull, stderr = devnull)
+        sleep(1)
+
+    def tearDown(self):
+        """ Stop the mock TPM script """
+        if self._simulator is not None:
+            self._simulator.kill()
+            self._simulator.wait()
+            self._simulator = None
+
+    @staticmethod
+    def _resident_memory():
+        """ Resident memory of this process, in bytes """
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+
+    def test_read_into(self):
+        """ Check that values are read into caller-provided buffers """
+
+        tpm = TPM(simulator = True, ip = self._ip, port = self._port)
+        FPGABoard.load_firmware(tpm, Device.Board, self._config_file)
+
+        tpm['board.regfile.block'] = range(64)
+        buffer = np.zeros(64, dtype = np.uint32)
+        self.assertIs(tpm.read_into('board.regfile.block', buffer), buffer)
+        self.assertEqual(buffer.tolist(), range(64))
+
+        buffer[:] = 0
+        tpm.read_into(tpm.register_list['board.regfile.block']['address'] + 32 * 4, buffer[:16])
+        self.assertEqual(buffer[:16].tolist(), range(32, 48))
+
+        # Arrays are written through handles in the same way as lists
+        tpm.register('board.regfile.block').write(np.arange(100, 108, dtype = np.uint32), offset = 8)
+        self.assertEqual(tpm.read_register('board.regfile.block', 10, 6), [6, 7] + range(100, 108))
+
+        tpm['board.regfile.control'] = 0x5A
+        buffer = np.zeros(1, dtype = np.uint32)
+        tpm.register('board.regfile.control.mode').read_into(buffer)
+        self.assertEqual(buffer[0], 0x5)
+
+        tpm.disconnect()
+
+    def test_spi_batch(self):
+        """ Check that SPI batches write and read device registers, and verify written values """
+
+        tpm = TPM(simulator = True, ip = self._ip, port = self._port)
+        FPGABoard.load_firmware(tpm, Device.Board, self._config_file)
+        tpm.load_spi_devices(Device.Board, self._spi_file)
+        tpm.get_device_list(reset = True)
+
+        sequence = [(address, address & 0xFF) for address in range(0x100, 0x120)]
+        values = tpm.spi_batch('pll', sequence + [spi_read(0x105), spi_check(0x11F, 0x1F)], verify = True)
+        self.assertEqual(values, [0x05])
+        self.assertEqual(tpm.spi_statistics['accesses'], 66)
+        self.assertEqual(tpm[('pll', 0x110)], 0x10)
+
+        # Devices sharing the SPI controller are selected separately
+        tpm.spi_batch('adc0', [(0x105, 0xAA)])
+        self.assertEqual(tpm.spi_batch('adc0', [spi_read(0x105)]), [0xAA])
+        self.assertEqual(tpm.spi_batch('pll', [spi_read(0x105)]), [0x05])
+
+        self.assertRaises(BoardError, tpm.spi_batch, 'pll', [spi_check(0x105, 0x06)])
+        self.assertRaises(BoardError, tpm.spi_batch, 'pll', [spi_wait(0x105, 0x06, timeout = 0.1)])
+        self.assertEqual(tpm.spi_batch('pll', [spi_wait(0x105, 0x06, timeout = 0.1, required = False),
+                                               spi_read(0x106)]), [0x06])
+        self.assertRaises(LibraryError, tpm.spi_batch, 'missing', sequence)
+
+        tpm.disconnect()
+
+    def test_shadow_cache(self):
+        """ Check that unflushed writes are held in the shadow cache and seen by address-level I/O """
+
+        tpm = TPM(simulator = True, ip = self._ip, port = self._port)
+        FPGABoard.load_firmware(tpm, Device.Board, self._config_file)
+        address = tpm.register_list['board.regfile.control']['address']
+
+        tpm['board.regfile.control'] = 0x13
+        tpm.enable_shadow_cache(write_back = True)
+
+        # Bitfield writes are coalesced in the cache until flushed
+        tpm['board.regfile.control'] = 0x77
+        tpm['board.regfile.control.enable'] = 0x2
+        self.assertEqual(tpm['board.regfile.control'], 0x72)
+        self.assertEqual(tpm.get_shadow_cache_statistics()['words'], 1)
+
+        # Address reads send unflushed writes first
+        self.assertEqual(tpm.read_address(address), 0x72)
+
+        # Address writes replace unflushed writes, which are not sent on a later flush
+        tpm['board.regfile.control'] = 0x44
+        tpm.write_address(address, 0x21)
+        tpm.flush()
+        self.assertEqual(tpm.read_address(address), 0x21)
+        self.assertEqual(tpm['board.regfile.control.mode'], 0x2)
+
+        tpm.disable_shadow_cache()
+        tpm.disconnect()
+
+    def test_shadow_cache_write_back(self):
+        """ Check that unflushed writes reach the board when the register list is reloaded or on disconnect """
+
+        tpm = TPM(simulator = True, ip = self._ip, port = self._port)
+        FPGABoard.load_firmware(tpm, Device.Board, self._config_file)
+        address = tpm.register_list['board.regfile.control']['address']
+
+        tpm['board.regfile.control'] = 0x13
+        tpm.enable_shadow_cache(write_back = True)
+        tpm['board.regfile.control'] = 0x31
+        tpm.get_register_list(reset = True)
+        tpm.disable_shadow_cache()
+        self.assertEqual(tpm.read_address(address), 0x31)
+
+        tpm.enable_shadow_cache(write_back = True)
+        tpm['board.regfile.control'] = 0x42
+        tpm.disconnect()
+
+        tpm = TPM(simulator = True, ip = self._ip, port = self._port)
+        self.assertEqual(tpm.read_address(address), 0x42)
+        tpm.disconnect()
+
+    def test_concurrent_access(self):
+        """ Check that a statistics monitor and its caller can access the same board concurrently """
+
+        tpm = TPM(simulator = True, ip = self._ip, port = self._port)
+        FPGABoard.load_firmware(tpm, Device.Board, self._config_file)
+        tpm['board.regfile.block'] = range(1024)
+
+        with StatisticsMonitor(lambda: tpm.read_register('board.regfile.block', 1024, as_array = True),
+                               period = 0.005, latency = 0) as monitor:
+            for i in range(500):
+                tpm['board.regfile.control'] = i & 0xFF
+                self.assertEqual(tpm['board.regfile.control'], i & 0xFF)
+
+        self.assertEqual(monitor.errors, 0)
+        self.assertTrue(monitor.acquired > 10)
+        self.assertTrue(all(np.array_equal(sample.data, np.arange(1024)) for sample in monitor.latest(10)))
+
+        tpm.disconnect()
+
+    def test_read_cache(self):
+        """ Check that cached reads are served within their time-to-live and dropped on writes """
+
+        tpm = TPM(simulator = True, ip = self._ip, port = self._port)
+        FPGABoard.load_firmware(tpm, Device.Board, self._config_file)
+        tpm.enable_read_cache(ttl = {CachePolicy.Slow: 0.2}, rules = [('regfile.control', CachePolicy.Static),
+                                                                     ('regfile.block', CachePolicy.Slow)])
+
+        tpm['board.regfile.control'] = 0x5A
+        for i in range(10):
+            self.assertEqual(tpm['board.regfile.control.mode'], 0x5)
+        self.assertEqual(tpm.get_read_cache_statistics()['misses'], 1)
+        self.assertEqual(tpm.get_read_cache_statistics()['hits'], 9)
+
+        # Writes through any path drop cached words
+        tpm['board.regfile.control.enable'] = 0x3
+        self.assertEqual(tpm['board.regfile.control'], 0x53)
+        tpm.write_address(tpm.register_list['board.regfile.control']['address'], 0x11)
+        self.assertEqual(tpm['board.regfile.control'], 0x11)
+
+        # Slow registers expire, and volatile registers are always read from the board
+        tpm['board.regfile.block'] = range(1024)
+        self.assertEqual(tpm.read_register('board.regfile.block', 4), range(4))
+        address = tpm.register_list['board.regfile.block']['address']
+        with tpm.transaction() as transaction:
+            transaction.write(address, 7)
+        self.assertEqual(tpm.read_register('board.regfile.block', 4), [7, 1, 2, 3])
+
+        # Another client, sharing the board's connection
+        other = TPM(simulator = True, ip = self._ip, port = self._port)
+        other.write_address(address, 9)
+        self.assertEqual(tpm.read_register('board.regfile.block', 4), [7, 1, 2, 3])
+        sleep(0.2)
+        self.assertEqual(tpm.read_register('board.regfile.block', 4), [9, 1, 2, 3])
+
+        tpm.read_register('board.spi.read_data')
+        self.assertEqual(tpm.get_read_cache_statistics()['bypassed'], 1)
+
+        tpm.disable_read_cache()
+        tpm.disconnect()
+
+    def test_wait_register(self):
+        """ Check that register waits return once the condition holds and time out otherwise """
+
+        tpm = TPM(simulator = True, ip = self._ip, port = self._port)
+        FPGABoard.load_firmware(tpm, Device.Board, self._config_file)
+        wait_statistics.reset()
+
+        tpm['board.regfile.control'] = 0x5A
+        self.assertLess(wait_register(tpm, 'board.regfile.control', 0xA, mask = 0xF, name = "test.ready"), 1)
+        self.assertRaises(BoardError, wait_register, [tpm, tpm], 'board.regfile.control', [0x1, 0x2],
+                          timeout = 0.2, name = "test.ready")
+
+        statistics = wait_statistics.summary()['test.ready']
+        self.assertEqual(statistics['count'], 2)
+        self.assertEqual(statistics['timeouts'], 1)
+        self.assertGreaterEqual(statistics['max'], 0.2)
+
+        tpm.disconnect()
+
+    def test_async(self):
+        """ Check that asynchronous operations are performed in order and return their results """
+
+        tile = AsyncTPM(simulator = True, ip = self._ip, port = self._port)
+        tile.connected.result()
+        tile.load_firmware(Device.Board, self._config_file).result()
+
+        pending = [tile.write_register('board.regfile.control.enable', i) for i in range(16)]
+        pending.append(tile.read_register('board.regfile.control.enable'))
+        self.assertEqual(gather(pending)[-1], 15)
+
+        self.assertRaises(BoardError, gather, [tile.read_register('board.regfile.missing')])
+
+        gather([tile.disconnect()])
+        tile.close()
+
+    @unittest.skipUnless(os.path.exists("/proc/self/statm"), "Requires /proc/self/statm")
+    def test_memory_growth(self):
+        """ Check that steady-state reads and masked writes do not leak memory """
+
+        tpm = TPM(simulator = True, ip = self._ip, port = self._port)
+        FPGABoard.load_firmware(tpm, Device.Board, self._config_file)
+
+        buffer = np.zeros(16, dtype = np.uint32)
+        address = tpm.register_list['board.regfile.block']['address']
+
+        def monitor(iterations):
+            for i in range(iterations):
+                tpm.read_into('board.regfile.block', buffer)
+                tpm.read_into(address, buffer)
+                tpm['board.regfile.control.enable'] = i & 0xF
+                tpm['board.regfile.control']
+
+        # Warm up, such that pools and interpreter caches reach their steady-state size
+        monitor(2000)
+
+        # A leak grows memory in every window, while allocator growth happens in steps
+        growth = []
+        for i in range(3):
+            before = self._resident_memory()
+            monitor(5000)
+            growth.append(self._resident_memory() - before)
+
+        self.assertLess(min(growth), 64 * 1024)
+        self.assertLess(sum(growth), 1024 * 1024)
+
+        tpm.disconnect()
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,86 @@
+# Access layer tests against the UCP simulator, using the pytest fixtures in conftest.py
+import numpy as np
+import os
+
+from pyfabil import TPM, Device
+from pyfabil.boards.fpgaboard import FPGABoard
+
+TPM_TEST_MAP = os.path.join(os.path.dirname(__file__), "files", "tpm_test_map.xml")
+
+
+def connect(board, ip = "127.0.0.1"):
+    """ Connect to simulated board and load the TPM test memory map """
+    tpm = TPM(simulator = True, ip = ip, port = board.port)
+    FPGABoard.load_firmware(tpm, Device.Board, TPM_TEST_MAP)
+    return tpm
+
+
+def test_read_write(tpm_simulator):
+    """ Check that register and multi-packet block accesses reach the simulated address space """
+
+    tpm = connect(tpm_simulator)
+
+    tpm['board.regfile.control'] = 0x5A
+    assert tpm_simulator.read_register('board.regfile.control.mode') == 0x5
+
+    tpm_simulator.write_register('board.regfile.block', np.arange(1024))
+    assert np.array_equal(tpm.read_register('board.regfile.block', 1024, as_array = True), np.arange(1024))
+    assert tpm_simulator.statistics['requests'] == tpm_simulator.statistics['replies']
+
+    tpm.disconnect()
+
+
+def test_retry_on_loss(tpm_simulator):
+    """ Check that lost requests are re-sent and transfers complete """
+
+    tpm = connect(tpm_simulator)
+    tpm.set_timeout_policy(0.005, 0.02, max_retries = 10)
+    tpm_simulator.loss = 0.2
+
+    for i in range(20):
+        tpm['board.regfile.block'] = range(i, i + 1024)
+        assert np.array_equal(tpm.read_register('board.regfile.block', 1024, as_array = True), np.arange(i, i + 1024))
+
+    statistics = tpm.get_link_statistics()
+    assert tpm_simulator.statistics['lost'] > 0
+    assert statistics['retries'] >= tpm_simulator.statistics['lost']
+    assert statistics['failures'] == 0
+
+    tpm.disconnect()
+
+
+def test_reordered_replies(ucp_simulator):
+    """ Check that replies arriving out of order are matched to their packets """
+
+    board = ucp_simulator.add_board(ip = "127.0.0.2", memory_map = TPM_TEST_MAP, reordering = 0.3,
+                                    reorder_delay = 0.002, seed = 7)
+    board.write_register('board.regfile.block', np.arange(1024) * 3)
+
+    tpm = connect(board, "127.0.0.2")
+    tpm.set_window_size(8)
+    for i in range(20):
+        assert np.array_equal(tpm.read_register('board.regfile.block', 1024, as_array = True), np.arange(1024) * 3)
+
+    assert board.statistics['reordered'] > 0
+    assert tpm.get_link_statistics()['failures'] == 0
+
+    tpm.disconnect()
+
+
+def test_multiple_boards(ucp_simulator):
+    """ Check that boards served by a single simulator are connected and accessed independently """
+
+    boards = [ucp_simulator.add_board(ip = "127.0.0.%d" % (i + 3), memory_map = TPM_TEST_MAP, latency = 0.001)
+              for i in range(4)]
+    tpms = [connect(board, "127.0.0.%d" % (i + 3)) for i, board in enumerate(boards)]
+    assert len(set([tpm.id for tpm in tpms])) == 4
+
+    for i, tpm in enumerate(tpms):
+        tpm['board.regfile.control'] = i + 1
+    for i, (board, tpm) in enumerate(zip(boards, tpms)):
+        assert tpm['board.regfile.control'] == i + 1
+        assert board.read_register('board.regfile.control') == i + 1
+        assert board.statistics['requests'] > 0
+
+    for tpm in tpms:
+        tpm.disconnect()
@@ -1,99 +1,54 @@
 # This script present a mock TPM, used for testing the access layer
+from optparse import OptionParser
+from time import sleep
+import logging
 
-import socket
-import struct
+try:
+    from pyfabil.tests.ucp_simulator import UCPSimulator
+except ImportError:
+    from ucp_simulator import UCPSimulator
 
 UDP_PORT = 10000
 
-# Unpack string for UCP packet header
-# 1st byte:  PSN
-# 2nd byte:  OPCODE
-# 3rd byte:  N
-# 4th byte:  ADDRESS
-UCP_header_fmt = 'IIII'
-
-# UCP OPCODES
-OPCODE_READ  = 0x01
-OPCODE_WRITE = 0x02
-
-# Mock TPM memory
-# An entry per memory location is created
-memory = { }
-
-def readMemory(address, n):
-    """ Mock reading from TPM memory """
-
-    # Read values
-    values = []
-
-    # For each memory address, check if it is alread in memory
-    # if not, create a value and store in memory
-    for i in range(n):
-        addr = address + i * 4
-        if addr in memory.keys():
-            values.append(memory[addr])
-        else:
-            memory[addr] = 0
-            values.append(0)
-
-    # Return values
-    return values
-
-def writeMemory(address, n, values):
-    """ Mock writing to TPM memory """
-
-    # Blindly store all value to memory
-    for i in range(n):
-        addr = address + i * 4
-        memory[addr] = values[i]
-
 # Script entry point
 if __name__ == "__main__":
-    
-    # Create socket
-    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-
-    # Bind socket
-    sock.bind(("", UDP_PORT))
-
-    # Continuously wait for packets
-    while True:
-
-        # Receive packet (blocking)
-        print "Waiting for packet"
-        data, addr = sock.recvfrom(512)
-        
-        # Received packet, extract and convert data
-        psn, opcode, n, address = struct.unpack(UCP_header_fmt, data[:16])
-        psn     = psn
-        opcode  = opcode
-        n       = n
-        address = address
-
-        # Switch on opcode
-        if (opcode == OPCODE_READ):
-         
-            # Read operation, return packet with data
-            values = readMemory(address, n)
-            packet = struct.pack("II" + "I" * n, 
-                                 psn, 
-                                 address, 
-                                 *values)
-            sock.sendto(packet, addr)
-            print "Request to read addr %#08X, provided value %d (x %d)" % (address, values[0], n)
-
-        elif (opcode == OPCODE_WRITE):
-
-            # Write opreation, extract value
-            values = struct.unpack('I' * n, data[16:])        
 
-            # Return reply packet
-            writeMemory(address, n, values)
-            packet = struct.pack("II", 
-                                 psn, 
-                                 address)
-            sock.sendto(packet, addr)
-            print "Request to write value %d to address %#08X" % (values[0], address)
-        else:
-            print "Unsupported opcode %d" % opcode
-            continue
+    parser = OptionParser(usage = "usage: %tpm_simulator [options]")
+    parser.add_option("-p", "--port", action = "store", dest = "port", type = "int",
+                      default = UDP_PORT, help = "Port of first simulated board [default: %default]")
+    parser.add_option("-n", "--nof_boards", action = "store", dest = "nof_boards", type = "int",
+                      default = 1, help = "Number of simulated boards, on consecutive ports [default: %default]")
+    parser.add_option("-i", "--ip", action = "store", dest = "ip",
+                      default = "", help = "Interface to listen on [default: all]")
+    parser.add_option("-m", "--memory_map", action = "store", dest = "memory_map",
+                      default = None, help = "Firmware XML memory map [default: None]")
+    parser.add_option("-s", "--spi", action = "store", dest = "spi",
+                      default = None, help = "SPI XML file [default: None]")
+    parser.add_option("-l", "--latency", action = "store", dest = "latency", type = "float",
+                      default = 0, help = "Reply latency in seconds [default: %default]")
+    parser.add_option("-j", "--jitter", action = "store", dest = "jitter", type = "float",
+                      default = 0, help = "Maximum additional random reply latency in seconds [default: %default]")
+    parser.add_option("", "--loss", action = "store", dest = "loss", type = "float",
+                      default = 0, help = "Probability of dropping a request [default: %default]")
+    parser.add_option("", "--reordering", action = "store", dest = "reordering", type = "float",
+                      default = 0, help = "Probability of delaying a reply past later ones [default: %default]")
+    parser.add_option("", "--seed", action = "store", dest = "seed", type = "int",
+                      default = None, help = "Random seed for impairments [default: None]")
+    (conf, args) = parser.parse_args()
+
+    logging.basicConfig(format = "%(asctime)s - %(message)s", level = logging.INFO)
+
+    simulator = UCPSimulator()
+    for i in range(conf.nof_boards):
+        board = simulator.add_board(port = conf.port + i, ip = conf.ip, memory_map = conf.memory_map,
+                                    spi_devices = conf.spi, latency = conf.latency, jitter = conf.jitter,
+                                    loss = conf.loss, reordering = conf.reordering,
+                                    seed = None if conf.seed is None else conf.seed + i)
+        logging.info("Simulating TPM on port %d" % board.port)
+
+    simulator.start()
+    try:
+        while True:
+            sleep(1)
+    except KeyboardInterrupt:
+        simulator.stop()
@@ -0,0 +1,502 @@
+# This module implements a mock UCP board server, used for testing and benchmarking the access layer.
+# Any number of boards can be simulated from a single event loop, each listening on its own port
+
+from collections import namedtuple
+import xml.etree.ElementTree as ET
+import numpy as np
+import threading
+import logging
+import random
+import select
+import socket
+import struct
+import heapq
+import errno
+import time
+
+__author__ = 'Alessio Magro'
+
+# UCP packet headers
+# Command: PSN, OPCODE, N, ADDRESS
+# Reply:   PSN, ADDRESS
+UCP_COMMAND_HEADER = struct.Struct('<IIII')
+UCP_REPLY_HEADER   = struct.Struct('<II')
+
+# UCP OPCODES
+OPCODE_READ        = 0x01
+OPCODE_WRITE       = 0x02
+OPCODE_BITWISE_AND = 0x03
+OPCODE_BITWISE_OR  = 0x04
+OPCODE_FIFO_READ   = 0x09
+OPCODE_FIFO_WRITE  = 0x0A
+
+# Register entry of a memory map
+SimulatedRegister = namedtuple('SimulatedRegister', ['name', 'address', 'mask', 'shift', 'size', 'fifo'])
+
+
+def load_memory_map(filepath):
+    """ Load registers from a firmware XML memory map. Addresses of nested nodes are
+        relative to their parent, and node identifiers are joined to form register names
+    :param filepath: XML file path
+    :return: Dictionary of SimulatedRegister, keyed by register name
+    """
+
+    registers = {}
+
+    def process(node, prefix, base_address):
+        for child in node:
+            if 'id' not in child.attrib:
+                continue
+
+            name    = child.attrib['id'] if prefix is None else "%s.%s" % (prefix, child.attrib['id'])
+            address = base_address + int(child.attrib.get('address', '0'), 16)
+            mask    = int(child.attrib.get('mask', '0xFFFFFFFF'), 16) & 0xFFFFFFFF
+            shift   = 0
+            while mask != 0 and (mask >> shift) & 1 == 0:
+                shift += 1
+            tags    = child.attrib.get('tags', child.attrib.get('tag', ''))
+
+            registers[name] = SimulatedRegister(name, address, mask, shift, int(child.attrib.get('size', '1')),
+                                                'fifo' in tags.lower())
+            process(child, name, address)
+
+    process(ET.parse(filepath).getroot(), None, 0)
+    return registers
+
+
+def load_spi_devices(filepath):
+    """ Load SPI devices from an SPI XML file
+    :param filepath: XML file path
+    :return: Dictionary of chip select lines, keyed by device name
+    """
+    return dict([(node.attrib['id'], int(node.attrib['spi_en']))
+                 for node in ET.parse(filepath).getroot() if 'id' in node.attrib and 'spi_en' in node.attrib])
+
+
+class SimulatedFifo(object):
+    """ FIFO of 32-bit words, stored as a list of chunks such that packets are queued without copying """
+
+    def __init__(self):
+        self._chunks = []
+        self._offset = 0
+        self.size    = 0
+
+    def push(self, values):
+        """ Add values to FIFO
+        :param values: numpy.uint32 array
+        """
+        self._chunks.append(values)
+        self.size += values.size
+
+    def pop(self, n):
+        """ Remove values from FIFO. Reads from an empty FIFO return zeros
+        :param n: Number of values
+        :return: numpy.uint32 array
+        """
+        values = np.zeros(n, dtype = np.uint32)
+        filled = 0
+        while filled < n and len(self._chunks) > 0:
+            chunk = self._chunks[0]
+            count = min(n - filled, chunk.size - self._offset)
+            values[filled:filled + count] = chunk[self._offset:self._offset + count]
+            filled += count
+            self._offset += count
+            if self._offset == chunk.size:
+                self._chunks.pop(0)
+                self._offset = 0
+        self.size -= filled
+        return values
+
+    def contents(self):
+        """ Get all values in the FIFO without removing them
+        :return: numpy.uint32 array
+        """
+        if len(self._chunks) == 0:
+            return np.zeros(0, dtype = np.uint32)
+        return np.concatenate([self._chunks[0][self._offset:]] + self._chunks[1:])
+
+    def clear(self):
+        """ Remove all values """
+        self._chunks, self._offset, self.size = [], 0, 0
+
+
+class SimulatedBoard(object):
+    """ Address space and request handling of a single simulated board. Memory is stored
+        in numpy pages which are allocated when first accessed """
+
+    # Number of 32-bit words per memory page
+    PAGE_WORDS = 4096
+
+    def __init__(self, memory_map = None, spi_devices = None, latency = 0, jitter = 0, loss = 0,
+                 reordering = 0, reorder_delay = 0.002, seed = None):
+        """ Class constructor
+        :param memory_map: Firmware XML memory map, used for register names, FIFO registers and the SPI interface
+        :param spi_devices: SPI XML file, used to access SPI devices by name
+        :param latency: Delay applied to every reply, in seconds
+        :param jitter: Maximum additional random delay applied to every reply, in seconds
+        :param loss: Probability of a request being dropped
+        :param reordering: Probability of a reply being delayed past later replies
+        :param reorder_delay: Additional delay applied to reordered replies, in seconds
+        :param seed: Random seed for reproducible impairments
+        """
+        self.latency       = latency
+        self.jitter        = jitter
+        self.loss          = loss
+        self.reordering    = reordering
+        self.reorder_delay = reorder_delay
+        self._random       = random.Random(seed)
+
+        self._pages = {}
+        self.fifos  = {}
+        self._hooks = []
+
+        self.statistics = {'requests': 0, 'replies': 0, 'lost': 0, 'reordered': 0, 'unsupported': 0}
+
+        # Load memory map
+        self.registers = load_memory_map(memory_map) if memory_map is not None else {}
+        for register in self.registers.itervalues():
+            if register.fifo:
+                self.add_fifo(register.address)
+
+        # SPI interface, available if the memory map contains the SPI registers
+        self.spi_devices = load_spi_devices(spi_devices) if spi_devices is not None else {}
+        self.spi_memory  = {}
+        self._spi        = None
+        spi_names = ['address', 'write_data', 'read_data', 'chip_select', 'cmd', 'cmd.start', 'cmd.rnw']
+        spi_prefix = [name[:-len('spi.cmd.start')] for name in self.registers if name.endswith('spi.cmd.start')]
+        if len(spi_prefix) > 0 and all(["%sspi.%s" % (spi_prefix[0], n) in self.registers for n in spi_names]):
+            self._spi = dict([(n, self.registers["%sspi.%s" % (spi_prefix[0], n)]) for n in spi_names])
+            self.on_write(self._spi['cmd'].address, self._spi_command)
+
+        # Socket, assigned when the board is added to a simulator
+        self.socket = None
+        self.port   = None
+
+    # ----------------------------- Memory access -------------------------
+
+    def read(self, address, n = 1):
+        """ Read words from memory
+        :param address: Byte address
+        :param n: Number of words
+        :return: numpy.uint32 array
+        """
+        word = address >> 2
+        page, offset = divmod(word, self.PAGE_WORDS)
+        if offset + n <= self.PAGE_WORDS:
+            return self._page(page)[offset:offset + n].copy()
+
+        values = np.empty(n, dtype = np.uint32)
+        done = 0
+        while done < n:
+            page, offset = divmod(word + done, self.PAGE_WORDS)
+            count = min(n - done, self.PAGE_WORDS - offset)
+            values[done:done + count] = self._page(page)[offset:offset + count]
+            done += count
+        return values
+
+    def write(self, address, values):
+        """ Write words to memory
+        :param address: Byte address
+        :param values: Value or list/array of values
+        """
+        values = np.asarray(values, dtype = np.uint32).reshape(-1)
+        word = address >> 2
+        done = 0
+        while done < values.size:
+            page, offset = divmod(word + done, self.PAGE_WORDS)
+            count = min(values.size - done, self.PAGE_WORDS - offset)
+            self._page(page)[offset:offset + count] = values[done:done + count]
+            done += count
+
+    def read_register(self, name, n = 1):
+        """ Read register by name, applying bitmask and shift
+        :param name: Register name
+        :param n: Number of words
+        :return: Single value or numpy.uint32 array
+        """
+        register = self.registers[name]
+        values = (self.read(register.address, n) & register.mask) >> register.shift
+        return int(values[0]) if n == 1 else values
+
+    def write_register(self, name, values):
+        """ Write register by name, applying bitmask and shift
+        :param name: Register name
+        :param values: Value or list/array of values
+        """
+        register = self.registers[name]
+        values = np.asarray(values, dtype = np.uint32).reshape(-1)
+        current = self.read(register.address, values.size)
+        self.write(register.address, (current & ~np.uint32(register.mask)) |
+                                     ((values << register.shift) & register.mask))
+
+    def add_fifo(self, address):
+        """ Treat address as a FIFO. Writes to the address are queued and reads remove values from the queue
+        :param address: Byte address
+        :return: SimulatedFifo
+        """
+        if address not in self.fifos:
+            self.fifos[address] = SimulatedFifo()
+        return self.fifos[address]
+
+    def on_read(self, address, callback, n = 1):
+        """ Call function before a request reads from an address range, such that
+            scripts can update memory contents
+        :param address: Byte address
+        :param callback: Function called with the board, request address and number of words
+        :param n: Number of words in address range
+        """
+        self._hooks.append((False, address, address + n * 4, callback))
+
+    def on_write(self, address, callback, n = 1):
+        """ Call function after a request writes to an address range
+        :param address: Byte address
+        :param callback: Function called with the board, request address and written values
+        :param n: Number of words in address range
+        """
+        self._hooks.append((True, address, address + n * 4, callback))
+
+    # ----------------------------- SPI devices -------------------------
+
+    def spi_read(self, device, address):
+        """ Read from a simulated SPI device
+        :param device: Device name or chip select line
+        :param address: Device address
+        :return: Value
+        """
+        return self.spi_memory.get((self.spi_devices.get(device, device), address), 0)
+
+    def spi_write(self, device, address, value):
+        """ Write to a simulated SPI device
+        :param device: Device name or chip select line
+        :param address: Device address
+        :param value: Value
+        """
+        self.spi_memory[(self.spi_devices.get(device, device), address)] = value & 0xFF
+
+    def _spi_command(self, board, address, values):
+        """ Perform SPI request when the start bit of the command register is set """
+        spi = self._spi
+        cmd = int(self.read(spi['cmd'].address)[0])
+        if cmd & spi['cmd.start'].mask == 0:
+            return
+
+        def field(name):
+            return (int(self.read(spi[name].address)[0]) & spi[name].mask) >> spi[name].shift
+
+        chip_select = field('chip_select')
+        line = 0
+        while chip_select > 1:
+            chip_select >>= 1
+            line += 1
+
+        if cmd & spi['cmd.rnw'].mask:
+            value = self.spi_read(line, field('address'))
+            current = int(self.read(spi['read_data'].address)[0]) & ~spi['read_data'].mask
+            self.write(spi['read_data'].address, current | ((value << spi['read_data'].shift) & spi['read_data'].mask))
+        else:
+            self.spi_write(line, field('address'), field('write_data'))
+
+        # Request complete
+        self.write(spi['cmd'].address, cmd & ~spi['cmd.start'].mask & 0xFFFFFFFF)
+
+    # ----------------------------- Request handling -------------------------
+
+    def handle(self, data):
+        """ Process a UCP request
+        :param data: Request packet
+        :return: Reply packet, or None if no reply is sent
+        """
+        self.statistics['requests'] += 1
+        if len(data) < UCP_COMMAND_HEADER.size:
+            self.statistics['unsupported'] += 1
+            return None
+
+        psn, opcode, n, address = UCP_COMMAND_HEADER.unpack_from(data)
+        header = UCP_REPLY_HEADER.pack(psn, address)
+
+        if opcode in [OPCODE_READ, OPCODE_FIFO_READ]:
+            self._run_hooks(False, address, n)
+            if opcode == OPCODE_FIFO_READ or address in self.fifos:
+                values = self.add_fifo(address).pop(n)
+            else:
+                values = self.read(address, n)
+            return header + values.tostring()
+
+        elif opcode in [OPCODE_WRITE, OPCODE_FIFO_WRITE, OPCODE_BITWISE_AND, OPCODE_BITWISE_OR]:
+            values = np.frombuffer(data, dtype = '<u4', count = n, offset = UCP_COMMAND_HEADER.size)
+            if opcode == OPCODE_FIFO_WRITE or address in self.fifos:
+                self.add_fifo(address).push(values.astype(np.uint32))
+            elif opcode == OPCODE_BITWISE_AND:
+                self.write(address, self.read(address, n) & values)
+            elif opcode == OPCODE_BITWISE_OR:
+                self.write(address, self.read(address, n) | values)
+            else:
+                self.write(address, values)
+            self._run_hooks(True, address, n, values)
+            return header
+
+        self.statistics['unsupported'] += 1
+        return None
+
+    def _run_hooks(self, write, address, n, values = None):
+        """ Call hooks overlapping request address range """
+        end = address + n * 4
+        for hook_write, start, stop, callback in self._hooks:
+            if hook_write == write and start < end and address < stop:
+                callback(self, address, values if write else n)
+
+    def _page(self, page):
+        """ Get memory page, allocating it if required """
+        memory = self._pages.get(page)
+        if memory is None:
+            memory = self._pages[page] = np.zeros(self.PAGE_WORDS, dtype = np.uint32)
+        return memory
+
+
+class UCPSimulator(object):
+    """ Serves any number of simulated boards from a single non-blocking event loop """
+
+    def __init__(self):
+        self.boards   = []
+        self._sockets = {}
+        self._pending = []
+        self._counter = 0
+        self._thread  = None
+        self._stop    = threading.Event()
+        self._lock    = threading.Lock()
+
+    def add_board(self, port = 0, ip = "", **kwargs):
+        """ Create a simulated board listening on a UDP port. The access layer identifies boards
+            by IP, so boards accessed from the same process should listen on different loopback
+            addresses (127.0.0.1, 127.0.0.2, ...)
+        :param port: Port to listen on, 0 to choose a free port
+        :param ip: Interface to listen on, all interfaces by default
+        :param kwargs: SimulatedBoard arguments
+        :return: SimulatedBoard, with its port set
+        """
+        board = SimulatedBoard(**kwargs)
+
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4 * 1024 * 1024)
+        sock.bind((ip, port))
+        sock.setblocking(0)
+
+        board.socket = sock
+        board.port   = sock.getsockname()[1]
+
+        with self._lock:
+            self.boards.append(board)
+            self._sockets[sock.fileno()] = board
+        return board
+
+    def start(self):
+        """ Run event loop on a background thread """
+        if self._thread is not None:
+            return self
+        self._stop.clear()
+        self._thread = threading.Thread(target = self.run, name = "UCPSimulator")
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """ Stop event loop and close all sockets """
+        self._stop.set()
+        self.join()
+        with self._lock:
+            for board in self.boards:
+                board.socket.close()
+            self.boards, self._sockets = [], {}
+
+    def join(self, timeout = None):
+        """ Wait for event loop thread to finish """
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join(timeout)
+            if not self._thread.is_alive():
+                self._thread = None
+
+    def run(self):
+        """ Event loop, runs until stop is called """
+        while not self._stop.is_set():
+            with self._lock:
+                sockets = [board.socket for board in self.boards]
+
+            # Wait until a request arrives or a delayed reply is due
+            timeout = 0.05
+            if len(self._pending) > 0:
+                timeout = min(timeout, max(0, self._pending[0][0] - time.time()))
+
+            try:
+                readable = select.select(sockets, [], [], timeout)[0] if len(sockets) > 0 else []
+            except (select.error, socket.error, ValueError):
+                # Sockets closed while waiting
+                continue
+
+            for sock in readable:
+                board = self._sockets.get(sock.fileno())
+                if board is not None:
+                    self._receive(board)
+
+            self._send_due()
+
+    def _receive(self, board):
+        """ Process all requests waiting on a board's socket """
+        while True:
+            try:
+                data, address = board.socket.recvfrom(65536)
+            except socket.error as e:
+                if e.errno not in [errno.EAGAIN, errno.EWOULDBLOCK]:
+                    logging.warning("UCPSimulator: Receive failed on port %d (%s)" % (board.port, str(e)))
+                return
+
+            # Simulate lost requests
+            if board.loss > 0 and board._random.random() < board.loss:
+                board.statistics['requests'] += 1
+                board.statistics['lost'] += 1
+                continue
+
+            try:
+                reply = board.handle(data)
+            except Exception as e:
+                logging.warning("UCPSimulator: Failed to process request on port %d (%s)" % (board.port, str(e)))
+                continue
+
+            if reply is None:
+                continue
+
+            # Simulate latency and reordering
+            delay = board.latency
+            if board.jitter > 0:
+                delay += board._random.random() * board.jitter
+            if board.reordering > 0 and board._random.random() < board.reordering:
+                delay += board.reorder_delay
+                board.statistics['reordered'] += 1
+
+            if delay <= 0:
+                self._send(board, reply, address)
+            else:
+                self._counter += 1
+                heapq.heappush(self._pending, (time.time() + delay, self._counter, board, reply, address))
+
+    def _send_due(self):
+        """ Send delayed replies which are due """
+        now = time.time()
+        while len(self._pending) > 0 and self._pending[0][0] <= now:
+            _, _, board, reply, address = heapq.heappop(self._pending)
+            self._send(board, reply, address)
+
+    @staticmethod
+    def _send(board, reply, address):
+        try:
+            board.socket.sendto(reply, address)
+            board.statistics['replies'] += 1
+        except socket.error as e:
+            logging.warning("UCPSimulator: Send failed on port %d (%s)" % (board.port, str(e)))
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+        return False
@@ -1,162 +1,146 @@
 # This script present a mock UniBoard, used for testing the access layer
 from time import sleep
-import threading
-import socket
+import numpy as np
+import logging
 import struct
 
-UDP_PORT = 50000
-
-# Unpack string for UCP packet header
-# 1st byte:  PSN
-# 2nd byte:  OPCODE
-# 3rd byte:  N
-# 4th byte:  ADDRESS
-UCP_header_fmt = 'IIII'
-
-# UCP OPCODES
-OPCODE_READ  = 0x01
-OPCODE_WRITE = 0x02
-
-logging = False
-def output(string):
-    if logging:
-        print string
-
-class StoppableThread(threading.Thread):
-    """Thread class with a stop() method. The thread itself has to check
-    regularly for the stopped() condition."""
-
-    def __init__(self):
-        super(StoppableThread, self).__init__()
-        self._stop = threading.Event()
-
-    def stop(self):
-        self._stop.set()
-
-    def stopped(self):
-        return self._stop.isSet()
-
-class Node(StoppableThread):
+from pyfabil.tests.ucp_simulator import UCPSimulator
 
-    def __init__(self, port):
-        """ Class initialiser """
-        super(Node, self).__init__()
-
-        # Dictionary to represent memory
-        self._memory = {}
-
-        # Create socket, bind and set timeout
-        self._sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        self._sock.bind(("", port))
-        self._sock.settimeout(1)
-
-    def read_memory(self, address, n):
-        """ Mock reading from TPM memory """
-
-        # Read values
-        values = []
+UDP_PORT = 50000
 
-        # For each memory address, check if it is alread in memory
-        # if not, create a value and store in memory
-        for i in range(n):
-            addr = address + i * 4
-            if addr in self._memory.keys():
-                values.append(self._memory[addr])
-            else:
-                self._memory[addr] = 0
-                values.append(0)
+# UniBoard register map, stored in the ROM_SYSTEM_INFO area of each node
+ROM_ADDRESS = 0x1000
 
-        # Return values
-        return values
 
-    def write_memory(self, address, n, values):
-        """ Mock writing to TPM memory """
+def uniboard_rom(registers):
+    """ Encode register list as stored in the ROM_SYSTEM_INFO area of UniBoard nodes
+    :param registers: List of (name, address, size in words) tuples
+    :return: List of words, as stored on the node
+    """
+    rom = ' '.join(["%s %#x %d" % (name, address, size * 4) for name, address, size in registers])
+    rom += "\0" * (4 - len(rom) % 4)
+    return list(struct.unpack(">%dI" % (len(rom) / 4), rom))
 
-        # Blindly store all value to memory
-        for i in range(n):
-            addr = address + i * 4
-            self._memory[addr] = values[i]
 
-    def run(self):
+class UniBoardSimulator(object):
+    """ Simulates the nodes of a UniBoard, each listening on consecutive ports """
 
-        while True:
-            # If stopping clause has been set, return from main method
-            if self.stopped():
-                return
-
-            # Receive packet (non-blocking)
-            output("%s. Waiting for packet" % self.name)
-            try:
-                data, addr = self._sock.recvfrom(512)
-            except Exception:
-                continue
-
-            # Received packet, extract and convert data
-            psn, opcode, num_elements, address = struct.unpack(UCP_header_fmt, data[:16])
-            psn           = psn
-            opcode        = opcode
-            num_elements  = num_elements
-            address       = address
-
-            # Switch on opcode
-            if opcode == OPCODE_READ:
-
-                # Read operation, return packet with data
-                values = self.read_memory(address, num_elements)
-                packet = struct.pack("II" + "I" * num_elements,
-                                     psn,
-                                     address,
-                                     *values)
-                self._sock.sendto(packet, addr)
-                output("%s. Request to read addr %#08X, provided value %d (x %d)" % (self.name, address, values[0], num_elements))
-
-            elif opcode == OPCODE_WRITE:
-
-                # Write opreation, extract value
-                values = struct.unpack('I' * num_elements, data[16:])
-
-                # Return reply packet
-                self.write_memory(address, num_elements, values)
-                packet = struct.pack("II",
-                                     psn,
-                                     address)
-                self._sock.sendto(packet, addr)
-                output("%s. Request to write value %d to address %#08X" % (self.name, values[0], address))
-            else:
-                output("%s. Unsupported opcode %d" % (self.name, opcode))
-
-
-class UniBoardSimulator(StoppableThread):
-
-    def __init__(self):
-        super(UniBoardSimulator, self).__init__()
-        self._nodes = []
-
-    def run(self):
-
-        # Initialise and run Node threads
-        for i in xrange(8):
-            n = Node(UDP_PORT + i)
-            n.setName("Node %d" % i)
-            self._nodes.append(n)
-            n.start()
-
-        # Wait until the thread is stopped
-        while not self.stopped():
-            sleep(1)
+    def __init__(self, nof_nodes = 8, port = UDP_PORT, **kwargs):
+        """ Class initialiser
+        :param nof_nodes: Number of nodes
+        :param port: Port of first node
+        :param kwargs: SimulatedBoard arguments applied to all nodes
+        """
+        self._simulator = UCPSimulator()
+        self._nodes = [self._simulator.add_board(port = port + i, **kwargs) for i in xrange(nof_nodes)]
 
-        # Wait for all node threads to finish
-        [n.join() for n in self._nodes]
+    @property
+    def nodes(self):
+        """ Simulated node boards """
+        return self._nodes
 
-        return
+    def start(self):
+        self._simulator.start()
 
     def stop(self):
-        """ Override stop to call the stop method for all nodes """
-        [n.stop() for n in self._nodes]
-        super(UniBoardSimulator, self).stop()
+        self._simulator.stop()
+
+    def join(self, timeout = None):
+        self._simulator.join(timeout)
+
+
+class SimulatedEpcs(object):
+    """ EPCS flash controller of a simulated UniBoard node, with the MM->DP FIFO which holds
+        the page being written and the DP->MM FIFO which returns the page being read. Flash
+        is NOR, so erased words are all ones and programming can only clear bits """
+
+    # Register addresses, as listed in the node ROM
+    EPCS      = 0x4000
+    MMDP_CTRL = 0x4100
+    DPMM_CTRL = 0x4200
+    MMDP_DATA = 0x5000
+    DPMM_DATA = 0x6000
+    REGISTERS = [("REG_EPCS", EPCS, 8), ("REG_MMDP_CTRL", MMDP_CTRL, 2), ("REG_MMDP_DATA", MMDP_DATA, 256),
+                 ("REG_DPMM_CTRL", DPMM_CTRL, 2), ("REG_DPMM_DATA", DPMM_DATA, 256)]
+
+    PAGE_WORDS   = 64
+    SECTOR_PAGES = 1024
+
+    def __init__(self, board, busy_reads = 1):
+        """ Class constructor
+        :param board: SimulatedBoard of the node
+        :param busy_reads: Number of busy status reads after each command which report the controller as busy
+        """
+        self.pages       = {}
+        self.erased      = set()
+        self.statistics  = {'erased': 0, 'written': 0, 'read': 0}
+        self._board      = board
+        self._busy_reads = busy_reads
+        self._busy       = 0
+        self._fifo       = []
+
+        board.write(ROM_ADDRESS, uniboard_rom(self.REGISTERS))
+        board.on_write(self.EPCS + 2 * 4, self._read)
+        board.on_write(self.EPCS + 3 * 4, self._write)
+        board.on_write(self.EPCS + 4 * 4, self._erase)
+        board.on_read(self.EPCS + 5 * 4, self._status)
+        board.on_write(self.MMDP_DATA, self._push, n = 256)
+
+    def page(self, page):
+        """ Get contents of a flash page
+        :param page: Page number
+        :return: numpy.uint32 array
+        """
+        if page in self.pages:
+            return self.pages[page].copy()
+        return np.full(self.PAGE_WORDS, 0xFFFFFFFF if page // self.SECTOR_PAGES in self.erased else 0, dtype = np.uint32)
+
+    def _address(self):
+        return int(self._board.read(self.EPCS)[0])
+
+    def _read(self, board, address, values):
+        # Read page at the latched address into the DP->MM FIFO, which requires read enable
+        if board.read(self.EPCS + 4)[0] != 1:
+            return
+        board.write(self.DPMM_DATA, self.page(self._address() // (self.PAGE_WORDS * 4)))
+        self.statistics['read'] += 1
+        self._busy = self._busy_reads
+
+    def _write(self, board, address, values):
+        # Program the words queued in the MM->DP FIFO, from the start of the page at the latched address
+        page = self._address() // (self.PAGE_WORDS * 4)
+        data = np.full(self.PAGE_WORDS, 0xFFFFFFFF, dtype = np.uint32)
+        if len(self._fifo) > 0:
+            words = np.concatenate(self._fifo)[:self.PAGE_WORDS]
+            data[:words.size] = words
+        self.pages[page] = self.page(page) & data
+        self._fifo = []
+        self.statistics['written'] += 1
+        self._busy = self._busy_reads
+
+    def _erase(self, board, address, values):
+        sector = self._address() // (self.SECTOR_PAGES * self.PAGE_WORDS * 4)
+        for page in [p for p in self.pages if p // self.SECTOR_PAGES == sector]:
+            del self.pages[page]
+        self.erased.add(sector)
+        self.statistics['erased'] += 1
+        self._busy = self._busy_reads
+
+    def _status(self, board, address, n):
+        board.write(self.EPCS + 5 * 4, 1 if self._busy > 0 else 0)
+        self._busy = max(self._busy - 1, 0)
+
+    def _push(self, board, address, values):
+        self._fifo.append(np.array(values, dtype = np.uint32))
+
 
 # Script entry point
 if __name__ == "__main__":
-    logging = True
+    logging.basicConfig(format = "%(asctime)s - %(message)s", level = logging.INFO)
     simulator = UniBoardSimulator()
-    simulator.start()
\ No newline at end of file
+    simulator.start()
+    try:
+        while True:
+            sleep(1)
+    except KeyboardInterrupt:
+        simulator.stop()
@@ -4,12 +4,13 @@ setup(
     name='pyfabil',
     version='0.4',
     packages=['pyfabil', 'pyfabil.base', 'pyfabil.boards', 'pyfabil.plugins',
-              'pyfabil.tests', 'pyfabil.plugins.uniboard', 'pyfabil.plugins.tpm'],
+              'pyfabil.tests', 'pyfabil.plugins.uniboard', 'pyfabil.plugins.tpm',
+              'pyfabil.instruments', 'pyfabil.benchmarks'],
     url='https://github.com/lessju/TPM-Access-Layer/tree/master/python',
     license='',
     author='Alessio Magro',
     author_email='alessio.magro@um.edu.mt',
     description='',
-    install_requires=['futures', 'enum34'],
+    install_requires=['futures', 'enum34', 'numpy'],
     test_suite="pyfabil/tests",
 )
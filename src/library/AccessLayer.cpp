@@ -8,6 +8,7 @@
 // Includes and namespaces
 #include <string>
 #include <map>
+#include <pthread.h>
 
 #include "AccessLayer.hpp"
 #include "ROACH.hpp"
@@ -22,6 +23,18 @@ using namespace std;
 // through the same instance (similar to the Singleton design pattern)
 map<unsigned int, Board *> boards;
 
+// Protects the boards map, such that boards can be connected and accessed from multiple threads
+pthread_mutex_t boards_mutex = PTHREAD_MUTEX_INITIALIZER;
+
+// Find board in boards map. Iterators remain valid when other boards are added or removed
+static map<unsigned int, Board *>::iterator findBoard(ID id)
+{
+    pthread_mutex_lock(&boards_mutex);
+    map<unsigned int, Board *>::iterator it = boards.find(id);
+    pthread_mutex_unlock(&boards_mutex);
+    return it;
+}
+
 // Set up internal structures to be able to communicate with a processing board
 // Arguments:
 ID  connectBoard(BOARD_MAKE boardMake, const char* IP, unsigned short port)
@@ -34,16 +47,19 @@ ID  connectBoard(BOARD_MAKE boardMake, const char* IP, unsigned short port)
     DEBUG_PRINT("AccessLayer::connect. Board " << IP << " has ID " << id);
     
     // If board already exists in map, return ID
+    pthread_mutex_lock(&boards_mutex);
     if (boards.size() != 0)
     {
         map<unsigned int, Board *>::iterator it;
         it = boards.find(id);
         if (it != boards.end())
         {
+            pthread_mutex_unlock(&boards_mutex);
             DEBUG_PRINT("AccessLayer::connect. Board " << IP << " already connected");
             return id;
         }
     }
+    pthread_mutex_unlock(&boards_mutex);
 
     // If not, create board instance, store in map
     Board *board;
@@ -78,8 +94,20 @@ ID  connectBoard(BOARD_MAKE boardMake, const char* IP, unsigned short port)
     if (board -> getStatus() == NETWORK_ERROR)
         return 0;
 
+    // Check if board was connected by another thread in the meantime
+    pthread_mutex_lock(&boards_mutex);
+    if (boards.find(id) != boards.end())
+    {
+        pthread_mutex_unlock(&boards_mutex);
+        board -> disconnect();
+        delete board;
+        DEBUG_PRINT("AccessLayer::connect. Board " << IP << " already connected");
+        return id;
+    }
+
     // Return generated board ID
     boards[id] = board;
+    pthread_mutex_unlock(&boards_mutex);
     DEBUG_PRINT("AccessLayer::connect. Connected to " << IP);
     return id;
 }
@@ -88,13 +116,12 @@ ID  connectBoard(BOARD_MAKE boardMake, const char* IP, unsigned short port)
 RETURN disconnectBoard(ID id)
 {    
     // Check if board exists, and if not, return
-    if (boards.size() == 0)
-        return SUCCESS;
-
+    pthread_mutex_lock(&boards_mutex);
     map<unsigned int, Board *>::iterator it;
     it = boards.find(id);
     if (it == boards.end()) 
     {
+        pthread_mutex_unlock(&boards_mutex);
         DEBUG_PRINT("AccessLayer::disconnect. " << id << " not connected");
         return SUCCESS;    
     }
@@ -102,12 +129,12 @@ RETURN disconnectBoard(ID id)
     // Check if there any any pending requests, if so wait
     // TODO
 
-    // Call board disconnect
+    // Erase Board object from map, then call board disconnect
     Board *board = it -> second;
-    board -> disconnect();
-
-    // Once everything is done, erase Board object and return
     boards.erase(it);
+    pthread_mutex_unlock(&boards_mutex);
+
+    board -> disconnect();
 
     DEBUG_PRINT("AccessLayer::disconnect. " << id << " disconnected");
 
@@ -120,7 +147,7 @@ RETURN resetBoard(ID id, DEVICE device)
 {
     // Check if board exists
     map<unsigned int, Board *>::iterator it;
-    it = boards.find(id);
+    it = findBoard(id);
     if (it == boards.end())
     {
         DEBUG_PRINT("AccessLayer::reset. " << id << " not connected");
@@ -139,7 +166,7 @@ STATUS  getStatus(ID id)
 {
     // Check if board exists
     map<unsigned int, Board *>::iterator it;
-    it = boards.find(id);
+    it = findBoard(id);
     if (it == boards.end())
     {
         DEBUG_PRINT("AccessLayer::getStatus. " << id << " not connected");
@@ -158,7 +185,7 @@ REGISTER_INFO* getRegisterList(ID id, UINT *num_registers, bool load_values)
 {    
     // Check if board exists
     map<unsigned int, Board *>::iterator it;
-    it = boards.find(id);
+    it = findBoard(id);
     if (it == boards.end()) 
     {
         DEBUG_PRINT("AccessLayer::getRegisterList. " << id << " not connected");
@@ -177,7 +204,7 @@ RETURN loadSPIDevices(ID id, DEVICE device, const char *filepath)
 {
     // Check if board exists
     map<unsigned int, Board*>::iterator it;
-    it = boards.find(id);
+    it = findBoard(id);
     if (it == boards.end())
     {
         DEBUG_PRINT("AccessLayer:: loadSPIDevices. " << id << "not connected");
@@ -195,7 +222,7 @@ SPI_DEVICE_INFO*  getDeviceList(ID id, UINT *num_devices)
 {
     // Check if board exists
     map<unsigned int, Board *>::iterator it;
-    it = boards.find(id);
+    it = findBoard(id);
     if (it == boards.end())
     {
         DEBUG_PRINT("AccessLayer::getDeviceList. " << id << " not connected");
@@ -214,7 +241,7 @@ VALUES  readRegister(ID id, DEVICE device, REGISTER reg, UINT n, UINT offset)
 {  
     // Check if board exists
     map<unsigned int, Board *>::iterator it;
-    it = boards.find(id);
+    it = findBoard(id);
     if (it == boards.end()) 
     {
         DEBUG_PRINT("AccessLayer::readRegister. " << id << " not connected");
@@ -233,7 +260,7 @@ RETURN  writeRegister(ID id, DEVICE device, REGISTER reg, UINT *values, UINT n,
 {    
     // Check if board exists
     map<unsigned int, Board *>::iterator it;
-    it = boards.find(id);
+    it = findBoard(id);
     if (it == boards.end()) 
     {
         DEBUG_PRINT("AccessLayer::writeRegister. " << id << " not connected");
@@ -252,7 +279,7 @@ VALUES  readFifoRegister(ID id, DEVICE device, REGISTER reg, UINT n)
 {
     // Check if board exists
     map<unsigned int, Board *>::iterator it;
-    it = boards.find(id);
+    it = findBoard(id);
     if (it == boards.end())
     {
         DEBUG_PRINT("AccessLayer::readFifoRegister. " << id << " not connected");
@@ -271,7 +298,7 @@ RETURN  writeFifoRegister(ID id, DEVICE device, REGISTER reg, UINT *values, UINT
 {
     // Check if board exists
     map<unsigned int, Board *>::iterator it;
-    it = boards.find(id);
+    it = findBoard(id);
     if (it == boards.end())
     {
         DEBUG_PRINT("AccessLayer::writeFifoRegister. " << id << " not connected");
@@ -290,7 +317,7 @@ VALUES  readAddress(ID id, DEVICE device, UINT address, UINT n)
 {
     // Check if board exists
     map<unsigned int, Board *>::iterator it;
-    it = boards.find(id);
+    it = findBoard(id);
     if (it == boards.end()) 
     {
         DEBUG_PRINT("AccessLayer::readAddress. " << id << " not connected");
@@ -310,7 +337,7 @@ RETURN  writeAddress(ID id, DEVICE device, UINT address, UINT *values, UINT n)
 {
     // Check if board exists
     map<unsigned int, Board *>::iterator it;
-    it = boards.find(id);
+    it = findBoard(id);
     if (it == boards.end()) 
     {
         DEBUG_PRINT("AccessLayer::writeAddress. " << id << " not connected");
@@ -324,12 +351,153 @@ RETURN  writeAddress(ID id, DEVICE device, UINT address, UINT *values, UINT n)
     return board -> writeAddress(device, address, values, n);
 }
 
+// Read register into caller-provided buffer
+RETURN  readRegisterInto(ID id, DEVICE device, REGISTER reg, UINT *values, UINT n, UINT offset)
+{
+    // Check if board exists
+    map<unsigned int, Board *>::iterator it;
+    it = findBoard(id);
+    if (it == boards.end()) 
+    {
+        DEBUG_PRINT("AccessLayer::readRegisterInto. " << id << " not connected");
+        return FAILURE;
+    }
+
+    // Get pointer to board
+    Board *board = it -> second;
+
+    // Get register value from board
+    return board -> readRegisterInto(device, reg, values, n, offset);
+}
+
+// Read from address into caller-provided buffer
+RETURN  readAddressInto(ID id, DEVICE device, UINT address, UINT *values, UINT n)
+{
+    // Check if board exists
+    map<unsigned int, Board *>::iterator it;
+    it = findBoard(id);
+    if (it == boards.end()) 
+    {
+        DEBUG_PRINT("AccessLayer::readAddressInto. " << id << " not connected");
+        return FAILURE;
+    }
+
+    // Get pointer to board
+    Board *board = it -> second;
+
+    // Get address value from board
+    return board -> readAddressInto(device, address, values, n);
+}
+
+// Write values to a single address
+RETURN  writeStream(ID id, DEVICE device, UINT address, UINT *values, UINT n)
+{
+    // Check if board exists
+    map<unsigned int, Board *>::iterator it;
+    it = findBoard(id);
+    if (it == boards.end()) 
+    {
+        DEBUG_PRINT("AccessLayer::writeStream. " << id << " not connected");
+        return FAILURE;
+    }
+
+    // Get pointer to board
+    Board *board = it -> second;
+
+    // Write values to address on board
+    return board -> writeStream(device, address, values, n);
+}
+
+// Execute a batch of operations
+RETURN  executeTransaction(ID id, OPERATION *operations, UINT num_operations)
+{
+    // Check if board exists
+    map<unsigned int, Board *>::iterator it;
+    it = findBoard(id);
+    if (it == boards.end())
+    {
+        DEBUG_PRINT("AccessLayer::executeTransaction. " << id << " not connected");
+        for(unsigned i = 0; i < num_operations; i++)
+            operations[i].error = FAILURE;
+        return FAILURE;
+    }
+
+    // Get pointer to board
+    Board *board = it -> second;
+
+    // Execute operations on board
+    return board -> executeTransaction(operations, num_operations);
+}
+
+// Set maximum number of packets in flight
+RETURN  setWindowSize(ID id, UINT window_size)
+{
+    // Check if board exists
+    map<unsigned int, Board *>::iterator it;
+    it = findBoard(id);
+    if (it == boards.end())
+    {
+        DEBUG_PRINT("AccessLayer::setWindowSize. " << id << " not connected");
+        return FAILURE;
+    }
+
+    // Get pointer to board
+    Board *board = it -> second;
+
+    // Set window size on board
+    return board -> setWindowSize(window_size);
+}
+
+// Set timeout policy
+RETURN  setTimeoutPolicy(ID id, UINT timeout, UINT max_timeout, UINT max_retries)
+{
+    // Check if board exists
+    map<unsigned int, Board *>::iterator it;
+    it = findBoard(id);
+    if (it == boards.end())
+    {
+        DEBUG_PRINT("AccessLayer::setTimeoutPolicy. " << id << " not connected");
+        return FAILURE;
+    }
+
+    // Get pointer to board
+    Board *board = it -> second;
+
+    // Set timeout policy on board
+    return board -> setTimeoutPolicy(timeout, max_timeout, max_retries);
+}
+
+// Get communication statistics
+RETURN  getLinkStatistics(ID id, LINK_STATISTICS *statistics, bool reset)
+{
+    // Check if board exists
+    map<unsigned int, Board *>::iterator it;
+    it = findBoard(id);
+    if (it == boards.end())
+    {
+        DEBUG_PRINT("AccessLayer::getLinkStatistics. " << id << " not connected");
+        return FAILURE;
+    }
+
+    // Get pointer to board
+    Board *board = it -> second;
+
+    // Get statistics from board, clearing them if required
+    if (board -> getLinkStatistics(statistics) == FAILURE)
+        return FAILURE;
+
+    if (reset)
+        return board -> resetLinkStatistics();
+
+    return SUCCESS;
+}
+
 // Get a device's value
 VALUES  readDevice(ID id, REGISTER device, UINT address)
 {
     // Check if board exists
     map<unsigned int, Board *>::iterator it;
-    it = boards.find(id);
+    it = findBoard(id);
     if (it == boards.end()) 
     {
         DEBUG_PRINT("AccessLayer::readDevice. " << id << " not connected");
@@ -348,7 +516,7 @@ RETURN  writeDevice(ID id, REGISTER device, UINT address, UINT value)
 {
     // Check if board exists
     map<unsigned int, Board *>::iterator it;
-    it = boards.find(id);
+    it = findBoard(id);
     if (it == boards.end()) 
     {
         DEBUG_PRINT("AccessLayer::writeDevice. " << id << " not connected");
@@ -370,7 +538,7 @@ FIRMWARE  getFirmware(ID id, DEVICE device, UINT *num_firmware)
 
     // Check if board exists
     map<unsigned int, Board *>::iterator it;
-    it = boards.find(id);
+    it = findBoard(id);
     if (it == boards.end()) 
     {
         DEBUG_PRINT("AccessLayer::getFirmware. " << id << " not connected");
@@ -390,7 +558,7 @@ RETURN  loadFirmware(ID id, DEVICE device, const char* bitstream, uint32_t base_
 {
     // Check if board exists
     map<unsigned int, Board *>::iterator it;
-    it = boards.find(id);
+    it = findBoard(id);
     if (it == boards.end()) 
     {
         DEBUG_PRINT("AccessLayer::loadFirmware. " << id << " not connected");
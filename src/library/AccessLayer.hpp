@@ -122,6 +122,83 @@ extern "C" VALUES readAddress(ID id, DEVICE device, UINT address, UINT n = 1);
 //    VALUE 
 extern "C" RETURN writeAddress(ID id, DEVICE device, UINT address, UINT *values, UINT n = 1);
 
+// Read a register's value into a caller-provided buffer, such that no memory
+// is allocated by the library
+// Arguments:
+//   id      Board ID
+//   device  Specify to which DEVICE (if any) this applies
+//   reg     Register to query
+//   values  Buffer of at least n values where register values will be stored
+//   n       Number of words to read
+//   offset  Address offset to read from
+// Returns:
+//    RETURN
+extern "C" RETURN readRegisterInto(ID id, DEVICE device, REGISTER reg, UINT *values, UINT n = 1, UINT offset = 0);
+
+// Read address content into a caller-provided buffer
+// Arguments:
+//   id       Board ID
+//   device   Specify to which DEVICE (if any) this applies
+//   address  Address to read from
+//   values   Buffer of at least n values where address values will be stored
+//   n        Number of values to read
+// Returns:
+//    RETURN
+extern "C" RETURN readAddressInto(ID id, DEVICE device, UINT address, UINT *values, UINT n = 1);
+
+// Write values to a single address, such as a memory-mapped FIFO, splitting them
+// up into packets which are all sent to that address. Several packets may be
+// in flight at once, however lost packets are not re-sent
+// Arguments:
+//   id      Board ID
+//   device  Device to write to
+//   address Address to write to
+//   values  32-bit values to write
+//   n       Number of values to write
+// Returns:
+//    RETURN
+extern "C" RETURN writeStream(ID id, DEVICE device, UINT address, UINT *values, UINT n);
+
+// Execute a batch of single-word register, address and SPI device operations in
+// a single call. Operations are performed in order, however the board may keep
+// several requests in flight at once
+// Arguments:
+//   id              Board ID
+//   operations      Array of operations, updated with values and per-operation errors
+//   num_operations  Number of operations
+// Returns:
+//    RETURN, FAILURE if any of the operations failed
+extern "C" RETURN executeTransaction(ID id, OPERATION *operations, UINT num_operations);
+
+// Set the maximum number of packets kept in flight for multi-packet transfers
+// and transactions. A window size of 1 disables pipelining
+// Arguments:
+//   id           Board ID
+//   window_size  Maximum number of packets in flight
+// Returns:
+//    RETURN
+extern "C" RETURN setWindowSize(ID id, UINT window_size);
+
+// Set the reply timeout policy. The timeout is doubled after every timeout up
+// to max_timeout, and lost requests are re-sent at most max_retries times
+// Arguments:
+//   id           Board ID
+//   timeout      Reply timeout in microseconds
+//   max_timeout  Maximum reply timeout in microseconds after backoff
+//   max_retries  Maximum number of times a request is re-sent
+// Returns:
+//    RETURN
+extern "C" RETURN setTimeoutPolicy(ID id, UINT timeout, UINT max_timeout, UINT max_retries);
+
+// Get communication statistics for a board
+// Arguments:
+//   id          Board ID
+//   statistics  Structure to populate
+//   reset       Clear statistics after reading them
+// Returns:
+//    RETURN
+extern "C" RETURN getLinkStatistics(ID id, LINK_STATISTICS *statistics, bool reset);
+
 // [Optional] Set a periodic register
 // Arguments:
 //   id       Board ID
@@ -1,5 +1,7 @@
 #include "Board.hpp"
 
+#include <vector>
+
 // Board constructor
 Board::Board(const char *ip, unsigned short port)
 {
@@ -26,3 +28,346 @@ void Board::initialiseRegisterValues(REGISTER_INFO *regInfo, int num_registers)
 	
 	// All done
 }
+
+// Set maximum number of requests kept in flight
+RETURN Board::setWindowSize(UINT window_size)
+{
+    if (protocol == NULL)
+        return FAILURE;
+
+    return protocol -> setWindowSize(window_size);
+}
+
+// Read register into caller-provided buffer. Boards which do not use a memory map
+// read through readRegister, otherwise values are read straight into the buffer
+RETURN Board::readRegisterInto(DEVICE device, REGISTER reg, UINT *values, UINT n, UINT offset)
+{
+    Protocol *connection = getConnection(device);
+    if (memory_map == NULL || connection == NULL)
+    {
+        VALUES vals = this -> readRegister(device, reg, n, offset);
+        if (vals.error == SUCCESS)
+            memcpy(values, vals.values, n * sizeof(UINT));
+        free(vals.values);
+        return vals.error;
+    }
+
+    // Get register address from memory map
+    MemoryMap::RegisterInfo *info = memory_map -> getRegisterInfo(device, reg);
+    if (info == NULL)
+    {
+        DEBUG_PRINT("Board::readRegisterInto. Register " << reg << " on device " << device << " not found in memory map");
+        return FAILURE;
+    }
+
+    // No bit-masking is required for FIFO registers
+    if (info -> type == FIFO_REGISTER)
+        return connection -> readFifoRegisterInto(info -> address, values, n);
+
+    // Check if offset exceeds address area
+    if (offset + n * sizeof(UINT) > info -> address + info -> size * sizeof(UINT))
+    {
+        DEBUG_PRINT("Board::readRegisterInto. Offset and n exceed allocated address range for register " << reg);
+        return FAILURE;
+    }
+
+    if (connection -> readRegisterInto(info -> address, values, n, offset) != SUCCESS)
+        return FAILURE;
+
+    // Apply bitmask and shift
+    for(unsigned i = 0; i < n; i++)
+        values[i] = (values[i] & info -> bitmask) >> info -> shift;
+
+    return SUCCESS;
+}
+
+// Read from address into caller-provided buffer
+RETURN Board::readAddressInto(DEVICE device, UINT address, UINT *values, UINT n)
+{
+    Protocol *connection = getConnection(device);
+    if (memory_map == NULL || connection == NULL)
+    {
+        VALUES vals = this -> readAddress(device, address, n);
+        if (vals.error == SUCCESS)
+            memcpy(values, vals.values, n * sizeof(UINT));
+        free(vals.values);
+        return vals.error;
+    }
+
+    return connection -> readRegisterInto(address, values, n);
+}
+
+// Write values to a single address, one packet at a time
+RETURN Board::writeStream(DEVICE device, UINT address, UINT *values, UINT n)
+{
+    Protocol *connection = getConnection(device);
+    if (connection == NULL)
+        return FAILURE;
+
+    return connection -> writeStream(address, values, n);
+}
+
+// Set timeout policy
+RETURN Board::setTimeoutPolicy(UINT timeout, UINT max_timeout, UINT max_retries)
+{
+    if (protocol == NULL)
+        return FAILURE;
+
+    return protocol -> setTimeoutPolicy(timeout, max_timeout, max_retries);
+}
+
+// Get communication statistics
+RETURN Board::getLinkStatistics(LINK_STATISTICS *statistics)
+{
+    if (protocol == NULL)
+        return FAILURE;
+
+    *statistics = protocol -> getStatistics();
+    return SUCCESS;
+}
+
+// Clear communication statistics
+RETURN Board::resetLinkStatistics()
+{
+    if (protocol == NULL)
+        return FAILURE;
+
+    protocol -> resetStatistics();
+    return SUCCESS;
+}
+
+// Execute a batch of operations one after the other
+RETURN Board::executeTransaction(OPERATION *operations, UINT n)
+{
+    RETURN result = SUCCESS;
+    for(unsigned i = 0; i < n; i++)
+        if (executeOperation(&operations[i]) != SUCCESS)
+            result = FAILURE;
+
+    return result;
+}
+
+// Execute a single operation of a batched transaction
+RETURN Board::executeOperation(OPERATION *operation)
+{
+    VALUES vals = {NULL, FAILURE};
+    UINT   value = operation -> value;
+
+    switch (operation -> type)
+    {
+        case READ_REGISTER_OP:
+            vals = this -> readRegister(operation -> device, operation -> name, 1);
+            break;
+        case READ_ADDRESS_OP:
+            vals = this -> readAddress(operation -> device, operation -> address, 1);
+            break;
+        case READ_DEVICE_OP:
+            vals = this -> readDevice(operation -> name, operation -> address);
+            break;
+        case WRITE_REGISTER_OP:
+            operation -> error = this -> writeRegister(operation -> device, operation -> name, &value, 1);
+            return operation -> error;
+        case WRITE_ADDRESS_OP:
+            operation -> error = this -> writeAddress(operation -> device, operation -> address, &value, 1);
+            return operation -> error;
+        case WRITE_ADDRESS_MASKED_OP:
+        {
+            // Merge value with current value at address
+            vals = this -> readAddress(operation -> device, operation -> address, 1);
+            if (vals.error != SUCCESS)
+            {
+                free(vals.values);
+                operation -> error = FAILURE;
+                return FAILURE;
+            }
+            value = (vals.values[0] & ~(operation -> bitmask)) | (value & operation -> bitmask);
+            free(vals.values);
+            operation -> error = this -> writeAddress(operation -> device, operation -> address, &value, 1);
+            return operation -> error;
+        }
+        case WRITE_DEVICE_OP:
+            operation -> error = this -> writeDevice(operation -> name, operation -> address, value);
+            return operation -> error;
+        default:
+            DEBUG_PRINT("Board::executeOperation. Unsupported operation type " << operation -> type);
+            operation -> error = FAILURE;
+            return FAILURE;
+    }
+
+    // Read operation, extract value and release value buffer
+    operation -> error = vals.error;
+    if (vals.error == SUCCESS)
+        operation -> value = vals.values[0];
+    free(vals.values);
+
+    return operation -> error;
+}
+
+// Execute a batched transaction through the protocol. Consecutive register and address
+// operations on the same connection are issued as a single list of protocol requests.
+// SPI device operations and writes to bitfields or masked addresses, which require a
+// read-modify-write, are performed after all previously queued requests have completed
+RETURN Board::pipelineTransaction(OPERATION *operations, UINT n)
+{
+    // Requests queued on the current connection, with associated operation index,
+    // bitmask and shift (required to extract bitfields from read values)
+    vector<PROTOCOL_REQUEST> requests;
+    vector<UINT>             indices, bitmasks, shifts;
+    Protocol                 *connection = NULL;
+
+    RETURN result = SUCCESS;
+
+    for(unsigned i = 0; i <= n; i++)
+    {
+        OPERATION *operation = (i < n) ? &operations[i] : NULL;
+
+        // Check whether queued requests need to be issued: end of transaction,
+        // change of connection, SPI device operation or bitfield write
+        bool flush = (operation == NULL);
+        MemoryMap::RegisterInfo *info = NULL;
+        Protocol *current = NULL;
+
+        if (operation != NULL)
+        {
+            if (operation -> type == READ_DEVICE_OP || operation -> type == WRITE_DEVICE_OP)
+                flush = true;
+            else
+            {
+                current = getConnection(operation -> device);
+                if (current != connection || operation -> type == WRITE_ADDRESS_MASKED_OP)
+                    flush = true;
+
+                if (operation -> type == READ_REGISTER_OP || operation -> type == WRITE_REGISTER_OP)
+                {
+                    info = memory_map -> getRegisterInfo(operation -> device, operation -> name);
+                    if (info != NULL && operation -> type == WRITE_REGISTER_OP && info -> bitmask != 0xFFFFFFFF)
+                        flush = true;
+                }
+            }
+        }
+
+        // Issue queued requests and copy results to operations
+        if (flush && requests.size() > 0)
+        {
+            if (connection -> transact(&requests[0], requests.size()) != SUCCESS)
+                result = FAILURE;
+
+            for(unsigned j = 0; j < requests.size(); j++)
+            {
+                OPERATION *queued = &operations[indices[j]];
+                queued -> error = requests[j].error;
+                if (!requests[j].write && requests[j].error == SUCCESS)
+                    queued -> value = (requests[j].value & bitmasks[j]) >> shifts[j];
+            }
+
+            requests.clear();
+            indices.clear();
+            bitmasks.clear();
+            shifts.clear();
+        }
+
+        if (operation == NULL)
+            break;
+
+        // SPI device operations are performed directly
+        if (operation -> type == READ_DEVICE_OP || operation -> type == WRITE_DEVICE_OP)
+        {
+            if (executeOperation(operation) != SUCCESS)
+                result = FAILURE;
+            continue;
+        }
+
+        connection = current;
+        if (connection == NULL)
+        {
+            DEBUG_PRINT("Board::pipelineTransaction. No connection for device " << operation -> device);
+            operation -> error = FAILURE;
+            result = FAILURE;
+            continue;
+        }
+
+        // Convert operation to protocol request
+        PROTOCOL_REQUEST request = {operation -> address, operation -> value, false, SUCCESS};
+        UINT bitmask = 0xFFFFFFFF, shift = 0;
+
+        switch (operation -> type)
+        {
+            case WRITE_ADDRESS_OP:
+                request.write = true;
+            case READ_ADDRESS_OP:
+                break;
+            case WRITE_ADDRESS_MASKED_OP:
+            {
+                // Value is already shifted, merge with current value at address
+                request.write = true;
+                VALUES vals = connection -> readRegister(operation -> address, 1);
+                if (vals.error == FAILURE)
+                {
+                    DEBUG_PRINT("Board::pipelineTransaction. Error reading value to apply bitmask at address "
+                                << operation -> address);
+                    free(vals.values);
+                    operation -> error = FAILURE;
+                    result = FAILURE;
+                    continue;
+                }
+
+                request.value = (vals.values[0] & ~(operation -> bitmask)) | (operation -> value & operation -> bitmask);
+                free(vals.values);
+                break;
+            }
+            case WRITE_REGISTER_OP:
+                request.write = true;
+            case READ_REGISTER_OP:
+            {
+                if (info == NULL)
+                {
+                    DEBUG_PRINT("Board::pipelineTransaction. Register " << operation -> name << " on device "
+                                << operation -> device << " not found in memory map");
+                    operation -> error = FAILURE;
+                    result = FAILURE;
+                    continue;
+                }
+
+                request.address = info -> address;
+                bitmask = info -> bitmask;
+                shift   = info -> shift;
+
+                if (!request.write)
+                    break;
+
+                // Apply shift and bitmask to value, and if required merge with current register value
+                request.value = (operation -> value << shift) & bitmask;
+                if (bitmask != 0xFFFFFFFF)
+                {
+                    VALUES vals = connection -> readRegister(info -> address, 1);
+                    if (vals.error == FAILURE)
+                    {
+                        DEBUG_PRINT("Board::pipelineTransaction. Error reading value to apply bitmask for register "
+                                    << operation -> name);
+                        free(vals.values);
+                        operation -> error = FAILURE;
+                        result = FAILURE;
+                        continue;
+                    }
+
+                    request.value |= vals.values[0] & (~bitmask);
+                    free(vals.values);
+                }
+                break;
+            }
+            default:
+                DEBUG_PRINT("Board::pipelineTransaction. Unsupported operation type " << operation -> type);
+                operation -> error = FAILURE;
+                result = FAILURE;
+                continue;
+        }
+
+        // Queue request
+        requests.push_back(request);
+        indices.push_back(i);
+        bitmasks.push_back(bitmask);
+        shifts.push_back(shift);
+    }
+
+    return result;
+}
@@ -20,6 +20,9 @@ class Board
         // Board constructor
         Board(const char *ip, unsigned short port);
 
+        // Board destructor, boards are deleted through base class pointers
+        virtual ~Board() { }
+
 public:
 
         // Clear everything and remove connection
@@ -63,9 +66,45 @@ public:
         virtual SPI_DEVICE_INFO *getDeviceList(UINT *num_devices) = 0;
         virtual VALUES          readDevice(REGISTER device, UINT address) = 0;
         virtual RETURN          writeDevice(REGISTER device, UINT address, UINT value) = 0;
+
+        // Execute a batch of single-word operations. By default operations are
+        // performed one after the other through the functions above
+        virtual RETURN executeTransaction(OPERATION *operations, UINT n);
+
+        // Read register into caller-provided buffer, applying bitmask and shift
+        virtual RETURN readRegisterInto(DEVICE device, REGISTER reg, UINT *values, UINT n = 1, UINT offset = 0);
+
+        // Read from address into caller-provided buffer
+        virtual RETURN readAddressInto(DEVICE device, UINT address, UINT *values, UINT n = 1);
+
+        // Write values to a single address, one packet at a time
+        virtual RETURN writeStream(DEVICE device, UINT address, UINT *values, UINT n);
+
+        // Set maximum number of requests kept in flight on the board's connections
+        virtual RETURN setWindowSize(UINT window_size);
+
+        // Set timeout policy on the board's connections
+        virtual RETURN setTimeoutPolicy(UINT timeout, UINT max_timeout, UINT max_retries);
+
+        // Get communication statistics, accumulated over the board's connections
+        virtual RETURN getLinkStatistics(LINK_STATISTICS *statistics);
+
+        // Clear communication statistics
+        virtual RETURN resetLinkStatistics();
 	
 	// ---------- Protected call function ----------
 		void initialiseRegisterValues(REGISTER_INFO *regInfo, int num_registers);
+
+    protected:
+        // Get protocol instance which communicates with device
+        virtual Protocol *getConnection(DEVICE device) { return protocol; }
+
+        // Execute a single operation of a batched transaction
+        RETURN executeOperation(OPERATION *operation);
+
+        // Execute a batched transaction by converting register and address operations
+        // to protocol requests, such that multiple requests can be kept in flight
+        RETURN pipelineTransaction(OPERATION *operations, UINT n);
 		
     // ---------- Protected class members ---------- 
     protected:
@@ -80,6 +80,43 @@ typedef struct REGISTER_INFO {
     const char    *description; // Register string description
 } REGISTER_INFO;
 
+// Enumeration of operation types which can be batched in a transaction
+typedef enum {READ_REGISTER_OP  = 1,
+              WRITE_REGISTER_OP = 2,
+              READ_ADDRESS_OP   = 3,
+              WRITE_ADDRESS_OP  = 4,
+              READ_DEVICE_OP    = 5,
+              WRITE_DEVICE_OP   = 6,
+              WRITE_ADDRESS_MASKED_OP = 7} OPERATION_TYPE;
+
+// Encapsulate a single-word operation within a batched transaction. The value
+// is written for write operations and populated with the result for read operations
+typedef struct OPERATION {
+    OPERATION_TYPE type;        // Operation type
+    DEVICE         device;      // Device on which register or address resides
+    REGISTER       name;        // Register or SPI device name (unused for address operations)
+    UINT           address;     // Memory address, or address on SPI device
+    UINT           value;       // Value to write, or value read
+    UINT           bitmask;     // Bits to update for masked address writes
+    RETURN         error;       // If error is FAILURE, then operation failed
+} OPERATION;
+
+// Number of bins in link latency histograms. Bin i counts replies received within
+// [2^i, 2^(i+1)) microseconds of their request, with the last bin also counting
+// anything slower
+#define LATENCY_HISTOGRAM_BINS 24
+
+// Encapsulate communication statistics for a board
+typedef struct LINK_STATISTICS {
+    uint64_t packets_sent;      // Packets sent, including re-sent packets
+    uint64_t packets_received;  // Replies received, including discarded ones
+    uint64_t retries;           // Packets re-sent after a timeout
+    uint64_t timeouts;          // Number of times no reply was received in time
+    uint64_t duplicates;        // Late or duplicate replies which were discarded
+    uint64_t failures;          // Transfers which failed
+    uint64_t latency_histogram[LATENCY_HISTOGRAM_BINS]; // Reply latency histogram
+} LINK_STATISTICS;
+
 // Encapsulate SPI device information 
 typedef struct SPI_DEVICE_INFO {
     REGISTER      name;         // String representation of register
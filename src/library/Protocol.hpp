@@ -21,6 +21,24 @@
 // Define maximum payload size in bytes
 #define MAX_PAYLOAD_SIZE 1024
 
+// Define default number of requests kept in flight by pipelined transfers
+#define DEFAULT_WINDOW_SIZE 16
+
+// Define default timeout policy. The reply timeout (in microseconds) is doubled
+// after every timeout, up to the maximum, and requests are re-sent at most
+// DEFAULT_MAX_RETRIES times before failing
+#define DEFAULT_TIMEOUT     500000
+#define DEFAULT_MAX_TIMEOUT 2000000
+#define DEFAULT_MAX_RETRIES 3
+
+// Single-word request issued as part of a transaction
+typedef struct PROTOCOL_REQUEST {
+    UINT      address;     // Memory address
+    UINT      value;       // Value to write, or value read
+    bool      write;       // True for write requests, false for reads
+    RETURN    error;       // Request result
+} PROTOCOL_REQUEST;
+
 // Create protocol abstract class
 class Protocol
 {
@@ -30,6 +48,17 @@ class Protocol
         {
             // Initialise socket descriptor
             this -> sockfd = -1;
+
+            // Initialise number of requests kept in flight
+            this -> window_size = DEFAULT_WINDOW_SIZE;
+
+            // Initialise timeout policy
+            this -> timeout     = DEFAULT_TIMEOUT;
+            this -> max_timeout = DEFAULT_MAX_TIMEOUT;
+            this -> max_retries = DEFAULT_MAX_RETRIES;
+
+            // Clear statistics
+            resetStatistics();
         }
         
     // Define functions to be implemented by derived classes
@@ -55,10 +84,102 @@ class Protocol
         // Query board for list of firmware
         virtual FIRMWARE listFirmware(UINT *num_firmware) = 0;
 
+        // Issue a list of single-word requests. By default requests are issued one
+        // after the other, protocols can override this to keep several requests in flight
+        virtual RETURN transact(PROTOCOL_REQUEST *requests, UINT n)
+        {
+            RETURN result = SUCCESS;
+            for(unsigned i = 0; i < n; i++)
+            {
+                if (requests[i].write)
+                {
+                    UINT value = requests[i].value;
+                    requests[i].error = writeRegister(requests[i].address, &value, 1);
+                }
+                else
+                {
+                    VALUES vals = readRegister(requests[i].address, 1);
+                    requests[i].error = vals.error;
+                    if (vals.error == SUCCESS)
+                        requests[i].value = vals.values[0];
+                    free(vals.values);
+                }
+
+                if (requests[i].error != SUCCESS)
+                    result = FAILURE;
+            }
+            return result;
+        }
+
+        // Read register/memory area into a caller-provided buffer. By default values are
+        // read through readRegister and copied, protocols can override this such that
+        // no buffer is allocated per call
+        virtual RETURN readRegisterInto(UINT address, UINT *values, UINT n = 1, UINT offset = 0)
+        {
+            VALUES vals = readRegister(address, n, offset);
+            if (vals.error == SUCCESS)
+                memcpy(values, vals.values, n * sizeof(UINT));
+            free(vals.values);
+            return vals.error;
+        }
+
+        // Read FIFO register into a caller-provided buffer
+        virtual RETURN readFifoRegisterInto(UINT address, UINT *values, UINT n = 1)
+        {
+            VALUES vals = readFifoRegister(address, n);
+            if (vals.error == SUCCESS)
+                memcpy(values, vals.values, n * sizeof(UINT));
+            free(vals.values);
+            return vals.error;
+        }
+
+        // Write values to a single address, one packet's worth of values at a time. Used
+        // for memory-mapped FIFOs which accept a single packet at their base address.
+        // Packets are written one after the other, since the order in which they
+        // reach the address matters
+        virtual RETURN writeStream(UINT address, UINT *values, UINT n)
+        {
+            unsigned values_per_payload = MAX_PAYLOAD_SIZE / sizeof(UINT);
+            for(unsigned i = 0; i < n; i += values_per_payload)
+            {
+                UINT num_values = (n - i < values_per_payload) ? n - i : values_per_payload;
+                if (writeRegister(address, values + i, num_values) != SUCCESS)
+                    return FAILURE;
+            }
+            return SUCCESS;
+        }
+
         // Accessors
         char *getIP() { return this -> ip; }
         unsigned short getPort() { return this -> port; }
 
+        // Set maximum number of requests kept in flight, 1 disables pipelining
+        RETURN setWindowSize(UINT window_size)
+        {
+            if (window_size == 0)
+                return FAILURE;
+            this -> window_size = window_size;
+            return SUCCESS;
+        }
+
+        // Set reply timeout and maximum timeout after backoff (in microseconds), and
+        // maximum number of times a request is re-sent
+        RETURN setTimeoutPolicy(UINT timeout, UINT max_timeout, UINT max_retries)
+        {
+            if (timeout == 0 || max_timeout < timeout)
+                return FAILURE;
+            this -> timeout     = timeout;
+            this -> max_timeout = max_timeout;
+            this -> max_retries = max_retries;
+            return SUCCESS;
+        }
+
+        // Get communication statistics
+        LINK_STATISTICS getStatistics() { return this -> statistics; }
+
+        // Clear communication statistics
+        void resetStatistics() { memset(&(this -> statistics), 0, sizeof(LINK_STATISTICS)); }
+
     // Define functions and properties common to any derived classes, if any
     protected:
         char            *ip;  // Board IP address
@@ -66,6 +187,24 @@ class Protocol
 
         struct sockaddr_in board_addr;  // Board address structure
         int                sockfd;      // Socket
+        UINT               window_size; // Maximum number of requests in flight
+
+        UINT            timeout;      // Reply timeout in microseconds
+        UINT            max_timeout;  // Maximum reply timeout after backoff
+        UINT            max_retries;  // Maximum number of times a request is re-sent
+        LINK_STATISTICS statistics;   // Communication statistics
+
+        // Add reply latency in microseconds to statistics
+        void recordLatency(uint64_t latency)
+        {
+            unsigned bin = 0;
+            while (latency > 1 && bin < LATENCY_HISTOGRAM_BINS - 1)
+            {
+                latency >>= 1;
+                bin++;
+            }
+            statistics.latency_histogram[bin]++;
+        }
 };
 
 #endif  // PROTOCOL
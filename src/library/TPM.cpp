@@ -3,6 +3,7 @@
 #include "UCP.hpp"
 
 #include <unistd.h>
+#include <vector>
 
 // TPM constructor
 TPM::TPM(const char *ip, unsigned short port) : Board(ip, port)
@@ -17,8 +18,8 @@ TPM::TPM(const char *ip, unsigned short port) : Board(ip, port)
 
 	// TODO: Make this better
 	// Simple test to check whether remote IP/port are reachable
-	VALUES vals = protocol -> readRegister(0x0, 1);
-	if (vals.error == FAILURE)
+	UINT value;
+	if (protocol -> readRegisterInto(0x0, &value, 1) == FAILURE)
 	{
 		DEBUG_PRINT("TPM::TPM. Error during IP check.");
 		status = NETWORK_ERROR;
@@ -120,9 +121,8 @@ RETURN TPM::writeRegister(DEVICE device, REGISTER reg, UINT *values, UINT n, UIN
     if (info -> bitmask != 0xFFFFFFFF)
     {
         // Read values from board
-        VALUES vals = protocol -> readRegister(info -> address, n, offset);
-
-        if (vals.error == FAILURE)
+        std::vector<UINT> current(n);
+        if (protocol -> readRegisterInto(info -> address, &current[0], n, offset) == FAILURE)
         {
             DEBUG_PRINT("TPM::writeRegister. Error reading value to apply bitmaks for register " << reg);
             return FAILURE; 
@@ -130,7 +130,7 @@ RETURN TPM::writeRegister(DEVICE device, REGISTER reg, UINT *values, UINT n, UIN
 
         // Loop over all values, apply bitmask and mask with current value
         for(unsigned i = 0; i < n; i++)
-            values[i] = (vals.values[i] & (~info -> bitmask)) | values[i];
+            values[i] = (current[i] & (~info -> bitmask)) | values[i];
     }
 
     // Finished pre-processing, write values to register
@@ -163,6 +163,13 @@ SPI_DEVICE_INFO *TPM::getDeviceList(UINT *num_devices)
 // Read value from device
 VALUES TPM::readDevice(REGISTER device, UINT address)
 {
+    // Check if SPI devices have been loaded
+    if (spi_devices == NULL)
+    {
+        DEBUG_PRINT("TPM::readDevice. SPI devices not loaded");
+        return {0, FAILURE};
+    }
+
     // Get device information 
     std::pair<int, int> info = spi_devices -> getSPIInfo(device);
 
@@ -175,10 +182,12 @@ VALUES TPM::readDevice(REGISTER device, UINT address)
 
     // Wait for SPI switch to be ready
     // TODO: Make nicer
+    UINT cmd;
     for(;;)
     {
-        VALUES vals = protocol -> readRegister(spi_devices -> cmd_address);
-        if ((vals.values[0] & (spi_devices -> cmd_start_mask)) == 0)
+        if (protocol -> readRegisterInto(spi_devices -> cmd_address, &cmd) == FAILURE)
+            return {0, FAILURE};
+        if ((cmd & (spi_devices -> cmd_start_mask)) == 0)
             break;
         sleep(1);
     }
@@ -201,8 +210,9 @@ VALUES TPM::readDevice(REGISTER device, UINT address)
     // Wait for request to be completed on board
     for(;;)
     {
-        VALUES vals = protocol -> readRegister(spi_devices -> cmd_address);
-        if ((vals.values[0] & (spi_devices -> cmd_start_mask)) == 0)
+        if (protocol -> readRegisterInto(spi_devices -> cmd_address, &cmd) == FAILURE)
+            return {0, FAILURE};
+        if ((cmd & (spi_devices -> cmd_start_mask)) == 0)
             break;
         sleep(1);
     }
@@ -217,6 +227,13 @@ VALUES TPM::readDevice(REGISTER device, UINT address)
 // Write value to device
 RETURN TPM::writeDevice(REGISTER device, UINT address, UINT value)
 {
+    // Check if SPI devices have been loaded
+    if (spi_devices == NULL)
+    {
+        DEBUG_PRINT("TPM::writeDevice. SPI devices not loaded");
+        return FAILURE;
+    }
+
     // Get device information 
     std::pair<int, int> info = spi_devices -> getSPIInfo(device);
 
@@ -229,10 +246,12 @@ RETURN TPM::writeDevice(REGISTER device, UINT address, UINT value)
 
     // Wait for SPI switch to be ready
     // TODO: Make nicer
+    UINT cmd;
     for(;;)
     {
-        VALUES vals = protocol -> readRegister(spi_devices -> cmd_address);
-        if ((vals.values[0] & (spi_devices -> cmd_start_mask)) == 0)
+        if (protocol -> readRegisterInto(spi_devices -> cmd_address, &cmd) == FAILURE)
+            return FAILURE;
+        if ((cmd & (spi_devices -> cmd_start_mask)) == 0)
             break;
     }
 
@@ -255,8 +274,9 @@ RETURN TPM::writeDevice(REGISTER device, UINT address, UINT value)
     // Wait for request to be completed on board
     for(;;)
     {
-        VALUES vals = protocol -> readRegister(spi_devices -> cmd_address);
-        if ((vals.values[0] & (spi_devices -> cmd_start_mask)) == 0)
+        if (protocol -> readRegisterInto(spi_devices -> cmd_address, &cmd) == FAILURE)
+            return FAILURE;
+        if ((cmd & (spi_devices -> cmd_start_mask)) == 0)
             break;
     }
 
@@ -264,6 +284,12 @@ RETURN TPM::writeDevice(REGISTER device, UINT address, UINT value)
     return SUCCESS;
 }
 
+// Execute batch of operations, keeping multiple requests in flight
+RETURN TPM::executeTransaction(OPERATION *operations, UINT n)
+{
+    return pipelineTransaction(operations, n);
+}
+
 // Get list of firmware from board
 FIRMWARE TPM::getFirmware(DEVICE device, UINT *num_firmware)
 {
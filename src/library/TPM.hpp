@@ -61,6 +61,9 @@ class TPM: public Board
         SPI_DEVICE_INFO *getDeviceList(UINT *num_devices);
         VALUES          readDevice(REGISTER device, UINT address);
         RETURN          writeDevice(REGISTER device, UINT address, UINT value);
+
+        // Execute a batch of single-word operations
+        RETURN executeTransaction(OPERATION *operations, UINT n);
 };
 
 #endif // TPM_CLASS
@@ -3,6 +3,17 @@
 
 #include <stdlib.h>
 #include <math.h>
+#include <map>
+#include <time.h>
+#include <sys/select.h>
+
+// Get monotonic time in microseconds
+static uint64_t getTime()
+{
+    struct timespec ts;
+    clock_gettime(CLOCK_MONOTONIC, &ts);
+    return (uint64_t) ts.tv_sec * 1000000 + ts.tv_nsec / 1000;
+}
 
 // UCP Constructor
 UCP::UCP() : Protocol()
@@ -43,12 +54,7 @@ RETURN UCP::createConnection(const char *IP, int port)
     board_addr.sin_addr.s_addr = inet_addr(ip);
     board_addr.sin_port = htons(port);
 
-    // Set a receive timeout of 5 seconds
-    struct timeval tv;
-    tv.tv_sec = 5;  
-    tv.tv_usec = 0; 
-    setsockopt(sockfd, SOL_SOCKET, SO_RCVTIMEO, 
-               (char *) &tv, sizeof(struct timeval));
+    // Receive timeouts are handled per request, see setTimeoutPolicy
 
     DEBUG_PRINT("UCP::constructor. Created socket for " << IP);
 
@@ -79,98 +85,67 @@ RETURN UCP::sendPacket(char *message, size_t length)
     if (ret == -1)
         return FAILURE;
 
-    // Return success
+    // Update statistics and return success
+    statistics.packets_sent++;
     return SUCCESS;
 }
 
-// Receive packet from board
-size_t UCP::receivePacket(char *buffer, size_t max_length)
+// Receive packet from board, waiting until deadline (in microseconds). Returns
+// -1 if no packet was received in time
+ssize_t UCP::receivePacket(char *buffer, size_t max_length, uint64_t deadline)
 {
     // Wait for reply from board
-    return recvfrom(sockfd,       // Socket
-                    buffer,       // Buffer
-                    max_length,   // Maximum buffer length
-                    0,            // Flags
-                    NULL,         // Receive from anyone
-                    NULL);        // No structure provided, ignore
+    uint64_t now = getTime();
+    if (now >= deadline)
+        return -1;
+
+    struct timeval tv;
+    tv.tv_sec  = (deadline - now) / 1000000;
+    tv.tv_usec = (deadline - now) % 1000000;
+
+    fd_set fds;
+    FD_ZERO(&fds);
+    FD_SET(sockfd, &fds);
+    if (select(sockfd + 1, &fds, NULL, NULL, &tv) <= 0)
+        return -1;
+
+    // Packet available, read it
+    ssize_t ret = recvfrom(sockfd,       // Socket
+                           buffer,       // Buffer
+                           max_length,   // Maximum buffer length
+                           0,            // Flags
+                           NULL,         // Receive from anyone
+                           NULL);        // No structure provided, ignore
+
+    if (ret >= 0)
+        statistics.packets_received++;
+
+    return ret;
 }
 
-// Issue a read register request, and return reply
-VALUES UCP::read(UINT address, UINT n, UINT offset, bool fifo)
+// Get time at which the first packet in flight times out
+uint64_t UCP::getDeadline(std::map<UINT, in_flight_packet> &in_flight, uint64_t wait)
 {
-    // Value per payload
-    unsigned values_per_payload = MAX_PAYLOAD_SIZE / sizeof(UINT);
+    uint64_t deadline = UINT64_MAX;
+    std::map<UINT, in_flight_packet>::iterator it;
+    for(it = in_flight.begin(); it != in_flight.end(); it++)
+        if (it -> second.sent + wait < deadline)
+            deadline = it -> second.sent + wait;
 
-    // Check if we need to split this request up into multiple packets
-    unsigned num_packets = n / values_per_payload + 1;
+    return deadline;
+}
 
+// Issue a read register request, and return reply
+VALUES UCP::read(UINT address, UINT n, UINT offset, bool fifo)
+{
     // Allocate memory area for full reply
     UINT *values = (UINT *) malloc(n * sizeof(UINT));
 
-    // Issue requests one by one
-    for(unsigned i = 0; i < num_packets; i++)
+    // Issue requests and collect replies
+    if (transfer(address, values, n, offset, fifo, false) == FAILURE)
     {
-        // Increment sequence number
-        UINT seqno = sequence_number++;
-
-        // Number of words for current request
-        unsigned num_values = (i == num_packets - 1) ? n - i * values_per_payload: values_per_payload;
-
-        // New address
-        UINT currentAddress = (fifo) ? address : address + (offset + i * values_per_payload) * sizeof(UINT);
-
-        // Fill out request
-        header -> psn     = lendian(seqno);
-        header -> opcode  = lendian((fifo) ? OPCODE_FIFO_READ : OPCODE_READ);
-        header -> nvalues = lendian(num_values);
-        header -> address = lendian(currentAddress);
-
-        // Send out packet
-        DEBUG_PRINT("UCP::readRegister. Sending packet");
-        if (sendPacket((char *) header, sizeof(ucp_command_header)) == FAILURE)
-        {
-            DEBUG_PRINT("UCP::read. Failed to send packet");
-            free(values);
-            return {0, FAILURE};
-        }
-
-        // Successfully sent out packet, calculate response size
-        size_t reply_size = sizeof(ucp_reply_header) + num_values * sizeof(UINT);
-
-        // Allocate buffer for reply
-        memset(read_reply, 0, sizeof(ucp_read_reply));
-
-        // Wait for packet
-        DEBUG_PRINT("UCP::read. Receiving reply");
-        size_t ret = receivePacket((char *) read_reply, reply_size);
-
-        // Convert reply data to host endiannes
-        (read_reply -> header).addr = lendian((read_reply -> header).addr);
-        (read_reply -> header).psn = lendian((read_reply -> header).psn);
-
-        // Check number of bytes read
-        if (ret < reply_size)
-        {
-            // Something wrong, return error
-            DEBUG_PRINT("UCP::read. Failed to receive reply");
-            free(values);
-            return {NULL, FAILURE};
-        }
-
-        // Check if request was successful on board
-        else if ((read_reply -> header).psn != seqno || (read_reply -> header).addr != currentAddress)
-        {
-            // Something wrong, return error
-            DEBUG_PRINT("UCP::read. Command failed on board");
-            free(values);
-            return {NULL, FAILURE};
-        }
-
-        // Successfully received reply, return values
-        // TODO: Check endiannes
-
-        // Create array containing required values
-        memcpy(values + i * values_per_payload, read_reply -> data, num_values * sizeof(UINT));
+        free(values);
+        return {NULL, FAILURE};
     }
 
     return {values, SUCCESS};
@@ -178,76 +153,168 @@ VALUES UCP::read(UINT address, UINT n, UINT offset, bool fifo)
 
 // Issue a write register request, and return reply
 RETURN UCP::write(UINT address, UINT *values, UINT n, UINT offset, bool fifo)
+{
+    return transfer(address, values, n, offset, fifo, true);
+}
+
+// Split a transfer into MAX_PAYLOAD_SIZE packets, keeping up to window_size packets
+// in flight. Replies are matched to packets through their PSN, so they can arrive in
+// any order. Packets which are not replied to within the timeout are re-sent with
+// their original PSN, such that late replies are discarded, and the timeout is
+// doubled up to max_timeout until a reply is received. FIFO transfers are not
+// idempotent and depend on packet order, so they are issued one packet at a time
+// and are never re-sent, however their timeout still backs off. Stream transfers
+// write every packet to the same address, such as a programming FIFO, so like FIFO
+// transfers they are issued one packet at a time and never re-sent. A lost packet
+// fails the transfer rather than reaching the board out of order
+RETURN UCP::transfer(UINT address, UINT *values, UINT n, UINT offset, bool fifo, bool write, bool stream)
 {
     // Value per payload
     unsigned values_per_payload = MAX_PAYLOAD_SIZE / sizeof(UINT);
 
     // Check if we need to split this request up into multiple packets
-    unsigned num_packets = (int) ceil((float) n / (float) values_per_payload);
+    unsigned num_packets = (n + values_per_payload - 1) / values_per_payload;
 
-    // Issue requests one by one
-    for(unsigned i = 0; i < num_packets; i++)
-    {
-        // Increment sequence number
-        UINT seqno = sequence_number++;
-
-        // Number of words for current request
-        unsigned num_values = (i == num_packets - 1) ? n - i * values_per_payload: values_per_payload;
-
-        // New address
-        UINT currentAddress = (fifo) ? address : address + (offset + i * values_per_payload) * sizeof(UINT);
-
-        // Fill out request
-        (packet -> header).psn     = lendian(seqno);
-        (packet -> header).opcode  = lendian((fifo) ? OPCODE_FIFO_WRITE : OPCODE_WRITE);
-        (packet -> header).nvalues = lendian(num_values);
-        (packet -> header).address = lendian(currentAddress);
+    // Number of packets which can be in flight at any one time
+    unsigned window = (fifo || stream) ? 1 : window_size;
 
-        // Place data in packet
-        memcpy(&(packet -> data), values + i * values_per_payload, num_values * sizeof(UINT));
+    // Map between PSN and packet for all packets in flight
+    std::map<UINT, in_flight_packet> in_flight;
+    std::map<UINT, in_flight_packet>::iterator it;
 
-        // Send out packet
-        DEBUG_PRINT("UCP::write. Sending packet");
-        if (sendPacket((char *) packet, sizeof(ucp_command_header) + num_values * sizeof(UINT)) == FAILURE)
+    unsigned next = 0;
+    uint64_t wait = timeout;
+    while (next < num_packets || !in_flight.empty())
+    {
+        // Fill up window
+        while (next < num_packets && in_flight.size() < window)
         {
-            DEBUG_PRINT("UCP::writeRegister. Failed to send packet");
-            return FAILURE;
+            UINT seqno = sequence_number++;
+            if (sendRequest(seqno, address, values, n, offset, next, fifo, write, stream) == FAILURE)
+            {
+                DEBUG_PRINT("UCP::transfer. Failed to send packet");
+                statistics.failures++;
+                return FAILURE;
+            }
+            in_flight[seqno] = {next++, getTime(), 0};
         }
 
-        // Successfully sent out packet, calculate response size
-        size_t reply_size = sizeof(ucp_write_reply);
-
-        // Allocate buffer for reply
-        memset(write_reply, 0, sizeof(ucp_write_reply));
-
         // Wait for packet
-        DEBUG_PRINT("UCP::write. Receiving reply");
-        size_t ret = receivePacket((char *) write_reply, reply_size);
+        memset(read_reply, 0, sizeof(ucp_reply_header));
+        ssize_t ret = receivePacket((char *) read_reply, sizeof(ucp_read_reply), getDeadline(in_flight, wait));
+
+        // If no reply was received in time, re-send packets which timed out
+        if (ret < (ssize_t) sizeof(ucp_reply_header))
+        {
+            statistics.timeouts++;
+            uint64_t now = getTime();
+            for(it = in_flight.begin(); it != in_flight.end(); it++)
+            {
+                if (it -> second.sent + wait > now)
+                    continue;
+
+                if (it -> second.retries == max_retries)
+                {
+                    DEBUG_PRINT("UCP::transfer. Failed to receive reply");
+                    statistics.failures++;
+                    return FAILURE;
+                }
+
+                it -> second.retries++;
+                it -> second.sent = now;
+                if (fifo || stream)
+                    continue;
+
+                DEBUG_PRINT("UCP::transfer. Re-sending packet with PSN " << it -> first);
+                statistics.retries++;
+                if (sendRequest(it -> first, address, values, n, offset, it -> second.index, fifo, write, stream) == FAILURE)
+                {
+                    DEBUG_PRINT("UCP::transfer. Failed to send packet");
+                    statistics.failures++;
+                    return FAILURE;
+                }
+            }
+
+            // Back off
+            wait = (wait * 2 > max_timeout) ? max_timeout : wait * 2;
+            continue;
+        }
 
         // Convert reply data to host endiannes
-        (write_reply -> header).addr = lendian((write_reply -> header).addr);
-        (write_reply -> header).psn = lendian((write_reply -> header).psn);
+        UINT psn  = lendian((read_reply -> header).psn);
+        UINT addr = lendian((read_reply -> header).addr);
 
-        // Check number of bytes read
-        if (ret < reply_size)
+        // Match reply to packet, ignoring duplicate or stale replies
+        it = in_flight.find(psn);
+        if (it == in_flight.end())
         {
-            // Something wrong, return error
-            DEBUG_PRINT("UCP::write. Failed to receive reply");
-            return FAILURE;
+            DEBUG_PRINT("UCP::transfer. Discarding reply with unexpected PSN " << psn);
+            statistics.duplicates++;
+            continue;
         }
-            // Check if request was successful on board
-        else if ((write_reply -> header).psn != seqno || (write_reply -> header).addr != currentAddress)
+
+        // Latency is only recorded for packets which were not re-sent, since
+        // it is not known which copy of the packet is being replied to
+        unsigned index = it -> second.index;
+        if (it -> second.retries == 0)
+            recordLatency(getTime() - it -> second.sent);
+        in_flight.erase(it);
+        wait = timeout;
+
+        // Check if request was successful on board
+        unsigned num_values = (index == num_packets - 1) ? n - index * values_per_payload : values_per_payload;
+        UINT currentAddress = (fifo || stream) ? address : address + (offset + index * values_per_payload) * sizeof(UINT);
+        size_t reply_size = sizeof(ucp_reply_header) + ((write) ? 0 : num_values * sizeof(UINT));
+        if (addr != currentAddress || ret < (ssize_t) reply_size)
         {
-            // Something wrong, return error
-            DEBUG_PRINT("UCP::read. Command failed on board");
+            DEBUG_PRINT("UCP::transfer. Command failed on board");
+            statistics.failures++;
             return FAILURE;
         }
+
+        // Copy values to their place in the full reply
+        if (!write)
+            memcpy(values + index * values_per_payload, read_reply -> data, num_values * sizeof(UINT));
     }
 
     // All done
     return SUCCESS;
 }
 
+// Send the request for a single packet of a transfer
+RETURN UCP::sendRequest(UINT seqno, UINT address, UINT *values, UINT n, UINT offset,
+                        unsigned index, bool fifo, bool write, bool stream)
+{
+    // Value per payload
+    unsigned values_per_payload = MAX_PAYLOAD_SIZE / sizeof(UINT);
+    unsigned num_packets = (n + values_per_payload - 1) / values_per_payload;
+
+    // Number of words for current request
+    unsigned num_values = (index == num_packets - 1) ? n - index * values_per_payload : values_per_payload;
+
+    // New address
+    UINT currentAddress = (fifo || stream) ? address : address + (offset + index * values_per_payload) * sizeof(UINT);
+
+    // Fill out request
+    UINT opcode = (write) ? ((fifo) ? OPCODE_FIFO_WRITE : OPCODE_WRITE)
+                          : ((fifo) ? OPCODE_FIFO_READ : OPCODE_READ);
+    (packet -> header).psn     = lendian(seqno);
+    (packet -> header).opcode  = lendian(opcode);
+    (packet -> header).nvalues = lendian(num_values);
+    (packet -> header).address = lendian(currentAddress);
+
+    // Place data in packet
+    size_t length = sizeof(ucp_command_header);
+    if (write)
+    {
+        memcpy(&(packet -> data), values + index * values_per_payload, num_values * sizeof(UINT));
+        length += num_values * sizeof(UINT);
+    }
+
+    // Send out packet
+    return sendPacket((char *) packet, length);
+}
+
 // Issue a write request to a register or memory block
 VALUES UCP::readRegister(UINT address, UINT n, UINT offset)
 {
@@ -262,6 +329,27 @@ RETURN UCP::writeRegister(UINT address, UINT *values, UINT n, UINT offset)
     return write(address, values, n, offset);
 }
 
+// Read register or memory block into caller-provided buffer
+RETURN UCP::readRegisterInto(UINT address, UINT *values, UINT n, UINT offset)
+{
+    DEBUG_PRINT("UCP::readRegisterInto. Reading register at " << address);
+    return transfer(address, values, n, offset, false, false);
+}
+
+// Read FIFO register into caller-provided buffer
+RETURN UCP::readFifoRegisterInto(UINT address, UINT *values, UINT n)
+{
+    DEBUG_PRINT("UCP::readFifoRegisterInto. Reading FIFO register at " << address);
+    return transfer(address, values, n, 0, true, false);
+}
+
+// Write a stream of values to a single address, one packet at a time
+RETURN UCP::writeStream(UINT address, UINT *values, UINT n)
+{
+    DEBUG_PRINT("UCP::writeStream. Writing stream to address " << address);
+    return transfer(address, values, n, 0, false, true, true);
+}
+
 // Issue a read request to a FIFO register
 VALUES UCP::readFifoRegister(UINT address, UINT n)
 {
@@ -276,6 +364,146 @@ RETURN UCP::writeFifoRegister(UINT address, UINT *values, UINT n)
     return write(address, values, n, 0, true);
 }
 
+// Issue a list of single-word requests, keeping up to window_size requests in flight.
+// Replies are matched to requests through their PSN, so they can arrive in any order,
+// and requests which time out are re-sent as in transfer. A request is held back
+// while a request to the same address, where either of the two is a write, is
+// still in flight, such that the order of dependent requests is preserved
+RETURN UCP::transact(PROTOCOL_REQUEST *requests, UINT n)
+{
+    // Map between PSN and request for all requests in flight
+    std::map<UINT, in_flight_packet> in_flight;
+    std::map<UINT, in_flight_packet>::iterator it;
+
+    RETURN result = SUCCESS;
+    UINT next = 0;
+    uint64_t wait = timeout;
+
+    while (next < n || !in_flight.empty())
+    {
+        // Fill up window
+        while (next < n && in_flight.size() < window_size)
+        {
+            // Check whether request depends on a request in flight
+            bool hazard = false;
+            for(it = in_flight.begin(); it != in_flight.end(); it++)
+                if (requests[it -> second.index].address == requests[next].address &&
+                    (requests[it -> second.index].write || requests[next].write))
+                    hazard = true;
+
+            if (hazard)
+                break;
+
+            // Send out request
+            UINT seqno = sequence_number++;
+            if (sendRequest(seqno, &requests[next]) == FAILURE)
+            {
+                DEBUG_PRINT("UCP::transact. Failed to send packet");
+                requests[next].error = FAILURE;
+                result = FAILURE;
+            }
+            else
+                in_flight[seqno] = {next, getTime(), 0};
+
+            next++;
+        }
+
+        if (in_flight.empty())
+            continue;
+
+        // Wait for reply
+        memset(read_reply, 0, sizeof(ucp_reply_header));
+        ssize_t ret = receivePacket((char *) read_reply, sizeof(ucp_read_reply), getDeadline(in_flight, wait));
+
+        // If no reply was received in time, re-send requests which timed out. If a
+        // request runs out of retries the board is not responding, so fail all
+        // outstanding requests rather than waiting for each one in turn
+        if (ret < (ssize_t) sizeof(ucp_reply_header))
+        {
+            statistics.timeouts++;
+            uint64_t now = getTime();
+            bool failed = false;
+            for(it = in_flight.begin(); it != in_flight.end() && !failed; it++)
+            {
+                if (it -> second.sent + wait > now)
+                    continue;
+
+                it -> second.retries++;
+                it -> second.sent = now;
+                statistics.retries++;
+                if (it -> second.retries > max_retries || sendRequest(it -> first, &requests[it -> second.index]) == FAILURE)
+                    failed = true;
+            }
+
+            if (failed)
+            {
+                DEBUG_PRINT("UCP::transact. Failed to receive reply");
+                for(it = in_flight.begin(); it != in_flight.end(); it++)
+                    requests[it -> second.index].error = FAILURE;
+                for(; next < n; next++)
+                    requests[next].error = FAILURE;
+                statistics.failures++;
+                return FAILURE;
+            }
+
+            // Back off
+            wait = (wait * 2 > max_timeout) ? max_timeout : wait * 2;
+            continue;
+        }
+
+        // Match reply to request, ignoring replies to requests which are not in flight
+        UINT psn  = lendian((read_reply -> header).psn);
+        UINT addr = lendian((read_reply -> header).addr);
+        it = in_flight.find(psn);
+        if (it == in_flight.end())
+        {
+            DEBUG_PRINT("UCP::transact. Discarding reply with unexpected PSN " << psn);
+            statistics.duplicates++;
+            continue;
+        }
+
+        PROTOCOL_REQUEST *request = &requests[it -> second.index];
+        if (it -> second.retries == 0)
+            recordLatency(getTime() - it -> second.sent);
+        in_flight.erase(it);
+        wait = timeout;
+
+        // Check if request was successful on board
+        if (addr != request -> address ||
+            (!request -> write && ret < (ssize_t) (sizeof(ucp_reply_header) + sizeof(UINT))))
+        {
+            DEBUG_PRINT("UCP::transact. Command failed on board");
+            request -> error = FAILURE;
+            result = FAILURE;
+            continue;
+        }
+
+        if (!request -> write)
+            request -> value = read_reply -> data[0];
+        request -> error = SUCCESS;
+    }
+
+    if (result == FAILURE)
+        statistics.failures++;
+
+    return result;
+}
+
+// Send a single-word request of a transaction
+RETURN UCP::sendRequest(UINT seqno, PROTOCOL_REQUEST *request)
+{
+    // Fill out request
+    (packet -> header).psn     = lendian(seqno);
+    (packet -> header).opcode  = lendian((request -> write) ? OPCODE_WRITE : OPCODE_READ);
+    (packet -> header).nvalues = lendian(1);
+    (packet -> header).address = lendian(request -> address);
+    packet -> data[0] = request -> value;
+
+    // Send out packet
+    size_t length = sizeof(ucp_command_header) + ((request -> write) ? sizeof(UINT) : 0);
+    return sendPacket((char *) packet, length);
+}
+
 // TODO: Implement this when functionality is defined
 FIRMWARE UCP::listFirmware(UINT *num_firmware)
 {
@@ -3,6 +3,8 @@
 
 #include "Protocol.hpp"
 
+#include <map>
+
 // Protocol subclass implementing the UCP protocol
 class UCP: public Protocol
 {
@@ -20,12 +22,22 @@ class UCP: public Protocol
         RETURN writeFifoRegister(UINT address, UINT *values, UINT n);
         FIRMWARE listFirmware(UINT *num_firmware);
 
+        // Issue single-word requests, keeping up to window_size requests in flight
+        RETURN transact(PROTOCOL_REQUEST *requests, UINT n);
+
+        // Read into caller-provided buffers, without allocating
+        RETURN readRegisterInto(UINT address, UINT *values, UINT n = 1, UINT offset = 0);
+        RETURN readFifoRegisterInto(UINT address, UINT *values, UINT n = 1);
+
+        // Write values to a single address, one packet at a time
+        RETURN writeStream(UINT address, UINT *values, UINT n);
+
     private:
         // Send packet
         RETURN sendPacket(char *message, size_t length);
 
-        // Receive packet
-        size_t receivePacket(char *buffer, size_t max_length);
+        // Receive packet, returns -1 if no packet arrives before deadline
+        ssize_t receivePacket(char *buffer, size_t max_length, uint64_t deadline);
 
         // General write function
         RETURN write(UINT address, UINT *values, UINT n = 1, UINT offset = 0, bool fifo = false);
@@ -33,6 +45,27 @@ class UCP: public Protocol
         // General read function
         VALUES read(UINT address, UINT n = 1, UINT offset = 0, bool fifo = false);
 
+        // Pipelined multi-packet transfer used by read and write
+        RETURN transfer(UINT address, UINT *values, UINT n, UINT offset, bool fifo, bool write, bool stream = false);
+
+        // Send a single packet of a multi-packet transfer
+        RETURN sendRequest(UINT seqno, UINT address, UINT *values, UINT n, UINT offset,
+                           unsigned index, bool fifo, bool write, bool stream = false);
+
+        // Send a single-word request of a transaction
+        RETURN sendRequest(UINT seqno, PROTOCOL_REQUEST *request);
+
+        // Packet in flight, used to match replies and re-send lost packets
+        struct in_flight_packet
+        {
+            unsigned index;    // Packet or request index
+            uint64_t sent;     // Time at which packet was last sent, in microseconds
+            UINT     retries;  // Number of times packet was re-sent
+        };
+
+        // Get time at which the first packet in flight times out
+        uint64_t getDeadline(std::map<UINT, in_flight_packet> &in_flight, uint64_t wait);
+
     private:
         // Sequence number
         UINT  sequence_number;
@@ -1,5 +1,6 @@
 #include "UniBoard.hpp"
 #include <sstream>
+#include <vector>
 #include <math.h>
 
 // Constructor
@@ -41,8 +42,8 @@ UniBoard::UniBoard(const char *ip, unsigned short port) : Board(ip, port)
         #endif
 
         // Check if address is valid
-        VALUES vals = conn -> readRegister(0x0, 1);
-        if (vals.error == FAILURE)
+        UINT value;
+        if (conn -> readRegisterInto(0x0, &value, 1) == FAILURE)
 	    {
 		    DEBUG_PRINT("UniBoard::UniBoard. Error during IP check.");
 		    this -> status = NETWORK_ERROR;
@@ -137,7 +138,7 @@ RETURN UniBoard::populateRegisterList(DEVICE device)
     // Cast received data to input string stream and discard original data
     char *chr_str = (char *) vals.values;
     string info(chr_str);
-    delete[] vals.values;
+    free(vals.values);
 
     // Process the read register map
     istringstream info_stream(info);
@@ -253,9 +254,8 @@ RETURN UniBoard::writeRegister(DEVICE device, REGISTER reg, UINT *values, UINT n
     if (info -> bitmask != 0xFFFFFFFF)
     {
         // Read values from board
-        VALUES vals = connections[device_id_map[device]] -> readRegister(info -> address, n, offset);
-
-        if (vals.error == FAILURE)
+        std::vector<UINT> current(n);
+        if (connections[device_id_map[device]] -> readRegisterInto(info -> address, &current[0], n, offset) == FAILURE)
         {
             DEBUG_PRINT("UniBoard::writeRegister. Error reading value to apply bitmaks for register " << reg);
             return FAILURE;
@@ -263,7 +263,7 @@ RETURN UniBoard::writeRegister(DEVICE device, REGISTER reg, UINT *values, UINT n
 
         // Loop over all values, apply bitmask and mask with current value
         for(unsigned i = 0; i < n; i++)
-            values[i] = (vals.values[i] & (~info -> bitmask)) | values[i];
+            values[i] = (current[i] & (~info -> bitmask)) | values[i];
     }
 
     // Finished pre-processing, write values to register
@@ -356,6 +356,74 @@ RETURN UniBoard::writeFifoRegister(DEVICE device, REGISTER reg, UINT *values, UI
     return connections[device_id_map[device]] -> writeFifoRegister(info -> address, values, n);
 }
 
+// Execute batch of operations, keeping multiple requests in flight on each node
+RETURN UniBoard::executeTransaction(OPERATION *operations, UINT n)
+{
+    return pipelineTransaction(operations, n);
+}
+
+// Set maximum number of requests kept in flight on all node connections
+RETURN UniBoard::setWindowSize(UINT window_size)
+{
+    for(unsigned i = 0; i < 8; i++)
+        if (connections[i] != NULL && connections[i] -> setWindowSize(window_size) == FAILURE)
+            return FAILURE;
+
+    return SUCCESS;
+}
+
+// Set timeout policy on all node connections
+RETURN UniBoard::setTimeoutPolicy(UINT timeout, UINT max_timeout, UINT max_retries)
+{
+    for(unsigned i = 0; i < 8; i++)
+        if (connections[i] != NULL && connections[i] -> setTimeoutPolicy(timeout, max_timeout, max_retries) == FAILURE)
+            return FAILURE;
+
+    return SUCCESS;
+}
+
+// Get communication statistics, accumulated over all node connections
+RETURN UniBoard::getLinkStatistics(LINK_STATISTICS *statistics)
+{
+    memset(statistics, 0, sizeof(LINK_STATISTICS));
+    for(unsigned i = 0; i < 8; i++)
+    {
+        if (connections[i] == NULL)
+            continue;
+
+        LINK_STATISTICS node = connections[i] -> getStatistics();
+        statistics -> packets_sent     += node.packets_sent;
+        statistics -> packets_received += node.packets_received;
+        statistics -> retries          += node.retries;
+        statistics -> timeouts         += node.timeouts;
+        statistics -> duplicates       += node.duplicates;
+        statistics -> failures         += node.failures;
+        for(unsigned j = 0; j < LATENCY_HISTOGRAM_BINS; j++)
+            statistics -> latency_histogram[j] += node.latency_histogram[j];
+    }
+
+    return SUCCESS;
+}
+
+// Clear communication statistics on all node connections
+RETURN UniBoard::resetLinkStatistics()
+{
+    for(unsigned i = 0; i < 8; i++)
+        if (connections[i] != NULL)
+            connections[i] -> resetStatistics();
+
+    return SUCCESS;
+}
+
+// Get node connection for device
+Protocol *UniBoard::getConnection(DEVICE device)
+{
+    map<DEVICE, int>::iterator it = device_id_map.find(device);
+    if (it == device_id_map.end())
+        return NULL;
+
+    return connections[it -> second];
+}
 
 // =========================== NOT IMPLEMENTED FOR UNIBOARD ===========================
 
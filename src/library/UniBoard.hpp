@@ -62,10 +62,28 @@ class UniBoard: public Board
         VALUES          readDevice(REGISTER device, UINT address);
         RETURN          writeDevice(REGISTER device, UINT address, UINT value);
 
+        // Execute a batch of single-word operations
+        RETURN executeTransaction(OPERATION *operations, UINT n);
+
+        // Set maximum number of requests kept in flight on all node connections
+        RETURN setWindowSize(UINT window_size);
+
+        // Set timeout policy on all node connections
+        RETURN setTimeoutPolicy(UINT timeout, UINT max_timeout, UINT max_retries);
+
+        // Get communication statistics, accumulated over all node connections
+        RETURN getLinkStatistics(LINK_STATISTICS *statistics);
+
+        // Clear communication statistics on all node connections
+        RETURN resetLinkStatistics();
+
     protected:
         // Populate register list
         RETURN populateRegisterList(DEVICE device);
 
+        // Get node connection for device
+        Protocol *getConnection(DEVICE device);
+
     protected:
         // From Board base class, we will use the following variables as are:
         // id, ip, port, num_fpgas, status, memory_map